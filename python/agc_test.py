@@ -0,0 +1,145 @@
+"""Tests for the asi.agc module."""
+
+import unittest
+import numpy as np
+
+from asi import agc
+
+
+class FakeBackend:
+    """Records calls to ASISetControlValue."""
+
+    ASI_SUCCESS = 0
+    ASI_FALSE = 0
+    ASI_GAIN = 0
+    ASI_EXPOSURE = 1
+
+    def __init__(self):
+        self.calls = []
+
+    @staticmethod
+    def ASICheck(return_values):
+        return return_values
+
+    def ASISetControlValue(self, camera_id, control_type, value, auto):
+        self.calls.append((camera_id, control_type, value, auto))
+        return self.ASI_SUCCESS
+
+
+class TestHistogram(unittest.TestCase):
+    """Collection of tests for histogram() and percentile_value()."""
+
+    def test_full_histogram(self):
+        """With a stride of 1 every pixel is counted."""
+        for dtype, bins in ((np.uint8, 256), (np.uint16, 65536)):
+            image = np.random.randint(0, bins, size=(30, 40), dtype=dtype)
+            hist = agc.histogram(image, stride=1)
+            self.assertEqual(len(hist), bins)
+            np.testing.assert_array_equal(hist, np.histogram(image, bins=bins, range=(0, bins))[0])
+
+    def test_stride_covers_bayer_pattern(self):
+        """The default stride is odd so every position of the Bayer pattern is sampled."""
+        image = np.zeros((2080, 3096), dtype=np.uint8)
+        image[0::2, 0::2] = 1
+        image[0::2, 1::2] = 2
+        image[1::2, 0::2] = 3
+        image[1::2, 1::2] = 4
+        stride = agc.sample_stride(image)
+        self.assertEqual(stride % 2, 1)
+        hist = agc.histogram(image)
+        self.assertTrue(np.all(hist[1:5] > 0))
+        self.assertLess(hist.sum(), 2 * agc.HISTOGRAM_SAMPLES)
+
+    def test_roi(self):
+        """Only pixels inside the ROI are counted."""
+        image = np.zeros((20, 20), dtype=np.uint8)
+        image[5:10, 2:6] = 200
+        hist = agc.histogram(image, stride=1, roi=(2, 5, 4, 5))
+        self.assertEqual(hist[200], 20)
+        self.assertEqual(hist.sum(), 20)
+
+    def test_unsupported_dtype(self):
+        """Only uint8 and uint16 images are supported."""
+        with self.assertRaises(TypeError):
+            agc.histogram(np.zeros((4, 4), dtype=np.float32))
+
+    def test_percentile_value(self):
+        """Percentiles match the search done by the capture program."""
+        hist = np.zeros(256, dtype=np.int64)
+        hist[10] = 90
+        hist[200] = 9
+        hist[250] = 1
+        self.assertEqual(agc.percentile_value(hist, 100), 250)
+        self.assertEqual(agc.percentile_value(hist, 99.5), 250)
+        self.assertEqual(agc.percentile_value(hist, 95), 200)
+        self.assertEqual(agc.percentile_value(hist, 50), 10)
+        self.assertEqual(agc.percentile_value(hist, 0), 10)
+
+
+class TestServo(unittest.TestCase):
+    """Collection of tests for the servo policies, mapping and AGC."""
+
+    def test_mapping_matches_capture_program(self):
+        """Default mapping is the same as in the capture program."""
+        mapping = agc.ExposureGainMapping()
+        for value in np.linspace(0, 1, 41):
+            gain = int(4.0 * agc.GAIN_MAX * value - 3.0 * agc.GAIN_MAX)
+            exposure = int(4.0 / 3.0 * agc.EXPOSURE_MAX_US * value)
+            self.assertEqual(
+                mapping(value),
+                (
+                    min(max(gain, agc.GAIN_MIN), agc.GAIN_MAX),
+                    min(max(exposure, agc.EXPOSURE_MIN_US), agc.EXPOSURE_MAX_US),
+                )
+            )
+
+    def test_step_policy(self):
+        """AGC value steps down when saturated, up when dark, and holds in between."""
+        servo = agc.AGC(value=0.5)
+        saturated = np.full((100, 100), 255, dtype=np.uint8)
+        servo.update(saturated)
+        self.assertAlmostEqual(servo.value, 0.49)
+        servo.update(np.full((100, 100), 240, dtype=np.uint8))
+        self.assertAlmostEqual(servo.value, 0.49)
+        servo.update(np.full((100, 100), 100, dtype=np.uint8))
+        self.assertAlmostEqual(servo.value, 0.5)
+
+        # 16-bit frames from a 14-bit sensor never reach 65535
+        servo.update(np.full((100, 100), 0xfffc, dtype=np.uint16))
+        self.assertAlmostEqual(servo.value, 0.49)
+
+    def test_value_clamped(self):
+        """AGC value stays in [0, 1]."""
+        servo = agc.AGC(policy=agc.ProportionalPolicy(gain=10.0, max_step=1.0), value=0.9)
+        servo.update(np.zeros((10, 10), dtype=np.uint16))
+        self.assertEqual(servo.value, 1.0)
+        self.assertEqual((servo.gain, servo.exposure_us), (agc.GAIN_MAX, agc.EXPOSURE_MAX_US))
+
+    def test_proportional_policy(self):
+        """Proportional policy converges on the target level."""
+        policy = agc.ProportionalPolicy(target=0.8, gain=0.5, deadband=0.01)
+        value = 0.1
+        for _ in range(50):
+            level = min(1.0, value * 1.2)  # simulated scene brightness
+            value = policy(value, level)
+        self.assertAlmostEqual(value * 1.2, 0.8, delta=0.01)
+
+    def test_camera_applier(self):
+        """Applier only calls the SDK when a setting changes."""
+        backend = FakeBackend()
+        apply = agc.CameraApplier(3, backend=backend)
+        apply(100, 1000)
+        apply(100, 1000)
+        apply(100, 2000)
+        self.assertEqual(
+            backend.calls,
+            [
+                (3, backend.ASI_GAIN, 100, backend.ASI_FALSE),
+                (3, backend.ASI_EXPOSURE, 1000, backend.ASI_FALSE),
+                (3, backend.ASI_EXPOSURE, 2000, backend.ASI_FALSE),
+            ]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
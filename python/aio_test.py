@@ -0,0 +1,145 @@
+"""Tests for asi.aio on the simulated backend."""
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import numpy as np
+
+from asi import aio
+from asi import sim
+from asi import tune
+
+
+class CountingBackend:
+    """Wraps asi.sim, counting API calls and recording the threads they were made on."""
+
+    def __init__(self):
+        self.calls = {}
+        self.threads = set()
+
+    def __getattr__(self, name):
+        attr = getattr(sim, name)
+        if not callable(attr) or not name.startswith('ASI') or name in ('ASICheck', 'ASIError'):
+            return attr
+
+        def counted(*args):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.threads.add(threading.current_thread().name)
+            return attr(*args)
+        return counted
+
+
+def run(coro):
+    """Run a coroutine on a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestAio(unittest.TestCase):
+    """Collection of tests for AsyncCamera."""
+
+    def setUp(self):
+        # Keep any profile stored for the simulated camera on this host out of the tests
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profiles = mock.patch.dict(
+            os.environ, {tune.PROFILES_ENV: os.path.join(directory.name, 'profiles.json')}
+        )
+        profiles.start()
+        self.addCleanup(profiles.stop)
+        self.cameras = [
+            sim.SimulatedCamera(
+                width=320,
+                height=240,
+                bandwidth=320 * 240 * 500,
+                readout_latency=0.0,
+                sync_words=True,
+            )
+            for _ in range(2)
+        ]
+        sim.set_cameras(*self.cameras)
+        self.backend = CountingBackend()
+
+    def tearDown(self):
+        sim.set_cameras(sim.SimulatedCamera())
+
+    def test_expose_concurrently(self):
+        """Exposures on two cameras overlap and status is polled only a few times."""
+        async def expose_both():
+            cameras = [await aio.open_camera(i, backend=self.backend) for i in range(2)]
+            for camera in cameras:
+                await camera.check(
+                    sim.ASISetROIFormat, camera.camera_id, 320, 240, 1, sim.ASI_IMG_RAW16
+                )
+            start = time.monotonic()
+            images = await asyncio.gather(*(camera.expose(0.2) for camera in cameras))
+            elapsed = time.monotonic() - start
+            for camera in cameras:
+                await camera.close()
+            return images, elapsed
+
+        images, elapsed = run(expose_both())
+        self.assertLess(elapsed, 0.35)
+        for image in images:
+            self.assertEqual((image.shape, image.dtype), ((240, 320), np.uint16))
+            self.assertGreater(image.mean(), 0)
+        self.assertLessEqual(self.backend.calls['ASIGetExpStatus'], 2 * 4)
+        self.assertEqual(self.backend.threads, {'asi-0_0', 'asi-1_0'})
+
+    def test_expose_cancelled(self):
+        """A cancelled exposure is stopped."""
+        async def cancel():
+            async with await aio.open_camera(0, backend=self.backend) as camera:
+                task = asyncio.ensure_future(camera.expose(10.0))
+                await asyncio.sleep(0.05)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                return await camera.check(sim.ASIGetExpStatus, camera.camera_id)
+
+        self.assertEqual(run(cancel()), sim.ASI_EXP_IDLE)
+        self.assertEqual(self.backend.calls['ASIStopExposure'], 1)
+
+    def test_controls_serialized(self):
+        """Concurrent control calls all run on the camera's worker thread and are diffed."""
+        async def apply_many():
+            async with await aio.open_camera(0, backend=self.backend) as camera:
+                await asyncio.gather(*(camera.apply(gain=100 + i % 2) for i in range(50)))
+                with self.assertRaises(ValueError):
+                    await camera.set('gain', 1000)
+                return camera.camera.stats(), await camera.read('gain')
+
+        stats, gain = run(apply_many())
+        self.assertEqual(stats['writes'], 50)
+        self.assertEqual(gain, 101)
+        self.assertEqual(self.backend.threads, {'asi-0_0'})
+
+    def test_video_frames(self):
+        """Frames arrive in order from an async iterator and capture stops when it is closed."""
+        async def read_frames():
+            async with await aio.open_camera(0, backend=self.backend) as camera:
+                await camera.set('exposure', 100)
+                indices = []
+                frames = camera.video_frames(maxsize=4)
+                async for frame in frames:
+                    self.assertEqual(frame.image.shape, (240, 320))
+                    indices.append(frame.index)
+                    if len(indices) == 20:
+                        break
+                await frames.aclose()
+                return indices, self.cameras[0].capturing
+
+        indices, capturing = run(read_frames())
+        self.assertEqual(indices, list(range(20)))
+        self.assertFalse(capturing)
+
+
+if __name__ == '__main__':
+    unittest.main()
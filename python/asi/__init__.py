@@ -0,0 +1,27 @@
+"""Python interface to the ZWO ASI camera SDK.
+
+The functions, constants and structures of the C API are wrapped by SWIG in the asi.sdk module.
+Everything from asi.sdk is re-exported here so the C API can be used directly as, for example,
+asi.ASIGetVideoData(). Higher-level building blocks are provided by the submodules of this
+package, such as asi.stream. Camera (from asi.camera) is also re-exported as an object-oriented
+alternative to the C API.
+
+Setting the environment variable ASI_BACKEND to sim before the package is first imported
+re-exports the simulated cameras of asi.sim instead, so code written against the asi package runs
+unchanged without a camera or the ZWO library. The backend in use is given by BACKEND.
+"""
+
+import os
+
+BACKEND = os.environ.get('ASI_BACKEND', 'sdk')
+
+# pylint: disable=wildcard-import,unused-wildcard-import
+if BACKEND == 'sdk':
+    from asi.sdk import *
+elif BACKEND == 'sim':
+    from asi.sim import *
+else:
+    raise ImportError(f'Unknown ASI_BACKEND {BACKEND!r}, must be sdk or sim')
+
+# pylint: disable=wrong-import-position
+from asi.camera import Camera
@@ -0,0 +1,307 @@
+"""Automatic gain control.
+
+This is a Python port of the AGC in the C++ capture program, generalized so the parts that are
+hardcoded there can be swapped out. Each update goes through four steps:
+
+1. A histogram of a subsample of the frame is computed (histogram()).
+2. The pixel value at a chosen percentile is found and normalized to [0, 1] (percentile_value()).
+3. A servo policy nudges a single AGC value in [0, 1] based on that level (StepPolicy,
+   ProportionalPolicy).
+4. The AGC value is mapped to a camera gain and exposure time (ExposureGainMapping), which can be
+   written to the camera by an applier (CameraApplier).
+
+Typical usage with asi.stream, running in its own thread:
+
+    consumer = stream.add_consumer('agc', policy=LATEST)
+    agc = AGC(percentile=99.9)
+    agc.run(consumer, CameraApplier(camera_id))
+"""
+
+import logging
+import math
+import numpy as np
+
+import asi
+
+
+logger = logging.getLogger(__name__)
+
+# Camera limits, matching camera.h in the capture program
+GAIN_MIN = 0
+GAIN_MAX = 510  # 510 is the maximum value for the ASI178
+EXPOSURE_MIN_US = 32  # 32 is the minimum value for the ASI178
+EXPOSURE_MAX_US = 16_667  # Max for ~60 FPS
+
+# Target number of pixels sampled per histogram when no stride is given. About 100k samples is
+# plenty to place the upper percentiles and keeps a full 6 MP frame well under 1 ms.
+HISTOGRAM_SAMPLES = 100_000
+
+# Thresholds of the capture program's servo, as fractions of full scale. The capture program steps
+# down when the 100th percentile 8-bit value is 255 and up when it is below 230. The high threshold
+# is just under 1.0 so that 16-bit frames from 12 or 14 bit sensors, whose low bits are always
+# zero, are also seen as saturated.
+LOW_LEVEL = 230 / 255
+HIGH_LEVEL = 254.5 / 255
+
+
+def sample_stride(image, samples=HISTOGRAM_SAMPLES):
+    """Return the stride along each axis that samples roughly the given number of pixels.
+
+    The stride is always odd so that successive samples land on different positions of the 2x2
+    Bayer pattern and every color channel is represented in the histogram.
+    """
+    pixels = image.shape[0] * image.shape[1]
+    stride = max(1, int(math.sqrt(pixels / samples)))
+    return stride | 1
+
+
+def histogram(image, stride=None, roi=None):
+    """Compute the histogram of an 8-bit or 16-bit frame.
+
+    Args:
+        image: Numpy array of shape (height, width) or (height, width, channels) with dtype uint8
+            or uint16.
+        stride: Only every stride-th pixel along each axis is counted. Defaults to a stride chosen
+            by sample_stride(). Use 1 to count every pixel.
+        roi: Optional region of interest as a tuple (x, y, width, height) in pixels. Only pixels
+            inside this region are counted.
+
+    Returns:
+        Array of counts with 256 bins for uint8 images or 65536 bins for uint16 images.
+
+    Raises:
+        TypeError: If the image dtype is not uint8 or uint16.
+    """
+    if image.dtype == np.uint8:
+        bins = 0x100
+    elif image.dtype == np.uint16:
+        bins = 0x10000
+    else:
+        raise TypeError(f'Histogram requires uint8 or uint16 images, not {image.dtype}')
+
+    if roi is not None:
+        x, y, width, height = roi
+        image = image[y:y + height, x:x + width]
+    if stride is None:
+        stride = sample_stride(image)
+    return np.bincount(image[::stride, ::stride].ravel(), minlength=bins)
+
+
+def percentile_value(hist, percentile):
+    """Return the pixel value at a percentile of a histogram.
+
+    The result matches the search in the capture program: the largest value v such that the
+    fraction of pixels with value v or above is more than 1 - percentile / 100. A percentile of 100
+    gives the maximum pixel value and a percentile of 0 gives the minimum.
+
+    Args:
+        hist: Histogram as returned by histogram().
+        percentile: Percentile in the range [0, 100].
+    """
+    cumulative = np.cumsum(hist)
+    total = int(cumulative[-1])
+    threshold = int((1.0 - percentile / 100) * total)
+    value = int(np.searchsorted(cumulative, max(1, total - threshold), side='left'))
+    return min(value, len(hist) - 1)
+
+
+class StepPolicy:
+    """Bang-bang servo with a dead band, as used by the capture program.
+
+    Args:
+        low: The AGC value increases when the level is below this.
+        high: The AGC value decreases when the level is at or above this.
+        step: Amount the AGC value changes per update.
+    """
+
+    def __init__(self, low=LOW_LEVEL, high=HIGH_LEVEL, step=0.01):
+        self.low = low
+        self.high = high
+        self.step = step
+
+    def __call__(self, value, level):
+        """Return the new AGC value given the current value and the measured level."""
+        if level >= self.high:
+            return value - self.step
+        if level < self.low:
+            return value + self.step
+        return value
+
+
+class ProportionalPolicy:
+    """Servo that moves the AGC value in proportion to the distance from a target level.
+
+    This converges much faster than StepPolicy after large changes in scene brightness.
+
+    Args:
+        target: Desired level as a fraction of full scale.
+        gain: Change in AGC value per unit of level error.
+        deadband: No change is made when the level is within this distance of the target.
+        max_step: Largest change in AGC value per update.
+    """
+
+    def __init__(self, target=0.9, gain=0.5, deadband=0.02, max_step=0.1):
+        self.target = target
+        self.gain = gain
+        self.deadband = deadband
+        self.max_step = max_step
+
+    def __call__(self, value, level):
+        """Return the new AGC value given the current value and the measured level."""
+        error = self.target - level
+        if abs(error) <= self.deadband:
+            return value
+        return value + max(-self.max_step, min(self.max_step, self.gain * error))
+
+
+class ExposureGainMapping:
+    """Maps an AGC value in [0, 1] to a camera gain and exposure time.
+
+    The lower part of the range controls exposure time only, with gain at its minimum. Once the
+    exposure time reaches its maximum the rest of the range controls gain. With the defaults this is
+    the same mapping as in the capture program.
+
+    Args:
+        gain_min: Minimum camera gain.
+        gain_max: Maximum camera gain.
+        exposure_min_us: Minimum exposure time in microseconds.
+        exposure_max_us: Maximum exposure time in microseconds.
+        exposure_fraction: Fraction of the AGC range used for exposure time.
+    """
+
+    def __init__(
+            self,
+            gain_min=GAIN_MIN,
+            gain_max=GAIN_MAX,
+            exposure_min_us=EXPOSURE_MIN_US,
+            exposure_max_us=EXPOSURE_MAX_US,
+            exposure_fraction=0.75,
+        ):
+        self.gain_min = gain_min
+        self.gain_max = gain_max
+        self.exposure_min_us = exposure_min_us
+        self.exposure_max_us = exposure_max_us
+        self.exposure_fraction = exposure_fraction
+
+    def __call__(self, value):
+        """Return a tuple (gain, exposure_us) for an AGC value."""
+        gain_span = self.gain_max - self.gain_min
+        gain = self.gain_min + gain_span * (value - self.exposure_fraction) / (
+            1.0 - self.exposure_fraction
+        )
+        exposure_us = self.exposure_max_us * value / self.exposure_fraction
+        return (
+            max(self.gain_min, min(self.gain_max, int(gain))),
+            max(self.exposure_min_us, min(self.exposure_max_us, int(exposure_us))),
+        )
+
+
+class CameraApplier:
+    """Writes gain and exposure time to a camera, skipping calls when nothing changed.
+
+    Args:
+        camera_id: ID of an open camera.
+        backend: Module implementing the ASI API. Defaults to the asi package.
+    """
+
+    def __init__(self, camera_id, backend=None):
+        self.camera_id = camera_id
+        self._backend = asi if backend is None else backend
+        self.gain = None
+        self.exposure_us = None
+
+    def __call__(self, gain, exposure_us):
+        """Set the camera gain and exposure time."""
+        backend = self._backend
+        if gain != self.gain:
+            backend.ASICheck(backend.ASISetControlValue(
+                self.camera_id, backend.ASI_GAIN, gain, backend.ASI_FALSE
+            ))
+            self.gain = gain
+        if exposure_us != self.exposure_us:
+            backend.ASICheck(backend.ASISetControlValue(
+                self.camera_id, backend.ASI_EXPOSURE, exposure_us, backend.ASI_FALSE
+            ))
+            self.exposure_us = exposure_us
+
+
+class AGC:
+    """Automatic gain control servo.
+
+    Args:
+        percentile: Percentile of pixel values servoed by the policy, in the range [0, 100]. The
+            capture program uses 100, the brightest pixel.
+        policy: Callable taking the current AGC value and the measured level and returning the new
+            AGC value. Defaults to StepPolicy().
+        mapping: Callable mapping the AGC value to a tuple (gain, exposure_us). Defaults to
+            ExposureGainMapping().
+        histogram_func: Callable with the same signature as histogram(), for alternative histogram
+            implementations.
+        stride: Subsampling stride passed to the histogram function.
+        roi: Region of interest (x, y, width, height) passed to the histogram function.
+        value: Initial AGC value in [0, 1].
+
+    Attributes:
+        value: Current AGC value in [0, 1].
+        level: Most recent measured level as a fraction of full scale, or None before the first
+            update.
+        gain: Most recent camera gain output.
+        exposure_us: Most recent exposure time output in microseconds.
+    """
+
+    def __init__(
+            self,
+            percentile=100.0,
+            policy=None,
+            mapping=None,
+            histogram_func=histogram,
+            stride=None,
+            roi=None,
+            value=0.0,
+        ):
+        if not 0.0 <= percentile <= 100.0:
+            raise ValueError(f'Percentile {percentile} is outside the range [0, 100]')
+        self.percentile = percentile
+        self.policy = StepPolicy() if policy is None else policy
+        self.mapping = ExposureGainMapping() if mapping is None else mapping
+        self.histogram_func = histogram_func
+        self.stride = stride
+        self.roi = roi
+        self.value = value
+        self.level = None
+        self.gain, self.exposure_us = self.mapping(self.value)
+
+    def measure(self, image):
+        """Return the level of a frame at the configured percentile as a fraction of full scale."""
+        hist = self.histogram_func(image, stride=self.stride, roi=self.roi)
+        return percentile_value(hist, self.percentile) / (len(hist) - 1)
+
+    def update(self, image):
+        """Update the servo from a frame.
+
+        Returns:
+            Tuple (gain, exposure_us) with the new camera settings.
+        """
+        self.level = self.measure(image)
+        self.value = max(0.0, min(1.0, self.policy(self.value, self.level)))
+        self.gain, self.exposure_us = self.mapping(self.value)
+        logger.debug(
+            'AGC value: %.3f, level: %.3f, gain: %03d, exposure: %05.3f ms',
+            self.value,
+            self.level,
+            self.gain,
+            self.exposure_us / 1.0e3,
+        )
+        return self.gain, self.exposure_us
+
+    def run(self, consumer, apply):
+        """Update from every frame received by a stream consumer until the stream stops.
+
+        Args:
+            consumer: An asi.stream.Consumer, normally with the LATEST policy.
+            apply: Callable taking (gain, exposure_us), such as a CameraApplier.
+        """
+        for frame in consumer:
+            with frame:
+                settings = self.update(frame.image)
+            apply(*settings)
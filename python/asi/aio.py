@@ -0,0 +1,243 @@
+"""asyncio front-end for ASI cameras.
+
+Every call into the ASI library for a camera runs on a single worker thread dedicated to that
+camera, so calls are serialized per camera without any locking by the caller and the event loop
+is never blocked. Video frames are read by the reader thread of an asi.stream.VideoStream and
+handed to the event loop without a thread waiting on them, and exposures sleep on the event loop
+until they are due instead of polling the camera. One event loop can drive several cameras this
+way with one worker thread per camera, plus one reader thread per camera while streaming video:
+
+    async def main():
+        async with await open_camera(0) as camera:
+            await camera.apply(gain=100)
+            image = await camera.expose(2.0)
+            async with contextlib.aclosing(camera.video_frames()) as frames:
+                async for frame in frames:
+                    process(frame.image)
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import numpy as np
+
+from asi.camera import Camera
+from asi.stream import BLOCK, FRAME_POOL_SIZE, VideoStream, image_geometry
+
+
+logger = logging.getLogger(__name__)
+
+# Interval between the first two status checks once an exposure is expected to have completed.
+# Readout usually takes a few ms, so polling starts fast and backs off from there.
+POLL_INTERVAL_MIN = 0.002
+
+# Maximum interval between status checks
+POLL_INTERVAL_MAX = 0.1
+
+# Time allowed beyond the exposure time for an exposure to complete before it is abandoned
+EXPOSURE_TIMEOUT = 10.0
+
+# Maximum number of frames waiting to be taken by an async frame iterator
+VIDEO_QUEUE_SIZE = 8
+
+
+async def open_camera(index=0, backend=None):
+    """Open and initialize a camera without blocking the event loop.
+
+    Args:
+        index: Index of the camera, from 0 to ASIGetNumOfConnectedCameras() - 1.
+        backend: Module implementing the ASI API. Defaults to the asi package.
+
+    Returns:
+        An AsyncCamera.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix=f'asi-{index}')
+    try:
+        camera = await asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(Camera, index, backend=backend)
+        )
+    except BaseException:
+        executor.shutdown(wait=False)
+        raise
+    return AsyncCamera(camera, executor)
+
+
+class AsyncCamera:
+    """Awaitable interface to an open asi.camera.Camera.
+
+    Normally created with open_camera().
+
+    Args:
+        camera: An open asi.camera.Camera. It is closed when the AsyncCamera is closed.
+        executor: Executor with a single worker thread on which all calls for the camera are run.
+            A new one is created if None.
+
+    Attributes:
+        camera: The underlying asi.camera.Camera, whose cached camera information and controls
+            can be read directly from the event loop.
+    """
+
+    def __init__(self, camera, executor=None):
+        self.camera = camera
+        self._backend = camera.backend
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                1, thread_name_prefix=f'asi-{camera.camera_id}'
+            )
+        self._executor = executor
+
+    @property
+    def camera_id(self):
+        """ID of the camera, for use with the functions of the C API."""
+        return self.camera.camera_id
+
+    async def call(self, func, *args):
+        """Run a blocking callable on the camera's worker thread and return its result.
+
+        Calls for the same camera run one at a time, in the order they were made.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def check(self, func, *args):
+        """Like call() but for ASI API functions; the result is passed through ASICheck()."""
+        return self._backend.ASICheck(await self.call(func, *args))
+
+    async def apply(self, **values):
+        """Awaitable Camera.apply()."""
+        return await self.call(functools.partial(self.camera.apply, **values))
+
+    async def set(self, key, value, auto=False):
+        """Awaitable Camera.set()."""
+        return await self.call(self.camera.set, key, value, auto)
+
+    async def read(self, key):
+        """Awaitable Camera.read()."""
+        return await self.call(self.camera.read, key)
+
+    async def expose(self, seconds, dark=False, out=None, timeout=EXPOSURE_TIMEOUT):
+        """Take a single exposure and return the image.
+
+        The coroutine sleeps until the exposure is expected to end and then checks its status
+        with exponentially increasing intervals. If it is cancelled the exposure is stopped.
+
+        Args:
+            seconds: Exposure time in seconds.
+            dark: Whether to close the mechanical shutter, on cameras that have one.
+            out: Array to receive the image, matching the shape and dtype of the current ROI
+                format. A new array is allocated if None.
+            timeout: Time in seconds allowed beyond the exposure time for the exposure to
+                complete.
+
+        Returns:
+            The image as an array of shape (height, width) or (height, width, 3).
+
+        Raises:
+            ASIError if the exposure failed.
+            asyncio.TimeoutError if the exposure did not complete in time.
+        """
+        backend = self._backend
+        camera_id = self.camera_id
+        await self.apply(exposure=round(seconds * 1e6))
+        if out is None:
+            shape, dtype = await self.call(image_geometry, camera_id, backend)
+            out = np.empty(shape, dtype)
+
+        loop = asyncio.get_running_loop()
+        await self.check(
+            backend.ASIStartExposure, camera_id, backend.ASI_TRUE if dark else backend.ASI_FALSE
+        )
+        end = loop.time() + seconds
+        try:
+            await asyncio.sleep(seconds)
+            interval = POLL_INTERVAL_MIN
+            while True:
+                status = await self.check(backend.ASIGetExpStatus, camera_id)
+                if status == backend.ASI_EXP_SUCCESS:
+                    break
+                if status != backend.ASI_EXP_WORKING:
+                    raise backend.ASIError(f'Exposure ended with status {status}')
+                if loop.time() > end + timeout:
+                    raise asyncio.TimeoutError(f'Exposure did not complete within {timeout} s')
+                await asyncio.sleep(interval)
+                interval = min(2 * interval, POLL_INTERVAL_MAX)
+        except BaseException:
+            await self.call(backend.ASIStopExposure, camera_id)
+            raise
+
+        await self.check(backend.ASIGetDataAfterExpInto, camera_id, out)
+        return out
+
+    async def video_frames(
+            self,
+            maxsize=VIDEO_QUEUE_SIZE,
+            policy=BLOCK,
+            pool_size=FRAME_POOL_SIZE,
+            timeout_ms=500,
+        ):
+        """Capture video and yield frames as they arrive.
+
+        Video capture starts when the first frame is requested and stops when the generator is
+        closed. Since an async generator abandoned by breaking out of an async for loop is only
+        closed once garbage collected, wrap it in contextlib.aclosing() or call aclose() when
+        capture must stop at a known point.
+
+        Each frame is an asi.stream.Frame that is released back to the pool when the next frame
+        is requested, so the image must be copied if it is needed for longer.
+
+        Args:
+            maxsize: Maximum number of frames waiting to be taken.
+            policy: Queue policy from asi.stream; BLOCK, DROP_OLDEST or LATEST.
+            pool_size: Number of frame buffers to allocate.
+            timeout_ms: Timeout passed to ASIGetVideoDataInto() by the reader thread.
+
+        Yields:
+            asi.stream.Frame objects.
+        """
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+
+        def notify():
+            loop.call_soon_threadsafe(ready.set)
+
+        stream = await self.call(
+            functools.partial(
+                VideoStream,
+                self.camera_id,
+                pool_size=pool_size,
+                timeout_ms=timeout_ms,
+                backend=self._backend,
+            )
+        )
+        consumer = stream.add_consumer('aio', maxsize, policy, notify)
+        await self.call(stream.start)
+        try:
+            while True:
+                # Cleared before checking the queue so a frame queued in between is not missed
+                ready.clear()
+                frame = consumer.get(timeout=0)
+                if frame is None:
+                    if consumer.closed:
+                        return
+                    await ready.wait()
+                    continue
+                with frame:
+                    yield frame
+        finally:
+            await self.call(stream.stop)
+            stream.remove_consumer(consumer)
+            logger.debug('Video stream stopped: %s', stream.stats())
+
+    async def close(self):
+        """Close the camera and shut down its worker thread."""
+        try:
+            await self.call(self.camera.close)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,271 @@
+"""Software binning and cropping of raw frames ahead of writers and encoders.
+
+Hardware binning (the bin argument of ASISetROIFormat()) is limited to the factors a camera
+supports, and on many sensors it averages in the digital domain at 8 or 10 bits, or only bins one
+of the two axes. Binning in software keeps the full sample values: in sum mode, the output keeps
+every photon counted, so the signal to read noise ratio of each output pixel improves by
+sqrt(N * M) at no cost in dynamic range, at the price of a wider output dtype.
+
+A Binning stage crops and bins each frame into a preallocated output without allocating memory,
+so it can sit between a VideoStream consumer and an ImageSink or SegmentedWriter. Those copy only
+the reduced frame, so the memory bandwidth, queue space and storage used downstream shrink by the
+binning factor. RAW16 frames from the SDK are MSB-aligned, so a 12-bit camera needs shift=4 to
+right-align its samples before they are added up:
+
+    binning = Binning((2080, 3096), np.uint16, factor=2, mode=SUM, crop=(0, 0, 2048, 2048),
+                      bit_depth=12, shift=4)
+    with SegmentedWriter(['/data'], 1024, 1024, ser.MONO, binning.bit_depth,
+                         stage=binning) as writer:
+        for frame in consumer:
+            with frame:
+                writer.add_frame(frame)
+
+With a Bayer pattern, samples of each color are binned only with samples of the same color, and
+the output keeps the 2x2 color filter structure of the input: each 2N x 2M block of the input
+becomes one 2x2 Bayer cell of the output.
+"""
+
+import logging
+import time
+import numpy as np
+
+from asi import metrics
+from asi import stream
+from asi.debayer import BAYER_PATTERNS
+from asi.debayer import shift_pattern
+
+
+logger = logging.getLogger(__name__)
+
+# Each output pixel is the sum of the input pixels it covers
+SUM = 'sum'
+# Each output pixel is the mean of the input pixels it covers, rounded to the nearest integer
+MEAN = 'mean'
+MODES = (SUM, MEAN)
+
+
+def _accumulator_dtype(max_value):
+    """Return the narrowest unsigned dtype of 8, 16 or 32 bits that holds max_value."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise ValueError(f'Sums of up to {max_value} do not fit in 32 bits')
+
+
+class Binning:
+    """Crops and bins frames of a fixed shape into a preallocated output.
+
+    Instances are not thread safe: use one per thread.
+
+    Args:
+        shape: Shape (height, width) of the input frames.
+        dtype: dtype of the input frames, uint8 or uint16.
+        factor: Binning factor, either an int for both axes or a tuple (horizontal, vertical).
+        mode: SUM or MEAN.
+        crop: Region (x, y, width, height) of each frame to keep, in input pixels, or None for the
+            whole frame. Rows and columns at the right and bottom of the region that do not fill
+            a whole bin are discarded.
+        pattern: Bayer pattern of the input frames, such as 'RGGB', for binning that keeps the
+            color filter structure. None for mono frames.
+        bit_depth: Number of significant bits of the input samples, used to choose the narrowest
+            output dtype for sums. Defaults to all bits of dtype minus shift.
+        shift: Number of bits the samples are shifted left by in dtype, such as 4 for the
+            MSB-aligned RAW16 frames of a 12-bit camera. Samples are shifted right by this many
+            bits before they are binned, so the output is right-aligned and the lowest shift bits
+            of the input are discarded.
+        out_dtype: dtype of the output. Defaults to dtype in MEAN mode, or the narrowest of uint8,
+            uint16 and uint32 that holds the largest possible sum in SUM mode.
+        registry: asi.metrics.Registry to report the time taken per frame to. Defaults to
+            asi.metrics.REGISTRY.
+
+    Attributes:
+        output_shape: Shape of the binned frames.
+        out: Preallocated output array returned by apply().
+        pattern: Bayer pattern of the output, which differs from the input pattern if the crop
+            starts at an odd row or column; None for mono frames.
+        input_bit_depth: Number of significant bits of the input samples once right-aligned.
+        bit_depth: Number of significant bits of the output samples.
+        frames: Number of frames binned.
+    """
+
+    def __init__(
+            self,
+            shape,
+            dtype,
+            factor=2,
+            mode=MEAN,
+            crop=None,
+            pattern=None,
+            bit_depth=None,
+            shift=0,
+            out_dtype=None,
+            registry=None,
+        ):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.uint8, np.uint16):
+            raise TypeError(f'Binning requires uint8 or uint16 frames, not {self.dtype}')
+        if len(self.shape) != 2:
+            raise ValueError(f'Binning requires 2-D frames, not shape {self.shape}')
+        if mode not in MODES:
+            raise ValueError(f'mode must be one of {MODES}, got {mode!r}')
+        factor_x, factor_y = (factor, factor) if isinstance(factor, int) else factor
+        if factor_x < 1 or factor_y < 1:
+            raise ValueError(f'Binning factors must be at least 1, got {factor}')
+        self.factor = (factor_x, factor_y)
+        self.mode = mode
+
+        height, width = self.shape
+        x, y, crop_width, crop_height = (0, 0, width, height) if crop is None else crop
+        if x < 0 or y < 0 or x + crop_width > width or y + crop_height > height:
+            raise ValueError(f'Crop {crop} is outside of frames of shape {self.shape}')
+        self.crop = (x, y, crop_width, crop_height)
+
+        if pattern is not None:
+            pattern = pattern.upper()
+            if pattern not in BAYER_PATTERNS:
+                raise ValueError(f'Invalid Bayer pattern {pattern!r}')
+            self.pattern = shift_pattern(pattern, x, y)
+            # Whole 2x2 output cells only
+            cell_x, cell_y = 2 * factor_x, 2 * factor_y
+            self.output_shape = (crop_height // cell_y * 2, crop_width // cell_x * 2)
+        else:
+            self.pattern = None
+            self.output_shape = (crop_height // factor_y, crop_width // factor_x)
+        if 0 in self.output_shape:
+            raise ValueError(f'Crop {self.crop} is smaller than one bin')
+
+        dtype_bits = 8 * self.dtype.itemsize
+        if not 0 <= shift < dtype_bits:
+            raise ValueError(f'shift must be between 0 and {dtype_bits - 1}, got {shift}')
+        self.shift = shift
+        self.input_bit_depth = dtype_bits - shift if bit_depth is None else bit_depth
+        if not 1 <= self.input_bit_depth <= dtype_bits - shift:
+            raise ValueError(
+                f'{self.input_bit_depth}-bit samples shifted by {shift} do not fit in {self.dtype}'
+            )
+        # Largest valid input sample, checked on every frame if the dtype has room for more
+        self._max_input = None
+        if self.input_bit_depth + shift < dtype_bits:
+            self._max_input = ((1 << self.input_bit_depth) - 1) << shift
+        count = factor_x * factor_y
+        max_sum = ((1 << self.input_bit_depth) - 1) * count
+        if mode == SUM:
+            self.bit_depth = int(max_sum).bit_length()
+            needed = _accumulator_dtype(max_sum)
+        else:
+            # Room for the rounding offset added before dividing
+            self._accumulator_dtype = _accumulator_dtype(max_sum + count // 2)
+            self.bit_depth = self.input_bit_depth
+            needed = self.dtype
+        self.out_dtype = needed if out_dtype is None else np.dtype(out_dtype)
+        if self.out_dtype.kind != 'u' or self.out_dtype.itemsize < needed.itemsize:
+            raise ValueError(
+                f'out_dtype {self.out_dtype} cannot hold the {mode} of {count} '
+                f'{self.input_bit_depth}-bit samples; use at least {needed}'
+            )
+        self.out = np.empty(self.output_shape, dtype=self.out_dtype)
+        self._scratch = None
+        self._shifted = None
+        if shift:
+            self._shifted = np.empty(self.output_shape, dtype=self.dtype)
+        if mode == MEAN and count > 1:
+            self._scratch = np.empty(self.output_shape, dtype=self._accumulator_dtype)
+
+        self.frames = 0
+        registry = metrics.REGISTRY if registry is None else registry
+        self._latency = registry.stage_latency('bin')
+
+    def _views(self, image):
+        """Yield pairs (cell, view) of the input samples that are added up into the output.
+
+        Each view is a strided view into image with one sample per output pixel of a Bayer cell
+        position (row, column), or of every output pixel if cell is None for mono frames.
+        """
+        x, y, _, _ = self.crop
+        factor_x, factor_y = self.factor
+        height, width = self.output_shape
+        if self.pattern is None:
+            for j in range(factor_y):
+                for i in range(factor_x):
+                    yield None, image[
+                        y + j:y + j + height * factor_y:factor_y,
+                        x + i:x + i + width * factor_x:factor_x,
+                    ]
+            return
+        # Sites of one color are 2 apart, so a bin of one color spans 2 * factor pixels
+        step_x, step_y = 2 * factor_x, 2 * factor_y
+        for cell_y in range(2):
+            for cell_x in range(2):
+                for j in range(factor_y):
+                    for i in range(factor_x):
+                        top = y + cell_y + 2 * j
+                        left = x + cell_x + 2 * i
+                        yield (cell_y, cell_x), image[
+                            top:top + height // 2 * step_y:step_y,
+                            left:left + width // 2 * step_x:step_x,
+                        ]
+
+    def apply(self, image, out=None):
+        """Crop and bin a frame.
+
+        Args:
+            image: Array of the shape and dtype given to the constructor, or a stream.Frame.
+            out: Array of shape output_shape and dtype out_dtype to write to. Defaults to the
+                preallocated self.out, which is overwritten by the next call.
+
+        Returns:
+            The binned frame.
+
+        Raises:
+            ValueError: If the frame does not match the constructor arguments, including samples
+                with more significant bits than bit_depth, as with MSB-aligned frames binned
+                without shift.
+        """
+        if isinstance(image, stream.Frame):
+            image = image.image
+        if image.shape != self.shape or image.dtype != self.dtype:
+            raise ValueError(
+                f'Frame of shape {image.shape} and dtype {image.dtype} does not match '
+                f'{self.shape} {self.dtype}'
+            )
+        if out is None:
+            out = self.out
+        elif out.shape != self.output_shape or out.dtype != self.out_dtype:
+            raise ValueError(f'out must have shape {self.output_shape} and dtype {self.out_dtype}')
+
+        start_time = time.perf_counter()
+        if self._max_input is not None:
+            x, y, width, height = self.crop
+            maximum = image[y:y + height, x:x + width].max()
+            if maximum > self._max_input:
+                raise ValueError(
+                    f'Sample value {maximum} has more than {self.input_bit_depth} bits shifted by '
+                    f'{self.shift}; set shift for MSB-aligned frames'
+                )
+        total = out if self._scratch is None else self._scratch
+        started = set()
+        for cell, view in self._views(image):
+            target = total if cell is None else total[cell[0]::2, cell[1]::2]
+            if self._shifted is not None:
+                shifted = self._shifted if cell is None else self._shifted[cell[0]::2, cell[1]::2]
+                np.right_shift(view, self.shift, out=shifted)
+                view = shifted
+            if cell not in started:
+                np.copyto(target, view)
+                started.add(cell)
+            else:
+                target += view
+        if self._scratch is not None:
+            count = self.factor[0] * self.factor[1]
+            # Round to nearest
+            total += count // 2
+            if count & (count - 1) == 0:
+                np.right_shift(total, count.bit_length() - 1, out=out, casting='unsafe')
+            else:
+                np.floor_divide(total, count, out=out, casting='unsafe')
+        self.frames += 1
+        self._latency.observe_since(start_time)
+        return out
+
+    __call__ = apply
@@ -0,0 +1,516 @@
+"""Master dark, bias and flat frames and fast in-place calibration.
+
+ASIEnableDarkSubtract() only works with 8-bit BMP darks and only at RAW8. This module does the same
+job in Python for any image type, including RAW16:
+
+1. Masters are built from any source of frames (a list of arrays, a SERReader, or a Consumer of a
+   VideoStream) in a single pass with constant memory, using a running mean (MeanAccumulator) or a
+   running sigma-clipped mean (SigmaClipAccumulator) that rejects outliers such as cosmic ray hits
+   and satellite trails.
+2. Masters are cached by the settings they depend on (exposure, gain, sensor temperature, ROI and
+   binning) in a MasterCache with least recently used eviction.
+3. Calibration applies a dark and/or a flat to frames in place, without allocating any buffers per
+   frame, fast enough to keep up with video capture.
+
+Typical usage:
+
+    cache = MasterCache()
+    key = camera_key(camera_id)
+    dark = cache.get_or_build(key, lambda: build_master(dark_consumer, count=64))
+    calibration = Calibration(dark=dark, flat=flat)
+    for frame in consumer:
+        with frame:
+            calibration.apply(frame.image)
+"""
+
+import collections
+import logging
+import math
+import threading
+import time
+import numpy as np
+
+import asi
+from asi import metrics
+from asi import stream
+
+
+logger = logging.getLogger(__name__)
+
+# Frames accepted unconditionally by SigmaClipAccumulator before outliers are rejected, so that
+# the running standard deviation is meaningful. With fewer, the noisy estimate of the standard
+# deviation makes the accumulator reject several percent of the values of pure Gaussian noise.
+CLIP_WARMUP_FRAMES = 10
+
+# Default rejection threshold of SigmaClipAccumulator in standard deviations
+DEFAULT_KAPPA = 3.0
+
+# Sensor temperatures within this many degrees C share a master in the cache
+TEMPERATURE_STEP = 2.0
+
+# Default number of masters kept by MasterCache
+CACHE_SIZE = 16
+
+# Pixels of a flat below this fraction of the mean are treated as dead and left uncorrected rather
+# than amplified
+FLAT_MIN = 0.1
+
+# Calibration processes frames in blocks of rows of about this many pixels so that the
+# intermediate float32 values stay in the CPU cache between operations. 64k pixels is 256 kB.
+CHUNK_PIXELS = 65_536
+
+
+class MeanAccumulator:
+    """Running per-pixel mean and standard deviation of a sequence of frames.
+
+    Uses Welford's single-pass algorithm with float32 state and preallocated scratch buffers, so
+    memory use is constant and no memory is allocated per frame.
+
+    Args:
+        shape: Shape of the frames.
+
+    Attributes:
+        frames: Number of frames added.
+        mean: float32 array of the per-pixel mean.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.frames = 0
+        self.mean = np.zeros(self.shape, dtype=np.float32)
+        self._m2 = np.zeros(self.shape, dtype=np.float32)
+        self._delta = np.empty(self.shape, dtype=np.float32)
+        self._scratch = np.empty(self.shape, dtype=np.float32)
+
+    def _check(self, image):
+        if image.shape != self.shape:
+            raise ValueError(f'Expected frames of shape {self.shape}, got {image.shape}')
+
+    def add(self, image):
+        """Add a frame."""
+        self._check(image)
+        self.frames += 1
+        np.subtract(image, self.mean, out=self._delta)
+        np.multiply(self._delta, 1.0 / self.frames, out=self._scratch)
+        self.mean += self._scratch
+        np.subtract(image, self.mean, out=self._scratch)
+        self._scratch *= self._delta
+        self._m2 += self._scratch
+
+    def _counts(self):
+        return self.frames
+
+    @property
+    def std(self):
+        """float32 array of the per-pixel sample standard deviation."""
+        return np.sqrt(self._m2 / np.maximum(self._counts() - 1, 1))
+
+
+class SigmaClipAccumulator(MeanAccumulator):
+    """Running per-pixel mean that rejects values far from the mean so far.
+
+    The first warmup frames are all accepted. After that, a pixel value is rejected if it differs
+    from the running mean of that pixel by more than kappa times its running standard deviation.
+    This is a single-pass approximation of iterative sigma clipping that gives almost the same
+    result for the short-lived outliers found in calibration frames (cosmic rays, hot pixels
+    flickering on, satellite trails) without keeping the frames in memory.
+
+    Args:
+        shape: Shape of the frames.
+        kappa: Rejection threshold in standard deviations.
+        warmup: Number of frames accepted unconditionally, at least 2.
+        min_sigma: Lower limit on the standard deviation used for the threshold, so that pixels
+            whose first few values happen to be identical do not reject everything afterwards.
+            For RAW16 data from a sensor with fewer bits, use the step between values (16 for a
+            12-bit sensor).
+
+    Attributes:
+        frames: Number of frames added.
+        mean: float32 array of the per-pixel mean of the accepted values.
+        counts: float32 array of the number of accepted values of each pixel.
+        rejected: Total number of pixel values rejected.
+    """
+
+    def __init__(self, shape, kappa=DEFAULT_KAPPA, warmup=CLIP_WARMUP_FRAMES, min_sigma=1.0):
+        if warmup < 2:
+            raise ValueError('warmup must be at least 2')
+        super().__init__(shape)
+        self.kappa = kappa
+        self.warmup = warmup
+        self.min_sigma = min_sigma
+        self.counts = np.zeros(self.shape, dtype=np.float32)
+        self.rejected = 0
+        self._accept = np.empty(self.shape, dtype=bool)
+        self._square = np.empty(self.shape, dtype=np.float32)
+
+    def add(self, image):
+        """Add a frame, ignoring the values of pixels that are outliers."""
+        self._check(image)
+        self.frames += 1
+        np.subtract(image, self.mean, out=self._delta)
+        if self.frames <= self.warmup:
+            self.counts += 1
+        else:
+            # Accept where delta^2 <= kappa^2 * max(variance, min_sigma^2)
+            np.subtract(self.counts, 1, out=self._scratch)
+            np.divide(self._m2, self._scratch, out=self._scratch)
+            np.maximum(self._scratch, self.min_sigma ** 2, out=self._scratch)
+            self._scratch *= self.kappa ** 2
+            np.square(self._delta, out=self._square)
+            np.less_equal(self._square, self._scratch, out=self._accept)
+            self.rejected += self._accept.size - int(np.count_nonzero(self._accept))
+            # Rejected values leave the mean and M2 unchanged since their delta becomes zero
+            self._delta *= self._accept
+            self.counts += self._accept
+        np.divide(self._delta, self.counts, out=self._scratch)
+        self.mean += self._scratch
+        np.subtract(image, self.mean, out=self._scratch)
+        self._scratch *= self._delta
+        self._m2 += self._scratch
+
+    def _counts(self):
+        return self.counts
+
+
+class Master:
+    """A master calibration frame.
+
+    Attributes:
+        kind: 'bias', 'dark' or 'flat'.
+        data: float32 array. For darks and biases this is the mean frame in ADU; for flats it is
+            the dark-subtracted mean frame normalized to a mean of 1.
+        noise: float32 array of the per-pixel standard deviation of the frames, in the same units
+            as data.
+        frames: Number of frames combined.
+        rejected: Fraction of pixel values rejected by sigma clipping.
+    """
+
+    def __init__(self, kind, data, noise, frames, rejected=0.0):
+        self.kind = kind
+        self.data = data
+        self.noise = noise
+        self.frames = frames
+        self.rejected = rejected
+
+    @property
+    def shape(self):
+        """Shape of the frames this master applies to."""
+        return self.data.shape
+
+    def __repr__(self):
+        return f'Master({self.kind!r}, shape={self.shape}, frames={self.frames})'
+
+
+def iter_images(source, count=None):
+    """Yield the images of a source of frames.
+
+    Args:
+        source: Iterable of Numpy arrays (such as a SERReader) or of stream Frames (such as a
+            Consumer). Frames are released after each image has been used.
+        count: Maximum number of images, or None for all of them.
+    """
+    for i, item in enumerate(source):
+        if count is not None and i >= count:
+            if isinstance(item, stream.Frame):
+                item.decr_ref_count()
+            return
+        if isinstance(item, stream.Frame):
+            with item:
+                yield item.image
+        else:
+            yield np.asarray(item)
+
+
+def _accumulate(source, count, kappa, min_sigma):
+    accumulator = None
+    for image in iter_images(source, count):
+        if accumulator is None:
+            if kappa is None:
+                accumulator = MeanAccumulator(image.shape)
+            else:
+                accumulator = SigmaClipAccumulator(image.shape, kappa, min_sigma=min_sigma)
+        accumulator.add(image)
+    if accumulator is None:
+        raise ValueError('No frames to build a master from')
+    return accumulator
+
+
+def _rejected_fraction(accumulator):
+    rejected = getattr(accumulator, 'rejected', 0)
+    return rejected / (accumulator.mean.size * accumulator.frames)
+
+
+def build_master(source, kind='dark', count=None, kappa=DEFAULT_KAPPA, min_sigma=1.0):
+    """Build a master dark or bias from a source of frames in a single pass.
+
+    Args:
+        source: Frames, as accepted by iter_images().
+        kind: 'dark' or 'bias'.
+        count: Maximum number of frames to use, or None to use the whole source. Required for an
+            endless source such as a Consumer of a running VideoStream.
+        kappa: Sigma clipping threshold (see SigmaClipAccumulator), or None for a plain mean.
+        min_sigma: See SigmaClipAccumulator.
+
+    Returns:
+        A Master.
+    """
+    if kind not in ('dark', 'bias'):
+        raise ValueError(f"kind must be 'dark' or 'bias', got {kind!r}")
+    accumulator = _accumulate(source, count, kappa, min_sigma)
+    master = Master(
+        kind, accumulator.mean, accumulator.std, accumulator.frames, _rejected_fraction(accumulator)
+    )
+    logger.info('Built %r, %.3f%% of values rejected', master, master.rejected * 100)
+    return master
+
+
+def build_flat(source, dark=None, count=None, kappa=DEFAULT_KAPPA, min_sigma=1.0):
+    """Build a master flat from a source of frames in a single pass.
+
+    Args:
+        source: Frames, as accepted by iter_images().
+        dark: Master dark (or bias) matching the flat frames, subtracted before normalization.
+        count: Maximum number of frames to use, or None to use the whole source.
+        kappa: Sigma clipping threshold (see SigmaClipAccumulator), or None for a plain mean.
+        min_sigma: See SigmaClipAccumulator.
+
+    Returns:
+        A Master whose data has a mean of 1.
+    """
+    accumulator = _accumulate(source, count, kappa, min_sigma)
+    data = accumulator.mean
+    if dark is not None:
+        if dark.shape != data.shape:
+            raise ValueError(f'Dark of shape {dark.shape} does not match flats of {data.shape}')
+        data -= dark.data
+    level = float(data.mean())
+    if level <= 0:
+        raise ValueError('Flat frames have no signal above the dark')
+    data /= level
+    master = Master(
+        'flat', data, accumulator.std / level, accumulator.frames, _rejected_fraction(accumulator)
+    )
+    logger.info('Built %r with a level of %.1f ADU', master, level)
+    return master
+
+
+def master_key(exposure, gain, temperature, roi, binning, temperature_step=TEMPERATURE_STEP):
+    """Return the MasterCache key for a set of camera settings.
+
+    Args:
+        exposure: Exposure time in microseconds.
+        gain: Gain.
+        temperature: Sensor temperature as reported by ASI_TEMPERATURE, in units of 0.1 degree C.
+        roi: Region of interest (x, y, width, height) in binned pixels.
+        binning: Binning factor.
+        temperature_step: Temperatures are rounded to a multiple of this many degrees C.
+    """
+    bucket = int(math.floor(temperature / 10 / temperature_step + 0.5))
+    return (int(exposure), int(gain), bucket, tuple(int(v) for v in roi), int(binning))
+
+
+def camera_key(camera_id, temperature_step=TEMPERATURE_STEP, backend=None):
+    """Return the MasterCache key for the current settings of an open camera."""
+    backend = asi if backend is None else backend
+
+    def value(control_type):
+        return backend.ASICheck(backend.ASIGetControlValue(camera_id, control_type))[0]
+
+    width, height, binning, _ = backend.ASICheck(backend.ASIGetROIFormat(camera_id))
+    x, y = backend.ASICheck(backend.ASIGetStartPos(camera_id))
+    return master_key(
+        value(backend.ASI_EXPOSURE),
+        value(backend.ASI_GAIN),
+        value(backend.ASI_TEMPERATURE),
+        (x, y, width, height),
+        binning,
+        temperature_step,
+    )
+
+
+class MasterCache:
+    """Masters by camera settings with least recently used eviction.
+
+    Keys are normally made with master_key() or camera_key(). Safe to use from multiple threads.
+
+    Args:
+        maxsize: Maximum number of masters kept.
+
+    Attributes:
+        hits: Number of lookups that found a master.
+        misses: Number of lookups that did not.
+        evictions: Number of masters evicted to make room for new ones.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._masters = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the master for a key, or None if there is none."""
+        with self._lock:
+            master = self._masters.get(key)
+            if master is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._masters.move_to_end(key)
+            return master
+
+    def put(self, key, master):
+        """Add or replace the master for a key."""
+        with self._lock:
+            self._masters[key] = master
+            self._masters.move_to_end(key)
+            while len(self._masters) > self.maxsize:
+                evicted, _ = self._masters.popitem(last=False)
+                self.evictions += 1
+                logger.debug('Evicted master for %s', evicted)
+
+    def get_or_build(self, key, build):
+        """Return the master for a key, calling build() to make it if it is not in the cache.
+
+        The lock is not held while building, so two threads missing on the same key may both
+        build the master.
+        """
+        master = self.get(key)
+        if master is None:
+            master = build()
+            self.put(key, master)
+        return master
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._masters
+
+    def __len__(self):
+        with self._lock:
+            return len(self._masters)
+
+    def stats(self):
+        """Return a dict of cache statistics."""
+        with self._lock:
+            return {
+                'size': len(self._masters),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class Calibration:
+    """Applies a master dark and/or flat to uint8 or uint16 frames in place.
+
+    The corrected value of each pixel is (raw - dark) / flat + pedestal, rounded and clipped to the
+    range of the frame's dtype. This is folded into a single multiply-add, raw * scale + offset,
+    with scale and offset precomputed, and evaluated in blocks of rows that fit in the CPU cache
+    with preallocated float32 scratch space. With a dark alone and no pedestal, the subtraction
+    is done with saturating integer arithmetic instead, which is faster still.
+
+    Args:
+        dark: Master dark or bias, or None.
+        flat: Master flat, or None.
+        pedestal: Value added after calibration so that noise below the dark level is not clipped
+            to zero.
+        chunk_pixels: Approximate number of pixels processed per block.
+        registry: asi.metrics.Registry to report the time taken per frame to. Defaults to
+            asi.metrics.REGISTRY.
+
+    Attributes:
+        frames: Number of frames calibrated.
+    """
+
+    def __init__(
+            self,
+            dark=None,
+            flat=None,
+            pedestal=0,
+            chunk_pixels=CHUNK_PIXELS,
+            registry=None,
+        ):
+        if dark is None and flat is None:
+            raise ValueError('At least one of dark and flat is required')
+        if dark is not None and flat is not None and dark.shape != flat.shape:
+            raise ValueError(f'Dark of shape {dark.shape} does not match flat of {flat.shape}')
+        self.dark = dark
+        self.flat = flat
+        self.pedestal = pedestal
+        self.chunk_pixels = chunk_pixels
+        self.shape = (dark if dark is not None else flat).shape
+        self.frames = 0
+        registry = metrics.REGISTRY if registry is None else registry
+        self._latency = registry.stage_latency('calibrate')
+
+        self._scale = None
+        self._offset = None
+        self._integer_darks = {}
+        self._scratch = None
+        if flat is not None or pedestal:
+            if flat is not None:
+                usable = flat.data >= FLAT_MIN
+                self._scale = np.where(usable, 1.0 / np.maximum(flat.data, FLAT_MIN), 1.0)
+                self._scale = self._scale.astype(np.float32)
+            else:
+                self._scale = np.ones(self.shape, dtype=np.float32)
+            # 0.5 makes the truncation when converting back to integers round to nearest
+            self._offset = np.full(self.shape, pedestal + 0.5, dtype=np.float32)
+            if dark is not None:
+                self._offset -= dark.data * self._scale
+
+    def _integer_dark(self, dtype):
+        dark = self._integer_darks.get(dtype)
+        if dark is None:
+            limit = np.iinfo(dtype).max
+            dark = np.clip(np.rint(self.dark.data), 0, limit).astype(dtype)
+            self._integer_darks[dtype] = dark
+        return dark
+
+    def _rows_per_chunk(self):
+        return max(1, self.chunk_pixels // max(1, int(np.prod(self.shape[1:]))))
+
+    def apply(self, image):
+        """Calibrate a frame in place.
+
+        Args:
+            image: uint8 or uint16 array with the shape of the masters.
+
+        Returns:
+            image.
+
+        Raises:
+            TypeError: If the image dtype is not uint8 or uint16.
+            ValueError: If the image shape does not match the masters.
+        """
+        if image.dtype not in (np.uint8, np.uint16):
+            raise TypeError(f'Calibration requires uint8 or uint16 images, not {image.dtype}')
+        if image.shape != self.shape:
+            raise ValueError(f'Image of shape {image.shape} does not match masters of {self.shape}')
+
+        start_time = time.perf_counter()
+        rows = self._rows_per_chunk()
+        if self._scale is None:
+            dark = self._integer_dark(image.dtype)
+            for start in range(0, self.shape[0], rows):
+                block = image[start:start + rows]
+                dark_block = dark[start:start + rows]
+                # max(raw, dark) - dark is raw - dark saturated at zero
+                np.maximum(block, dark_block, out=block)
+                np.subtract(block, dark_block, out=block)
+        else:
+            if self._scratch is None:
+                self._scratch = np.empty((rows,) + self.shape[1:], dtype=np.float32)
+            limit = np.iinfo(image.dtype).max
+            for start in range(0, self.shape[0], rows):
+                block = image[start:start + rows]
+                scratch = self._scratch[:len(block)]
+                np.multiply(block, self._scale[start:start + rows], out=scratch)
+                scratch += self._offset[start:start + rows]
+                np.clip(scratch, 0, limit, out=scratch)
+                np.copyto(block, scratch, casting='unsafe')
+        self.frames += 1
+        self._latency.observe_since(start_time)
+        return image
@@ -0,0 +1,323 @@
+"""Object-oriented handle for an ASI camera with cached capabilities and diffed control writes.
+
+The C API is stateless, so code using it directly tends to repeat queries whose answers never
+change while a camera is open (ASI_CAMERA_INFO, the supported bins and image types, and the
+capabilities of every control) and to write control values every frame whether or not they
+changed. Each of these calls is a round trip through the ASI library and often over USB.
+
+Camera snapshots all of that once when the camera is opened. Controls are looked up by name or
+control type in a local table, values are range-checked against the cached capabilities without
+calling the library, and apply() only writes the values that differ from what was last written:
+
+    with Camera(0) as camera:
+        camera.apply(gain=200, exposure=10_000, high_speed_mode=1)
+        ...
+        camera.apply(gain=200, exposure=12_000)  # only the exposure time is written
+        print(camera.stats())
+
+Camera.apply() can be used directly as the applier of asi.agc.AGC.run():
+
+    agc.run(consumer, lambda gain, exposure_us: camera.apply(gain=gain, exposure=exposure_us))
+
+If asi.tune has stored a profile for the camera on this host, its USB bandwidth and high speed
+mode settings are applied when the camera is opened.
+"""
+
+import logging
+import threading
+
+import asi
+from asi import tune
+
+
+logger = logging.getLogger(__name__)
+
+# Names of the ASI_CONTROL_TYPE constants without the ASI_ prefix. The lower-case forms are the
+# control names accepted by Camera, e.g. 'high_speed_mode' for ASI_HIGH_SPEED_MODE.
+CONTROL_TYPE_NAMES = (
+    'GAIN',
+    'EXPOSURE',
+    'GAMMA',
+    'WB_R',
+    'WB_B',
+    'OFFSET',
+    'BANDWIDTHOVERLOAD',
+    'OVERCLOCK',
+    'TEMPERATURE',
+    'FLIP',
+    'AUTO_MAX_GAIN',
+    'AUTO_MAX_EXP',
+    'AUTO_TARGET_BRIGHTNESS',
+    'HARDWARE_BIN',
+    'HIGH_SPEED_MODE',
+    'COOLER_POWER_PERC',
+    'TARGET_TEMP',
+    'COOLER_ON',
+    'MONO_BIN',
+    'FAN_ON',
+    'PATTERN_ADJUST',
+    'ANTI_DEW_HEATER',
+)
+
+
+class Control:
+    """Snapshot of the capabilities of one camera control, along with its last known value.
+
+    Attributes:
+        name: Lower-case name of the control type, e.g. 'gain'. For control types not listed in
+            CONTROL_TYPE_NAMES this is the name reported by the camera.
+        caps_name: Name of the control as reported by the camera, e.g. 'Gain'.
+        description: Description of the control as reported by the camera.
+        control_type: ASI_CONTROL_TYPE value.
+        min_value: Minimum value.
+        max_value: Maximum value.
+        default_value: Default value.
+        writable: Whether the control can be set.
+        auto_supported: Whether the camera can adjust the control automatically.
+        value: Last value read from or written to the camera.
+        auto: Whether automatic adjustment was last enabled.
+    """
+
+    def __init__(self, name, caps, value, auto):
+        self.name = name
+        self.caps_name = caps.Name
+        self.description = caps.Description
+        self.control_type = caps.ControlType
+        self.min_value = caps.MinValue
+        self.max_value = caps.MaxValue
+        self.default_value = caps.DefaultValue
+        self.writable = bool(caps.IsWritable)
+        self.auto_supported = bool(caps.IsAutoSupported)
+        self.value = value
+        self.auto = bool(auto)
+
+    def check(self, value, auto=False):
+        """Raise ValueError if the value cannot be written to this control."""
+        if not self.writable:
+            raise ValueError(f'Control {self.name} is read-only')
+        if auto and not self.auto_supported:
+            raise ValueError(f'Control {self.name} does not support automatic adjustment')
+        if not self.min_value <= value <= self.max_value:
+            raise ValueError(
+                f'Value {value} for control {self.name} is outside the range '
+                f'[{self.min_value}, {self.max_value}]'
+            )
+
+    def __repr__(self):
+        return (
+            f'Control({self.name!r}, value={self.value}, range=[{self.min_value}, '
+            f'{self.max_value}], default={self.default_value}, writable={self.writable})'
+        )
+
+
+class Camera:
+    """Handle for an open camera.
+
+    The camera is opened and initialized when the object is created and closed by close() or when
+    used as a context manager. The camera information, supported bins and image types, and the
+    capabilities and current values of all controls are read once on opening.
+
+    Control values are assumed to change only through this object while it is open. Controls in
+    automatic mode and read-only controls such as the temperature change on their own, so they are
+    never skipped by apply() and should be read with read().
+
+    Args:
+        index: Index of the camera, from 0 to ASIGetNumOfConnectedCameras() - 1.
+        backend: Module implementing the ASI API. Defaults to the asi package.
+        apply_profile: Apply the profile stored by asi.tune for this camera on this host, if any.
+        profile_path: Path of the profile file. Defaults to asi.tune.profile_path().
+
+    Attributes:
+        info: ASI_CAMERA_INFO snapshot taken when the camera was opened.
+        camera_id: ID of the camera, for use with the functions of the C API.
+        name: Name of the camera model.
+        supported_bins: List of supported binning factors.
+        supported_video_formats: List of supported ASI_IMG_TYPE values.
+        controls: Dict of Control objects keyed by control type.
+        writes: Number of ASISetControlValue() calls made.
+        writes_skipped: Number of ASISetControlValue() calls avoided because the value was
+            unchanged.
+        profile: Profile dict from asi.tune applied when the camera was opened, or None.
+    """
+
+    def __init__(self, index=0, backend=None, apply_profile=True, profile_path=None):
+        self._backend = asi if backend is None else backend
+        backend = self._backend
+        self.info = backend.ASICheck(backend.ASIGetCameraProperty(index))
+        self.camera_id = self.info.CameraID
+        self.name = self.info.Name
+        self.supported_bins = backend.ASIGetSupportedBins(self.info)
+        self.supported_video_formats = backend.ASIGetSupportedVideoFormats(self.info)
+
+        backend.ASICheck(backend.ASIOpenCamera(self.camera_id))
+        self._closed = False
+        try:
+            backend.ASICheck(backend.ASIInitCamera(self.camera_id))
+            self.controls = self._read_controls()
+            self._controls_by_name = {
+                control.name: control for control in self.controls.values()
+            }
+            self._lock = threading.Lock()
+            self.writes = 0
+            self.writes_skipped = 0
+            self.profile = None
+            if apply_profile:
+                profile = tune.ProfileStore(profile_path).find(self.camera_id, backend)
+                if profile is not None:
+                    self.apply_profile(profile)
+        except Exception:
+            self.close()
+            raise
+
+    def _read_controls(self):
+        """Return a dict of Control objects keyed by control type read from the camera."""
+        backend = self._backend
+        names = {}
+        for name in CONTROL_TYPE_NAMES:
+            control_type = getattr(backend, 'ASI_' + name, None)
+            if control_type is not None:
+                names.setdefault(control_type, name.lower())
+
+        controls = {}
+        num_controls = backend.ASICheck(backend.ASIGetNumOfControls(self.camera_id))
+        for control_index in range(num_controls):
+            caps = backend.ASICheck(backend.ASIGetControlCaps(self.camera_id, control_index))
+            value, auto = backend.ASICheck(
+                backend.ASIGetControlValue(self.camera_id, caps.ControlType)
+            )
+            name = names.get(caps.ControlType, caps.Name)
+            controls[caps.ControlType] = Control(name, caps, value, auto)
+        return controls
+
+    def control(self, key):
+        """Return the Control for a control name like 'gain' or a control type like ASI_GAIN.
+
+        Raises:
+            KeyError if the camera does not have the control.
+        """
+        table = self._controls_by_name if isinstance(key, str) else self.controls
+        control = table.get(key)
+        if control is None:
+            raise KeyError(f'Camera {self.name} has no control {key!r}')
+        return control
+
+    def __contains__(self, key):
+        try:
+            self.control(key)
+        except KeyError:
+            return False
+        return True
+
+    def value(self, key):
+        """Return the last value read from or written to a control, without calling the library."""
+        return self.control(key).value
+
+    def read(self, key):
+        """Read the current value of a control from the camera and update the cached value."""
+        control = self.control(key)
+        backend = self._backend
+        value, auto = backend.ASICheck(
+            backend.ASIGetControlValue(self.camera_id, control.control_type)
+        )
+        with self._lock:
+            control.value = value
+            control.auto = bool(auto)
+        return value
+
+    def set(self, key, value, auto=False):
+        """Write a value to a control unless it is unchanged.
+
+        Returns:
+            True if the value was written, False if the write was skipped.
+
+        Raises:
+            KeyError if the camera does not have the control.
+            ValueError if the control is read-only or the value is out of range.
+        """
+        control = self.control(key)
+        control.check(value, auto)
+        with self._lock:
+            return self._write(control, value, auto)
+
+    def apply(self, **values):
+        """Write several control values, skipping those that are unchanged.
+
+        Controls are given as keyword arguments named after the lower-case control type, e.g.
+        apply(gain=100, exposure=10_000). All values are checked before anything is written, so
+        an invalid value leaves the camera unchanged.
+
+        Returns:
+            Number of values written.
+
+        Raises:
+            KeyError if the camera does not have one of the controls.
+            ValueError if one of the controls is read-only or a value is out of range.
+        """
+        pending = []
+        for key, value in values.items():
+            control = self.control(key)
+            control.check(value)
+            pending.append((control, value))
+        with self._lock:
+            return sum(self._write(control, value, False) for control, value in pending)
+
+    def apply_profile(self, profile):
+        """Apply the bandwidth and high speed mode settings of a profile from asi.tune.
+
+        Settings for controls the camera does not have are ignored.
+        """
+        values = {
+            'bandwidthoverload': profile.get('bandwidth'),
+            'high_speed_mode': profile.get('high_speed_mode'),
+        }
+        self.apply(**{
+            name: value for name, value in values.items() if value is not None and name in self
+        })
+        self.profile = profile
+        logger.info('Applied tuned profile to %s: bandwidth %s, high speed mode %s', self.name,
+                    values['bandwidthoverload'], values['high_speed_mode'])
+
+    def _write(self, control, value, auto):
+        """Write a value to a control unless unchanged. Must be called with the lock held."""
+        if not auto and not control.auto and value == control.value:
+            self.writes_skipped += 1
+            return False
+        backend = self._backend
+        backend.ASICheck(backend.ASISetControlValue(
+            self.camera_id,
+            control.control_type,
+            int(value),
+            backend.ASI_TRUE if auto else backend.ASI_FALSE,
+        ))
+        control.value = value
+        control.auto = bool(auto)
+        self.writes += 1
+        return True
+
+    def stats(self):
+        """Return a dict with the number of control writes made and skipped."""
+        with self._lock:
+            return {'writes': self.writes, 'writes_skipped': self.writes_skipped}
+
+    def close(self):
+        """Close the camera. Does nothing if it is already closed."""
+        if self._closed:
+            return
+        self._closed = True
+        self._backend.ASICheck(self._backend.ASICloseCamera(self.camera_id))
+
+    @property
+    def backend(self):
+        """Module implementing the ASI API used for this camera."""
+        return self._backend
+
+    @property
+    def closed(self):
+        """True if the camera has been closed."""
+        return self._closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
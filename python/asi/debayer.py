@@ -0,0 +1,419 @@
+"""Demosaicing of raw Bayer frames from color cameras.
+
+Three methods are available, for 8 and 16-bit frames with any of the four RGGB-type patterns:
+
+- superpixel: each 2x2 Bayer cell becomes one pixel, with the two green samples averaged, as in
+  asi.preview.superpixel(). Half resolution, but no interpolation artifacts.
+- bilinear: every missing color sample is the average of the nearest 2 or 4 samples of that color.
+  Full resolution, with some color fringing at sharp edges.
+- edge: green is interpolated along edges rather than across them, choosing between horizontal
+  and vertical interpolation by comparing the gradients in both directions (Hamilton and Adams,
+  1997), and red and blue are interpolated as differences from green, which follow edges as well.
+  Several times slower than bilinear.
+
+The Bayer pattern can be taken from the camera or from the header of a SER file:
+
+    pattern = camera_pattern(asi.ASIGetCameraProperty(0)[1])  # or ser_pattern(reader.color_id)
+    with Debayer(pattern, 'bilinear') as debayer:
+        rgb = np.empty(debayer.output_shape(raw.shape), raw.dtype)
+        for frame in consumer:
+            with frame:
+                debayer(frame.image, out=rgb)
+
+Frames are processed in bands of rows small enough to stay in the CPU cache, spread over a pool
+of threads. All of the work is done by NumPy ufuncs, which release the GIL, so the threads run in
+parallel. Each thread keeps its own scratch buffers, so nothing is allocated per frame once every
+thread has processed a band.
+"""
+
+import concurrent.futures
+import logging
+import os
+import threading
+import numpy as np
+
+import asi
+from asi import ser
+
+
+logger = logging.getLogger(__name__)
+
+METHODS = ('superpixel', 'bilinear', 'edge')
+
+# Bayer patterns with diagonal greens, given as the colors of the top-left 2x2 cell in row order
+BAYER_PATTERNS = ('RGGB', 'BGGR', 'GRBG', 'GBRG')
+
+# Approximate number of raw pixels per band of rows processed by one thread at a time, sized so
+# that a band and its temporaries stay in the L2 cache
+TILE_PIXELS = 1 << 16
+
+# Rows of context needed above and below a band by each method
+_HALO = {'superpixel': 0, 'bilinear': 1, 'edge': 3}
+
+# SER color IDs of the patterns supported here
+_SER_PATTERNS = {
+    ser.BAYER_RGGB: 'RGGB',
+    ser.BAYER_GRBG: 'GRBG',
+    ser.BAYER_GBRG: 'GBRG',
+    ser.BAYER_BGGR: 'BGGR',
+}
+
+
+def camera_pattern(info, start_x=0, start_y=0, backend=None):
+    """Return the Bayer pattern of a camera.
+
+    Args:
+        info: ASI_CAMERA_INFO of the camera, from ASIGetCameraProperty().
+        start_x: Horizontal start of the ROI in pixels. An odd start shifts the pattern.
+        start_y: Vertical start of the ROI in pixels.
+        backend: Module implementing the ASI API. Defaults to the asi package.
+
+    Returns:
+        Pattern such as 'RGGB', or None for a mono camera.
+    """
+    backend = asi if backend is None else backend
+    if not info.IsColorCam:
+        return None
+    pattern = {
+        backend.ASI_BAYER_RG: 'RGGB',
+        backend.ASI_BAYER_BG: 'BGGR',
+        backend.ASI_BAYER_GR: 'GRBG',
+        backend.ASI_BAYER_GB: 'GBRG',
+    }[info.BayerPattern]
+    return shift_pattern(pattern, start_x, start_y)
+
+
+def ser_pattern(color_id):
+    """Return the Bayer pattern of a SER file from its ColorID, or None if it is mono or RGB.
+
+    Raises:
+        ValueError: For the CMY patterns, which are not supported.
+    """
+    if color_id in (ser.MONO, ser.RGB, ser.BGR):
+        return None
+    if color_id not in _SER_PATTERNS:
+        raise ValueError(f'Unsupported SER color ID {color_id}')
+    return _SER_PATTERNS[color_id]
+
+
+def shift_pattern(pattern, dx, dy):
+    """Return the pattern of a crop of a frame starting dx columns and dy rows into it."""
+    cells = [pattern[0:2], pattern[2:4]]
+    if dy % 2:
+        cells.reverse()
+    if dx % 2:
+        cells = [row[::-1] for row in cells]
+    return ''.join(cells)
+
+
+def output_shape(shape, method):
+    """Return the shape of the color image produced from a raw frame of the given shape."""
+    height, width = shape
+    if method == 'superpixel':
+        return (height // 2, width // 2, 3)
+    return (height, width, 3)
+
+
+def _wide_dtype(dtype):
+    """Return a dtype that can hold the sum of four pixels of the given dtype."""
+    return np.uint16 if dtype == np.uint8 else np.uint32
+
+
+class Debayer:
+    """Demosaics raw frames with a fixed pattern and method on a pool of threads.
+
+    Args:
+        pattern: Colors of the top-left 2x2 cell of the frames in row order; one of BAYER_PATTERNS.
+        method: One of METHODS.
+        order: Order of the color channels of the output, 'RGB' or 'BGR' (as used by OpenCV).
+        workers: Number of threads. Defaults to the number of CPUs. With 1, frames are processed
+            in the calling thread.
+        tile_pixels: Approximate number of pixels in each band of rows.
+    """
+
+    def __init__(self, pattern, method='bilinear', order='RGB', workers=None,
+                 tile_pixels=TILE_PIXELS):
+        pattern = pattern.upper()
+        if pattern not in BAYER_PATTERNS:
+            raise ValueError(f'Invalid Bayer pattern {pattern!r}')
+        if method not in METHODS:
+            raise ValueError(f'method must be one of {METHODS}, got {method!r}')
+        if order not in ('RGB', 'BGR'):
+            raise ValueError(f"order must be 'RGB' or 'BGR', got {order!r}")
+        self.pattern = pattern
+        self.method = method
+        self.order = order
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.tile_pixels = tile_pixels
+        self._channels = {color: order.index(color) for color in 'RGB'}
+        self._local = threading.local()
+        self._executor = None
+        if self.workers > 1:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.workers, thread_name_prefix='asi-debayer'
+            )
+
+    def output_shape(self, shape):
+        """Return the shape of the color image produced from a raw frame of the given shape."""
+        return output_shape(shape, self.method)
+
+    def __call__(self, raw, out=None):
+        """Demosaic a frame.
+
+        Args:
+            raw: uint8 or uint16 array of shape (height, width), with even height and width.
+            out: Optional preallocated array of shape output_shape(raw.shape) and the dtype of
+                raw, which is returned.
+
+        Returns:
+            Color image of shape output_shape(raw.shape).
+        """
+        if raw.dtype not in (np.uint8, np.uint16):
+            raise TypeError(f'Debayering requires uint8 or uint16 frames, not {raw.dtype}')
+        if raw.ndim != 2 or raw.shape[0] % 2 or raw.shape[1] % 2:
+            raise ValueError(f'Raw frames must be 2-D with even dimensions, not {raw.shape}')
+        shape = self.output_shape(raw.shape)
+        if out is None:
+            out = np.empty(shape, dtype=raw.dtype)
+        elif out.shape != shape or out.dtype != raw.dtype:
+            raise ValueError(f'out must have shape {shape} and dtype {raw.dtype}')
+
+        height, width = raw.shape
+        rows = max(2, self.tile_pixels // width // 2 * 2)
+        bands = [(start, min(start + rows, height)) for start in range(0, height, rows)]
+        if self._executor is None or len(bands) == 1:
+            for start, stop in bands:
+                self._band(raw, out, start, stop)
+        else:
+            futures = [
+                self._executor.submit(self._band, raw, out, start, stop) for start, stop in bands
+            ]
+            for future in futures:
+                future.result()
+        return out
+
+    def close(self):
+        """Shut down the thread pool."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _scratch(self, name, shape, dtype):
+        """Return a scratch array of this thread, reallocated only if the shape changes."""
+        key = (name, shape, np.dtype(dtype))
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        array = buffers.get(key)
+        if array is None:
+            # Drop buffers of other shapes from earlier frames
+            for old in [k for k in buffers if k[0] == name]:
+                del buffers[old]
+            array = buffers[key] = np.empty(shape, dtype=dtype)
+        return array
+
+    def _padded(self, raw, start, stop, halo):
+        """Return rows start to stop of raw with halo rows and columns of context on each side.
+
+        Beyond the edges of the frame the context is mirrored, which keeps the Bayer pattern.
+        """
+        height, width = raw.shape
+        padded = self._scratch('padded', (stop - start + 2 * halo, width + 2 * halo), raw.dtype)
+        top = max(start - halo, 0)
+        bottom = min(stop + halo, height)
+        padded[top - start + halo:bottom - start + halo, halo:halo + width] = raw[top:bottom]
+        for i in range(halo):
+            # Rows above the frame, then below, mirrored about the edge row
+            if start - halo + i < 0:
+                padded[i, halo:halo + width] = raw[halo - i - start]
+            if stop + i >= height:
+                mirrored = 2 * (height - 1) - (stop + i)
+                padded[stop - start + halo + i, halo:halo + width] = raw[mirrored]
+        for i in range(halo):
+            padded[:, i] = padded[:, 2 * halo - i]
+            padded[:, width + halo + i] = padded[:, width + halo - 2 - i]
+        return padded
+
+    def _band(self, raw, out, start, stop):
+        if self.method == 'superpixel':
+            self._superpixel(raw[start:stop], out[start // 2:stop // 2])
+            return
+        padded = self._padded(raw, start, stop, _HALO[self.method])
+        if self.method == 'bilinear':
+            self._bilinear(padded, out[start:stop])
+        else:
+            self._edge(padded, out[start:stop])
+
+    def _superpixel(self, raw, out):
+        green = self._scratch('green', out.shape[:2], _wide_dtype(raw.dtype))
+        first_green = True
+        for i, color in enumerate(self.pattern):
+            site = raw[i // 2::2, i % 2::2]
+            if color != 'G':
+                out[..., self._channels[color]] = site
+            elif first_green:
+                np.copyto(green, site)
+                first_green = False
+            else:
+                green += site
+                green >>= 1
+                out[..., self._channels['G']] = green
+
+    def _bilinear(self, padded, out):
+        """Interpolate a band padded with one row and column of context on each side."""
+        height, width = out.shape[:2]
+        total = self._scratch('total', (height // 2, width // 2), _wide_dtype(padded.dtype))
+
+        def neighbor(py, px, dy, dx):
+            """View of the sites (py, px) of the band shifted by (dy, dx)."""
+            return padded[1 + py + dy:1 + py + dy + height:2, 1 + px + dx:1 + px + dx + width:2]
+
+        for py in range(2):
+            for px in range(2):
+                site = self.pattern[2 * py + px]
+                horizontal = self.pattern[2 * py + 1 - px]
+                for color, channel in self._channels.items():
+                    target = out[py::2, px::2, channel]
+                    if color == site:
+                        target[...] = neighbor(py, px, 0, 0)
+                        continue
+                    if color == 'G':
+                        offsets = ((-1, 0), (1, 0), (0, -1), (0, 1))
+                    elif site != 'G':
+                        offsets = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+                    elif horizontal == color:
+                        offsets = ((0, -1), (0, 1))
+                    else:
+                        offsets = ((-1, 0), (1, 0))
+                    np.add(neighbor(py, px, *offsets[0]), neighbor(py, px, *offsets[1]),
+                           out=total, dtype=total.dtype)
+                    for offset in offsets[2:]:
+                        total += neighbor(py, px, *offset)
+                    # Round to nearest
+                    total += len(offsets) // 2
+                    total >>= len(offsets).bit_length() - 1
+                    target[...] = total
+
+    def _edge(self, padded, out):
+        """Interpolate a band padded with three rows and columns of context on each side."""
+        halo = 3
+        rows, cols = padded.shape
+        height, width = out.shape[:2]
+        values = self._scratch('values', padded.shape, np.float32)
+        np.copyto(values, padded)
+        green = self._scratch('green_plane', padded.shape, np.float32)
+        np.copyto(green, values)
+        difference = self._scratch('difference', padded.shape, np.float32)
+        temp = self._scratch('temp', ((rows - 4) // 2, (cols - 4) // 2), np.float32)
+        gradient = self._scratch('gradient', temp.shape, np.float32)
+        estimate = self._scratch('estimate', temp.shape, np.float32)
+
+        # Green at red and blue sites of the padded band, except the outer two rows and columns
+        for i, color in enumerate(self.pattern):
+            if color == 'G':
+                continue
+            # Sites of this color, offset so that the first one is at least 2 from the edge
+            py = (i // 2 + halo) % 2
+            px = (i % 2 + halo) % 2
+            y0 = 2 + (py - 2) % 2
+            x0 = 2 + (px - 2) % 2
+            n_rows = (rows - 2 - y0 + 1) // 2
+            n_cols = (cols - 2 - x0 + 1) // 2
+
+            def view(array, dy, dx, y0=y0, x0=x0, n_rows=n_rows, n_cols=n_cols):
+                return array[y0 + dy:y0 + dy + 2 * n_rows:2, x0 + dx:x0 + dx + 2 * n_cols:2]
+
+            h_grad, v_grad = gradient[:n_rows, :n_cols], temp[:n_rows, :n_cols]
+            h_est, v_est = estimate[:n_rows, :n_cols], view(green, 0, 0)
+            center = view(values, 0, 0)
+            # Horizontal gradient and estimate
+            np.subtract(view(values, 0, -1), view(values, 0, 1), out=h_grad)
+            np.abs(h_grad, out=h_grad)
+            laplacian = self._scratch('laplacian', h_grad.shape, np.float32)
+            np.multiply(center, 2, out=laplacian)
+            laplacian -= view(values, 0, -2)
+            laplacian -= view(values, 0, 2)
+            np.add(view(values, 0, -1), view(values, 0, 1), out=h_est)
+            h_est += laplacian * 0.5
+            h_est *= 0.5
+            np.abs(laplacian, out=laplacian)
+            h_grad += laplacian
+            # Vertical gradient and estimate
+            np.subtract(view(values, -1, 0), view(values, 1, 0), out=v_grad)
+            np.abs(v_grad, out=v_grad)
+            np.multiply(center, 2, out=laplacian)
+            laplacian -= view(values, -2, 0)
+            laplacian -= view(values, 2, 0)
+            vertical = self._scratch('vertical', h_grad.shape, np.float32)
+            np.add(view(values, -1, 0), view(values, 1, 0), out=vertical)
+            vertical += laplacian * 0.5
+            vertical *= 0.5
+            np.abs(laplacian, out=laplacian)
+            v_grad += laplacian
+            # Interpolate along the direction with the smaller gradient, or average if equal
+            np.add(h_est, vertical, out=v_est)
+            v_est *= 0.5
+            np.copyto(v_est, h_est, where=h_grad < v_grad)
+            np.copyto(v_est, vertical, where=v_grad < h_grad)
+
+        # Red and blue by bilinear interpolation of their difference from green
+        np.subtract(values, green, out=difference)
+        limit = np.iinfo(out.dtype).max
+        result = self._scratch('result', (height // 2, width // 2), np.float32)
+
+        def neighbor(array, py, px, dy, dx):
+            y = halo + py + dy
+            x = halo + px + dx
+            return array[y:y + height:2, x:x + width:2]
+
+        for py in range(2):
+            for px in range(2):
+                site = self.pattern[2 * py + px]
+                horizontal = self.pattern[2 * py + 1 - px]
+                for color, channel in self._channels.items():
+                    target = out[py::2, px::2, channel]
+                    if color == site:
+                        target[...] = neighbor(padded, py, px, 0, 0)
+                        continue
+                    if color == 'G':
+                        np.copyto(result, neighbor(green, py, px, 0, 0))
+                    else:
+                        if site != 'G':
+                            offsets = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+                        elif horizontal == color:
+                            offsets = ((0, -1), (0, 1))
+                        else:
+                            offsets = ((-1, 0), (1, 0))
+                        np.add(neighbor(difference, py, px, *offsets[0]),
+                               neighbor(difference, py, px, *offsets[1]), out=result)
+                        for offset in offsets[2:]:
+                            result += neighbor(difference, py, px, *offset)
+                        result *= 1 / len(offsets)
+                        result += neighbor(green, py, px, 0, 0)
+                    result += 0.5
+                    np.clip(result, 0, limit, out=result)
+                    np.copyto(target, result, casting='unsafe')
+
+
+def debayer(raw, pattern, method='bilinear', order='RGB', out=None):
+    """Demosaic a single frame in the calling thread.
+
+    For a stream of frames, create a Debayer once instead.
+
+    Args:
+        raw: uint8 or uint16 array of shape (height, width), with even height and width.
+        pattern: Colors of the top-left 2x2 cell of the frame in row order, e.g. 'RGGB'.
+        method: One of METHODS.
+        order: Order of the color channels of the output, 'RGB' or 'BGR'.
+        out: Optional preallocated output array.
+
+    Returns:
+        Color image of shape output_shape(raw.shape, method).
+    """
+    return Debayer(pattern, method, order, workers=1)(raw, out)
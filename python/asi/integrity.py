@@ -0,0 +1,226 @@
+"""Frame integrity validation and sequence gap detection.
+
+Raw frames read from ASI178 cameras start and end with fixed 16-bit sync words, and the third and
+fourth bytes of each frame hold a 16-bit frame counter that increments with every frame sent by the
+camera. These are the same checks done one frame at a time by Frame::validate() and
+Frame::frameIndex() in the capture program, but here they are done for a whole batch of frames at
+once. Only the first four and last two bytes of each frame are touched, so auditing a
+memory-mapped SER file only reads a couple of pages per frame from disk:
+
+    with SERReader('capture.ser') as reader:
+        report = audit_ser(reader)
+    print(report.summary())
+"""
+
+import mmap
+import numpy as np
+
+
+# Valid frames from ASI178 cameras always start and end with these 16-bit values
+SYNC_START = 0x7e5a
+SYNC_END = 0xf03c
+
+# The frame counter sometimes increments by 2 even at low frame rates, so steps of 1 or 2 are both
+# considered normal.
+MAX_NORMAL_STEP = 2
+
+# Number of frames from a SER file checked per batch by audit_ser()
+AUDIT_BATCH_SIZE = 65536
+
+
+def _raw_bytes(frames):
+    """View a stack of frames as a 2D array of bytes with one row per frame, without copying."""
+    frames = np.asarray(frames)
+    return frames.reshape(frames.shape[0], -1).view(np.uint8)
+
+
+def sync_words(frames):
+    """Return the start and end sync words of every frame.
+
+    Args:
+        frames: Array of raw frames stacked along the first axis. Any dtype and frame shape is
+            accepted; the frames are interpreted as the bytes received from the camera.
+
+    Returns:
+        Tuple of two uint16 arrays (start, end) with one element per frame.
+    """
+    raw = _raw_bytes(frames)
+    start = (raw[:, 0].astype(np.uint16) << 8) | raw[:, 1]
+    end = (raw[:, -2].astype(np.uint16) << 8) | raw[:, -1]
+    return start, end
+
+
+def validate(frames):
+    """Return a bool array that is True for every frame with valid sync words."""
+    start, end = sync_words(frames)
+    return (start == SYNC_START) & (end == SYNC_END)
+
+
+def frame_indices(frames):
+    """Return the 16-bit frame counter embedded in every frame as a uint16 array."""
+    raw = _raw_bytes(frames)
+    return (raw[:, 3].astype(np.uint16) << 8) | raw[:, 2]
+
+
+class IntegrityReport:
+    """Result of checking a sequence of frames.
+
+    Attributes:
+        frame_count: Number of frames checked.
+        corrupt: Positions (within the checked sequence) of frames with bad sync words.
+        gaps: Positions of frames whose counter did not follow the previous valid frame normally.
+        gap_steps: Counter step at each gap, modulo 2**16. Steps of 0 are repeated frames and steps
+            of 2**15 or more are frames that went backwards.
+        wraparounds: Number of times the counter wrapped around from 65535 to 0.
+        estimated_missing: Number of frames estimated to be missing based on counter gaps.
+        camera_dropped: Number of dropped frames reported by ASIGetDroppedFrames() over the same
+            period, or None if not provided.
+    """
+
+    def __init__(
+            self,
+            frame_count,
+            corrupt,
+            gaps,
+            gap_steps,
+            wraparounds,
+            camera_dropped=None,
+        ):
+        self.frame_count = frame_count
+        self.corrupt = corrupt
+        self.gaps = gaps
+        self.gap_steps = gap_steps
+        self.wraparounds = wraparounds
+        forward = gap_steps[(gap_steps >= 1) & (gap_steps < 0x8000)]
+        self.estimated_missing = int(np.sum(forward.astype(np.int64) - 1))
+        self.camera_dropped = camera_dropped
+
+    @property
+    def ok(self):
+        """True if no corrupt frames or counter gaps were found."""
+        return len(self.corrupt) == 0 and len(self.gaps) == 0
+
+    @property
+    def unexplained_missing(self):
+        """Missing frames not accounted for by the camera's dropped frame counter.
+
+        A positive value means frames were lost after the SDK handed them over, e.g. in the
+        capture pipeline. None if camera_dropped was not provided.
+        """
+        if self.camera_dropped is None:
+            return None
+        return self.estimated_missing - self.camera_dropped
+
+    def summary(self):
+        """Return a one-line human readable summary."""
+        text = (
+            f'{self.frame_count} frames, {len(self.corrupt)} corrupt, {len(self.gaps)} gaps, '
+            f'~{self.estimated_missing} missing, {self.wraparounds} counter wraparounds'
+        )
+        if self.camera_dropped is not None:
+            text += f', {self.camera_dropped} dropped according to camera'
+        return text
+
+
+class IntegrityChecker:
+    """Incrementally checks batches of frames from one continuous sequence.
+
+    The state needed to detect gaps across batch boundaries is kept between calls to update(), so
+    a long recording can be checked in pieces, or checked live as frames arrive.
+
+    Args:
+        max_step: Largest counter increment between consecutive frames considered normal.
+    """
+
+    def __init__(self, max_step=MAX_NORMAL_STEP):
+        self.max_step = max_step
+        self.frame_count = 0
+        self.wraparounds = 0
+        self._last_index = None
+        self._corrupt = []
+        self._gaps = []
+        self._gap_steps = []
+
+    def update(self, frames):
+        """Check a batch of frames that directly follows the previous batch."""
+        frames = np.asarray(frames)
+        if len(frames) == 0:
+            return
+        positions = np.arange(self.frame_count, self.frame_count + len(frames))
+        valid = validate(frames)
+        self._corrupt.append(positions[~valid])
+
+        # Corrupt frames are excluded from the counter checks since their counter is suspect
+        indices = frame_indices(frames)[valid].astype(np.int64)
+        positions = positions[valid]
+        if self._last_index is not None:
+            indices = np.concatenate(([self._last_index], indices))
+            positions = np.concatenate(([-1], positions))
+        if len(indices) > 0:
+            diffs = np.diff(indices)
+            steps = diffs % 0x10000
+            forward = (steps >= 1) & (steps < 0x8000)
+            self.wraparounds += int(np.count_nonzero((diffs < 0) & forward))
+            bad = (steps < 1) | (steps > self.max_step)
+            self._gaps.append(positions[1:][bad])
+            self._gap_steps.append(steps[bad])
+            self._last_index = indices[-1]
+
+        self.frame_count += len(frames)
+
+    def report(self, camera_dropped=None):
+        """Return an IntegrityReport for all frames checked so far.
+
+        Args:
+            camera_dropped: Optional number of dropped frames reported by ASIGetDroppedFrames() over
+                the same period, for comparison with the gaps found in the frame counter.
+        """
+        def join(arrays, dtype):
+            return np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype)
+
+        return IntegrityReport(
+            self.frame_count,
+            join(self._corrupt, np.int64),
+            join(self._gaps, np.int64),
+            join(self._gap_steps, np.int64),
+            self.wraparounds,
+            camera_dropped,
+        )
+
+
+def check(frames, camera_dropped=None, max_step=MAX_NORMAL_STEP):
+    """Check a stack of frames in one pass and return an IntegrityReport."""
+    checker = IntegrityChecker(max_step)
+    checker.update(frames)
+    return checker.report(camera_dropped)
+
+
+def audit_ser(
+        reader,
+        start=0,
+        stop=None,
+        camera_dropped=None,
+        max_step=MAX_NORMAL_STEP,
+        batch_size=AUDIT_BATCH_SIZE,
+    ):
+    """Check a range of frames from an asi.ser.SERReader.
+
+    Frames are processed in batches so memory use stays bounded for files of any size. Positions
+    in the returned report are relative to start. Since only a few bytes of each frame are read,
+    readahead on the mapping is disabled; otherwise the kernel would read most of the file.
+
+    Args:
+        reader: An open SERReader.
+        start: Index of the first frame to check.
+        stop: Index one past the last frame to check. Defaults to the end of the file.
+        camera_dropped: Optional dropped frame count from ASIGetDroppedFrames() for comparison.
+        max_step: Largest counter increment between consecutive frames considered normal.
+        batch_size: Number of frames checked per batch.
+    """
+    stop = len(reader) if stop is None else min(stop, len(reader))
+    if hasattr(mmap, 'MADV_RANDOM'):
+        reader.advise(mmap.MADV_RANDOM)
+    checker = IntegrityChecker(max_step)
+    for batch_start in range(start, stop, batch_size):
+        checker.update(reader[batch_start:min(batch_start + batch_size, stop)])
+    return checker.report(camera_dropped)
@@ -0,0 +1,462 @@
+"""Telemetry for the capture pipeline: counters, gauges and latency histograms.
+
+Metrics are kept in a Registry and can be served in the Prometheus text format over HTTP and
+written periodically to a JSON file, so the state of a running capture can be watched without
+digging through log lines:
+
+    server = MetricsServer(port=9178)  # http://localhost:9178/metrics and /metrics.json
+    snapshots = SnapshotWriter('/data/metrics.json', interval=10)
+    with VideoStream(camera_id) as stream:
+        ...
+
+Recording is designed to cost as little as possible on the frame path:
+
+- Most values are counted by the pipeline objects anyway, such as VideoStream.frames_read or the
+  depth of each consumer queue. Those objects register themselves as collectors and their values
+  are only read when metrics are scraped, so they add nothing per frame.
+- Counter, Gauge and Histogram objects are created once, and updating them only changes numbers
+  in place: no lock is taken and nothing is allocated per observation. Histogram buckets live in
+  a preallocated array. Like the counters of VideoStream, each metric is meant to be updated by
+  one thread; concurrent updates from several threads may occasionally lose an increment.
+- Readers take no locks either, so a scrape racing with an update may see a histogram whose count
+  is off by one from its buckets.
+
+Metrics exported by the asi package, all with the prefix asi_:
+
+- frames_read_total, read_timeouts_total, read_errors_total, camera_dropped_frames_total (deltas
+  of ASIGetDroppedFrames()), sync_errors_total, pool_exhausted_total and pool_free_frames for
+  each VideoStream, labeled by camera.
+- queue_depth, queue_max_depth and queue_dropped_total for each consumer of a VideoStream, each
+  ImageSink and each SegmentedWriter, labeled by queue.
+- bytes_written_total for each output directory of an ImageSink or SegmentedWriter, labeled by
+  output, along with files_written_total and write_failures_total for an ImageSink and
+  output_failed for a SegmentedWriter.
+- stage_latency_seconds, a histogram labeled by stage: read (time blocked in
+  ASIGetVideoDataInto(), which includes waiting for the frame), calibrate, encode and write.
+"""
+
+import array
+import bisect
+import collections
+import http.server
+import json
+import logging
+import math
+import os
+import threading
+import time
+import weakref
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the buckets of latency histograms, in seconds
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+    5.0, 10.0,
+)
+
+# Histogram of per-stage latencies; see the module docstring
+STAGE_LATENCY = 'asi_stage_latency_seconds'
+
+DEFAULT_PORT = 9178
+
+# Interval between JSON snapshots in seconds
+SNAPSHOT_INTERVAL = 10.0
+
+# Quantiles estimated from histograms in JSON snapshots
+SNAPSHOT_QUANTILES = (0.5, 0.9, 0.99)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# A value reported by a collector. kind is 'counter' or 'gauge', labels a dict.
+Sample = collections.namedtuple('Sample', ['name', 'kind', 'help', 'labels', 'value'])
+
+
+class Counter:
+    """A value that only increases, such as a number of frames.
+
+    Attributes:
+        value: Current value.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Increase the value."""
+        self.value += amount
+
+
+class Gauge:
+    """A value that can go up and down, such as a queue depth.
+
+    Attributes:
+        value: Current value.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.value = 0
+
+    def set(self, value):
+        """Set the value."""
+        self.value = value
+
+    def inc(self, amount=1):
+        """Increase the value."""
+        self.value += amount
+
+    def dec(self, amount=1):
+        """Decrease the value."""
+        self.value -= amount
+
+
+class Histogram:
+    """Distribution of observed values in fixed buckets, such as latencies.
+
+    Attributes:
+        bounds: Upper bound of each bucket, in increasing order. Values above the last bound are
+            counted in an extra overflow bucket.
+        counts: Number of observations in each bucket (not cumulative), including the overflow
+            bucket.
+        sum: Sum of all observed values.
+        count: Number of observations.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels, bounds=LATENCY_BUCKETS):
+        if list(bounds) != sorted(bounds) or not bounds:
+            raise ValueError('Histogram bounds must be a non-empty increasing sequence')
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.bounds = tuple(float(bound) for bound in bounds)
+        self.counts = array.array('q', [0] * (len(bounds) + 1))
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Record one value."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def observe_since(self, start):
+        """Record the time elapsed since start, a value of time.perf_counter()."""
+        self.observe(time.perf_counter() - start)
+
+    def cumulative(self):
+        """Return the number of observations at or below each bound and in total."""
+        total = 0
+        result = []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating within its bucket.
+
+        Returns:
+            The estimate, the last bound if the quantile is in the overflow bucket, or None if
+            nothing has been observed.
+        """
+        cumulative = self.cumulative()
+        if not cumulative[-1]:
+            return None
+        rank = q * cumulative[-1]
+        i = bisect.bisect_left(cumulative, rank)
+        if i >= len(self.bounds):
+            return self.bounds[-1]
+        lower = self.bounds[i - 1] if i > 0 else 0.0
+        below = cumulative[i - 1] if i > 0 else 0
+        return lower + (self.bounds[i] - lower) * (rank - below) / max(self.counts[i], 1)
+
+
+class Registry:
+    """A set of metrics and collectors that can be rendered together.
+
+    Metrics are identified by name and labels: asking for a metric that already exists returns the
+    existing object, so components can look up their metrics independently. A lock is only taken
+    when metrics are created or collected.
+
+    Collectors are objects with a collect_metrics() method returning an iterable of Sample. They
+    are held by weak reference, so registering an object does not keep it alive.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels, *args):
+        labels = dict(labels or {})
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = cls(name, help_text, labels, *args)
+                self._metrics[key] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f'Metric {name} already exists as a {metric.kind}')
+            return metric
+
+    def counter(self, name, help_text='', labels=None):
+        """Return the Counter with the given name and labels, creating it if needed."""
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text='', labels=None):
+        """Return the Gauge with the given name and labels, creating it if needed."""
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text='', labels=None, bounds=LATENCY_BUCKETS):
+        """Return the Histogram with the given name and labels, creating it if needed."""
+        return self._get(Histogram, name, help_text, labels, bounds)
+
+    def stage_latency(self, stage):
+        """Return the latency histogram of a pipeline stage, such as 'write'."""
+        return self.histogram(
+            STAGE_LATENCY, 'Time spent in each stage of the pipeline per frame', {'stage': stage}
+        )
+
+    def add_collector(self, collector):
+        """Register an object whose collect_metrics() is called whenever metrics are collected."""
+        with self._lock:
+            self._collectors.add(collector)
+
+    def remove_collector(self, collector):
+        """Unregister a collector."""
+        with self._lock:
+            self._collectors.discard(collector)
+
+    def collect(self):
+        """Return all current metrics and samples, grouped by name in order of first appearance.
+
+        Returns:
+            Dict mapping each name to a dict with the keys kind, help and values, a list of
+            metric objects and Samples.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                metrics.extend(collector.collect_metrics())
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error('Collecting metrics from %r failed: %s', collector, e)
+        families = {}
+        for metric in metrics:
+            family = families.setdefault(
+                metric.name, {'kind': metric.kind, 'help': metric.help, 'values': []}
+            )
+            family['values'].append(metric)
+        return families
+
+    def to_prometheus(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, family in self.collect().items():
+            if family['help']:
+                lines.append(f'# HELP {name} {_escape(family["help"], False)}')
+            lines.append(f'# TYPE {name} {family["kind"]}')
+            for metric in family['values']:
+                if family['kind'] != 'histogram':
+                    lines.append(f'{name}{_labels(metric.labels)} {_number(metric.value)}')
+                    continue
+                bounds = [_number(bound) for bound in metric.bounds] + ['+Inf']
+                for bound, count in zip(bounds, metric.cumulative()):
+                    labels = _labels(dict(metric.labels, le=bound))
+                    lines.append(f'{name}_bucket{labels} {count}')
+                lines.append(f'{name}_sum{_labels(metric.labels)} {_number(metric.sum)}')
+                lines.append(f'{name}_count{_labels(metric.labels)} {metric.count}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Return all metrics as a dict that can be serialized to JSON.
+
+        Histograms are summarized by their count, sum, mean and estimated quantiles.
+        """
+        result = {}
+        for name, family in self.collect().items():
+            values = []
+            for metric in family['values']:
+                if family['kind'] != 'histogram':
+                    values.append({'labels': metric.labels, 'value': metric.value})
+                    continue
+                summary = {
+                    'labels': metric.labels,
+                    'count': metric.count,
+                    'sum': metric.sum,
+                    'mean': metric.sum / metric.count if metric.count else None,
+                }
+                for q in SNAPSHOT_QUANTILES:
+                    summary[f'p{round(q * 100)}'] = metric.quantile(q)
+                values.append(summary)
+            result[name] = {'kind': family['kind'], 'help': family['help'], 'values': values}
+        return {'time': time.time(), 'metrics': result}
+
+
+def queue_samples(queue, depth, max_depth, dropped):
+    """Return the Samples describing one queue of the pipeline, for collect_metrics().
+
+    Args:
+        queue: Name of the queue, used as the value of the queue label.
+        depth: Number of items currently waiting.
+        max_depth: Highest number of items ever waiting.
+        dropped: Number of items discarded because the queue was full.
+    """
+    labels = {'queue': queue}
+    return [
+        Sample('asi_queue_depth', 'gauge', 'Items waiting in each queue', labels, depth),
+        Sample('asi_queue_max_depth', 'gauge', 'Most items ever waiting in each queue', labels,
+               max_depth),
+        Sample('asi_queue_dropped_total', 'counter', 'Items discarded because the queue was full',
+               labels, dropped),
+    ]
+
+
+def _escape(text, quote=True):
+    text = text.replace('\\', '\\\\').replace('\n', '\\n')
+    return text.replace('"', '\\"') if quote else text
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+# Registry used by the asi package unless another one is given
+REGISTRY = Registry()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Serves /metrics in the Prometheus text format and /metrics.json as a JSON snapshot."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handle a GET request."""
+        registry = self.server.registry
+        path = self.path.split('?', 1)[0]
+        if path in ('/', '/metrics'):
+            body = registry.to_prometheus().encode()
+            content_type = PROMETHEUS_CONTENT_TYPE
+        elif path == '/metrics.json':
+            body = json.dumps(registry.snapshot()).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug('%s %s', self.address_string(), format % args)
+
+
+class MetricsServer:
+    """Serves the metrics of a registry over HTTP on a background thread.
+
+    Args:
+        port: TCP port. Use 0 to pick a free port, given by the port attribute.
+        host: Address to listen on. Defaults to the local machine only.
+        registry: Registry to serve. Defaults to REGISTRY.
+    """
+
+    def __init__(self, port=DEFAULT_PORT, host='127.0.0.1', registry=None):
+        self._server = http.server.ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.registry = REGISTRY if registry is None else registry
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name='asi-metrics', daemon=True
+        )
+        self._thread.start()
+        logger.info('Serving metrics on http://%s:%d/metrics', self.host, self.port)
+
+    def close(self):
+        """Stop serving."""
+        if self._thread is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SnapshotWriter:
+    """Writes a JSON snapshot of a registry to a file at regular intervals.
+
+    Each snapshot replaces the file atomically, so readers never see a partial file. A final
+    snapshot is written on close.
+
+    Args:
+        filename: Path of the JSON file.
+        interval: Time between snapshots in seconds.
+        registry: Registry to snapshot. Defaults to REGISTRY.
+    """
+
+    def __init__(self, filename, interval=SNAPSHOT_INTERVAL, registry=None):
+        self.filename = os.fspath(filename)
+        self.interval = interval
+        self.registry = REGISTRY if registry is None else registry
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='asi-snapshot', daemon=True)
+        self._thread.start()
+
+    def write(self):
+        """Write a snapshot now."""
+        temp = self.filename + '.tmp'
+        try:
+            with open(temp, 'w', encoding='utf-8') as f:
+                json.dump(self.registry.snapshot(), f, indent=2)
+            os.replace(temp, self.filename)
+        except OSError as e:
+            logger.error('Unable to write metrics snapshot %s: %s', self.filename, e)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.write()
+
+    def close(self):
+        """Stop the writer thread and write a final snapshot."""
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self.write()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
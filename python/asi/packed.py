@@ -0,0 +1,713 @@
+"""Bit-packed, optionally compressed container for RAW frames.
+
+RAW16 frames from the ASI library use 16 bits per pixel even though most sensors have a bit depth
+of 12 or 14 (ASI_CAMERA_INFO.BitDepth), with the samples shifted to the most significant bits.
+Stored as is, as in a SER file, a quarter (12 bits) or an eighth (14 bits) of every frame is
+zero padding. This container stores only the significant bits of each sample, optionally
+compresses the packed data, and keeps an index of where every frame is for random access.
+
+Layout of a file:
+
+- A fixed size header (HEADER_DTYPE) with the frame geometry, packing parameters, and a copy of
+  the SER header for converting back to SER exactly.
+- A sequence of chunks of frames_per_chunk frames, each made of a chunk header (CHUNK_DTYPE), the
+  int64 SER timestamp of each frame, and the packed (and possibly compressed) frame data.
+- An index (INDEX_DTYPE entries) of the offset and size of every chunk, the timestamps of all
+  frames, and a footer (FOOTER_DTYPE), written when the file is closed.
+
+Packing a 6 MP frame takes about 40 ms on a single core, enough for full frame capture. zlib
+compression (from the standard library) takes several times longer and saves little on noisy
+frames, so it is better suited to converting files after capture. zstd is much faster, but needs
+the optional zstandard package.
+
+If the writer did not close the file, for example because the program was killed, the reader
+rebuilds the index by walking the chunk headers, so every complete chunk can still be read.
+
+Typical usage:
+
+    with PackedWriter('capture.asipack', width, height, bit_depth=12) as writer:
+        writer.add_frame(raw16_image)
+
+    with PackedReader('capture.asipack') as reader:
+        image = reader[1000]  # uint16 with the same values as raw16_image
+
+    ser_to_packed('capture.ser', 'capture.asipack', bit_depth=12)
+    packed_to_ser('capture.asipack', 'copy.ser')  # byte for byte identical to capture.ser
+"""
+
+import array
+import logging
+import os
+import sys
+import time
+import zlib
+import numpy as np
+
+from asi import ser
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'ASIPACK1'
+CHUNK_MAGIC = b'CHNK'
+INDEX_MAGIC = b'ASIPIDX1'
+
+# Compression codecs stored in the header
+NONE = 0
+ZLIB = 1
+ZSTD = 2
+COMPRESSION_NAMES = {None: NONE, 'zlib': ZLIB, 'zstd': ZSTD}
+
+# Bits of the Flags header field
+HAS_TIMESTAMPS = 1  # the frames have real timestamps (a SER file without trailer has none)
+SER_LITTLE_ENDIAN = 2  # byte order of the 16-bit data of the SER file the frames came from
+
+# Default compression levels, chosen for speed since the writer has to keep up with capture
+DEFAULT_LEVELS = {ZLIB: 1, ZSTD: 1}
+
+HEADER_DTYPE = np.dtype([
+    ('Magic', 'S8'),
+    ('BitDepth', '<u2'),  # bits stored per sample
+    ('Shift', '<u2'),  # low bits of every input sample that are always zero
+    ('Compression', '<u2'),
+    ('Flags', '<u2'),
+    ('FramesPerChunk', '<u4'),
+    ('ImageWidth', '<u4'),
+    ('ImageHeight', '<u4'),
+    ('Channels', '<u4'),
+    ('SampleBytes', '<u4'),  # bytes per sample of the decoded frames, 1 or 2
+    ('SER', ser.HEADER_DTYPE),
+])
+HEADER_SIZE = HEADER_DTYPE.itemsize
+
+CHUNK_DTYPE = np.dtype([
+    ('Magic', 'S4'),
+    ('Frames', '<u4'),
+    ('FirstFrame', '<u8'),
+    ('StoredSize', '<u8'),
+])
+
+INDEX_DTYPE = np.dtype([
+    ('Offset', '<u8'),  # offset of the chunk header
+    ('Frames', '<u4'),
+    ('FirstFrame', '<u8'),
+    ('StoredSize', '<u8'),
+])
+
+FOOTER_DTYPE = np.dtype([
+    ('IndexOffset', '<u8'),
+    ('ChunkCount', '<u8'),
+    ('FrameCount', '<u8'),
+    ('Magic', 'S8'),
+])
+
+
+def packed_size(samples, bit_depth):
+    """Return the number of bytes used by a number of packed samples.
+
+    Samples are packed in groups of 8, so this is rounded up to a multiple of bit_depth bytes.
+    """
+    return -(-samples // 8) * bit_depth
+
+
+def pack(samples, bit_depth):
+    """Pack samples into bit_depth bits each.
+
+    Sample i occupies bits i * bit_depth to (i + 1) * bit_depth - 1 of the output, counting from
+    the least significant bit of the first byte.
+
+    Args:
+        samples: 1-D array of unsigned integers less than 2 ** bit_depth.
+        bit_depth: Number of bits per sample, from 1 to 16.
+
+    Returns:
+        uint8 array of packed_size(len(samples), bit_depth) bytes.
+    """
+    if not 1 <= bit_depth <= 16:
+        raise ValueError(f'bit_depth must be in the range [1, 16], got {bit_depth}')
+    count = len(samples)
+    if count % 8:
+        samples = np.concatenate([samples, np.zeros(8 - count % 8, dtype=samples.dtype)])
+    if bit_depth == 8:
+        return samples.astype(np.uint8)
+    if bit_depth == 16:
+        return samples.astype('<u2').view(np.uint8)
+
+    if bit_depth == 12:
+        # The most common case gets a faster path with 16-bit arithmetic: 2 samples in 3 bytes
+        pairs = samples.astype(np.uint16, copy=False).reshape(-1, 2)
+        out = np.empty((len(pairs), 3), dtype=np.uint8)
+        out[:, 0] = pairs[:, 0]  # assignment keeps the low 8 bits
+        out[:, 1] = (pairs[:, 0] >> 8) | (pairs[:, 1] << 4)
+        out[:, 2] = pairs[:, 1] >> 4
+        return out.ravel()
+
+    # Groups of 8 samples in two 64-bit words, of which the packed group is the first bit_depth
+    # bytes
+    groups = samples.reshape(-1, 8)
+    words = np.zeros((len(groups), 2), dtype='<u8')
+    low, high = words[:, 0], words[:, 1]
+    temp = np.empty(len(groups), dtype=np.uint64)
+    for i in range(4):
+        shift = np.uint64(i * bit_depth)
+        np.left_shift(groups[:, i], shift, out=temp)
+        low |= temp
+        np.left_shift(groups[:, i + 4], shift, out=temp)
+        high |= temp
+    # The high half starts at bit 4 * bit_depth and spills into the second word
+    half = np.uint64(4 * bit_depth)
+    np.left_shift(high, half, out=temp)
+    low |= temp
+    if bit_depth > 8:
+        high >>= np.uint64(64 - 4 * bit_depth)
+    else:
+        high[:] = 0
+    return np.ascontiguousarray(words.view(np.uint8)[:, :bit_depth]).ravel()
+
+
+def unpack(data, bit_depth, count):
+    """Unpack samples packed by pack().
+
+    Args:
+        data: uint8 array (or buffer) of at least packed_size(count, bit_depth) bytes.
+        bit_depth: Number of bits per sample.
+        count: Number of samples.
+
+    Returns:
+        1-D uint16 array of count samples, or uint8 if bit_depth is 8 or less.
+    """
+    data = np.frombuffer(data, dtype=np.uint8, count=packed_size(count, bit_depth))
+    dtype = np.uint8 if bit_depth <= 8 else np.uint16
+    if bit_depth == 8:
+        return data[:count].copy()
+    if bit_depth == 16:
+        return data.view('<u2')[:count].astype(np.uint16)
+
+    if bit_depth == 12:
+        triples = data.reshape(-1, 3).astype(np.uint16)
+        out = np.empty((len(triples), 2), dtype=np.uint16)
+        out[:, 0] = triples[:, 0] | ((triples[:, 1] & 0xf) << 8)
+        out[:, 1] = (triples[:, 1] >> 4) | (triples[:, 2] << 4)
+        return out.ravel()[:count]
+
+    groups = data.reshape(-1, bit_depth)
+    words = np.zeros((len(groups), 16), dtype=np.uint8)
+    words[:, :bit_depth] = groups
+    words = words.view('<u8')
+    half = np.uint64(4 * bit_depth)
+    low = words[:, 0]
+    high = low >> half
+    if bit_depth >= 8:
+        high |= words[:, 1] << np.uint64(64 - 4 * bit_depth)
+    shifts = np.arange(4, dtype=np.uint64) * np.uint64(bit_depth)
+    mask = np.uint64((1 << bit_depth) - 1)
+    out = np.empty((len(groups), 8), dtype=dtype)
+    out[:, :4] = (low[:, np.newaxis] >> shifts) & mask
+    out[:, 4:] = (high[:, np.newaxis] >> shifts) & mask
+    return out.ravel()[:count]
+
+
+def _codec(compression):
+    if compression not in COMPRESSION_NAMES:
+        raise ValueError(f"compression must be None, 'zlib' or 'zstd', got {compression!r}")
+    codec = COMPRESSION_NAMES[compression]
+    if codec == ZSTD and zstandard is None:
+        raise ValueError('zstd compression requires the zstandard package')
+    return codec
+
+
+class PackedWriter:
+    """Writes frames to a packed container file.
+
+    Frames are packed and compressed in the calling thread as they are added, and each chunk is
+    written with a single write() as soon as it is complete.
+
+    Args:
+        filename: Path of the file to create. An existing file is overwritten.
+        width: Width of every image in pixels.
+        height: Height of every image in pixels.
+        bit_depth: Number of significant bits per sample, normally ASI_CAMERA_INFO.BitDepth.
+        color_id: How color information is encoded; one of the color ID constants of asi.ser.
+        shift: Number of low bits of every sample that are zero and not stored. Defaults to
+            16 - bit_depth for bit depths above 8, since RAW16 samples are aligned to the most
+            significant bit, and 0 otherwise.
+        compression: None, 'zlib', or 'zstd' (requires the zstandard package).
+        level: Compression level. Defaults to a fast level.
+        frames_per_chunk: Number of frames compressed together. More frames per chunk can
+            compress slightly better, but reading any frame decompresses its whole chunk.
+        check: Verify that every sample fits in bit_depth bits after the shift, so that packing
+            is lossless. Raises ValueError from add_frames() if not.
+        timestamps: Whether the frames have meaningful timestamps. If False, PackedReader
+            returns None for timestamps, as SERReader does for a file without a trailer.
+        ser_header: SER header (an element of asi.ser.HEADER_DTYPE) stored in the file so that
+            packed_to_ser() can recreate the original SER file exactly.
+        ser_little_endian: Byte order of the 16-bit data of the SER file given by ser_header.
+            Defaults to its LittleEndian field.
+
+    Attributes:
+        frame_count: Number of frames written so far.
+        bytes_in: Size of the frames added, in bytes.
+        bytes_out: Size of the packed data written, in bytes.
+    """
+
+    def __init__(
+            self,
+            filename,
+            width,
+            height,
+            bit_depth,
+            color_id=ser.BAYER_RGGB,
+            shift=None,
+            compression=None,
+            level=None,
+            frames_per_chunk=1,
+            check=True,
+            timestamps=True,
+            ser_header=None,
+            ser_little_endian=None,
+        ):
+        if not 1 <= bit_depth <= 16:
+            raise ValueError(f'bit_depth must be in the range [1, 16], got {bit_depth}')
+        if shift is None:
+            shift = 16 - bit_depth if bit_depth > 8 else 0
+        sample_bytes = 1 if bit_depth + shift <= 8 else 2
+        if bit_depth + shift > 8 * sample_bytes:
+            raise ValueError('bit_depth + shift must be at most 16')
+        self.filename = os.fspath(filename)
+        self.bit_depth = bit_depth
+        self.shift = shift
+        self.codec = _codec(compression)
+        self.level = DEFAULT_LEVELS.get(self.codec) if level is None else level
+        self.frames_per_chunk = frames_per_chunk
+        self.check = check
+        self.dtype = np.dtype(np.uint8 if sample_bytes == 1 else np.uint16)
+        channels = 3 if color_id in (ser.RGB, ser.BGR) else 1
+        self.samples_per_frame = width * height * channels
+        self.frame_count = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._pending = []
+        self._ticks = []
+        self._index = []
+        self._timestamps = array.array('q')
+        self._compressor = None
+        if self.codec == ZSTD:
+            self._compressor = zstandard.ZstdCompressor(level=self.level)
+
+        header = np.zeros((), dtype=HEADER_DTYPE)
+        header['Magic'] = MAGIC
+        header['BitDepth'] = bit_depth
+        header['Shift'] = shift
+        header['Compression'] = self.codec
+        header['FramesPerChunk'] = frames_per_chunk
+        header['ImageWidth'] = width
+        header['ImageHeight'] = height
+        header['Channels'] = channels
+        header['SampleBytes'] = sample_bytes
+        if ser_header is None:
+            ser_header = np.zeros((), dtype=ser.HEADER_DTYPE)
+            ser_header['FileID'] = ser.FILE_ID
+            ser_header['ColorID'] = color_id
+            ser_header['LittleEndian'] = int(sample_bytes == 2 and sys.byteorder == 'little')
+            ser_header['ImageWidth'] = width
+            ser_header['ImageHeight'] = height
+            ser_header['PixelDepthPerPlane'] = 8 * sample_bytes
+            utc = ser.unix_to_ticks(time.time())
+            ser_header['DateTime_UTC'] = utc
+            ser_header['DateTime'] = utc + ser.utc_offset() * ser.VB_DATE_TICKS_PER_SEC
+        header['SER'] = ser_header
+        if ser_little_endian is None:
+            ser_little_endian = bool(ser_header['LittleEndian'])
+        header['Flags'] = (HAS_TIMESTAMPS if timestamps else 0) | (
+            SER_LITTLE_ENDIAN if ser_little_endian else 0)
+
+        self._fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._offset = 0
+        self._write([header.tobytes()])
+
+    @property
+    def closed(self):
+        """True once the file has been closed."""
+        return self._fd is None
+
+    def _write(self, buffers):
+        for data in buffers:
+            data = memoryview(data).cast('B')
+            while data:
+                written = os.write(self._fd, data)
+                data = data[written:]
+                self._offset += written
+
+    def _pack(self, image):
+        samples = np.asarray(image).reshape(-1)
+        if samples.size != self.samples_per_frame:
+            raise ValueError(
+                f'frame has {samples.size} samples, expected {self.samples_per_frame}'
+            )
+        if self.shift:
+            if self.check and np.any(samples & ((1 << self.shift) - 1)):
+                raise ValueError(f'frame has samples whose low {self.shift} bits are not zero')
+            samples = samples >> self.shift
+        if self.check and self.bit_depth < 16 and np.any(samples >> self.bit_depth):
+            raise ValueError(f'frame has samples with more than {self.bit_depth + self.shift} bits')
+        return pack(samples, self.bit_depth)
+
+    def add_frame(self, image, timestamp=None):
+        """Append one frame.
+
+        Args:
+            image: Numpy array holding one frame.
+            timestamp: Time the frame was captured in seconds since the Unix epoch. Defaults to
+                the current time.
+        """
+        self.add_frames([image], None if timestamp is None else [timestamp])
+
+    def add_frames(self, images, timestamps=None, ticks=None):
+        """Append several frames.
+
+        Args:
+            images: Sequence of frames, or an array with the frames stacked along the first axis.
+            timestamps: Optional sequence of capture times in seconds since the Unix epoch.
+                Defaults to the current time for all frames.
+            ticks: Optional sequence of SER timestamps (100 ns ticks since year 1), used instead
+                of timestamps to copy timestamps exactly.
+        """
+        if self._fd is None:
+            raise ValueError('I/O operation on closed file')
+        if ticks is None:
+            if timestamps is None:
+                timestamps = [time.time()] * len(images)
+            ticks = [ser.unix_to_ticks(t) for t in timestamps]
+        if len(ticks) != len(images):
+            raise ValueError('number of timestamps does not match number of frames')
+        for image, tick in zip(images, ticks):
+            self._pending.append(self._pack(image))
+            self._ticks.append(int(tick))
+            self.bytes_in += self.samples_per_frame * self.dtype.itemsize
+            if len(self._pending) == self.frames_per_chunk:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        data = self._pending[0] if len(self._pending) == 1 else np.concatenate(self._pending)
+        if self.codec == ZLIB:
+            data = zlib.compress(data, self.level)
+        elif self.codec == ZSTD:
+            data = self._compressor.compress(data)
+        chunk = np.zeros((), dtype=CHUNK_DTYPE)
+        chunk['Magic'] = CHUNK_MAGIC
+        chunk['Frames'] = len(self._pending)
+        chunk['FirstFrame'] = self.frame_count
+        chunk['StoredSize'] = len(data)
+        self._index.append((self._offset, len(self._pending), self.frame_count, len(data)))
+        ticks = array.array('q', self._ticks)
+        self._write([chunk.tobytes(), ticks, data])
+        self._timestamps.extend(ticks)
+        self.bytes_out += len(data)
+        self.frame_count += len(self._pending)
+        self._pending = []
+        self._ticks = []
+
+    def close(self):
+        """Write any partial chunk and the index, and close the file."""
+        if self._fd is None:
+            return
+        try:
+            self._flush()
+            index = np.array(self._index, dtype=INDEX_DTYPE)
+            footer = np.zeros((), dtype=FOOTER_DTYPE)
+            footer['IndexOffset'] = self._offset
+            footer['ChunkCount'] = len(index)
+            footer['FrameCount'] = self.frame_count
+            footer['Magic'] = INDEX_MAGIC
+            self._write([index, self._timestamps, footer.tobytes()])
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PackedReader:
+    """Random access to the frames of a packed container file.
+
+    The file is memory-mapped and each frame is decoded when it is accessed. Indexing the reader
+    with an integer returns a new array of shape (height, width) or (height, width, 3), and with a
+    slice an array of those frames stacked along the first axis:
+
+        with PackedReader('capture.asipack') as reader:
+            frame = reader[1000]
+            subset = reader[10:20]
+            for frame in reader:
+                ...
+
+    Finding a frame takes a division and one lookup in the chunk index. With several frames per
+    chunk, the most recently decompressed chunk is kept so that reading frames in order
+    decompresses each chunk once.
+
+    Args:
+        filename: Path of the file.
+
+    Attributes:
+        header: Copy of the file header as a Numpy structured scalar (see HEADER_DTYPE).
+        ser_header: The SER header stored in the file (see asi.ser.HEADER_DTYPE).
+        width: Width of every image in pixels.
+        height: Height of every image in pixels.
+        color_id: How color information is encoded; one of the color ID constants of asi.ser.
+        bit_depth: Number of bits stored per sample.
+        shift: Number of low zero bits restored in every sample.
+        dtype: Numpy dtype of the decoded frames, uint8 or uint16.
+        shape: Shape of each frame.
+        frame_count: Number of complete frames in the file.
+        index: Array of INDEX_DTYPE with one element per chunk.
+        timestamps: int64 array of per-frame UTC timestamps (100 ns ticks since year 1, see
+            asi.ser.ticks_to_unix()), or None if the frames have no timestamps.
+    """
+
+    def __init__(self, filename):
+        self.filename = os.fspath(filename)
+        self._data = np.memmap(self.filename, dtype=np.uint8, mode='r')
+        if len(self._data) < HEADER_SIZE:
+            raise ValueError(f'{self.filename} is too small to be a packed file')
+        self.header = np.frombuffer(self._data, dtype=HEADER_DTYPE, count=1)[0].copy()
+        if self.header['Magic'] != MAGIC:
+            raise ValueError(f'{self.filename} is not a packed file')
+
+        self.ser_header = self.header['SER']
+        self.width = int(self.header['ImageWidth'])
+        self.height = int(self.header['ImageHeight'])
+        self.color_id = int(self.ser_header['ColorID'])
+        self.bit_depth = int(self.header['BitDepth'])
+        self.shift = int(self.header['Shift'])
+        self.dtype = np.dtype(np.uint8 if self.header['SampleBytes'] == 1 else np.uint16)
+        channels = int(self.header['Channels'])
+        self.shape = (self.height, self.width) + ((channels,) if channels > 1 else ())
+        self.samples_per_frame = self.width * self.height * channels
+        self.frames_per_chunk = int(self.header['FramesPerChunk'])
+        self.codec = int(self.header['Compression'])
+        if self.codec not in DEFAULT_LEVELS and self.codec != NONE:
+            raise ValueError(f'{self.filename} uses unknown compression {self.codec}')
+        if self.codec == ZSTD and zstandard is None:
+            raise ValueError(f'{self.filename} uses zstd compression, which requires zstandard')
+        self._decompressor = zstandard.ZstdDecompressor() if self.codec == ZSTD else None
+        self._frame_bytes = packed_size(self.samples_per_frame, self.bit_depth)
+        self._cached = (None, None)
+
+        if not self._read_index():
+            logger.warning('%s has no index, probably because it was not closed; scanning it',
+                           self.filename)
+            self._scan()
+        self.frame_count = int(self.index['Frames'].sum())
+        if not self.header['Flags'] & HAS_TIMESTAMPS:
+            self.timestamps = None
+
+    def _read_index(self):
+        """Load the index and timestamps written by PackedWriter.close(), if present."""
+        if len(self._data) < HEADER_SIZE + FOOTER_DTYPE.itemsize:
+            return False
+        footer = np.frombuffer(self._data[-FOOTER_DTYPE.itemsize:], dtype=FOOTER_DTYPE)[0]
+        if footer['Magic'] != INDEX_MAGIC:
+            return False
+        start = int(footer['IndexOffset'])
+        end = start + int(footer['ChunkCount']) * INDEX_DTYPE.itemsize
+        self.index = self._data[start:end].view(INDEX_DTYPE)
+        self.timestamps = self._data[end:end + int(footer['FrameCount']) * 8].view('<i8')
+        return True
+
+    def _scan(self):
+        """Rebuild the index and timestamps by walking the chunk headers."""
+        index = []
+        timestamps = []
+        offset = HEADER_SIZE
+        while offset + CHUNK_DTYPE.itemsize <= len(self._data):
+            chunk = np.frombuffer(self._data, CHUNK_DTYPE, count=1, offset=offset)[0]
+            ticks_offset = offset + CHUNK_DTYPE.itemsize
+            end = ticks_offset + 8 * int(chunk['Frames']) + int(chunk['StoredSize'])
+            if chunk['Magic'] != CHUNK_MAGIC or end > len(self._data):
+                break
+            index.append((offset, chunk['Frames'], chunk['FirstFrame'], chunk['StoredSize']))
+            timestamps.append(self._data[ticks_offset:ticks_offset + 8 * int(chunk['Frames'])])
+            offset = end
+        self.index = np.array(index, dtype=INDEX_DTYPE)
+        self.timestamps = (
+            np.concatenate(timestamps).view('<i8') if timestamps else np.zeros(0, dtype='<i8')
+        )
+
+    def _chunk(self, number):
+        """Return the decompressed data of a chunk."""
+        if self._cached[0] == number:
+            return self._cached[1]
+        entry = self.index[number]
+        start = int(entry['Offset']) + CHUNK_DTYPE.itemsize + 8 * int(entry['Frames'])
+        data = self._data[start:start + int(entry['StoredSize'])]
+        if self.codec == ZLIB:
+            data = zlib.decompress(data)
+        elif self.codec == ZSTD:
+            data = self._decompressor.decompress(
+                data, max_output_size=int(entry['Frames']) * self._frame_bytes
+            )
+        if self.frames_per_chunk > 1:
+            self._cached = (number, data)
+        return data
+
+    def frame(self, index):
+        """Decode one frame.
+
+        Args:
+            index: Frame number; negative values count from the end.
+
+        Returns:
+            New array of shape shape and dtype dtype.
+        """
+        if index < 0:
+            index += self.frame_count
+        if not 0 <= index < self.frame_count:
+            raise IndexError(f'frame {index} out of range [0, {self.frame_count})')
+        # Every chunk but the last has frames_per_chunk frames
+        number, position = divmod(index, self.frames_per_chunk)
+        data = self._chunk(number)
+        start = position * self._frame_bytes
+        samples = unpack(data[start:start + self._frame_bytes], self.bit_depth,
+                         self.samples_per_frame)
+        if samples.dtype != self.dtype:
+            samples = samples.astype(self.dtype)
+        if self.shift:
+            samples <<= self.shift
+        return samples.reshape(self.shape)
+
+    def __len__(self):
+        return self.frame_count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            frames = range(self.frame_count)[index]
+            out = np.empty((len(frames),) + self.shape, dtype=self.dtype)
+            for i, frame in enumerate(frames):
+                out[i] = self.frame(frame)
+            return out
+        return self.frame(int(index))
+
+    def __iter__(self):
+        for index in range(self.frame_count):
+            yield self.frame(index)
+
+    def close(self):
+        """Release this reader's reference to the memory map."""
+        self.index = None
+        self.timestamps = None
+        self._cached = (None, None)
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def ser_to_packed(
+        filename,
+        output,
+        bit_depth=None,
+        shift=None,
+        compression=None,
+        level=None,
+        frames_per_chunk=1,
+        little_endian=None,
+    ):
+    """Convert a SER file to a packed container file.
+
+    The conversion is lossless and is checked to be so: a ValueError is raised if any sample
+    does not fit in bit_depth bits after removing shift low bits.
+
+    Args:
+        filename: Path of the SER file.
+        output: Path of the packed file to create.
+        bit_depth: Number of significant bits per sample, normally ASI_CAMERA_INFO.BitDepth of the
+            camera. Defaults to the bit depth of the SER file, which only saves space if
+            compression is used.
+        shift: Number of low zero bits of every sample. Defaults to the difference between the
+            bit depth of the SER file and bit_depth, which is right for RAW16 data.
+        compression: None, 'zlib', or 'zstd'.
+        level: Compression level. Defaults to a fast level.
+        frames_per_chunk: Number of frames compressed together.
+        little_endian: Byte order override passed to SERReader.
+
+    Returns:
+        Number of frames converted.
+    """
+    with ser.SERReader(filename, little_endian) as reader:
+        if bit_depth is None:
+            bit_depth = reader.bit_depth
+        if shift is None:
+            shift = max(reader.bit_depth - bit_depth, 0)
+        with PackedWriter(
+                output,
+                reader.width,
+                reader.height,
+                bit_depth,
+                color_id=reader.color_id,
+                shift=shift,
+                compression=compression,
+                level=level,
+                frames_per_chunk=frames_per_chunk,
+                timestamps=reader.timestamps is not None,
+                ser_header=reader.header,
+                ser_little_endian=reader.dtype.byteorder == '<',
+            ) as writer:
+            for start in range(0, len(reader), frames_per_chunk):
+                stop = min(start + frames_per_chunk, len(reader))
+                ticks = np.zeros(stop - start, dtype=np.int64)
+                if reader.timestamps is not None:
+                    ticks = reader.timestamps[start:stop]
+                writer.add_frames(reader[start:stop], ticks=ticks)
+        logger.info('Packed %d frames of %s to %s: %.1f%% of the original size',
+                    len(reader), filename, output,
+                    100 * writer.bytes_out / max(writer.bytes_in, 1))
+        return len(reader)
+
+
+def packed_to_ser(filename, output):
+    """Convert a packed container file back to a SER file.
+
+    If the packed file was created by ser_to_packed(), the SER file is identical to the original,
+    including the header, byte order, and timestamps.
+
+    Args:
+        filename: Path of the packed file.
+        output: Path of the SER file to create.
+
+    Returns:
+        Number of frames converted.
+    """
+    with PackedReader(filename) as reader:
+        bit_depth = int(reader.ser_header['PixelDepthPerPlane'])
+        with ser.SERWriter(
+                output,
+                reader.width,
+                reader.height,
+                color_id=reader.color_id,
+                bit_depth=bit_depth,
+                add_trailer=reader.timestamps is not None,
+            ) as writer:
+            for name in ser.HEADER_DTYPE.names:
+                if name != 'FrameCount':
+                    writer.header[name] = reader.ser_header[name]
+            dtype = reader.dtype
+            if dtype.itemsize > 1:
+                dtype = dtype.newbyteorder('<' if reader.header['Flags'] & SER_LITTLE_ENDIAN
+                                           else '>')
+            for index in range(len(reader)):
+                ticks = None if reader.timestamps is None else reader.timestamps[index:index + 1]
+                writer.add_frames([reader[index].astype(dtype, copy=False)], ticks=ticks)
+        return len(reader)
@@ -0,0 +1,296 @@
+"""Live preview of a VideoStream that stays off the capture critical path.
+
+Like the preview thread in the C++ capture program, the preview runs on its own thread and only
+ever takes the most recent frame from the stream through a LATEST consumer, so it can never stall
+the reader or any other consumer. To keep the cost per preview frame low, color frames are
+debayered at reduced resolution by combining each 2x2 Bayer cell into one RGB pixel (superpixel
+debayering) rather than by a full demosaic. A region of interest can instead be shown at full
+sensor resolution for focusing, debayered with bilinear interpolation. The refresh rate adapts
+to the measured cost of each preview frame so that the preview uses at most a fixed fraction of
+one CPU core.
+
+Typical usage:
+
+    with VideoStream(camera_id) as stream, Preview(stream, WindowRenderer()):
+        ...
+"""
+
+import logging
+import threading
+import time
+import numpy as np
+
+from asi.debayer import BAYER_PATTERNS
+from asi.debayer import Debayer
+from asi.stream import LATEST
+
+
+logger = logging.getLogger(__name__)
+
+# Default Bayer pattern of the ASI178MC, given as the colors of the top-left 2x2 cell in row order.
+# This is the layout OpenCV calls COLOR_BayerBG.
+BAYER_PATTERN = 'RGGB'
+
+# Default upper limit on the preview refresh rate in frames per second
+MAX_FRAME_RATE = 30.0
+
+# Default fraction of one CPU core the preview may use. The interval between preview frames is
+# stretched so that the time spent producing and rendering each one is at most this fraction of it.
+MAX_LOAD = 0.5
+
+# Weight of the newest measurement in the moving average of the preview frame cost
+COST_SMOOTHING = 0.2
+
+
+def _sum_dtype(dtype):
+    """Return the narrowest dtype that can hold the sum of four pixels of the given dtype."""
+    return np.uint16 if dtype == np.uint8 else np.uint32
+
+
+def superpixel(raw, pattern=BAYER_PATTERN, decimation=1):
+    """Debayer a raw frame at half resolution by combining each 2x2 Bayer cell into one pixel.
+
+    The two green samples of each cell are averaged. No interpolation is done, so this is much
+    cheaper than a full demosaic and has no color artifacts at edges.
+
+    Args:
+        raw: Raw Bayer frame of shape (height, width).
+        pattern: Colors of the top-left 2x2 cell in row order, e.g. 'RGGB'.
+        decimation: Only every decimation-th Bayer cell along each axis is used, giving an image
+            of 1 / (2 * decimation) the resolution of the raw frame.
+
+    Returns:
+        Array of shape (height // (2 * decimation), width // (2 * decimation), 3) with the same
+        dtype as the raw frame, in BGR order as expected by OpenCV.
+    """
+    pattern = pattern.upper()
+    if pattern not in BAYER_PATTERNS:
+        raise ValueError(f'Invalid Bayer pattern {pattern!r}')
+
+    step = 2 * decimation
+    rows = raw.shape[0] // step * step
+    cols = raw.shape[1] // step * step
+    planes = {}
+    for i, color in enumerate(pattern):
+        planes.setdefault(color, []).append(raw[i // 2:rows:step, i % 2:cols:step])
+
+    # Filling a preallocated array channel by channel is faster than np.dstack()
+    image = np.empty((rows // step, cols // step, 3), dtype=raw.dtype)
+    image[..., 0] = planes['B'][0]
+    image[..., 2] = planes['R'][0]
+    green_a, green_b = planes['G']
+    green = green_a.astype(_sum_dtype(raw.dtype))
+    green += green_b
+    green >>= 1
+    image[..., 1] = green
+    return image
+
+
+def bin2x2(raw, decimation=1):
+    """Reduce a mono frame to half resolution by averaging each 2x2 block of pixels.
+
+    Args:
+        raw: Mono frame of shape (height, width).
+        decimation: Only every decimation-th block along each axis is used.
+
+    Returns:
+        Array of shape (height // (2 * decimation), width // (2 * decimation)) with the same dtype
+        as the raw frame.
+    """
+    step = 2 * decimation
+    rows = raw.shape[0] // step * step
+    cols = raw.shape[1] // step * step
+    total = raw[0:rows:step, 0:cols:step].astype(_sum_dtype(raw.dtype))
+    total += raw[0:rows:step, 1:cols:step]
+    total += raw[1:rows:step, 0:cols:step]
+    total += raw[1:rows:step, 1:cols:step]
+    return (total >> 2).astype(raw.dtype)
+
+
+def to_8bit(image):
+    """Scale a 16-bit image to 8 bits for display. 8-bit images are returned unchanged."""
+    if image.dtype == np.uint8:
+        return image
+    return (image >> 8).astype(np.uint8)
+
+
+class WindowRenderer:
+    """Renders preview images in an OpenCV HighGUI window.
+
+    OpenCV is imported when the renderer is created, so it is only required when it is used. The
+    window is created on first use from the preview thread since HighGUI windows must be used from
+    a single thread.
+
+    Args:
+        name: Window title.
+        size: Initial window size as a tuple (width, height).
+    """
+
+    def __init__(self, name='Live Preview', size=(640, 480)):
+        import cv2  # pylint: disable=import-outside-toplevel
+        self._cv2 = cv2
+        self.name = name
+        self.size = size
+        self._window_created = False
+
+    def __call__(self, image):
+        """Show an image in the window."""
+        if not self._window_created:
+            self._cv2.namedWindow(self.name, self._cv2.WINDOW_NORMAL)
+            self._cv2.resizeWindow(self.name, *self.size)
+            self._window_created = True
+        self._cv2.imshow(self.name, image)
+        self._cv2.waitKey(1)
+
+
+class Preview:
+    """Shows the latest frames of a VideoStream on a dedicated thread.
+
+    Args:
+        stream: The VideoStream to preview. A LATEST consumer is added to it when the preview is
+            started.
+        render: Callable taking a BGR or mono uint8 image, called on the preview thread. Defaults
+            to a WindowRenderer.
+        bayer_pattern: Bayer pattern of raw color frames, or None for mono cameras. Ignored for
+            RGB24 frames.
+        decimation: Additional reduction of the preview resolution beyond the 2x2 binning.
+        zoom_roi: Optional region (x, y, width, height) of the sensor to show at full resolution
+            instead of the whole frame at reduced resolution. Color frames are debayered with
+            asi.debayer bilinear interpolation so every sensor pixel is shown. The region is
+            rounded to whole Bayer cells. Can be changed while running.
+        max_frame_rate: Upper limit on the preview refresh rate.
+        max_load: Fraction of one CPU core the preview may use.
+
+    Attributes:
+        frames_rendered: Number of preview images rendered.
+        frame_cost: Moving average of the time in seconds to produce and render one preview image.
+        interval: Current interval between preview images in seconds.
+    """
+
+    def __init__(
+            self,
+            stream,
+            render=None,
+            bayer_pattern=BAYER_PATTERN,
+            decimation=1,
+            zoom_roi=None,
+            max_frame_rate=MAX_FRAME_RATE,
+            max_load=MAX_LOAD,
+        ):
+        self.stream = stream
+        self.render = WindowRenderer() if render is None else render
+        self.bayer_pattern = bayer_pattern
+        self.decimation = decimation
+        self.zoom_roi = zoom_roi
+        self.max_frame_rate = max_frame_rate
+        self.max_load = max_load
+        self.frames_rendered = 0
+        self.frame_cost = 0.0
+        self.interval = 1.0 / max_frame_rate
+        self._consumer = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._debayer = None
+
+    def process(self, image):
+        """Convert a frame to the 8-bit image that is rendered.
+
+        The result never shares memory with the frame, so the frame can be released before the
+        image is rendered and the renderer is free to draw on it.
+        """
+        color = self.bayer_pattern is not None and image.ndim == 2
+        if self.zoom_roi is not None:
+            # Start on an even pixel so the crop has the same Bayer pattern as the full frame
+            x, y, width, height = self.zoom_roi
+            x -= x % 2
+            y -= y % 2
+            if color:
+                image = self._zoom_debayer()(image[y:y + height // 2 * 2, x:x + width // 2 * 2])
+            else:
+                image = image[y:y + height, x:x + width].copy()
+        elif image.ndim == 3:
+            image = image[::self.decimation, ::self.decimation].copy()
+        elif color:
+            image = superpixel(image, self.bayer_pattern, self.decimation)
+        else:
+            image = bin2x2(image, self.decimation)
+        return to_8bit(image)
+
+    def _zoom_debayer(self):
+        """Return the Debayer used for zoomed regions, created on first use."""
+        if self._debayer is None or self._debayer.pattern != self.bayer_pattern.upper():
+            self._debayer = Debayer(self.bayer_pattern, 'bilinear', order='BGR', workers=1)
+        return self._debayer
+
+    def start(self):
+        """Start the preview thread."""
+        if self._thread is not None:
+            raise RuntimeError('preview already started')
+        self._consumer = self.stream.add_consumer('preview', policy=LATEST)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='asi-preview', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the preview thread."""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self.stream.remove_consumer(self._consumer)
+        self._consumer = None
+
+    @property
+    def running(self):
+        """True if the preview thread is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self):
+        """Return a dict of preview statistics."""
+        return {
+            'rendered': self.frames_rendered,
+            'frame_cost': self.frame_cost,
+            'frame_rate': 1.0 / self.interval,
+        }
+
+    def _run(self):
+        """Preview thread body."""
+        next_time = time.monotonic()
+        while not self._stop_event.is_set():
+            # Frames arriving while waiting replace each other in the LATEST consumer, so the
+            # frame taken below is always the most recent one.
+            if self._stop_event.wait(max(0.0, next_time - time.monotonic())):
+                break
+            frame = self._consumer.get(timeout=0.1)
+            if frame is None:
+                # Once the stream has stopped, get() returns at once instead of waiting
+                if self._consumer.closed:
+                    break
+                continue
+
+            start = time.monotonic()
+            with frame:
+                image = self.process(frame.image)
+            try:
+                self.render(image)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Preview render failed')
+            cost = time.monotonic() - start
+            self.frames_rendered += 1
+
+            if self.frames_rendered == 1:
+                self.frame_cost = cost
+            else:
+                self.frame_cost += COST_SMOOTHING * (cost - self.frame_cost)
+            self.interval = max(1.0 / self.max_frame_rate, self.frame_cost / self.max_load)
+            next_time = start + self.interval
+
+        logger.info('Preview thread ending')
@@ -0,0 +1,299 @@
+"""Frame quality scoring and selection for lucky imaging.
+
+Planetary and satellite video is recorded at high frame rates so that the few frames taken during
+moments of good seeing can be kept and the rest discarded. This module scores every frame of a
+SER file and ranks them:
+
+    metrics = score_ser('jupiter.ser')
+    best = rank(metrics)[:len(metrics) // 10]
+
+or, in one step, writing the best 10% of frames to a new SER file in their original order:
+
+    select_ser('jupiter.ser', 'jupiter_best.ser', top_percent=10)
+
+Each frame gets two sharpness metrics, the variance of its Laplacian and its gradient energy (mean
+squared difference between neighboring pixels), both divided by the square of the mean brightness
+so that changes in transparency or exposure do not masquerade as changes in sharpness. Bayer
+frames are scored on their 2x2 superpixel luminance so that the color pattern is not mistaken for
+detail. The mean brightness and the fraction of saturated pixels are also recorded so that frames
+where the target drifted out of the field, clouds passed, or the target saturated can be
+excluded by rank().
+
+Frames are scored in batches straight from the read-only memory map of the file. Ranges of frames
+are spread over a pool of worker processes, each of which maps the same file itself, so frames are
+never pickled or copied between processes and the page cache is shared.
+"""
+
+import concurrent.futures
+import logging
+import mmap
+import multiprocessing
+import os
+import numpy as np
+
+from asi import ser
+
+
+logger = logging.getLogger(__name__)
+
+# Per-frame results of score_ser()
+METRICS_DTYPE = np.dtype([
+    ('index', '<i8'),
+    ('laplacian', '<f4'),
+    ('gradient', '<f4'),
+    ('mean', '<f4'),
+    ('saturated', '<f4'),
+])
+
+SHARPNESS_METRICS = ('laplacian', 'gradient')
+
+# Frames handed to a worker process per task
+TASK_FRAMES = 256
+
+# Frames scored together are limited to about this many pixels so that the float32 temporaries of
+# a batch stay around 16 MB each
+BATCH_PIXELS = 4 << 20
+
+# Pixels at or above this fraction of full scale count as saturated
+SATURATION_LEVEL = 0.98
+
+# Default limits of rank(): frames whose mean brightness is less than this fraction of the median,
+# or with more than this fraction of saturated pixels, are excluded
+MIN_RELATIVE_BRIGHTNESS = 0.5
+MAX_SATURATED = 0.01
+
+# Reader opened by each worker process for the file being scored
+_reader = None
+
+
+def _luminance(frames, bayer):
+    """Return float32 luminance in ADU of a batch of frames of shape (n, height, width[, 3])."""
+    if frames.ndim == 4:
+        luminance = frames.sum(axis=-1, dtype=np.float32)
+        luminance *= 1 / 3
+    elif bayer:
+        rows = frames.shape[1] // 2 * 2
+        cols = frames.shape[2] // 2 * 2
+        luminance = frames[:, 0:rows:2, 0:cols:2].astype(np.float32)
+        luminance += frames[:, 0:rows:2, 1:cols:2]
+        luminance += frames[:, 1:rows:2, 0:cols:2]
+        luminance += frames[:, 1:rows:2, 1:cols:2]
+        luminance *= 0.25
+    else:
+        luminance = frames.astype(np.float32)
+    return luminance
+
+
+def frame_metrics(frames, bayer=False, saturation=None, roi=None, first_index=0):
+    """Score a batch of frames.
+
+    Args:
+        frames: Array of shape (n, height, width) or (n, height, width, 3), such as a slice of
+            SERReader.frames.
+        bayer: True if the frames are raw Bayer data.
+        saturation: Pixel value counted as saturated. Defaults to SATURATION_LEVEL of the maximum
+            value of the dtype.
+        roi: Optional region (x, y, width, height) of each frame to score, in pixels.
+        first_index: Frame index recorded for the first frame of the batch.
+
+    Returns:
+        Array of METRICS_DTYPE with one element per frame.
+    """
+    if roi is not None:
+        x, y, width, height = roi
+        if bayer:
+            # Keep the Bayer pattern phase
+            x, y = x // 2 * 2, y // 2 * 2
+        frames = frames[:, y:y + height, x:x + width]
+    if saturation is None:
+        saturation = SATURATION_LEVEL * np.iinfo(frames.dtype).max
+
+    metrics = np.zeros(len(frames), dtype=METRICS_DTYPE)
+    metrics['index'] = np.arange(first_index, first_index + len(frames))
+    if len(frames) == 0:
+        return metrics
+
+    pixel_axes = tuple(range(1, frames.ndim))
+    pixels = np.prod(frames.shape[1:])
+    metrics['saturated'] = np.count_nonzero(frames >= saturation, axis=pixel_axes) / pixels
+
+    luminance = _luminance(frames, bayer)
+    mean = luminance.mean(axis=(1, 2))
+    metrics['mean'] = mean
+    scale = np.zeros_like(mean)
+    np.divide(1.0, np.square(mean), out=scale, where=mean > 0)
+
+    # 4-neighbor Laplacian of the interior pixels
+    laplacian = luminance[:, 1:-1, 1:-1] * 4
+    laplacian -= luminance[:, :-2, 1:-1]
+    laplacian -= luminance[:, 2:, 1:-1]
+    laplacian -= luminance[:, 1:-1, :-2]
+    laplacian -= luminance[:, 1:-1, 2:]
+    metrics['laplacian'] = laplacian.var(axis=(1, 2)) * scale
+    del laplacian
+
+    gradient = np.square(np.diff(luminance, axis=1)).mean(axis=(1, 2))
+    gradient += np.square(np.diff(luminance, axis=2)).mean(axis=(1, 2))
+    metrics['gradient'] = gradient * scale
+    return metrics
+
+
+def _batch_frames(reader, roi):
+    width, height = (reader.width, reader.height) if roi is None else roi[2:]
+    return max(1, BATCH_PIXELS // (width * height))
+
+
+def _score_range(reader, start, stop, saturation, roi):
+    """Score frames start to stop of an open SERReader in batches."""
+    bayer = reader.color_id not in (ser.MONO, ser.RGB, ser.BGR)
+    batch = _batch_frames(reader, roi)
+    results = []
+    for batch_start in range(start, stop, batch):
+        frames = reader[batch_start:min(batch_start + batch, stop)]
+        results.append(frame_metrics(frames, bayer, saturation, roi, batch_start))
+    return np.concatenate(results) if results else np.zeros(0, dtype=METRICS_DTYPE)
+
+
+def _init_worker(filename, little_endian):
+    global _reader  # pylint: disable=global-statement
+    _reader = ser.SERReader(filename, little_endian)
+    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+        _reader.advise(mmap.MADV_SEQUENTIAL)
+
+
+def _score_task(start, stop, saturation, roi):
+    return _score_range(_reader, start, stop, saturation, roi)
+
+
+def score_ser(filename, workers=None, roi=None, saturation=None, little_endian=None):
+    """Score every frame of a SER file.
+
+    Args:
+        filename: Path of the SER file.
+        workers: Number of worker processes. Defaults to the number of CPUs. With 1, frames are
+            scored in the calling process.
+        roi: Optional region (x, y, width, height) of each frame to score, such as the area
+            around a planet. Scoring less of each frame is proportionally faster.
+        saturation: Pixel value counted as saturated. Defaults to SATURATION_LEVEL of full scale
+            for the bit depth of the file.
+        little_endian: Byte order override passed to SERReader.
+
+    Returns:
+        Array of METRICS_DTYPE with one element per frame, in file order.
+    """
+    filename = os.fspath(filename)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with ser.SERReader(filename, little_endian) as reader:
+        frame_count = len(reader)
+        if saturation is None:
+            saturation = SATURATION_LEVEL * ((1 << reader.bit_depth) - 1)
+        if workers <= 1 or frame_count <= TASK_FRAMES:
+            return _score_range(reader, 0, frame_count, saturation, roi)
+
+    # Worker processes are spawned for the same reason as in asi.sink: forking a process that may
+    # have other threads running is not safe.
+    with concurrent.futures.ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(filename, little_endian),
+        ) as executor:
+        futures = []
+        for start in range(0, frame_count, TASK_FRAMES):
+            stop = min(start + TASK_FRAMES, frame_count)
+            futures.append(executor.submit(_score_task, start, stop, saturation, roi))
+        return np.concatenate([future.result() for future in futures])
+
+
+def rank(
+        metrics,
+        metric='laplacian',
+        min_relative_brightness=MIN_RELATIVE_BRIGHTNESS,
+        max_saturated=MAX_SATURATED,
+    ):
+    """Return the indices of the usable frames, sharpest first.
+
+    Args:
+        metrics: Array of METRICS_DTYPE from score_ser() or frame_metrics().
+        metric: Sharpness metric to rank by; one of SHARPNESS_METRICS.
+        min_relative_brightness: Frames whose mean brightness is below this fraction of the
+            median over all frames are excluded. Use 0 to keep them.
+        max_saturated: Frames with a larger fraction of saturated pixels are excluded. Use 1 to
+            keep them.
+
+    Returns:
+        int64 array of frame indices.
+    """
+    if metric not in SHARPNESS_METRICS:
+        raise ValueError(f'metric must be one of {SHARPNESS_METRICS}, got {metric!r}')
+    if len(metrics) == 0:
+        return np.zeros(0, dtype=np.int64)
+    usable = metrics['mean'] >= min_relative_brightness * np.median(metrics['mean'])
+    usable &= metrics['saturated'] <= max_saturated
+    candidates = metrics[usable]
+    logger.debug('%d of %d frames pass the brightness and saturation checks',
+                 len(candidates), len(metrics))
+    order = np.argsort(-candidates[metric], kind='stable')
+    return candidates['index'][order]
+
+
+def write_selected(reader, indices, filename, keep_order=True):
+    """Write a subset of the frames of a SER file to a new SER file.
+
+    Args:
+        reader: An open SERReader.
+        indices: Indices of the frames to write.
+        filename: Path of the file to create.
+        keep_order: Write the frames in their original order rather than in the order given.
+
+    Returns:
+        Number of frames written.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    if keep_order:
+        indices = np.sort(indices)
+    header = reader.header
+    with ser.SERWriter(
+            filename,
+            reader.width,
+            reader.height,
+            color_id=reader.color_id,
+            bit_depth=reader.bit_depth,
+            observer=header['Observer'].decode('ascii', 'replace'),
+            instrument=header['Instrument'].decode('ascii', 'replace'),
+            telescope=header['Telescope'].decode('ascii', 'replace'),
+            add_trailer=reader.timestamps is not None,
+        ) as writer:
+        batch = _batch_frames(reader, None)
+        for start in range(0, len(indices), batch):
+            selected = indices[start:start + batch]
+            timestamps = None
+            if reader.timestamps is not None:
+                timestamps = ser.ticks_to_unix(reader.timestamps[selected]).tolist()
+            writer.add_frames([reader[i] for i in selected], timestamps)
+    return len(indices)
+
+
+def select_ser(filename, output, top_percent=10.0, metric='laplacian', keep_order=True, **kwargs):
+    """Score a SER file and write its sharpest frames to a new SER file.
+
+    Args:
+        filename: Path of the SER file to read.
+        output: Path of the SER file to create.
+        top_percent: Percentage of all frames to keep. Fewer are kept if not enough frames pass
+            the checks of rank().
+        metric: Sharpness metric to rank by; one of SHARPNESS_METRICS.
+        keep_order: Write the frames in their original order rather than sharpest first.
+        **kwargs: Passed to score_ser().
+
+    Returns:
+        Indices of the frames written, sharpest first.
+    """
+    metrics = score_ser(filename, **kwargs)
+    ranked = rank(metrics, metric)
+    selected = ranked[:int(round(len(metrics) * top_percent / 100))]
+    with ser.SERReader(filename, kwargs.get('little_endian')) as reader:
+        write_selected(reader, selected, output, keep_order)
+    logger.info('Wrote %d of %d frames of %s to %s', len(selected), len(metrics), filename, output)
+    return selected
@@ -0,0 +1,370 @@
+"""Wall-clock aligned scheduling of exposures for timelapse and all-sky capture.
+
+Shots are fired at instants aligned to multiples of the interval since the Unix epoch, so with a
+60 s interval every shot starts on the minute. Each wait is a single sleep until an absolute
+deadline on the realtime clock with clock_nanosleep(TIMER_ABSTIME), which wakes within tens of
+microseconds of the deadline on Linux without polling, and keeps working across NTP adjustments
+of the clock. A shot that cannot start on time because the previous one overran is skipped and
+counted rather than treated as an error.
+
+Observation windows (times when the Sun is low enough) are computed once per UTC day from a
+vectorized low-precision solar position and cached, so checking whether a shot should be taken
+costs a bisection rather than an ephemeris calculation.
+
+Typical usage:
+
+    windows = ObservationWindows(latitude=-72.32, longitude=170.23, sun_altitude_max=-10.0)
+    scheduler = Scheduler(60.0, take_exposure, windows=windows)
+    scheduler.run()
+"""
+
+import bisect
+import collections
+import ctypes
+import ctypes.util
+import datetime
+import logging
+import math
+import sys
+import threading
+import time
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86_400
+
+# Resolution of the solar altitude samples used to find observation window boundaries. Crossings
+# are interpolated between samples so the boundaries are much more accurate than this.
+SUN_SAMPLE_STEP = 60.0
+
+# Number of recent shots kept for jitter statistics
+JITTER_HISTORY = 1000
+
+# Instants closer than this in seconds are treated as the same when aligning to an interval
+ALIGNMENT_TOLERANCE = 1e-6
+
+# Constants from <time.h> on Linux
+_CLOCK_REALTIME = 0
+_TIMER_ABSTIME = 1
+_EINTR = 4
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _load_clock_nanosleep():
+    """Return libc's clock_nanosleep() via ctypes or None if it is not available."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = libc.clock_nanosleep
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [
+        ctypes.c_int, ctypes.c_int, ctypes.POINTER(_Timespec), ctypes.POINTER(_Timespec)
+    ]
+    func.restype = ctypes.c_int
+    return func
+
+
+_clock_nanosleep = _load_clock_nanosleep()
+
+
+def sleep_until(deadline):
+    """Sleep until an absolute wall-clock time.
+
+    Uses clock_nanosleep() with TIMER_ABSTIME where available, which releases the GIL and does
+    not accumulate error from computing a relative delay. Elsewhere falls back to time.sleep().
+
+    Args:
+        deadline: Time to wake up, in seconds since the Unix epoch as returned by time.time().
+
+    Returns:
+        How late the wakeup was in seconds (negative if early, which only the fallback can be).
+    """
+    if _clock_nanosleep is not None:
+        sec = math.floor(deadline)
+        request = _Timespec(sec, min(int((deadline - sec) * 1e9), 999_999_999))
+        while True:
+            # Returns the error number directly rather than setting errno
+            err = _clock_nanosleep(_CLOCK_REALTIME, _TIMER_ABSTIME, ctypes.byref(request), None)
+            if err != _EINTR:
+                break
+        if err != 0:
+            raise OSError(err, f'clock_nanosleep failed: {err}')
+    else:
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(remaining)
+    return time.time() - deadline
+
+
+def next_aligned_time(interval, after=None, offset=0.0, margin=0.0):
+    """Return the next instant aligned to the interval at least margin seconds in the future.
+
+    Instants are offset + k * interval seconds since the Unix epoch for integer k, so a 60 s
+    interval gives times on the minute and a 3600 s interval times on the hour (in UTC).
+
+    Args:
+        interval: Interval between instants in seconds.
+        after: Reference time in seconds since the epoch. Defaults to now.
+        offset: Offset of the instants from the aligned times in seconds.
+        margin: Minimum time between the reference time and the returned instant, to leave time
+            to prepare for the first shot.
+    """
+    if interval <= 0:
+        raise ValueError('interval must be positive')
+    after = time.time() if after is None else after
+    earliest = after + margin
+    # The tolerance keeps an instant computed from an earlier one from rounding up a whole interval.
+    # It is in seconds since times around 1e9 s only have a resolution of about 2e-7 s.
+    return offset + math.ceil((earliest - offset - ALIGNMENT_TOLERANCE) / interval) * interval
+
+
+def sun_altitude(times, latitude, longitude):
+    """Compute the altitude of the Sun.
+
+    Uses the low-precision formulae of the Astronomical Almanac, accurate to about 0.01 degrees
+    between 1950 and 2050. Refraction is not included.
+
+    Args:
+        times: Time or array of times in seconds since the Unix epoch.
+        latitude: Geodetic latitude of the observer in degrees, positive north.
+        longitude: Longitude of the observer in degrees, positive east.
+
+    Returns:
+        Altitude in degrees, with the same shape as times.
+    """
+    days = np.asarray(times, dtype=np.float64) / SECONDS_PER_DAY - 10_957.5  # days since J2000.0
+    mean_anomaly = np.radians(357.529 + 0.98560028 * days)
+    mean_longitude = 280.459 + 0.98564736 * days
+    ecliptic_longitude = np.radians(
+        mean_longitude + 1.915 * np.sin(mean_anomaly) + 0.020 * np.sin(2 * mean_anomaly)
+    )
+    obliquity = np.radians(23.439 - 0.00000036 * days)
+    right_ascension = np.arctan2(
+        np.cos(obliquity) * np.sin(ecliptic_longitude), np.cos(ecliptic_longitude)
+    )
+    declination = np.arcsin(np.sin(obliquity) * np.sin(ecliptic_longitude))
+    sidereal_time = np.radians(280.46061837 + 360.98564736629 * days + longitude)
+    hour_angle = sidereal_time - right_ascension
+    lat = math.radians(latitude)
+    return np.degrees(np.arcsin(
+        math.sin(lat) * np.sin(declination)
+        + math.cos(lat) * np.cos(declination) * np.cos(hour_angle)
+    ))
+
+
+class ObservationWindows:
+    """Time intervals in which the Sun is below a given altitude, computed once per UTC day.
+
+    Args:
+        latitude: Geodetic latitude of the observer in degrees, positive north.
+        longitude: Longitude of the observer in degrees, positive east.
+        sun_altitude_max: Observations are made only while the Sun is at or below this altitude
+            in degrees, e.g. -18 for astronomical darkness.
+        step: Interval in seconds between the samples of solar altitude used to find windows.
+        cache_days: Number of days of windows kept in the cache.
+    """
+
+    def __init__(
+            self,
+            latitude,
+            longitude,
+            sun_altitude_max=-10.0,
+            step=SUN_SAMPLE_STEP,
+            cache_days=4,
+        ):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.sun_altitude_max = sun_altitude_max
+        self.step = step
+        self.cache_days = cache_days
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _compute(self, day):
+        """Return the windows within one UTC day as a tuple (starts, ends) of sorted lists."""
+        day_start = day * SECONDS_PER_DAY
+        offsets = np.arange(0.0, SECONDS_PER_DAY + self.step, self.step)
+        offsets[-1] = SECONDS_PER_DAY
+        excess = sun_altitude(day_start + offsets, self.latitude, self.longitude)
+        excess -= self.sun_altitude_max
+        below = excess <= 0
+
+        # Interpolate the time at which the altitude crosses the limit between adjacent samples
+        changes = np.flatnonzero(below[1:] != below[:-1])
+        fraction = excess[changes] / (excess[changes] - excess[changes + 1])
+        gaps = offsets[changes + 1] - offsets[changes]
+        crossings = day_start + offsets[changes] + fraction * gaps
+
+        edges = crossings.tolist()
+        if below[0]:
+            edges.insert(0, float(day_start))
+        if below[-1]:
+            edges.append(float(day_start + SECONDS_PER_DAY))
+        return edges[0::2], edges[1::2]
+
+    def _windows(self, day):
+        with self._lock:
+            windows = self._cache.get(day)
+            if windows is None:
+                windows = self._compute(day)
+                self._cache[day] = windows
+                while len(self._cache) > self.cache_days:
+                    self._cache.popitem(last=False)
+                logger.debug('Computed %d observation windows for day %d', len(windows[0]), day)
+            return windows
+
+    def windows(self, date):
+        """Return the list of (start, end) observation windows within a UTC date.
+
+        Args:
+            date: A datetime.date.
+
+        Returns:
+            List of tuples of times in seconds since the epoch. Windows are clipped to the day, so
+            a window spanning midnight appears in both days.
+        """
+        day = (date - datetime.date(1970, 1, 1)).days
+        return list(zip(*self._windows(day)))
+
+    def contains(self, t):
+        """True if observations should be made at time t (seconds since the epoch)."""
+        starts, ends = self._windows(int(t // SECONDS_PER_DAY))
+        i = bisect.bisect_right(starts, t) - 1
+        return i >= 0 and t <= ends[i]
+
+    def next_start(self, t, max_days=366):
+        """Return the earliest time at or after t within an observation window.
+
+        Returns:
+            Time in seconds since the epoch, or None if there is no window within max_days.
+        """
+        if self.contains(t):
+            return t
+        day = int(t // SECONDS_PER_DAY)
+        for day in range(day, day + max_days):
+            starts, _ = self._windows(day)
+            i = bisect.bisect_right(starts, t)
+            if i < len(starts):
+                return starts[i]
+        return None
+
+
+class Scheduler:
+    """Calls an action at wall-clock aligned intervals.
+
+    Args:
+        interval: Interval between shots in seconds.
+        action: Callable taking the scheduled time of the shot in seconds since the epoch. It
+            should start the exposure promptly; any work that can be done later (e.g. saving the
+            image) should be handed off to another thread or process.
+        windows: Optional ObservationWindows. Shots are only taken within its windows.
+        offset: Offset of the shot times from the aligned times in seconds.
+        margin: Minimum time between starting the scheduler and the first shot in seconds.
+
+    Attributes:
+        shots: Number of shots taken.
+        missed: Number of scheduled shots skipped because the previous shot overran.
+    """
+
+    def __init__(self, interval, action, windows=None, offset=0.0, margin=0.0):
+        if interval <= 0:
+            raise ValueError('interval must be positive')
+        self.interval = interval
+        self.action = action
+        self.windows = windows
+        self.offset = offset
+        self.margin = margin
+        self.shots = 0
+        self.missed = 0
+        self._jitter = collections.deque(maxlen=JITTER_HISTORY)
+        self._stop_event = threading.Event()
+
+    def next_shot(self, after=None, margin=0.0):
+        """Return the time of the first shot strictly after the given time (default now).
+
+        Returns:
+            Time in seconds since the epoch, or None if there are no more observation windows.
+        """
+        after = time.time() if after is None else after
+        t = next_aligned_time(self.interval, after, self.offset, margin)
+        if t <= after + ALIGNMENT_TOLERANCE:
+            t += self.interval
+        while self.windows is not None and not self.windows.contains(t):
+            start = self.windows.next_start(t)
+            if start is None:
+                return None
+            t = next_aligned_time(self.interval, start, self.offset)
+        return t
+
+    def run(self, count=None):
+        """Take shots until stop() is called or count shots have been taken.
+
+        Runs in the calling thread.
+        """
+        self._stop_event.clear()
+        t = self.next_shot(margin=self.margin)
+        while t is not None and not self._stop_event.is_set():
+            if count is not None and self.shots >= count:
+                break
+
+            # Wake up in slices so stop() takes effect without waiting for the next shot
+            while t - time.time() > 1.0 and not self._stop_event.is_set():
+                sleep_until(min(t - 0.5, time.time() + 1.0))
+            if self._stop_event.is_set():
+                break
+            jitter = sleep_until(t)
+
+            self._jitter.append(jitter)
+            self.shots += 1
+            self.action(t)
+
+            # Skip shots whose time has already passed instead of firing them late
+            now = time.time()
+            t_next = self.next_shot(t)
+            if t_next is not None and t_next <= now:
+                skipped = self._count_shots(t_next, now)
+                self.missed += skipped
+                logger.warning('Shot at %.3f overran, skipping %d shot(s)', t, skipped)
+                t_next = self.next_shot(now)
+            t = t_next
+
+    def _count_shots(self, first, end):
+        """Return the number of shot times from first, itself a shot time, up to end.
+
+        Only times inside the observation windows are counted, so an overrun into the gap before
+        the next window does not count the shots that would never have been taken.
+        """
+        if self.windows is None:
+            return int((end - first) // self.interval) + 1
+        count = 0
+        t = first
+        while t is not None and t <= end:
+            count += 1
+            t = self.next_shot(t)
+        return count
+
+    def stop(self):
+        """Make run() return before the next shot. May be called from another thread."""
+        self._stop_event.set()
+
+    def stats(self):
+        """Return a dict of shot counts and start jitter statistics in milliseconds."""
+        stats = {'shots': self.shots, 'missed': self.missed}
+        if self._jitter:
+            jitter_ms = np.abs(np.array(self._jitter)) * 1e3
+            stats['jitter_ms'] = {
+                'mean': float(np.mean(jitter_ms)),
+                'p50': float(np.percentile(jitter_ms, 50)),
+                'p99': float(np.percentile(jitter_ms, 99)),
+                'max': float(np.max(jitter_ms)),
+            }
+        return stats
@@ -0,0 +1,334 @@
+%module(package="asi", threads="1") sdk
+%{
+#define SWIG_FILE_WITH_INIT
+#include <stdio.h>
+#include "ASICamera2.h"
+%}
+
+%include "carrays.i"
+%include "cstring.i"
+%include "numpy.i"
+%include "typemaps.i"
+
+%init
+%{
+    import_array();
+%}
+
+/*
+ * Release the Python GIL while inside the ASI library for calls that can block for a long time,
+ * for example waiting for a frame or doing USB transfers. This allows other Python threads to make
+ * progress in the meantime. All other calls are fast enough that releasing the GIL would cost more
+ * than it saves, so thread support is disabled for everything not listed here.
+ */
+%nothread;
+%thread ASIGetNumOfConnectedCameras;
+%thread ASIGetCameraProperty;
+%thread ASIGetCameraPropertyByID;
+%thread ASIOpenCamera;
+%thread ASIInitCamera;
+%thread ASICloseCamera;
+%thread ASIGetControlValue;
+%thread ASISetControlValue;
+%thread ASISetROIFormat;
+%thread ASISetStartPos;
+%thread ASIStartVideoCapture;
+%thread ASIStopVideoCapture;
+%thread ASIGetVideoData;
+%thread ASIGetVideoDataInto;
+%thread ASIStartExposure;
+%thread ASIStopExposure;
+%thread ASIGetExpStatus;
+%thread ASIGetDataAfterExp;
+%thread ASIGetDataAfterExpInto;
+
+/*
+ * This applies a Numpy SWIG template to all C functions that have arguments matching this
+ * pattern (argument types and names). The resulting Python functions will return a Numpy array.
+ * This is meant to match the ASIGetVideoData and ASIGetDataAfterExp functions.
+ */
+%apply (unsigned char *ARGOUT_ARRAY1, int DIM1) {(unsigned char *pBuffer, long lBuffSize)};
+
+/*
+ * For ASIGetVideoDataInto and ASIGetDataAfterExpInto which write into a buffer owned by the
+ * caller instead of allocating a new Numpy array on every call. Any object supporting the buffer
+ * protocol is accepted (Numpy array, bytearray, memoryview, mmap, ...) as long as it is writable,
+ * C-contiguous, and made up of 8-bit or 16-bit unsigned integers. The buffer is held for the
+ * duration of the call so the data is written directly into it without any copy.
+ */
+%typemap(in) (unsigned char *pOutBuffer, long lOutBuffSize) (Py_buffer view, int have_view = 0)
+{
+    if (PyObject_GetBuffer($input, &view, PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) < 0)
+    {
+        SWIG_fail;
+    }
+    have_view = 1;
+    const char *format = (view.format != NULL) ? view.format : "B";
+    if (*format == '<' || *format == '=' || *format == '@')
+    {
+        format++;
+    }
+    if (!((view.itemsize == 1 && strcmp(format, "B") == 0)
+          || (view.itemsize == 2 && strcmp(format, "H") == 0)))
+    {
+        PyErr_Format(
+            PyExc_TypeError,
+            "output buffer must contain uint8 or uint16 items, got format '%s'",
+            view.format
+        );
+        SWIG_fail;
+    }
+    $1 = (unsigned char *)view.buf;
+    $2 = (long)view.len;
+}
+
+%typemap(freearg) (unsigned char *pOutBuffer, long lOutBuffSize)
+{
+    if (have_view$argnum)
+    {
+        PyBuffer_Release(&view$argnum);
+    }
+}
+
+/*
+ * For ASIGetNumOfControls which returns an int by pointer in C
+ */
+%apply int *OUTPUT { int * piNumberOfControls };
+
+/*
+ * For ASIGetControlValue which returns a long and a bool enum by pointers
+ */
+%apply int *OUTPUT { long *plValue, int *pbAuto };
+
+/*
+ * For ASIGetROIFormat which returns several values by pointer
+ */
+%apply int *OUTPUT { int *piWidth, int *piHeight, int *piBin, int *pImg_type };
+
+/*
+ * For ASIGetStartPos which returns X and Y coordinates by pointer to int
+ */
+%apply int *OUTPUT { int *piStartX, int *piStartY };
+
+/*
+ * For ASIGetDroppedFrames which returns an int by pointer
+ */
+%apply int *OUTPUT { int *piDropFrames };
+
+/*
+ * For ASIGetExpStatus which returns status by pointer
+ */
+%apply int *OUTPUT { ASI_EXPOSURE_STATUS *pExpStatus }
+
+/*
+ * For ASIGetCameraMode which returns the camera mode by pointer
+ */
+%apply int *OUTPUT { ASI_CAMERA_MODE *mode };
+
+/*
+ * For use with functions that expect an array to be passed in by pointer, such as ASIGetProductIDs
+ */
+%array_class(int, intArray);
+
+%include "ASICamera2.h"
+
+/*
+ * For GetSerialNumber which writes the serial number as a string of hexadecimal digits
+ */
+%cstring_bounded_output(char *pSerial, 16);
+
+%inline
+%{
+    int GetNumProductIDs()
+    {
+        return ASIGetProductIDs(0);
+    }
+
+    /*
+     * Returns the number of bytes in one image given the current ROI format, or a negative value
+     * if the ROI format could not be read.
+     */
+    long GetImageSizeBytes(int iCameraID)
+    {
+        int width, height, bin;
+        ASI_IMG_TYPE img_type;
+        if (ASIGetROIFormat(iCameraID, &width, &height, &bin, &img_type) != ASI_SUCCESS)
+        {
+            return -1;
+        }
+        long size = (long)width * height;
+        switch (img_type)
+        {
+            case ASI_IMG_RAW16: return 2 * size;
+            case ASI_IMG_RGB24: return 3 * size;
+            default: return size;
+        }
+    }
+
+    /*
+     * Same as ASIGetVideoData() except the data is written into a buffer provided by the caller.
+     * Returns ASI_ERROR_INVALID_SIZE if the buffer size does not match the current ROI format.
+     */
+    ASI_ERROR_CODE ASIGetVideoDataInto(
+        int iCameraID,
+        unsigned char *pOutBuffer,
+        long lOutBuffSize,
+        int iWaitms)
+    {
+        long image_size = GetImageSizeBytes(iCameraID);
+        if (image_size < 0)
+        {
+            return ASI_ERROR_INVALID_ID;
+        }
+        if (lOutBuffSize != image_size)
+        {
+            return ASI_ERROR_INVALID_SIZE;
+        }
+        return ASIGetVideoData(iCameraID, pOutBuffer, lOutBuffSize, iWaitms);
+    }
+
+    /*
+     * Same as ASIGetDataAfterExp() except the data is written into a buffer provided by the
+     * caller. Returns ASI_ERROR_INVALID_SIZE if the buffer size does not match the current ROI
+     * format.
+     */
+    ASI_ERROR_CODE ASIGetDataAfterExpInto(
+        int iCameraID,
+        unsigned char *pOutBuffer,
+        long lOutBuffSize)
+    {
+        long image_size = GetImageSizeBytes(iCameraID);
+        if (image_size < 0)
+        {
+            return ASI_ERROR_INVALID_ID;
+        }
+        if (lOutBuffSize != image_size)
+        {
+            return ASI_ERROR_INVALID_SIZE;
+        }
+        return ASIGetDataAfterExp(iCameraID, pOutBuffer, lOutBuffSize);
+    }
+
+    /*
+     * Same as ASIGetSerialNumber() except the serial number is written into pSerial as 16
+     * lower-case hexadecimal digits, or as an empty string if it could not be read.
+     */
+    ASI_ERROR_CODE GetSerialNumber(int iCameraID, char *pSerial)
+    {
+        ASI_SN serial;
+        int i;
+        ASI_ERROR_CODE rtn = ASIGetSerialNumber(iCameraID, &serial);
+        pSerial[0] = '\0';
+        if (rtn == ASI_SUCCESS)
+        {
+            for (i = 0; i < 8; i++)
+            {
+                sprintf(pSerial + 2 * i, "%02x", serial.id[i]);
+            }
+        }
+        return rtn;
+    }
+%}
+
+/*
+ * Redefine the Python function definition for certain functions to make them more Pythonic or
+ * just easier to use.
+ */
+%pythoncode
+%{
+def ASIGetProductIDs():
+    num_ids = _sdk.GetNumProductIDs()
+    id_array = intArray(num_ids)
+    _sdk.ASIGetProductIDs(id_array)
+    id_list = []
+    for i in range(num_ids):
+        id_list.append(id_array[i])
+    return id_list
+
+def ASIGetCameraProperty(camera_index):
+    info = ASI_CAMERA_INFO()
+    rtn = _sdk.ASIGetCameraProperty(info, camera_index)
+    return rtn, info
+
+def ASIGetCameraPropertyByID(camera_id):
+    info = ASI_CAMERA_INFO()
+    rtn = _sdk.ASIGetCameraPropertyByID(camera_id, info)
+    return rtn, info
+
+def ASIGetSerialNumber(camera_id):
+    rtn, serial = _sdk.GetSerialNumber(camera_id)
+    return rtn, serial
+
+def ASIGetControlCaps(camera_id, control_index):
+    caps = ASI_CONTROL_CAPS()
+    rtn = _sdk.ASIGetControlCaps(camera_id, control_index, caps)
+    return rtn, caps
+
+def ASIGetSupportedBins(camera_info):
+    supported_bins = []
+    for i in range(16):
+        bin = camera_info.get_supported_bins(i);
+        if bin == 0:
+            break
+        else:
+            supported_bins.append(bin)
+    return supported_bins
+
+def ASIGetSupportedVideoFormats(camera_info):
+    supported_formats = []
+    for i in range(8):
+        format = camera_info.get_supported_video_format(i)
+        if format == _sdk.ASI_IMG_END:
+            break
+        else:
+            supported_formats.append(format)
+    return supported_formats
+
+class ASIError(Exception):
+    """Raised by ASICheck() when the status code returned by an API call is not ASI_SUCCESS"""
+
+def ASICheck(return_values):
+    """Check status return code from ASICamera2 API calls for errors.
+
+    This function can be used to eliminate the need for boilerplate if-statements after every API
+    call to check for error conditions. Typical usage is to wrap an API call like so:
+    exposure_status = asi.ASICheck(asi.ASIGetExpStatus(camera_info.CameraID))
+
+    Args:
+        return_values: The return value or values from a ASICamera2 API call.
+
+    Returns:
+        The return_values but with the status code removed. If the status code was the only return
+        value from the API call, this function returns None.
+
+    Raises:
+        ASIError if the status code was something other than ASI_SUCCESS.
+    """
+    if isinstance(return_values, (tuple, list)):
+        status_code = return_values[0]
+        return_values = return_values[1:] if len(return_values) > 2 else return_values[1]
+    else:
+        status_code = return_values
+        return_values = None
+
+    if status_code != _sdk.ASI_SUCCESS:
+        raise ASIError('ASI return code: {}'.format(status_code))
+
+    return return_values
+%}
+
+/*
+ * Otherwise it's impossible to access the elements of these arrays from Python
+ */
+%extend _ASI_CAMERA_INFO
+{
+    int get_supported_bins(int index)
+    {
+        return self->SupportedBins[index];
+    }
+
+    ASI_IMG_TYPE get_supported_video_format(int index)
+    {
+        return self->SupportedVideoFormat[index];
+    }
+}
@@ -0,0 +1,628 @@
+"""Segmented SER recording with size and time rollover across several disks.
+
+The capture program writes a whole recording to a single SER file that grows without bound, and
+once its disk is nearly full it can only discard frames. A SegmentedWriter instead splits a
+recording into SER files ("segments") limited in size and optionally in duration, and spreads
+them round-robin over several directories, normally on different disks:
+
+    with SegmentedWriter(['/mnt/disk0/run', '/mnt/disk1/run'], width, height,
+                         bit_depth=16, max_bytes=1 << 30) as writer:
+        for frame in consumer:
+            with frame:
+                writer.add_frame(frame)
+
+Each directory has its own writer thread and queue. While one directory is still writing the
+queued frames of its segment, the next directory starts on the next segment, so the disks write
+in parallel and with N directories each disk only needs to sustain about 1/N of the data rate.
+The queue must then hold the backlog of a disk at the end of its segment, up to a segment less
+what the disk wrote meanwhile, so keep max_bytes well below queue_bytes when striping for
+bandwidth.
+
+Before a segment is started, the free space of its directory is checked and the whole segment is
+preallocated, so a directory without room for a complete segment is skipped rather than filled.
+Free space is also checked every FREE_SPACE_CHECK_FRAMES frames, as in the capture program, in
+case other programs use the same disk. If a write fails, the directory is taken out of rotation
+and the frames queued for it are moved to continuation segments in the other directories, so no
+frame is lost as long as any directory has room.
+
+A JSON manifest named after the prefix is kept in every directory, listing each segment with its
+path, range of frame numbers, and first and last timestamps. It is rewritten whenever a segment
+is opened or closed and every FREE_SPACE_CHECK_FRAMES frames, so it is valid even if the program
+is killed and the segments being written can be read while recording. SegmentedReader reads the
+frames of all segments of a manifest as one sequence, taking the number of frames of segments
+that are still open from their SER headers, which are updated with every frame.
+"""
+
+import bisect
+import collections
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+
+from asi import metrics
+from asi import ser
+from asi import stream
+
+
+logger = logging.getLogger(__name__)
+
+# Default limit on the size of each segment. Some SER readers cannot handle files over 2 GiB.
+DEFAULT_MAX_BYTES = 2 << 30
+
+# Free space left on every disk. Matches MIN_FREE_DISK_SPACE_BYTES in the capture program.
+MIN_FREE_BYTES = 100 << 20
+
+# Frames between free space checks. Matches the capture program.
+FREE_SPACE_CHECK_FRAMES = 100
+
+# Default limit on the size of the frames waiting to be written
+QUEUE_BYTES = 1 << 30
+
+MANIFEST_VERSION = 1
+
+
+def free_bytes(directory):
+    """Return the space available to unprivileged users on the file system holding a directory."""
+    stats = os.statvfs(directory)
+    return stats.f_bavail * stats.f_frsize
+
+
+class _Segment:
+    """One SER file of a recording and its frames."""
+
+    def __init__(self, number, disk, filename, first_frame, start_time):
+        self.number = number
+        self.disk = disk
+        self.filename = filename
+        self.first_frame = first_frame
+        self.start_time = start_time
+        self.end_time = start_time
+        self.assigned = 0  # frames queued for this segment
+        self.frame_count = 0  # frames written
+        self.writer = None
+        self.complete = False
+
+    def entry(self):
+        """Return the manifest entry for this segment."""
+        return {
+            'path': self.filename,
+            'first_frame': self.first_frame,
+            'frame_count': self.frame_count,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'complete': self.complete,
+        }
+
+
+class _Disk:
+    """A target directory with its queue of (segment, frame number, image, ticks) items.
+
+    An item with an image of None closes its segment.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.queue = collections.deque()
+        self.failed = False
+        self.bytes_written = 0
+        self.thread = None
+
+
+class SegmentedWriter:
+    """Records frames to a sequence of SER files spread over several directories.
+
+    Args:
+        directories: Directory or list of directories for the segments. They are created if
+            needed.
+        width: Width of every image in pixels.
+        height: Height of every image in pixels.
+        color_id: How color information is encoded; one of the color ID constants of asi.ser.
+        bit_depth: Number of bits per pixel per color plane (1-16).
+        prefix: Prefix of the segment file names, which are followed by the segment number, and
+            name of the manifest.
+        max_bytes: Maximum size of each segment file including its header and trailer.
+        max_seconds: Optional maximum time between the first and last frames of a segment.
+        min_free_bytes: Space left free on every disk.
+        queue_bytes: Maximum size of the frames waiting to be written. add_frame() blocks when
+            the queue is full.
+        preallocate: Reserve the space of each segment when it is opened. Fast on file systems
+            with fallocate() support such as ext4 and XFS, but slow on others since the C library
+            writes zeros instead.
+        stage: Optional callable applied to each image in add_frame() before it is copied, such
+            as an asi.binning.Binning. width and height are those of the images it returns.
+        registry: asi.metrics.Registry the writer reports to. Defaults to asi.metrics.REGISTRY.
+        **ser_options: Passed to asi.ser.SERWriter, such as observer or direct_io.
+
+    Attributes:
+        frame_count: Number of frames accepted by add_frame(), which are numbered from 0 in the
+            manifest.
+        dropped: Number of frames discarded because the queue stayed full or no directory had
+            room.
+        max_queued: Highest number of frames ever waiting to be written.
+        manifest_name: File name of the manifest in each directory.
+    """
+
+    def __init__(
+            self,
+            directories,
+            width,
+            height,
+            color_id=ser.BAYER_RGGB,
+            bit_depth=8,
+            prefix='segment',
+            max_bytes=DEFAULT_MAX_BYTES,
+            max_seconds=None,
+            min_free_bytes=MIN_FREE_BYTES,
+            queue_bytes=QUEUE_BYTES,
+            preallocate=True,
+            stage=None,
+            registry=None,
+            **ser_options,
+        ):
+        if isinstance(directories, (str, os.PathLike)):
+            directories = [directories]
+        if not directories:
+            raise ValueError('At least one directory is required')
+        self.width = width
+        self.height = height
+        self.color_id = color_id
+        self.bit_depth = bit_depth
+        self.prefix = prefix
+        self.bytes_per_frame = ser.bytes_per_frame(width, height, bit_depth, color_id)
+        # Each frame also takes 8 bytes in the timestamp trailer
+        self.frames_per_segment = (max_bytes - ser.HEADER_SIZE) // (self.bytes_per_frame + 8)
+        if self.frames_per_segment < 1:
+            raise ValueError(f'max_bytes of {max_bytes} is too small for a single frame')
+        if queue_bytes < self.bytes_per_frame:
+            raise ValueError(f'queue_bytes of {queue_bytes} is too small for a single frame')
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.min_free_bytes = min_free_bytes
+        self.queue_bytes = queue_bytes
+        self.preallocate = preallocate
+        self.stage = stage
+        self.ser_options = ser_options
+        self.manifest_name = f'{prefix}.json'
+
+        self.frame_count = 0
+        self.dropped = 0
+        self.max_queued = 0
+        self._disks = []
+        for directory in directories:
+            directory = os.path.abspath(os.fspath(directory))
+            os.makedirs(directory, exist_ok=True)
+            self._disks.append(_Disk(directory))
+        self._segments = []
+        self._segment = None
+        self._next_disk = 0
+        self._queued_bytes = 0
+        self._roll_over = False
+        self._retry_countdown = 0
+        self._closed = False
+        self._cv = threading.Condition()
+        # Serializes manifest writes so that an older snapshot never replaces a newer one
+        self._manifest_lock = threading.Lock()
+        registry = metrics.REGISTRY if registry is None else registry
+        self._write_latency = registry.stage_latency('write')
+        registry.add_collector(self)
+
+        self._write_manifest()
+        for disk in self._disks:
+            disk.thread = threading.Thread(
+                target=self._run, args=(disk,), name='asi-segment', daemon=True
+            )
+            disk.thread.start()
+
+    def add_frame(self, image, timestamp=None, timeout=None):
+        """Queue a frame to be written.
+
+        The frame is copied, after the stage if there is one, so the caller may reuse or release it
+        as soon as this returns.
+
+        Args:
+            image: Numpy array holding one frame, or a stream.Frame.
+            timestamp: Time the frame was captured in seconds since the Unix epoch. Defaults to
+                the timestamp of a stream.Frame or else the current time.
+            timeout: Maximum time to wait for room in the queue, or None to wait indefinitely.
+
+        Returns:
+            True if the frame was queued, False if it was dropped.
+        """
+        if isinstance(image, stream.Frame):
+            timestamp = image.timestamp if timestamp is None else timestamp
+            image = image.image
+        timestamp = time.time() if timestamp is None else timestamp
+        if self.stage is not None:
+            image = self.stage(image)
+        image = np.array(image)
+        if image.nbytes != self.bytes_per_frame:
+            raise ValueError(
+                f'frame size {image.nbytes} bytes does not match expected size '
+                f'{self.bytes_per_frame} bytes'
+            )
+
+        with self._cv:
+            if self._closed:
+                raise RuntimeError('SegmentedWriter is closed')
+            if not self._cv.wait_for(
+                    lambda: self._queued_bytes + image.nbytes <= self.queue_bytes, timeout):
+                self.dropped += 1
+                logger.warning('Write queue full, dropped a frame')
+                return False
+            segment = self._segment
+            if (
+                    segment is None
+                    or self._roll_over
+                    or segment.assigned >= self.frames_per_segment
+                    or (self.max_seconds is not None
+                        and timestamp - segment.start_time >= self.max_seconds)
+                ):
+                segment = self._start_segment(self.frame_count, timestamp)
+            if segment is None:
+                self.dropped += 1
+                return False
+            segment.assigned += 1
+            segment.disk.queue.append(
+                (segment, self.frame_count, image, ser.unix_to_ticks(timestamp))
+            )
+            self.frame_count += 1
+            self._queued_bytes += image.nbytes
+            self.max_queued = max(self.max_queued, self.queued)
+            self._cv.notify_all()
+        return True
+
+    def _start_segment(self, first_frame, start_time):
+        """Close the current segment and start a new one. Called with the lock held.
+
+        Returns:
+            The new segment, or None if no directory has room for it.
+        """
+        if self._segment is not None:
+            self._segment.disk.queue.append((self._segment, None, None, None))
+            self._segment = None
+        self._roll_over = False
+        if self._retry_countdown > 0:
+            self._retry_countdown -= 1
+            return None
+        disk = self._choose_disk()
+        if disk is None:
+            # Checking free space for every frame would be wasteful
+            self._retry_countdown = FREE_SPACE_CHECK_FRAMES
+            return None
+        self._segment = self._new_segment(disk, first_frame, start_time)
+        return self._segment
+
+    def _new_segment(self, disk, first_frame, start_time):
+        number = len(self._segments)
+        filename = os.path.join(disk.directory, f'{self.prefix}_{number:05d}.ser')
+        segment = _Segment(number, disk, filename, first_frame, start_time)
+        self._segments.append(segment)
+        return segment
+
+    def _choose_disk(self):
+        """Return the next directory in rotation with room for a segment, or None.
+
+        Called with the lock held.
+        """
+        for i in range(len(self._disks)):
+            index = (self._next_disk + i) % len(self._disks)
+            disk = self._disks[index]
+            if disk.failed:
+                continue
+            try:
+                # Frames still queued for the directory will use some of its free space
+                available = free_bytes(disk.directory) - len(disk.queue) * self.bytes_per_frame
+            except OSError as e:
+                logger.error('Unable to check free space of %s: %s', disk.directory, e)
+                continue
+            if available >= self.max_bytes + self.min_free_bytes:
+                self._next_disk = (index + 1) % len(self._disks)
+                return disk
+            logger.warning('Skipping %s with only %d MiB free', disk.directory, available >> 20)
+        logger.error('No directory has room for another segment: frames are being dropped!')
+        return None
+
+    def _run(self, disk):
+        """Writer thread body for one directory."""
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: disk.queue or self._closed)
+                if not disk.queue:
+                    return
+                # The item stays in the queue until it is written so that _fail() can move it
+                segment, number, image, ticks = disk.queue[0]
+            try:
+                if image is None:
+                    self._close_segment(segment)
+                else:
+                    self._write(segment, number, image, ticks)
+            except Exception as e:  # pylint: disable=broad-except
+                self._fail(disk, e)
+                return
+            with self._cv:
+                disk.queue.popleft()
+                if image is not None:
+                    self._queued_bytes -= image.nbytes
+                    disk.bytes_written += image.nbytes
+                    segment.frame_count += 1
+                    segment.end_time = float(ser.ticks_to_unix(ticks))
+                self._cv.notify_all()
+            if image is not None and segment.frame_count % FREE_SPACE_CHECK_FRAMES == 0:
+                self._write_manifest()
+
+    def _write(self, segment, number, image, ticks):
+        if segment.writer is None:
+            segment.writer = ser.SERWriter(
+                segment.filename,
+                self.width,
+                self.height,
+                self.color_id,
+                self.bit_depth,
+                preallocate_frames=self.frames_per_segment if self.preallocate else 0,
+                **self.ser_options,
+            )
+            logger.info('Recording frames from %d to %s', number, segment.filename)
+            self._write_manifest()
+        start = time.perf_counter()
+        segment.writer.add_frames([image], ticks=[ticks])
+        self._write_latency.observe_since(start)
+        if (segment.frame_count + 1) % FREE_SPACE_CHECK_FRAMES == 0:
+            free = free_bytes(segment.disk.directory)
+            if free <= self.min_free_bytes:
+                logger.warning('%s is nearly full, starting a new segment', segment.disk.directory)
+                with self._cv:
+                    if self._segment is segment:
+                        self._roll_over = True
+
+    def _close_segment(self, segment):
+        if segment.writer is not None:
+            segment.writer.close()
+            segment.writer = None
+        with self._cv:
+            segment.complete = True
+        self._write_manifest()
+
+    def _fail(self, disk, error):
+        """Take a directory out of rotation and move its queued frames to other directories."""
+        logger.error('Writing to %s failed, moving its frames to other directories: %s',
+                     disk.directory, error)
+        with self._cv:
+            disk.failed = True
+            items = list(disk.queue)
+            disk.queue.clear()
+            failed = [segment for segment in self._segments if segment.disk is disk]
+        # Keep the frames that were written, if the file can still be closed
+        for segment in failed:
+            if segment.writer is not None:
+                try:
+                    segment.writer.close()
+                except OSError as e:
+                    logger.error('Unable to close %s: %s', segment.filename, e)
+                segment.writer = None
+
+        with self._cv:
+            # Frames may have been queued for the current segment in the meantime
+            items.extend(disk.queue)
+            disk.queue.clear()
+            for segment in failed:
+                segment.complete = True
+            # Continuation segment of each segment with frames left, in order
+            continuations = {}
+            for segment, number, image, ticks in items:
+                if image is None and segment not in continuations:
+                    # Every frame of the segment was written and it was closed above
+                    continue
+                if segment not in continuations:
+                    continuations[segment] = None
+                    target = self._choose_disk()
+                    if target is not None:
+                        start_time = None if ticks is None else float(ser.ticks_to_unix(ticks))
+                        continuations[segment] = self._new_segment(target, number, start_time)
+                continuation = continuations[segment]
+                if image is None:
+                    if continuation is not None:
+                        continuation.disk.queue.append((continuation, None, None, None))
+                    continue
+                if continuation is None:
+                    self.dropped += 1
+                    self._queued_bytes -= image.nbytes
+                    continue
+                if continuation.start_time is None:
+                    continuation.start_time = float(ser.ticks_to_unix(ticks))
+                continuation.assigned += 1
+                continuation.disk.queue.append((continuation, number, image, ticks))
+            if self._segment is not None and self._segment.disk.failed:
+                self._segment = continuations.get(self._segment)
+            self._cv.notify_all()
+        self._write_manifest()
+
+    def _write_manifest(self, complete=False):
+        """Write the manifest to every directory still in use."""
+        with self._manifest_lock:
+            with self._cv:
+                # Open segments are listed from their first frame on; empty ones are deleted
+                segments = sorted(
+                    (
+                        segment for segment in self._segments
+                        if segment.writer is not None or segment.frame_count > 0
+                    ),
+                    key=lambda segment: segment.first_frame,
+                )
+                manifest = {
+                    'version': MANIFEST_VERSION,
+                    'width': self.width,
+                    'height': self.height,
+                    'color_id': self.color_id,
+                    'bit_depth': self.bit_depth,
+                    'frame_count': sum(segment.frame_count for segment in segments),
+                    'dropped': self.dropped,
+                    'complete': complete,
+                    'segments': [segment.entry() for segment in segments],
+                }
+                directories = [disk.directory for disk in self._disks if not disk.failed]
+            for directory in directories:
+                path = os.path.join(directory, self.manifest_name)
+                try:
+                    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                        json.dump(manifest, f, indent=2)
+                    os.replace(path + '.tmp', path)
+                except OSError as e:
+                    logger.warning('Unable to write manifest %s: %s', path, e)
+
+    @property
+    def queued(self):
+        """Number of frames waiting to be written."""
+        return self._queued_bytes // self.bytes_per_frame
+
+    def close(self):
+        """Write all queued frames, close the last segment, and write the final manifest."""
+        with self._cv:
+            if self._closed:
+                return
+            if self._segment is not None:
+                self._segment.disk.queue.append((self._segment, None, None, None))
+                self._segment = None
+            self._cv.notify_all()
+            self._cv.wait_for(lambda: not any(disk.queue for disk in self._disks))
+            self._closed = True
+            self._cv.notify_all()
+        for disk in self._disks:
+            disk.thread.join()
+        self._write_manifest(complete=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def collect_metrics(self):
+        """Return asi.metrics.Sample values for the queue and each directory."""
+        samples = metrics.queue_samples(
+            f'segments:{self.prefix}', self.queued, self.max_queued, self.dropped
+        )
+        for disk in self._disks:
+            output = {'output': disk.directory}
+            samples.append(metrics.Sample('asi_bytes_written_total', 'counter', 'Bytes written',
+                                          output, disk.bytes_written))
+            samples.append(metrics.Sample('asi_output_failed', 'gauge',
+                                          'Whether writing to an output has failed', output,
+                                          int(disk.failed)))
+        return samples
+
+    def stats(self):
+        """Return a dict of frame counts and per-directory statistics."""
+        with self._cv:
+            return {
+                'frames': self.frame_count,
+                'written': sum(segment.frame_count for segment in self._segments),
+                'dropped': self.dropped,
+                'queued': self.queued,
+                'segments': len(self._segments),
+                'directories': {
+                    disk.directory: {
+                        'bytes_written': disk.bytes_written,
+                        'queued': len(disk.queue),
+                        'failed': disk.failed,
+                    }
+                    for disk in self._disks
+                },
+            }
+
+
+def read_manifest(filename):
+    """Read a manifest written by SegmentedWriter.
+
+    Segment files that are not at the path recorded in the manifest are looked for in the
+    directory of the manifest, so a recording can be gathered into a single directory.
+
+    Returns:
+        The manifest as a dict.
+    """
+    with open(filename, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f'{filename} is not a version {MANIFEST_VERSION} segment manifest')
+    directory = os.path.dirname(os.path.abspath(filename))
+    for segment in manifest['segments']:
+        if not os.path.exists(segment['path']):
+            segment['path'] = os.path.join(directory, os.path.basename(segment['path']))
+    return manifest
+
+
+class SegmentedReader:
+    """Random access to the frames of a segmented recording as one sequence.
+
+    Args:
+        filename: Path of a manifest written by SegmentedWriter.
+        little_endian: Byte order override passed to SERReader.
+
+    Attributes:
+        manifest: The manifest as a dict.
+        readers: SERReader of each segment, in frame order.
+        frame_count: Total number of frames.
+        shape: Shape of each frame.
+        dtype: Numpy dtype of the image data.
+    """
+
+    def __init__(self, filename, little_endian=None):
+        self.manifest = read_manifest(filename)
+        self.readers = []
+        self._starts = []
+        self.frame_count = 0
+        try:
+            for segment in self.manifest['segments']:
+                reader = ser.SERReader(segment['path'], little_endian)
+                if not segment['complete']:
+                    # Space preallocated after the frames of an open segment is not a trailer
+                    reader.timestamps = None
+                if segment['first_frame'] != self.frame_count:
+                    logger.warning('%s starts at frame %d, expected %d', segment['path'],
+                                   segment['first_frame'], self.frame_count)
+                self.readers.append(reader)
+                self._starts.append(self.frame_count)
+                self.frame_count += len(reader)
+        except BaseException:
+            self.close()
+            raise
+        if not self.readers:
+            raise ValueError(f'{filename} has no segments')
+        self.shape = self.readers[0].shape
+        self.dtype = self.readers[0].dtype
+
+    @property
+    def timestamps(self):
+        """int64 array of the SER timestamps of every frame, or None if any segment has none."""
+        if any(reader.timestamps is None for reader in self.readers):
+            return None
+        return np.concatenate([reader.timestamps for reader in self.readers])
+
+    def __len__(self):
+        return self.frame_count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.frame_count
+        if not 0 <= index < self.frame_count:
+            raise IndexError(f'frame {index} out of range [0, {self.frame_count})')
+        segment = bisect.bisect_right(self._starts, index) - 1
+        return self.readers[segment][index - self._starts[segment]]
+
+    def __iter__(self):
+        for reader in self.readers:
+            yield from reader
+
+    def close(self):
+        """Close every segment."""
+        for reader in self.readers:
+            reader.close()
+        self.readers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,535 @@
+"""Reading and writing of SER files.
+
+The SER file format is popular in astrophotography for storage of RAW images or video. It is
+described on this website: http://www.grischa-hahn.homepage.t-online.de/astro/ser/. This module
+implements version 3 which is documented here:
+http://www.grischa-hahn.homepage.t-online.de/astro/ser/SER%20Doc%20V3b.pdf
+
+The layout and behavior match SERFile in the capture program: a packed 178-byte header, followed
+by the raw image data of every frame, followed by an optional trailer holding one int64 UTC
+timestamp per frame.
+"""
+
+import array
+import logging
+import mmap
+import os
+import sys
+import time
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# Values of the ColorID header field (SERColorID_t in the capture program)
+MONO = 0
+BAYER_RGGB = 8
+BAYER_GRBG = 9
+BAYER_GBRG = 10
+BAYER_BGGR = 11
+BAYER_CYYM = 16
+BAYER_YCMY = 17
+BAYER_YMCY = 18
+BAYER_MYYC = 19
+RGB = 100
+BGR = 101
+
+FILE_ID = b'LUCAM-RECORDER'
+
+# Packed layout of the SER header (SERHeader_t in the capture program)
+HEADER_DTYPE = np.dtype([
+    ('FileID', 'S14'),
+    ('LuID', '<i4'),
+    ('ColorID', '<i4'),
+    ('LittleEndian', '<i4'),
+    ('ImageWidth', '<i4'),
+    ('ImageHeight', '<i4'),
+    ('PixelDepthPerPlane', '<i4'),
+    ('FrameCount', '<i4'),
+    ('Observer', 'S40'),
+    ('Instrument', 'S40'),
+    ('Telescope', 'S40'),
+    ('DateTime', '<i8'),
+    ('DateTime_UTC', '<i8'),
+])
+HEADER_SIZE = HEADER_DTYPE.itemsize
+
+# Number of ticks from the Visual Basic Date data type to the Unix time epoch. The VB Date type is
+# the number of "ticks" since Jan 1, year 0001 in the Gregorian calendar, where each tick is 100 ns.
+VB_DATE_TICKS_TO_UNIX_EPOCH = 621_355_968_000_000_000
+VB_DATE_TICKS_PER_SEC = 10_000_000
+
+# O_DIRECT requires that file offsets, transfer sizes and buffer addresses are all multiples of the
+# logical block size of the device. Page size is a safe choice for all common devices.
+DIRECT_IO_ALIGN = 4096
+
+# Size of the aligned staging buffer used for O_DIRECT writes
+DIRECT_IO_BUFFER_SIZE = 16 << 20
+
+IOV_MAX = os.sysconf('SC_IOV_MAX') if 'SC_IOV_MAX' in os.sysconf_names else 1024
+
+
+def utc_offset():
+    """Return the offset of local time from UTC in seconds."""
+    return time.localtime().tm_gmtoff
+
+
+def unix_to_ticks(timestamp):
+    """Convert seconds since the Unix epoch to a SER timestamp (100 ns ticks since year 1)."""
+    return int(round(timestamp * VB_DATE_TICKS_PER_SEC)) + VB_DATE_TICKS_TO_UNIX_EPOCH
+
+
+def ticks_to_unix(ticks):
+    """Convert SER timestamps (100 ns ticks since year 1) to seconds since the Unix epoch.
+
+    Accepts a scalar or a Numpy array.
+    """
+    return (np.asarray(ticks, dtype=np.int64) - VB_DATE_TICKS_TO_UNIX_EPOCH) / VB_DATE_TICKS_PER_SEC
+
+
+def bytes_per_frame(width, height, bit_depth, color_id):
+    """Number of bytes taken by one frame in a SER file with the given properties."""
+    num_bytes = width * height * ((bit_depth - 1) // 8 + 1)
+    if color_id in (RGB, BGR):
+        num_bytes *= 3
+    return num_bytes
+
+
+def _as_bytes(image):
+    """Return a flat byte memoryview of an image without copying if it is already contiguous."""
+    return memoryview(np.ascontiguousarray(image)).cast('B')
+
+
+def _write_all(fd, buffers):
+    """Write a list of buffers to fd with as few system calls as possible, handling short writes."""
+    buffers = list(buffers)
+    while buffers:
+        chunk = buffers[:IOV_MAX]
+        written = os.writev(fd, chunk) if len(chunk) > 1 else os.write(fd, chunk[0])
+        # Drop buffers that were completely written and trim a partially written one
+        for buf in chunk:
+            if written >= len(buf):
+                written -= len(buf)
+                buffers.pop(0)
+            else:
+                buffers[0] = buf[written:]
+                break
+
+
+def _pwrite_all(fd, data, offset):
+    """Write all of data to fd at the given offset, handling short writes."""
+    data = memoryview(data)
+    while data:
+        written = os.pwrite(fd, data, offset)
+        data = data[written:]
+        offset += written
+
+
+class _DirectWriter:
+    """Appends data to a file with O_DIRECT, bypassing the OS page cache.
+
+    Data is copied into a page-aligned staging buffer and written in aligned blocks through a
+    separate O_DIRECT file descriptor. The first block of the file, which holds the memory-mapped
+    header, and the unaligned tail at the end are written through the regular buffered file
+    descriptor instead so that O_DIRECT never touches a page that is also in the page cache.
+    """
+
+    def __init__(self, filename, fd, offset):
+        self._fd = fd
+        self._direct_fd = os.open(filename, os.O_WRONLY | os.O_DIRECT)
+        self._buffer = mmap.mmap(-1, DIRECT_IO_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._fill = 0
+        self.offset = offset  # file offset of the next byte written
+
+    @property
+    def flushed(self):
+        """File offset up to which all data has been written to the file."""
+        return self.offset - self._fill
+
+    def write(self, buffers):
+        """Append buffers to the file. Data is staged until a full aligned block is available."""
+        for data in buffers:
+            # Bytes before the first aligned block go through the buffered descriptor
+            if self.offset < DIRECT_IO_ALIGN:
+                head = data[:DIRECT_IO_ALIGN - self.offset]
+                _pwrite_all(self._fd, head, self.offset)
+                self.offset += len(head)
+                data = data[len(head):]
+            while data:
+                count = min(len(data), len(self._view) - self._fill)
+                self._view[self._fill:self._fill + count] = data[:count]
+                self._fill += count
+                self.offset += count
+                data = data[count:]
+                if self._fill == len(self._view):
+                    self._flush()
+        self._flush()
+
+    def _flush(self):
+        """Write all complete aligned blocks in the staging buffer."""
+        aligned = self._fill - self._fill % DIRECT_IO_ALIGN
+        if aligned == 0:
+            return
+        start = self.offset - self._fill
+        _pwrite_all(self._direct_fd, self._view[:aligned], start)
+        remainder = self._fill - aligned
+        self._view[:remainder] = self._view[aligned:self._fill]
+        self._fill = remainder
+
+    def close(self):
+        """Write the unaligned remainder through the buffered descriptor and clean up."""
+        if self._fill:
+            _pwrite_all(self._fd, self._view[:self._fill], self.offset - self._fill)
+            self._fill = 0
+        self._view.release()
+        self._buffer.close()
+        os.close(self._direct_fd)
+
+
+class SERWriter:
+    """Writes frames to a SER file.
+
+    The header is memory-mapped and updated in place as frames are added, so the file is valid at
+    all times even if the program is killed before close() is called (only the timestamp trailer
+    would be missing). If no frames were written by the time the file is closed it is deleted.
+
+    Args:
+        filename: Path of the file to create. An existing file is overwritten.
+        width: Width of every image in pixels.
+        height: Height of every image in pixels.
+        color_id: How color information is encoded; one of the color ID constants in this module.
+        bit_depth: Number of bits per pixel per color plane (1-16).
+        observer: Name of the observer (up to 40 ASCII characters).
+        instrument: Name of the camera (up to 40 ASCII characters).
+        telescope: Name of the telescope (up to 40 ASCII characters).
+        add_trailer: Append the UTC timestamp of every frame to the end of the file on close.
+        direct_io: Write frame data with O_DIRECT, bypassing the OS page cache. This avoids
+            polluting the page cache with data that will not be read back and gives more
+            consistent write latency, at the cost of one copy into an aligned staging buffer.
+        preallocate_frames: Reserve disk space for this many frames up front with
+            posix_fallocate(). Unused space is released when the file is closed.
+    """
+
+    def __init__(
+            self,
+            filename,
+            width,
+            height,
+            color_id=BAYER_RGGB,
+            bit_depth=8,
+            observer='',
+            instrument='',
+            telescope='',
+            add_trailer=True,
+            direct_io=False,
+            preallocate_frames=0,
+        ):
+        self.filename = os.fspath(filename)
+        self.bytes_per_frame = bytes_per_frame(width, height, bit_depth, color_id)
+        self.add_trailer = add_trailer
+        self._utc_offset_ticks = utc_offset() * VB_DATE_TICKS_PER_SEC
+        self._timestamps = array.array('q')
+        self._direct = None
+        self._frame_count = 0
+
+        self._fd = os.open(self.filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            # Extend file to the length of the header and map that portion of the file into memory
+            os.ftruncate(self._fd, HEADER_SIZE)
+            self._mmap = mmap.mmap(self._fd, HEADER_SIZE)
+            self._header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self._mmap)
+            self._header['FileID'] = FILE_ID
+            self._header['ColorID'] = color_id
+            self._header['LittleEndian'] = int(bit_depth > 8 and sys.byteorder == 'little')
+            self._header['ImageWidth'] = width
+            self._header['ImageHeight'] = height
+            self._header['PixelDepthPerPlane'] = bit_depth
+            self._header['Observer'] = observer.encode('ascii')[:40]
+            self._header['Instrument'] = instrument.encode('ascii')[:40]
+            self._header['Telescope'] = telescope.encode('ascii')[:40]
+            utc = unix_to_ticks(time.time())
+            self._header['DateTime_UTC'] = utc
+            self._header['DateTime'] = utc + self._utc_offset_ticks
+
+            if preallocate_frames > 0:
+                os.posix_fallocate(
+                    self._fd,
+                    HEADER_SIZE,
+                    preallocate_frames * self.bytes_per_frame
+                )
+
+            os.lseek(self._fd, HEADER_SIZE, os.SEEK_SET)
+            if direct_io:
+                self._direct = _DirectWriter(self.filename, self._fd, HEADER_SIZE)
+        except BaseException:
+            os.close(self._fd)
+            os.remove(self.filename)
+            raise
+
+    @property
+    def frame_count(self):
+        """Number of frames written so far.
+
+        With direct_io, the last few frames may still be staged, and the FrameCount in the header
+        only counts the frames that have reached the file until it is closed.
+        """
+        return self._frame_count
+
+    @property
+    def closed(self):
+        """True once the file has been closed."""
+        return self._fd is None
+
+    @property
+    def header(self):
+        """The memory-mapped header, for setting fields such as DateTime_UTC directly."""
+        return self._header
+
+    def add_frame(self, image, timestamp=None):
+        """Append one frame to the file.
+
+        Args:
+            image: Numpy array (or any buffer) holding exactly one frame of data.
+            timestamp: Time the frame was captured in seconds since the Unix epoch. Defaults to
+                the current time.
+        """
+        self.add_frames([image], None if timestamp is None else [timestamp])
+
+    def add_frames(self, images, timestamps=None, ticks=None):
+        """Append several frames to the file using a single vectored write where possible.
+
+        Args:
+            images: Sequence of frames, or an array with the frames stacked along the first axis.
+            timestamps: Optional sequence of capture times in seconds since the Unix epoch, one per
+                frame. Defaults to the current time for all frames.
+            ticks: Optional sequence of SER timestamps (100 ns ticks since year 1), one per frame,
+                used instead of timestamps to copy timestamps from another file exactly.
+        """
+        if self._fd is None:
+            raise ValueError('I/O operation on closed SER file')
+
+        buffers = [_as_bytes(image) for image in images]
+        for buf in buffers:
+            if len(buf) != self.bytes_per_frame:
+                raise ValueError(
+                    f'frame size {len(buf)} bytes does not match expected size '
+                    f'{self.bytes_per_frame} bytes'
+                )
+        if not buffers:
+            return
+
+        if self.add_trailer:
+            if ticks is not None:
+                if len(ticks) != len(buffers):
+                    raise ValueError('number of timestamps does not match number of frames')
+                ticks = [int(t) for t in ticks]
+            elif timestamps is None:
+                ticks = [unix_to_ticks(time.time())] * len(buffers)
+            else:
+                if len(timestamps) != len(buffers):
+                    raise ValueError('number of timestamps does not match number of frames')
+                ticks = [unix_to_ticks(t) for t in timestamps]
+
+        if self._direct is not None:
+            self._direct.write(buffers)
+        else:
+            _write_all(self._fd, buffers)
+
+        # Only frames that were written successfully are counted, so that the file stays valid if
+        # a write fails, for example because the disk is full
+        if self.add_trailer:
+            self._timestamps.extend(ticks)
+        self._frame_count += len(buffers)
+        if self._direct is not None:
+            # Frames whose end is still in the staging buffer are not in the file yet
+            self._header['FrameCount'] = (
+                (self._direct.flushed - HEADER_SIZE) // self.bytes_per_frame
+            )
+        else:
+            self._header['FrameCount'] = self._frame_count
+
+    def close(self):
+        """Write the trailer and close the file, or delete it if no frames were written."""
+        if self._fd is None:
+            return
+
+        frame_count = self.frame_count
+        if self._direct is not None:
+            self._direct.close()
+            self._header['FrameCount'] = frame_count
+        end = HEADER_SIZE + frame_count * self.bytes_per_frame
+
+        if frame_count == 0:
+            logger.info('Deleting %s since no frames were written to it.', self.filename)
+            self._close_file()
+            try:
+                os.remove(self.filename)
+            except OSError as e:
+                logger.error('Unable to delete %s: %s', self.filename, e)
+            return
+
+        if self.add_trailer:
+            if frame_count != len(self._timestamps):
+                logger.error(
+                    'SERWriter frame count %d does not match number of timestamps %d',
+                    frame_count,
+                    len(self._timestamps)
+                )
+            _pwrite_all(self._fd, memoryview(self._timestamps).cast('B'), end)
+            end += len(self._timestamps) * self._timestamps.itemsize
+
+        # Release any space reserved by preallocation that was not used
+        os.ftruncate(self._fd, end)
+        self._close_file()
+
+    def _close_file(self):
+        del self._header
+        self._mmap.close()
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SERReader:
+    """Random access to the frames of a SER file through a read-only memory map.
+
+    Nothing is read from disk until a frame is accessed, so opening even a very large file is
+    immediate and uses almost no memory. Indexing the reader returns Numpy views directly into the
+    mapped file, shaped (height, width) for mono and Bayer data or (height, width, 3) for RGB and
+    BGR data:
+
+        with SERReader('capture.ser') as reader:
+            frame = reader[1000]
+            subset = reader[10:20]  # (10, height, width) view
+            for frame in reader:
+                ...
+
+    Views remain valid after the reader is closed; the mapping is released once the last view is
+    garbage collected.
+
+    Args:
+        filename: Path of the SER file.
+        little_endian: Byte order of 16-bit data. Defaults to the LittleEndian header field. Some
+            software writes this field with the opposite meaning, in which case it can be
+            overridden here.
+
+    Attributes:
+        header: Copy of the file header as a Numpy structured scalar (see HEADER_DTYPE).
+        width: Width of every image in pixels.
+        height: Height of every image in pixels.
+        color_id: How color information is encoded; one of the color ID constants in this module.
+        bit_depth: Number of bits per pixel per color plane.
+        dtype: Numpy dtype of the image data.
+        shape: Shape of each frame.
+        frame_count: Number of complete frames in the file.
+        timestamps: int64 array of per-frame UTC timestamps from the trailer (100 ns ticks since
+            year 1, see ticks_to_unix()), or None if the file has no trailer.
+    """
+
+    def __init__(self, filename, little_endian=None):
+        self.filename = os.fspath(filename)
+        with open(self.filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < HEADER_SIZE:
+                raise ValueError(f'{self.filename} is too small to be a SER file')
+            # The mapping stays valid once the file is closed
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = np.frombuffer(self._mmap, dtype=np.uint8)
+
+        self.header = np.frombuffer(self._data, dtype=HEADER_DTYPE, count=1)[0].copy()
+        if self.header['FileID'] != FILE_ID:
+            raise ValueError(f'{self.filename} is not a SER file')
+
+        self.width = int(self.header['ImageWidth'])
+        self.height = int(self.header['ImageHeight'])
+        self.color_id = int(self.header['ColorID'])
+        self.bit_depth = int(self.header['PixelDepthPerPlane'])
+
+        if little_endian is None:
+            little_endian = bool(self.header['LittleEndian'])
+        if self.bit_depth > 8:
+            self.dtype = np.dtype('<u2' if little_endian else '>u2')
+        else:
+            self.dtype = np.dtype(np.uint8)
+        if self.color_id in (RGB, BGR):
+            self.shape = (self.height, self.width, 3)
+        else:
+            self.shape = (self.height, self.width)
+        self.bytes_per_frame = bytes_per_frame(
+            self.width,
+            self.height,
+            self.bit_depth,
+            self.color_id
+        )
+
+        # The header may claim more frames than are actually present if the writer was killed
+        # while writing a frame.
+        data_size = len(self._data) - HEADER_SIZE
+        self.frame_count = min(int(self.header['FrameCount']), data_size // self.bytes_per_frame)
+        if self.frame_count < self.header['FrameCount']:
+            logger.warning(
+                '%s header says %d frames but only %d are complete',
+                self.filename,
+                self.header['FrameCount'],
+                self.frame_count
+            )
+
+        frames_end = HEADER_SIZE + self.frame_count * self.bytes_per_frame
+        self._frames = self._data[HEADER_SIZE:frames_end].view(self.dtype).reshape(
+            (self.frame_count,) + self.shape
+        )
+
+        trailer_size = self.frame_count * 8
+        if self.frame_count > 0 and len(self._data) - frames_end >= trailer_size:
+            self.timestamps = self._data[frames_end:frames_end + trailer_size].view('<i8')
+        else:
+            self.timestamps = None
+
+    @property
+    def frames(self):
+        """View of all frames as one array of shape (frame_count,) + shape."""
+        return self._frames
+
+    @property
+    def datetime_utc(self):
+        """Start time of the recording in seconds since the Unix epoch."""
+        return float(ticks_to_unix(self.header['DateTime_UTC']))
+
+    def advise(self, advice):
+        """Pass an access pattern hint such as mmap.MADV_RANDOM to the kernel for the mapping.
+
+        Returns:
+            True if the hint was applied, False if madvise() is not available on this platform.
+        """
+        if not hasattr(self._mmap, 'madvise'):
+            return False
+        self._mmap.madvise(advice)
+        return True
+
+    def __len__(self):
+        return self.frame_count
+
+    def __getitem__(self, index):
+        return self._frames[index]
+
+    def __iter__(self):
+        return iter(self._frames)
+
+    def close(self):
+        """Release this reader's reference to the memory map."""
+        self._frames = None
+        self.timestamps = None
+        self._data = None
+        # Frames handed out keep the mapping alive until they are released
+        self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,635 @@
+"""Shared memory frame bus for consumers in other processes.
+
+Threads cannot run CPU-bound Python consumers such as frame scoring, stacking or encoding in
+parallel, and sending frames to worker processes through a pipe or multiprocessing.Queue pickles
+and copies every frame. A FrameBus instead publishes frames into a ring of slots in a
+multiprocessing.shared_memory segment, and any number of processes on the same machine attach a
+FrameReader by name and read the frames as NumPy views of the shared memory, without copying:
+
+    # Capture process
+    with FrameBus(shape, dtype, slots=32) as bus:
+        start_workers(bus.name)
+        for frame in consumer:
+            with frame:
+                bus.publish(frame)
+
+    # Each worker process
+    with FrameReader(name, policy=BLOCK) as reader:
+        for frame in reader:
+            with frame:
+                process(frame.image)
+
+Like the frame pool of a VideoStream (and of the C++ capture program), a slot is not reused while
+a reader still holds the frame in it, but only for readers attached with the BLOCK policy, each of
+which records in the segment the sequence number of the oldest frame it has not released. The
+publisher waits for the slowest of them before overwriting a slot. Other readers never hold up the
+publisher: a DROP_OLDEST reader that falls more than a ring behind skips the frames that were
+overwritten and counts them as overruns, and a LATEST reader always skips to the newest frame.
+
+Every slot carries the sequence number of the frame in it, which the publisher clears before
+writing the slot and sets once the frame is complete. Readers check it when taking a frame and
+again when releasing it, so a frame overwritten while a non-blocking reader was using it is
+detected (SharedFrame.valid) rather than silently read torn.
+
+Waiting is done by polling, since the publisher and readers need not share a parent process that
+could hand out locks or conditions.
+"""
+
+import contextlib
+import fcntl
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+from asi import stream
+from asi.stream import BLOCK, DROP_OLDEST, LATEST
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'ASISHM01'
+VERSION = 1
+
+# Reader policies
+POLICIES = (BLOCK, DROP_OLDEST, LATEST)
+
+# Default number of slots in the ring
+DEFAULT_SLOTS = 16
+
+# Default maximum number of BLOCK readers attached at once
+MAX_READERS = 16
+
+# Interval in seconds between checks while waiting for a frame or for a slot to be released
+POLL_INTERVAL = 0.0005
+
+# Interval in seconds between checks for BLOCK readers whose process has exited, while the
+# publisher is waiting for them
+STALE_READER_INTERVAL = 1.0
+
+# Slots start at multiples of this many bytes, so that frames are aligned for SIMD loads
+ALIGNMENT = 64
+
+# Static description of the ring, followed by the counters updated by the publisher. The
+# counters are 8-byte aligned so that they are written and read in a single access.
+HEADER_DTYPE = np.dtype([
+    ('Magic', 'S8'),
+    ('Version', '<u4'),
+    ('Slots', '<u4'),
+    ('MaxReaders', '<u4'),
+    ('Ndim', '<u4'),
+    ('Shape', '<u8', (3,)),
+    ('Dtype', 'S8'),
+    ('SlotBytes', '<u8'),
+    ('DataOffset', '<u8'),
+    ('Published', '<u8'),
+    ('Closed', '<u8'),
+])
+
+# Per slot: Sequence is one more than the sequence number of the frame in the slot, or 0 while the
+# slot is being written
+SLOT_DTYPE = np.dtype([
+    ('Sequence', '<u8'),
+    ('Index', '<i8'),
+    ('Timestamp', '<f8'),
+])
+
+# Per BLOCK reader: Pid is 0 for a free entry, and Position is the sequence number of the oldest
+# frame the reader has not released
+READER_DTYPE = np.dtype([
+    ('Pid', '<i8'),
+    ('Position', '<u8'),
+])
+
+_SLOTS_OFFSET = 128
+
+_fence_lock = threading.Lock()
+_attach_lock = threading.Lock()
+
+
+def _fence():
+    """Memory barrier between the writes or reads of a frame and of its sequence number.
+
+    Stores to shared memory are not reordered on x86, but they can be on ARM. Acquiring and
+    releasing a lock implies a full barrier on every platform.
+    """
+    with _fence_lock:
+        pass
+
+
+def _align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def _lock_path(name):
+    return os.path.join(tempfile.gettempdir(), f'{name.lstrip("/")}.lock')
+
+
+@contextlib.contextmanager
+def _registration_lock(name):
+    """Serialize changes to the table of BLOCK readers between processes."""
+    with open(_lock_path(name), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _attach(name):
+    """Attach to an existing shared memory segment without taking ownership of it."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(  # pylint: disable=unexpected-keyword-arg
+            name, track=False
+        )
+    # Before Python 3.13, attaching registers the segment with the resource tracker of this
+    # process, which unlinks it when the process exits even though the publisher still uses it
+    # (https://github.com/python/cpython/issues/82300).
+    with _attach_lock:
+        register = shared_memory.resource_tracker.register
+        shared_memory.resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name)
+        finally:
+            shared_memory.resource_tracker.register = register
+
+
+def _pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Segment:
+    """Views of the header, tables and slots of a shared memory segment."""
+
+    def __init__(self, shm):
+        self.shm = shm
+        buf = shm.buf
+        self.header = np.ndarray((), HEADER_DTYPE, buffer=buf)
+        if self.header['Magic'].item() != MAGIC or self.header['Version'] != VERSION:
+            raise ValueError(f'Shared memory segment {shm.name} is not a FrameBus')
+        self.slot_count = int(self.header['Slots'])
+        self.shape = tuple(int(n) for n in self.header['Shape'][:self.header['Ndim']])
+        self.dtype = np.dtype(self.header['Dtype'].item().decode())
+        self.published = np.ndarray(
+            1, np.uint64, buffer=buf, offset=HEADER_DTYPE.fields['Published'][1]
+        )
+        self.closed = np.ndarray(1, np.uint64, buffer=buf, offset=HEADER_DTYPE.fields['Closed'][1])
+        self.slots = np.ndarray(self.slot_count, SLOT_DTYPE, buffer=buf, offset=_SLOTS_OFFSET)
+        self.sequence = self.slots['Sequence']
+        self.readers = np.ndarray(
+            int(self.header['MaxReaders']),
+            READER_DTYPE,
+            buffer=buf,
+            offset=_SLOTS_OFFSET + self.slots.nbytes,
+        )
+        slot_bytes = int(self.header['SlotBytes'])
+        data_offset = int(self.header['DataOffset'])
+        self.images = [
+            np.ndarray(self.shape, self.dtype, buffer=buf, offset=data_offset + i * slot_bytes)
+            for i in range(self.slot_count)
+        ]
+
+    @staticmethod
+    def layout(slots, max_readers, shape, dtype):
+        """Return (slot_bytes, data_offset, total size) of a segment."""
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        slot_bytes = _align(frame_bytes, ALIGNMENT)
+        tables = _SLOTS_OFFSET + slots * SLOT_DTYPE.itemsize + max_readers * READER_DTYPE.itemsize
+        data_offset = _align(tables, 4096)
+        return slot_bytes, data_offset, data_offset + slots * slot_bytes
+
+    def close(self):
+        """Unmap the segment, unless frames handed out are still referenced."""
+        self.header = self.published = self.closed = None
+        self.slots = self.sequence = self.readers = None
+        self.images = []
+        try:
+            self.shm.close()
+        except BufferError:
+            logger.warning(
+                'Shared memory %s is still in use by frames that were not released; it will be '
+                'unmapped when they are garbage collected',
+                self.shm.name,
+            )
+
+
+class FrameBus:
+    """Publishes frames of a fixed shape and dtype to FrameReaders in other processes.
+
+    The publisher owns the shared memory segment and removes it when closed. Publishing from more
+    than one thread at a time is not supported.
+
+    Args:
+        shape: Shape of every frame, e.g. (height, width).
+        dtype: NumPy dtype of every frame.
+        slots: Number of frames in the ring. A non-blocking reader can hold a frame for about
+            slots - 1 frame periods before it is overwritten.
+        name: Name of the shared memory segment, or None for a random unique name.
+        max_readers: Maximum number of BLOCK readers attached at once.
+
+    Attributes:
+        name: Name of the shared memory segment, given to FrameReader to attach.
+        published: Number of frames published.
+        dropped: Number of frames not published because a BLOCK reader did not release the
+            oldest slot within the timeout.
+    """
+
+    def __init__(self, shape, dtype, slots=DEFAULT_SLOTS, name=None, max_readers=MAX_READERS):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        if not 1 <= len(self.shape) <= 3:
+            raise ValueError(f'Frames must have 1 to 3 dimensions, not shape {self.shape}')
+        if slots < 2:
+            raise ValueError('slots must be at least 2')
+        self.slots = slots
+        self.max_readers = max_readers
+        slot_bytes, data_offset, size = _Segment.layout(slots, max_readers, self.shape, self.dtype)
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self._shm.name
+
+        header = np.ndarray((), HEADER_DTYPE, buffer=self._shm.buf)
+        header['Magic'] = MAGIC
+        header['Version'] = VERSION
+        header['Slots'] = slots
+        header['MaxReaders'] = max_readers
+        header['Ndim'] = len(self.shape)
+        header['Shape'][:len(self.shape)] = self.shape
+        header['Dtype'] = self.dtype.str.encode()
+        header['SlotBytes'] = slot_bytes
+        header['DataOffset'] = data_offset
+        del header
+        self._segment = _Segment(self._shm)
+        self._segment.slots.fill(0)
+        self._segment.readers.fill(0)
+
+        self.published = 0
+        self.dropped = 0
+        self._claimed = None
+        self._closed = False
+
+    def _wait_for_readers(self, sequence, timeout):
+        """Wait until every BLOCK reader has released the frame in the slot for a sequence number.
+
+        Returns:
+            False if the timeout expired first.
+        """
+        oldest = sequence - self.slots
+        if oldest < 0:
+            return True
+        readers = self._segment.readers
+        start = time.monotonic()
+        next_stale_check = start + STALE_READER_INTERVAL
+        while True:
+            _fence()
+            active = readers['Pid'] != 0
+            if not active.any() or readers['Position'][active].min() > oldest:
+                return True
+            now = time.monotonic()
+            if timeout is not None and now - start >= timeout:
+                return False
+            if now >= next_stale_check:
+                self._remove_stale_readers()
+                next_stale_check = now + STALE_READER_INTERVAL
+            time.sleep(POLL_INTERVAL)
+
+    def _remove_stale_readers(self):
+        """Detach BLOCK readers whose process exited without closing them."""
+        with _registration_lock(self.name):
+            for reader in self._segment.readers:
+                pid = int(reader['Pid'])
+                if pid and not _pid_exists(pid):
+                    logger.warning('Detaching reader of process %d, which no longer exists', pid)
+                    reader['Pid'] = 0
+
+    def claim(self, timeout=None):
+        """Take the next slot to be filled in place, for example by ASIGetVideoDataInto().
+
+        Every claim must be followed by commit() before the next claim.
+
+        Args:
+            timeout: Maximum time in seconds to wait for BLOCK readers to release the slot, or
+                None to wait indefinitely.
+
+        Returns:
+            Writable array of the frame shape and dtype in shared memory, or None if the timeout
+            expired. Its .reshape(-1).view(np.uint8) is a flat byte buffer of the slot.
+        """
+        if self._closed:
+            raise RuntimeError('FrameBus is closed')
+        if self._claimed is not None:
+            raise RuntimeError('The previously claimed slot was not committed')
+        sequence = self.published
+        if not self._wait_for_readers(sequence, timeout):
+            self.dropped += 1
+            return None
+        slot = sequence % self.slots
+        self._segment.sequence[slot] = 0
+        _fence()
+        self._claimed = sequence
+        return self._segment.images[slot]
+
+    def commit(self, timestamp=None, index=None):
+        """Publish the frame written into the slot returned by claim().
+
+        Args:
+            timestamp: Time the frame was captured in seconds since the epoch. Defaults to now.
+            index: Frame number recorded with the frame. Defaults to its sequence number on the
+                bus.
+        """
+        sequence = self._claimed
+        if sequence is None:
+            raise RuntimeError('No slot was claimed')
+        slot = sequence % self.slots
+        self._segment.slots['Index'][slot] = sequence if index is None else index
+        self._segment.slots['Timestamp'][slot] = time.time() if timestamp is None else timestamp
+        _fence()
+        self._segment.sequence[slot] = sequence + 1
+        self._segment.published[0] = sequence + 1
+        self._claimed = None
+        self.published = sequence + 1
+
+    def publish(self, image, timestamp=None, index=None, timeout=None):
+        """Copy a frame into the next slot and publish it.
+
+        Args:
+            image: Array of the frame shape and dtype, or a stream.Frame.
+            timestamp: Time the frame was captured. Defaults to the timestamp of a stream.Frame
+                or else the current time.
+            index: Frame number recorded with the frame. Defaults to the index of a stream.Frame
+                or else the sequence number on the bus.
+            timeout: Maximum time in seconds to wait for BLOCK readers, or None to wait
+                indefinitely.
+
+        Returns:
+            True if the frame was published, False if it was dropped.
+        """
+        if isinstance(image, stream.Frame):
+            timestamp = image.timestamp if timestamp is None else timestamp
+            index = image.index if index is None else index
+            image = image.image
+        if image.shape != self.shape or image.dtype != self.dtype:
+            raise ValueError(
+                f'Frame of shape {image.shape} and dtype {image.dtype} does not match '
+                f'{self.shape} {self.dtype}'
+            )
+        buffer = self.claim(timeout)
+        if buffer is None:
+            return False
+        np.copyto(buffer, image)
+        self.commit(timestamp, index)
+        return True
+
+    def close(self):
+        """Tell readers that no more frames will be published and remove the segment.
+
+        Readers still attached keep their mapping of the segment, and can read the frames that
+        were published until they are overwritten, which they no longer can be.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._segment.closed[0] = 1
+        self._segment.close()
+        self._shm.unlink()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(_lock_path(self.name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self):
+        """Return a dict of statistics of the bus and its BLOCK readers."""
+        readers = []
+        if not self._closed:
+            for reader in self._segment.readers:
+                if reader['Pid']:
+                    readers.append({
+                        'pid': int(reader['Pid']),
+                        'lag': self.published - int(reader['Position']),
+                    })
+        return {
+            'published': self.published,
+            'dropped': self.dropped,
+            'readers': readers,
+        }
+
+
+class SharedFrame:
+    """A frame read from a FrameBus.
+
+    Readers must release each frame they receive, either by calling release() or by using the
+    frame as a context manager. For a BLOCK reader, frames must be released in the order they were
+    received.
+
+    Attributes:
+        image: Read-only view of the frame in shared memory. It must not be used after the frame
+            is released.
+        sequence: Sequence number of the frame on the bus, starting at 0.
+        index: Frame number given by the publisher.
+        timestamp: Time the frame was captured, in seconds since the epoch.
+    """
+
+    def __init__(self, reader, sequence, slot, image, index, timestamp):
+        self.image = image
+        self.sequence = sequence
+        self.index = index
+        self.timestamp = timestamp
+        self._reader = reader
+        self._slot = slot
+        self._released = False
+
+    @property
+    def valid(self):
+        """False if the slot of this frame was overwritten since the frame was read.
+
+        Only frames of DROP_OLDEST and LATEST readers can be overwritten. Check this after
+        processing a frame to discard results computed from a partially overwritten image.
+        """
+        _fence()
+        return self._reader.sequence_in_slot(self._slot) == self.sequence + 1
+
+    def release(self):
+        """Release the frame.
+
+        Returns:
+            True if the frame was still valid when released.
+        """
+        if self._released:
+            raise RuntimeError('Frame was already released')
+        self._released = True
+        return self._reader.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class FrameReader:
+    """Reads the frames published on a FrameBus, usually in another process.
+
+    Args:
+        name: Name of the FrameBus.
+        policy: BLOCK to receive every frame, making the publisher wait when this reader falls a
+            whole ring behind. DROP_OLDEST to receive every frame that is still in the ring,
+            skipping the oldest frames if this reader falls behind. LATEST to always receive the
+            most recent frame.
+
+    Attributes:
+        shape: Shape of the frames.
+        dtype: dtype of the frames.
+        frames_read: Number of frames received.
+        overruns: Number of frames lost because they were overwritten before or while this reader
+            used them. Always 0 for BLOCK readers.
+        skipped: Number of frames passed over by a LATEST reader to get to the newest frame.
+    """
+
+    def __init__(self, name, policy=DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError(f'policy must be one of {POLICIES}, got {policy!r}')
+        self.name = name
+        self.policy = policy
+        self._shm = _attach(name)
+        try:
+            self._segment = _Segment(self._shm)
+        except ValueError:
+            self._shm.close()
+            raise
+        self.shape = self._segment.shape
+        self.dtype = self._segment.dtype
+        self.slots = self._segment.slot_count
+        self.frames_read = 0
+        self.overruns = 0
+        self.skipped = 0
+        self._entry = None
+        self._closed = False
+        # Readers start with the next frame published after they attach
+        self._position = int(self._segment.published[0])
+        if policy == BLOCK:
+            self._register()
+
+    def _register(self):
+        with _registration_lock(self.name):
+            free = np.flatnonzero(self._segment.readers['Pid'] == 0)
+            if not len(free):
+                self.close()
+                raise RuntimeError(f'FrameBus {self.name} has no room for another BLOCK reader')
+            self._entry = self._segment.readers[free[0]]
+            self._position = int(self._segment.published[0])
+            self._entry['Position'] = self._position
+            _fence()
+            self._entry['Pid'] = os.getpid()
+
+    def sequence_in_slot(self, slot):
+        """Return one more than the sequence number of the frame in a slot, or 0 if none."""
+        return int(self._segment.sequence[slot])
+
+    def get(self, timeout=None):
+        """Get the next frame.
+
+        Args:
+            timeout: Maximum time to wait for a frame in seconds, or None to wait indefinitely.
+
+        Returns:
+            A SharedFrame, or None if the timeout expired or the bus was closed and every frame
+            published was received.
+        """
+        if self._closed:
+            raise RuntimeError('FrameReader is closed')
+        segment = self._segment
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            published = int(segment.published[0])
+            if published <= self._position:
+                if segment.closed[0]:
+                    return None
+                if deadline is not None and time.monotonic() >= deadline:
+                    return None
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            if self.policy == LATEST and published - 1 > self._position:
+                self.skipped += published - 1 - self._position
+                self._position = published - 1
+            elif self.policy == DROP_OLDEST:
+                # The slot after the newest frame may be being overwritten
+                oldest = published - (self.slots - 1)
+                if self._position < oldest:
+                    self.overruns += oldest - self._position
+                    self._position = oldest
+
+            _fence()
+            sequence = self._position
+            slot = sequence % self.slots
+            index = int(segment.slots['Index'][slot])
+            timestamp = float(segment.slots['Timestamp'][slot])
+            _fence()
+            if segment.sequence[slot] != sequence + 1:
+                # Overwritten since published was read; start over from the new position
+                continue
+            self._position += 1
+            self.frames_read += 1
+            image = segment.images[slot].view()
+            image.flags.writeable = False
+            return SharedFrame(self, sequence, slot, image, index, timestamp)
+
+    def release(self, frame):
+        """Release a frame. Called by SharedFrame.release()."""
+        valid = self._closed or frame.valid
+        if not valid:
+            self.overruns += 1
+        if self._entry is not None:
+            self._entry['Position'] = max(int(self._entry['Position']), frame.sequence + 1)
+        return valid
+
+    def __iter__(self):
+        """Yield frames until the bus is closed and every frame published was received."""
+        while True:
+            frame = self.get()
+            if frame is None:
+                return
+            yield frame
+
+    def close(self):
+        """Detach from the bus. Frames received must not be used afterwards."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._entry is not None:
+            if self._segment.closed[0]:
+                # The publisher is gone, along with the lock file
+                self._entry['Pid'] = 0
+            else:
+                with _registration_lock(self.name):
+                    self._entry['Pid'] = 0
+            self._entry = None
+        self._segment.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self):
+        """Return a dict of statistics of this reader."""
+        return {
+            'policy': self.policy,
+            'frames_read': self.frames_read,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+        }
@@ -0,0 +1,968 @@
+"""Simulated ASI cameras implementing the same Python API as the SWIG-wrapped SDK.
+
+This module provides the functions, constants and structures of asi.sdk for cameras that exist
+only in software, so capture pipelines can be developed, tested and benchmarked at realistic frame
+rates without a camera or even the ZWO library installed. It is selected in place of asi.sdk when
+the asi package is first imported with the environment variable ASI_BACKEND set to sim:
+
+    $ ASI_BACKEND=sim python3 video_preview.py
+
+It can also be passed directly as the backend of components that accept one, such as
+asi.stream.VideoStream(camera_id, backend=asi.sim).
+
+By default a single camera resembling an ASI178MC is connected. The set of connected cameras can
+be replaced with set_cameras():
+
+    sim.set_cameras(sim.SimulatedCamera(width=640, height=480, bit_depth=12, bayer_pattern=None))
+
+Simulated cameras model the parts of a real camera that matter for throughput and robustness:
+
+* Frames are produced on a fixed schedule set by the exposure time and a USB bandwidth limit, and
+  only become available after a readout latency.
+* The camera buffers only a few frames. Frames not read in time are lost and counted by
+  ASIGetDroppedFrames(), like on the real hardware.
+* Random frame drops and timeouts can be injected.
+* A camera can be unplugged, after which calls for it fail with ASI_ERROR_CAMERA_REMOVED until it
+  is plugged back in, or hung, so that video reads time out and exposures never complete until it
+  is closed (see asi.watchdog).
+* Frames can carry the sync words and 16-bit frame counter of raw ASI178 frames (see
+  asi.integrity).
+
+Image content is a synthetic scene with noise whose brightness follows the exposure time and gain,
+so auto gain control converges as it would on a real camera. Rendered frames are cached per
+camera setting, so in steady state delivering a frame costs a single memory copy.
+"""
+
+import random
+import threading
+import time
+import numpy as np
+
+
+# Enumerations from ASICamera2.h
+
+ASI_BAYER_RG = 0
+ASI_BAYER_BG = 1
+ASI_BAYER_GR = 2
+ASI_BAYER_GB = 3
+
+ASI_IMG_RAW8 = 0
+ASI_IMG_RGB24 = 1
+ASI_IMG_RAW16 = 2
+ASI_IMG_Y8 = 3
+ASI_IMG_END = -1
+
+ASI_GUIDE_NORTH = 0
+ASI_GUIDE_SOUTH = 1
+ASI_GUIDE_EAST = 2
+ASI_GUIDE_WEST = 3
+
+ASI_FLIP_NONE = 0
+ASI_FLIP_HORIZ = 1
+ASI_FLIP_VERT = 2
+ASI_FLIP_BOTH = 3
+
+ASI_MODE_NORMAL = 0
+ASI_MODE_TRIG_SOFT_EDGE = 1
+ASI_MODE_TRIG_RISE_EDGE = 2
+ASI_MODE_TRIG_FALL_EDGE = 3
+ASI_MODE_TRIG_SOFT_LEVEL = 4
+ASI_MODE_TRIG_HIGH_LEVEL = 5
+ASI_MODE_TRIG_LOW_LEVEL = 6
+ASI_MODE_END = -1
+
+ASI_SUCCESS = 0
+ASI_ERROR_INVALID_INDEX = 1
+ASI_ERROR_INVALID_ID = 2
+ASI_ERROR_INVALID_CONTROL_TYPE = 3
+ASI_ERROR_CAMERA_CLOSED = 4
+ASI_ERROR_CAMERA_REMOVED = 5
+ASI_ERROR_INVALID_PATH = 6
+ASI_ERROR_INVALID_FILEFORMAT = 7
+ASI_ERROR_INVALID_SIZE = 8
+ASI_ERROR_INVALID_IMGTYPE = 9
+ASI_ERROR_OUTOF_BOUNDARY = 10
+ASI_ERROR_TIMEOUT = 11
+ASI_ERROR_INVALID_SEQUENCE = 12
+ASI_ERROR_BUFFER_TOO_SMALL = 13
+ASI_ERROR_VIDEO_MODE_ACTIVE = 14
+ASI_ERROR_EXPOSURE_IN_PROGRESS = 15
+ASI_ERROR_GENERAL_ERROR = 16
+ASI_ERROR_INVALID_MODE = 17
+ASI_ERROR_END = 18
+
+ASI_FALSE = 0
+ASI_TRUE = 1
+
+ASI_GAIN = 0
+ASI_EXPOSURE = 1
+ASI_GAMMA = 2
+ASI_WB_R = 3
+ASI_WB_B = 4
+ASI_OFFSET = 5
+ASI_BANDWIDTHOVERLOAD = 6
+ASI_OVERCLOCK = 7
+ASI_TEMPERATURE = 8
+ASI_FLIP = 9
+ASI_AUTO_MAX_GAIN = 10
+ASI_AUTO_MAX_EXP = 11
+ASI_AUTO_TARGET_BRIGHTNESS = 12
+ASI_HARDWARE_BIN = 13
+ASI_HIGH_SPEED_MODE = 14
+ASI_COOLER_POWER_PERC = 15
+ASI_TARGET_TEMP = 16
+ASI_COOLER_ON = 17
+ASI_MONO_BIN = 18
+ASI_FAN_ON = 19
+ASI_PATTERN_ADJUST = 20
+ASI_ANTI_DEW_HEATER = 21
+ASI_BRIGHTNESS = ASI_OFFSET
+ASI_AUTO_MAX_BRIGHTNESS = ASI_AUTO_TARGET_BRIGHTNESS
+
+ASI_EXP_IDLE = 0
+ASI_EXP_WORKING = 1
+ASI_EXP_SUCCESS = 2
+ASI_EXP_FAILED = 3
+
+# Sync words and frame counter placement of raw ASI178 frames, see asi.integrity
+SYNC_START = 0x7e5a
+SYNC_END = 0xf03c
+
+# Exposure time and gain at which the brightest part of the simulated scene is at half scale. These
+# are the default control values.
+REFERENCE_EXPOSURE_US = 10_000
+REFERENCE_GAIN = 200
+
+# ASI_BANDWIDTHOVERLOAD value at which the USB bandwidth of a simulated camera is as configured.
+# This is the default value of the control.
+REFERENCE_BANDWIDTH_OVERLOAD = 50
+
+# Number of frames with independent noise generated for each camera setting
+NOISE_VARIANTS = 2
+
+
+class ASIError(Exception):
+    """Raised by ASICheck() when the status code returned by an API call is not ASI_SUCCESS"""
+
+
+def ASICheck(return_values):
+    """Check status return code from API calls for errors. Same as asi.sdk.ASICheck()."""
+    if isinstance(return_values, (tuple, list)):
+        status_code = return_values[0]
+        return_values = return_values[1:] if len(return_values) > 2 else return_values[1]
+    else:
+        status_code = return_values
+        return_values = None
+
+    if status_code != ASI_SUCCESS:
+        raise ASIError('ASI return code: {}'.format(status_code))
+
+    return return_values
+
+
+class ASI_CAMERA_INFO:
+    """Camera properties, with the same fields as the struct wrapped by asi.sdk."""
+
+    def __init__(self):
+        self.Name = ''
+        self.CameraID = 0
+        self.MaxHeight = 0
+        self.MaxWidth = 0
+        self.IsColorCam = ASI_FALSE
+        self.BayerPattern = ASI_BAYER_RG
+        self.SupportedBins = [0] * 16
+        self.SupportedVideoFormat = [ASI_IMG_END] * 8
+        self.PixelSize = 0.0
+        self.MechanicalShutter = ASI_FALSE
+        self.ST4Port = ASI_FALSE
+        self.IsCoolerCam = ASI_FALSE
+        self.IsUSB3Host = ASI_FALSE
+        self.IsUSB3Camera = ASI_FALSE
+        self.ElecPerADU = 0.0
+        self.BitDepth = 0
+        self.IsTriggerCam = ASI_FALSE
+
+    def get_supported_bins(self, index):
+        return self.SupportedBins[index]
+
+    def get_supported_video_format(self, index):
+        return self.SupportedVideoFormat[index]
+
+
+class ASI_CONTROL_CAPS:
+    """Control properties, with the same fields as the struct wrapped by asi.sdk."""
+
+    def __init__(
+            self,
+            Name='',
+            Description='',
+            MaxValue=0,
+            MinValue=0,
+            DefaultValue=0,
+            IsAutoSupported=ASI_FALSE,
+            IsWritable=ASI_TRUE,
+            ControlType=ASI_GAIN,
+        ):
+        self.Name = Name
+        self.Description = Description
+        self.MaxValue = MaxValue
+        self.MinValue = MinValue
+        self.DefaultValue = DefaultValue
+        self.IsAutoSupported = IsAutoSupported
+        self.IsWritable = IsWritable
+        self.ControlType = ControlType
+
+
+class SimulatedCamera:
+    """Configuration and state of one simulated camera.
+
+    Args:
+        name: Camera name reported in ASI_CAMERA_INFO.
+        width: Sensor width in pixels.
+        height: Sensor height in pixels.
+        bit_depth: ADC bit depth. RAW16 frames have the unused low bits set to zero.
+        bayer_pattern: One of the ASI_BAYER_* constants for a color camera, or None for a mono
+            camera.
+        bandwidth: USB bandwidth in bytes per second at the default ASI_BANDWIDTHOVERLOAD, to
+            which it is proportional. Together with the exposure time this sets the frame rate.
+            The default gives 60 frames per second for full size RAW8 frames.
+        host_bandwidth: Data rate in bytes per second that the host USB controller can sustain, or
+            None if unlimited. Frames sent faster than this are lost in proportion to the excess
+            and counted as dropped, so raising ASI_BANDWIDTHOVERLOAD eventually costs frames.
+        readout_latency: Time in seconds between the end of a frame and it becoming available.
+        buffer_frames: Number of completed frames the camera holds. Frames not read before they
+            are overwritten are counted as dropped.
+        drop_rate: Probability that a frame is lost in transfer and counted as dropped.
+        timeout_rate: Probability that a call to ASIGetVideoData() times out even though a frame
+            is available.
+        sync_words: If True, frames carry the start and end sync words and the frame counter of
+            raw ASI178 frames in their first four and last two bytes.
+        seed: Seed for the random number generators used for noise and injected faults.
+        product_id: USB product ID reported by ASIGetProductIDs().
+        serial: Serial number reported by ASIGetSerialNumber() as a string of 16 hexadecimal
+            digits, or None for a camera without one.
+        trigger_modes: ASI_MODE_TRIG_* camera modes supported in addition to ASI_MODE_NORMAL by
+            a camera with a trigger input, or None for a camera without one. The mode can only be
+            read and set with ASIGetCameraMode() and ASISetCameraMode() if this is given.
+
+    Attributes:
+        connected: False while the camera is unplugged. It is then left out of the enumeration and
+            calls for it fail with ASI_ERROR_CAMERA_REMOVED, even once it is plugged back in until
+            it has been closed and opened again.
+        hung: True while the camera is wedged: video reads time out and exposures stay in
+            progress. Closing the camera clears it.
+    """
+
+    def __init__(
+            self,
+            name='ZWO ASI178MC (simulated)',
+            width=3096,
+            height=2080,
+            bit_depth=14,
+            bayer_pattern=ASI_BAYER_RG,
+            bandwidth=3096 * 2080 * 60,
+            readout_latency=0.002,
+            buffer_frames=2,
+            drop_rate=0.0,
+            timeout_rate=0.0,
+            sync_words=False,
+            seed=None,
+            product_id=0x178,
+            host_bandwidth=None,
+            serial=None,
+            trigger_modes=None,
+        ):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.bit_depth = bit_depth
+        self.bayer_pattern = bayer_pattern
+        self.bandwidth = bandwidth
+        self.readout_latency = readout_latency
+        self.buffer_frames = buffer_frames
+        self.drop_rate = drop_rate
+        self.timeout_rate = timeout_rate
+        self.sync_words = sync_words
+        self.product_id = product_id
+        self.host_bandwidth = host_bandwidth
+        self.serial = serial
+        self.trigger_modes = None if trigger_modes is None else tuple(trigger_modes)
+        self.connected = True
+        self.removed = False
+        self.lock = threading.RLock()
+        self._random = random.Random(seed)
+        self._rng = np.random.default_rng(seed)
+
+        self.controls = [
+            ASI_CONTROL_CAPS('Gain', 'Gain', 510, 0, REFERENCE_GAIN, ASI_TRUE, ASI_TRUE, ASI_GAIN),
+            ASI_CONTROL_CAPS(
+                'Exposure',
+                'Exposure Time(us)',
+                2_000_000_000,
+                32,
+                REFERENCE_EXPOSURE_US,
+                ASI_TRUE,
+                ASI_TRUE,
+                ASI_EXPOSURE,
+            ),
+            ASI_CONTROL_CAPS('Offset', 'offset', 600, 0, 10, ASI_FALSE, ASI_TRUE, ASI_OFFSET),
+            ASI_CONTROL_CAPS(
+                'BandWidth',
+                'The total data transfer rate percentage',
+                100,
+                40,
+                REFERENCE_BANDWIDTH_OVERLOAD,
+                ASI_TRUE,
+                ASI_TRUE,
+                ASI_BANDWIDTHOVERLOAD,
+            ),
+            ASI_CONTROL_CAPS('Flip', 'Flip: 0->None 1->Horiz 2->Vert 3->Both', 3, 0, 0,
+                             ASI_FALSE, ASI_TRUE, ASI_FLIP),
+            ASI_CONTROL_CAPS('HighSpeedMode', 'Is high speed mode:0->No 1->Yes', 1, 0, 0,
+                             ASI_FALSE, ASI_TRUE, ASI_HIGH_SPEED_MODE),
+            ASI_CONTROL_CAPS('Temperature', 'Sensor temperature(degrees Celsius)', 1000, -500,
+                             20, ASI_FALSE, ASI_FALSE, ASI_TEMPERATURE),
+        ]
+        if bayer_pattern is not None:
+            self.controls += [
+                ASI_CONTROL_CAPS('WB_R', 'White balance: Red component', 99, 1, 52, ASI_TRUE,
+                                 ASI_TRUE, ASI_WB_R),
+                ASI_CONTROL_CAPS('WB_B', 'White balance: Blue component', 99, 1, 95, ASI_TRUE,
+                                 ASI_TRUE, ASI_WB_B),
+            ]
+        self.reset()
+
+    def reset(self):
+        """Return the camera to its power-on state."""
+        with self.lock:
+            self.opened = False
+            self.initialized = False
+            self.removed = False
+            self.hung = False
+            self.values = {caps.ControlType: caps.DefaultValue for caps in self.controls}
+            self.values[ASI_TEMPERATURE] = 200  # 20.0 degrees C, in units of 0.1 degree
+            self.auto = {caps.ControlType: ASI_FALSE for caps in self.controls}
+            self.roi = (self.width, self.height, 1, ASI_IMG_RAW8)
+            self.start_pos = (0, 0)
+            self.mode = ASI_MODE_NORMAL
+            self.capturing = False
+            self.dropped_frames = 0
+            self.frame_counter = 0
+            self.exposure_status = ASI_EXP_IDLE
+            self._exposure_end = 0.0
+            self._next_frame_time = 0.0
+            self._scene_key = None
+            self._scene = None
+            self._frame_key = None
+            self._frames = None
+            self._variant = 0
+
+    @property
+    def info(self):
+        """ASI_CAMERA_INFO describing this camera."""
+        info = ASI_CAMERA_INFO()
+        info.Name = self.name
+        info.MaxWidth = self.width
+        info.MaxHeight = self.height
+        info.IsColorCam = ASI_FALSE if self.bayer_pattern is None else ASI_TRUE
+        info.BayerPattern = ASI_BAYER_RG if self.bayer_pattern is None else self.bayer_pattern
+        info.SupportedBins[:4] = [1, 2, 3, 4]
+        formats = [ASI_IMG_RAW8, ASI_IMG_RAW16, ASI_IMG_Y8]
+        if self.bayer_pattern is not None:
+            formats.insert(1, ASI_IMG_RGB24)
+        info.SupportedVideoFormat[:len(formats)] = formats
+        info.PixelSize = 2.4
+        info.ST4Port = ASI_TRUE
+        info.IsUSB3Host = ASI_TRUE
+        info.IsUSB3Camera = ASI_TRUE
+        info.ElecPerADU = 0.25
+        info.BitDepth = self.bit_depth
+        info.IsTriggerCam = ASI_FALSE if self.trigger_modes is None else ASI_TRUE
+        return info
+
+    @property
+    def image_size_bytes(self):
+        """Number of bytes in one image given the current ROI format."""
+        width, height, _, img_type = self.roi
+        return width * height * {ASI_IMG_RAW16: 2, ASI_IMG_RGB24: 3}.get(img_type, 1)
+
+    @property
+    def link_rate(self):
+        """USB data rate in bytes per second given the current ASI_BANDWIDTHOVERLOAD."""
+        return (self.bandwidth * self.values[ASI_BANDWIDTHOVERLOAD]
+                / REFERENCE_BANDWIDTH_OVERLOAD)
+
+    @property
+    def frame_period(self):
+        """Time in seconds between frames in video mode."""
+        return max(self.values[ASI_EXPOSURE] / 1e6, self.image_size_bytes / self.link_rate)
+
+    @property
+    def transfer_loss(self):
+        """Probability that a frame is lost because the host cannot keep up with the data rate."""
+        if self.host_bandwidth is None:
+            return 0.0
+        data_rate = self.image_size_bytes / self.frame_period
+        return max(0.0, 1.0 - self.host_bandwidth / data_rate)
+
+    def _render_scene(self):
+        """Return the noise-free scene for the current ROI as float32, 0.5 at the brightest."""
+        width, height, binning, _ = self.roi
+        start_x, start_y = self.start_pos
+        key = (width, height, binning, start_x, start_y)
+        if key == self._scene_key:
+            return self._scene
+
+        # A planet-like disc on a faint sky gradient, centered on the sensor
+        y = (start_y + np.arange(height, dtype=np.float32) * binning)[:, np.newaxis]
+        x = (start_x + np.arange(width, dtype=np.float32) * binning)[np.newaxis, :]
+        radius = min(self.width, self.height) / 6
+        r2 = ((x - self.width / 2) ** 2 + (y - self.height / 2) ** 2) / radius ** 2
+        scene = 0.02 + 0.01 * y / self.height + 0.47 / (1.0 + r2 ** 4)
+
+        if self.bayer_pattern is not None and binning == 1:
+            # Dim green and blue relative to red so the color channels can be told apart after
+            # debayering
+            red_row, red_col = {
+                ASI_BAYER_RG: (0, 0),
+                ASI_BAYER_BG: (1, 1),
+                ASI_BAYER_GR: (0, 1),
+                ASI_BAYER_GB: (1, 0),
+            }[self.bayer_pattern]
+            red_row = (red_row + start_y) % 2
+            red_col = (red_col + start_x) % 2
+            scene[1 - red_row::2, red_col::2] *= 0.8
+            scene[red_row::2, 1 - red_col::2] *= 0.8
+            scene[1 - red_row::2, 1 - red_col::2] *= 0.6
+
+        self._scene_key = key
+        self._scene = scene.astype(np.float32)
+        return self._scene
+
+    def _render_frames(self):
+        """Return the list of rendered frames for the current settings as uint8 arrays."""
+        key = (
+            self.roi,
+            self.start_pos,
+            self.values[ASI_EXPOSURE],
+            self.values[ASI_GAIN],
+            self.values[ASI_FLIP],
+        )
+        if key == self._frame_key:
+            return self._frames
+
+        img_type = self.roi[3]
+        scale = (self.values[ASI_EXPOSURE] / REFERENCE_EXPOSURE_US
+                 * 10 ** ((self.values[ASI_GAIN] - REFERENCE_GAIN) / 200))
+        scene = self._render_scene() * scale
+        full_scale = (1 << self.bit_depth) - 1
+        frames = []
+        for _ in range(NOISE_VARIANTS):
+            noisy = scene + self._rng.standard_normal(scene.shape, dtype=np.float32) * 0.005
+            codes = np.clip(noisy * full_scale, 0, full_scale).astype(np.uint16)
+            flip = self.values[ASI_FLIP]
+            if flip & ASI_FLIP_HORIZ:
+                codes = codes[:, ::-1]
+            if flip & ASI_FLIP_VERT:
+                codes = codes[::-1]
+            if img_type == ASI_IMG_RAW16:
+                image = codes << (16 - self.bit_depth)
+            else:
+                image = (codes >> (self.bit_depth - 8)).astype(np.uint8)
+                if img_type == ASI_IMG_RGB24:
+                    image = np.repeat(image[:, :, np.newaxis], 3, axis=2)
+            frames.append(np.ascontiguousarray(image).reshape(-1).view(np.uint8))
+
+        self._frame_key = key
+        self._frames = frames
+        return frames
+
+    def fill(self, out):
+        """Write the next frame into a uint8 array of image_size_bytes bytes."""
+        frames = self._render_frames()
+        self._variant = (self._variant + 1) % len(frames)
+        np.copyto(out, frames[self._variant])
+        if self.sync_words:
+            out[0] = SYNC_START >> 8
+            out[1] = SYNC_START & 0xff
+            out[2] = self.frame_counter & 0xff
+            out[3] = (self.frame_counter >> 8) & 0xff
+            out[-2] = SYNC_END >> 8
+            out[-1] = SYNC_END & 0xff
+        self.frame_counter = (self.frame_counter + 1) & 0xffff
+
+    def start_video(self):
+        """Start producing frames."""
+        # Render up front so the first frames are not lost to rendering time
+        self._render_frames()
+        self.capturing = True
+        self._next_frame_time = time.monotonic() + self.frame_period
+
+    def start_exposure(self):
+        """Start a single exposure."""
+        self.exposure_status = ASI_EXP_WORKING
+        self._exposure_end = (
+            time.monotonic()
+            + self.values[ASI_EXPOSURE] / 1e6
+            + self.image_size_bytes / self.bandwidth
+            + self.readout_latency
+        )
+
+    def update_exposure_status(self):
+        """Update and return the status of a single exposure."""
+        if (self.exposure_status == ASI_EXP_WORKING and not self.hung
+                and time.monotonic() >= self._exposure_end):
+            self.exposure_status = ASI_EXP_SUCCESS
+        return self.exposure_status
+
+    def wait_for_frame(self, wait_ms):
+        """Wait until a video frame is ready and account for frames lost in the meantime.
+
+        Returns:
+            ASI_SUCCESS if a frame is ready, ASI_ERROR_TIMEOUT if not.
+        """
+        deadline = None if wait_ms < 0 else time.monotonic() + wait_ms / 1000
+        if self.hung:
+            self.sleep_until(deadline)
+            return ASI_ERROR_TIMEOUT
+        while True:
+            period = self.frame_period
+            now = time.monotonic()
+
+            # Frames completed beyond what the camera can buffer have been overwritten
+            completed = int((now - self._next_frame_time) / period) + 1 if (
+                now >= self._next_frame_time) else 0
+            if completed > self.buffer_frames:
+                lost = completed - self.buffer_frames
+                self.dropped_frames += lost
+                self.frame_counter = (self.frame_counter + lost) & 0xffff
+                self._next_frame_time += lost * period
+
+            if self.timeout_rate and self._random.random() < self.timeout_rate:
+                self.sleep_until(deadline)
+                return ASI_ERROR_TIMEOUT
+
+            ready = self._next_frame_time + self.readout_latency
+            if deadline is not None and ready > deadline:
+                self.sleep_until(deadline)
+                return ASI_ERROR_TIMEOUT
+            self.sleep_until(ready)
+            self._next_frame_time += period
+
+            loss = 1.0 - (1.0 - self.drop_rate) * (1.0 - self.transfer_loss)
+            if loss and self._random.random() < loss:
+                self.dropped_frames += 1
+                self.frame_counter = (self.frame_counter + 1) & 0xffff
+                continue
+            return ASI_SUCCESS
+
+    @staticmethod
+    def sleep_until(deadline):
+        """Sleep until a time.monotonic() deadline, or return immediately if it is None."""
+        if deadline is not None:
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+_cameras = [SimulatedCamera()]
+
+
+def set_cameras(*cameras):
+    """Replace the set of connected simulated cameras. Camera IDs are assigned in order from 0."""
+    _cameras[:] = cameras
+
+
+def get_camera(camera_id):
+    """Return the SimulatedCamera with the given ID, for inspecting or changing its state."""
+    return _cameras[camera_id]
+
+
+def unplug(camera_id):
+    """Disconnect a camera.
+
+    Like a real camera, it must be closed and opened again once reconnected, which returns it to
+    its power-on state.
+    """
+    camera = _cameras[camera_id]
+    with camera.lock:
+        camera.connected = False
+        camera.removed = camera.opened
+        camera.capturing = False
+
+
+def plug(camera_id):
+    """Reconnect a camera disconnected by unplug(). It keeps its camera ID."""
+    _cameras[camera_id].connected = True
+
+
+def _connected():
+    """Return the (camera ID, camera) pairs of the connected cameras in enumeration order."""
+    return [(camera_id, camera) for camera_id, camera in enumerate(_cameras) if camera.connected]
+
+
+def _open_camera(camera_id):
+    """Return (status, camera) for an API call that requires an open camera."""
+    if not 0 <= camera_id < len(_cameras):
+        return ASI_ERROR_INVALID_ID, None
+    camera = _cameras[camera_id]
+    if not camera.connected or camera.removed:
+        return ASI_ERROR_CAMERA_REMOVED, camera
+    if not camera.opened:
+        return ASI_ERROR_CAMERA_CLOSED, camera
+    return ASI_SUCCESS, camera
+
+
+def _out_buffer(out):
+    """Validate an output buffer the same way as the typemap of the Into functions in sdk.i."""
+    view = memoryview(out)
+    if view.readonly:
+        raise BufferError('Object is not writable.')
+    if not view.c_contiguous:
+        raise ValueError('ndarray is not C-contiguous')
+    if view.format.lstrip('<=@') not in ('B', 'H') or view.itemsize not in (1, 2):
+        raise TypeError(f"output buffer must contain uint8 or uint16 items, got format "
+                        f"'{view.format}'")
+    return np.frombuffer(view.cast('B'), dtype=np.uint8)
+
+
+def ASIGetNumOfConnectedCameras():
+    return len(_connected())
+
+
+def GetNumProductIDs():
+    return len(ASIGetProductIDs())
+
+
+def ASIGetProductIDs():
+    return sorted({camera.product_id for _, camera in _connected()})
+
+
+def ASIGetCameraProperty(camera_index):
+    connected = _connected()
+    if not 0 <= camera_index < len(connected):
+        return ASI_ERROR_INVALID_INDEX, ASI_CAMERA_INFO()
+    camera_id, camera = connected[camera_index]
+    info = camera.info
+    info.CameraID = camera_id
+    return ASI_SUCCESS, info
+
+
+def ASIGetCameraPropertyByID(camera_id):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status, ASI_CAMERA_INFO()
+    info = camera.info
+    info.CameraID = camera_id
+    return ASI_SUCCESS, info
+
+
+def ASIOpenCamera(camera_id):
+    if not 0 <= camera_id < len(_cameras):
+        return ASI_ERROR_INVALID_ID
+    if not _cameras[camera_id].connected:
+        return ASI_ERROR_CAMERA_REMOVED
+    _cameras[camera_id].opened = True
+    return ASI_SUCCESS
+
+
+def ASIInitCamera(camera_id):
+    status, camera = _open_camera(camera_id)
+    if status == ASI_SUCCESS:
+        camera.initialized = True
+    return status
+
+
+def ASICloseCamera(camera_id):
+    if not 0 <= camera_id < len(_cameras):
+        return ASI_ERROR_INVALID_ID
+    _cameras[camera_id].reset()
+    return ASI_SUCCESS
+
+
+def ASIGetNumOfControls(camera_id):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status, 0
+    return ASI_SUCCESS, len(camera.controls)
+
+
+def ASIGetControlCaps(camera_id, control_index):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status, ASI_CONTROL_CAPS()
+    if not 0 <= control_index < len(camera.controls):
+        return ASI_ERROR_INVALID_CONTROL_TYPE, ASI_CONTROL_CAPS()
+    return ASI_SUCCESS, camera.controls[control_index]
+
+
+def ASIGetControlValue(camera_id, control_type):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status, 0, ASI_FALSE
+    if control_type not in camera.values:
+        return ASI_ERROR_INVALID_CONTROL_TYPE, 0, ASI_FALSE
+    return ASI_SUCCESS, camera.values[control_type], camera.auto[control_type]
+
+
+def ASISetControlValue(camera_id, control_type, value, auto):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status
+    caps = next((c for c in camera.controls if c.ControlType == control_type), None)
+    if caps is None:
+        return ASI_ERROR_INVALID_CONTROL_TYPE
+    if not caps.IsWritable:
+        return ASI_ERROR_GENERAL_ERROR
+    with camera.lock:
+        # Like the real SDK, out of range values are clamped rather than rejected
+        camera.values[control_type] = max(caps.MinValue, min(caps.MaxValue, int(value)))
+        camera.auto[control_type] = ASI_TRUE if auto and caps.IsAutoSupported else ASI_FALSE
+    return ASI_SUCCESS
+
+
+def ASISetROIFormat(camera_id, width, height, binning, img_type):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status
+    info = camera.info
+    if img_type not in info.SupportedVideoFormat:
+        return ASI_ERROR_INVALID_IMGTYPE
+    if binning not in info.SupportedBins:
+        return ASI_ERROR_INVALID_SIZE
+    if (width <= 0 or height <= 0 or width % 8 or height % 2
+            or width * binning > camera.width or height * binning > camera.height):
+        return ASI_ERROR_INVALID_SIZE
+    with camera.lock:
+        camera.roi = (width, height, binning, img_type)
+        # The ROI is centered on the sensor whenever the format changes
+        camera.start_pos = (
+            (camera.width // binning - width) // 2,
+            (camera.height // binning - height) // 2,
+        )
+    return ASI_SUCCESS
+
+
+def ASIGetROIFormat(camera_id):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status, 0, 0, 0, ASI_IMG_RAW8
+    return (ASI_SUCCESS,) + camera.roi
+
+
+def ASISetStartPos(camera_id, start_x, start_y):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status
+    width, height, binning, _ = camera.roi
+    if (start_x < 0 or start_y < 0 or start_x + width > camera.width // binning
+            or start_y + height > camera.height // binning):
+        return ASI_ERROR_OUTOF_BOUNDARY
+    with camera.lock:
+        camera.start_pos = (start_x, start_y)
+    return ASI_SUCCESS
+
+
+def ASIGetStartPos(camera_id):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status, 0, 0
+    return (ASI_SUCCESS,) + camera.start_pos
+
+
+def ASIGetCameraMode(camera_id):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status, ASI_MODE_NORMAL
+    if camera.trigger_modes is None:
+        return ASI_ERROR_GENERAL_ERROR, ASI_MODE_NORMAL
+    return ASI_SUCCESS, camera.mode
+
+
+def ASISetCameraMode(camera_id, mode):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status
+    if camera.trigger_modes is None:
+        return ASI_ERROR_GENERAL_ERROR
+    if mode != ASI_MODE_NORMAL and mode not in camera.trigger_modes:
+        return ASI_ERROR_INVALID_MODE
+    with camera.lock:
+        if camera.capturing:
+            return ASI_ERROR_INVALID_SEQUENCE
+        camera.mode = mode
+    return ASI_SUCCESS
+
+
+def ASIGetDroppedFrames(camera_id):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status, 0
+    return ASI_SUCCESS, camera.dropped_frames
+
+
+def ASIEnableDarkSubtract(camera_id, _bmp_path):
+    return _open_camera(camera_id)[0]
+
+
+def ASIDisableDarkSubtract(camera_id):
+    return _open_camera(camera_id)[0]
+
+
+def ASIStartVideoCapture(camera_id):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status
+    if camera.exposure_status == ASI_EXP_WORKING:
+        return ASI_ERROR_EXPOSURE_IN_PROGRESS
+    with camera.lock:
+        if not camera.capturing:
+            camera.start_video()
+    return ASI_SUCCESS
+
+
+def ASIStopVideoCapture(camera_id):
+    status, camera = _open_camera(camera_id)
+    if status == ASI_SUCCESS:
+        camera.capturing = False
+    return status
+
+
+def _get_video_data(camera, out, wait_ms):
+    """Wait for the next video frame and write it into a uint8 array."""
+    if not camera.capturing:
+        camera.sleep_until(None if wait_ms < 0 else time.monotonic() + wait_ms / 1000)
+        return ASI_ERROR_TIMEOUT
+
+    # The lock is not held while waiting so controls can be changed from other threads meanwhile
+    status = camera.wait_for_frame(wait_ms)
+    if status == ASI_SUCCESS:
+        with camera.lock:
+            camera.fill(out)
+    return status
+
+
+def ASIGetVideoData(camera_id, buffer_size, wait_ms):
+    buffer = np.zeros(buffer_size, dtype=np.uint8)
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status, buffer
+    if buffer_size < camera.image_size_bytes:
+        return ASI_ERROR_BUFFER_TOO_SMALL, buffer
+    status = _get_video_data(camera, buffer[:camera.image_size_bytes], wait_ms)
+    return status, buffer
+
+
+def GetImageSizeBytes(camera_id):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return -1
+    return camera.image_size_bytes
+
+
+def ASIGetVideoDataInto(camera_id, out, wait_ms):
+    out = _out_buffer(out)
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status if status == ASI_ERROR_CAMERA_REMOVED else ASI_ERROR_INVALID_ID
+    if len(out) != camera.image_size_bytes:
+        return ASI_ERROR_INVALID_SIZE
+    return _get_video_data(camera, out, wait_ms)
+
+
+def ASIPulseGuideOn(camera_id, _direction):
+    return _open_camera(camera_id)[0]
+
+
+def ASIPulseGuideOff(camera_id, _direction):
+    return _open_camera(camera_id)[0]
+
+
+def ASIStartExposure(camera_id, _is_dark):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status
+    if camera.capturing:
+        return ASI_ERROR_VIDEO_MODE_ACTIVE
+    with camera.lock:
+        camera.start_exposure()
+    return ASI_SUCCESS
+
+
+def ASIStopExposure(camera_id):
+    status, camera = _open_camera(camera_id)
+    if status == ASI_SUCCESS and camera.exposure_status == ASI_EXP_WORKING:
+        camera.exposure_status = ASI_EXP_IDLE
+    return status
+
+
+def ASIGetExpStatus(camera_id):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status, ASI_EXP_IDLE
+    with camera.lock:
+        return ASI_SUCCESS, camera.update_exposure_status()
+
+
+def _get_data_after_exp(camera, out):
+    """Write the image of a completed exposure into a uint8 array."""
+    with camera.lock:
+        if camera.update_exposure_status() != ASI_EXP_SUCCESS:
+            return ASI_ERROR_TIMEOUT
+        camera.fill(out)
+    return ASI_SUCCESS
+
+
+def ASIGetDataAfterExp(camera_id, buffer_size):
+    buffer = np.zeros(buffer_size, dtype=np.uint8)
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status, buffer
+    if buffer_size < camera.image_size_bytes:
+        return ASI_ERROR_BUFFER_TOO_SMALL, buffer
+    return _get_data_after_exp(camera, buffer[:camera.image_size_bytes]), buffer
+
+
+def ASIGetDataAfterExpInto(camera_id, out):
+    out = _out_buffer(out)
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status if status == ASI_ERROR_CAMERA_REMOVED else ASI_ERROR_INVALID_ID
+    if len(out) != camera.image_size_bytes:
+        return ASI_ERROR_INVALID_SIZE
+    return _get_data_after_exp(camera, out)
+
+
+def ASIGetSerialNumber(camera_id):
+    status, camera = _open_camera(camera_id)
+    if status != ASI_SUCCESS:
+        return status, ''
+    if camera.serial is None:
+        return ASI_ERROR_GENERAL_ERROR, ''
+    return ASI_SUCCESS, camera.serial
+
+
+def ASIGetGainOffset(camera_id):
+    status, _ = _open_camera(camera_id)
+    return status, 70, 20, 252, 40
+
+
+def ASIGetSDKVersion():
+    return 'simulated'
+
+
+def ASIGetSupportedBins(camera_info):
+    return [b for b in camera_info.SupportedBins if b != 0]
+
+
+def ASIGetSupportedVideoFormats(camera_info):
+    formats = []
+    for img_type in camera_info.SupportedVideoFormat:
+        if img_type == ASI_IMG_END:
+            break
+        formats.append(img_type)
+    return formats
+
+
+# Only the API is re-exported by "from asi.sim import *", not the simulator controls
+__all__ = [name for name in dir() if name.startswith('ASI')] + ['GetImageSizeBytes']
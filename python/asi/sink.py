@@ -0,0 +1,477 @@
+"""Write-behind saving of images to PNG, TIFF, FITS or NumPy files.
+
+Encoding an image, especially compressing a 16-bit PNG, can take far longer than acquiring it. An
+ImageSink takes images from the acquisition loop into a bounded queue and encodes them in a pool
+of worker processes, so saving never delays the next exposure:
+
+    with ImageSink('/data/asc', 'png', prefix='ASC_', crop=(398, 0, 1200, 1200)) as sink:
+        while True:
+            image = take_exposure()
+            sink.submit(image, timestamp, suffix='_015000ms')
+
+Images are written to a directory per UTC date (by default /data/asc/YYYY/MM/DD/) under a
+temporary name and renamed once complete, so other programs never see partially written files.
+
+When images arrive faster than they can be encoded the queue fills up and submit() applies the
+overflow policy: BLOCK waits for room (backpressure on the acquisition loop), DROP_OLDEST discards
+the oldest image waiting in the queue, and DROP_NEWEST discards the image being submitted.
+"""
+
+import collections
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import numpy as np
+
+from asi import metrics
+from asi.stream import BLOCK, DROP_OLDEST
+
+
+logger = logging.getLogger(__name__)
+
+# Overflow policy that discards the image being submitted when the queue is full
+DROP_NEWEST = 'drop_newest'
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+# File extension for each supported format
+FORMATS = {
+    'png': '.png',
+    'tiff': '.tif',
+    'fits': '.fits',
+    'npy': '.npy',
+}
+
+# Number of recent files kept for latency statistics
+LATENCY_HISTORY = 1000
+
+FITS_BLOCK_SIZE = 2880
+FITS_CARD_SIZE = 80
+
+
+def bin_image(image, factor):
+    """Reduce resolution by averaging blocks of factor x factor pixels.
+
+    Rows and columns that do not fill a whole block are discarded. Color images of shape
+    (height, width, channels) are binned per channel.
+    """
+    if factor == 1:
+        return image
+    height = image.shape[0] // factor
+    width = image.shape[1] // factor
+    blocks = image[:height * factor, :width * factor].reshape(
+        (height, factor, width, factor) + image.shape[2:]
+    )
+    sums = blocks.sum(axis=(1, 3), dtype=np.uint32)
+    return ((sums + factor * factor // 2) // (factor * factor)).astype(image.dtype)
+
+
+def _fits_card(keyword, value, comment=''):
+    """Format one 80-character FITS header card."""
+    if keyword == 'END':
+        return keyword.ljust(FITS_CARD_SIZE)
+    if isinstance(value, bool):
+        value = 'T' if value else 'F'
+    if isinstance(value, str) and value not in ('T', 'F'):
+        value = f"'{value:<8}'"
+    card = f'{keyword:<8}= {value:>20}'
+    if comment:
+        card += f' / {comment}'
+    return card[:FITS_CARD_SIZE].ljust(FITS_CARD_SIZE)
+
+
+def _write_fits(f, image, timestamp=None):
+    """Write an 8-bit or 16-bit mono or color image as a primary HDU of a FITS file."""
+    if image.dtype == np.uint8:
+        bitpix, data = 8, image
+    elif image.dtype == np.uint16:
+        # FITS only has signed 16-bit integers; unsigned data is stored offset by BZERO
+        bitpix, data = 16, (image ^ 0x8000).astype('>u2')
+    else:
+        raise TypeError(f'Unsupported dtype {image.dtype}')
+    if image.ndim == 3:
+        # Color planes are stored one after the other
+        data = np.moveaxis(data, 2, 0)
+    cards = [
+        _fits_card('SIMPLE', True, 'conforms to FITS standard'),
+        _fits_card('BITPIX', bitpix),
+        _fits_card('NAXIS', image.ndim),
+    ]
+    cards += [
+        _fits_card(f'NAXIS{axis + 1}', length) for axis, length in enumerate(data.shape[::-1])
+    ]
+    if bitpix == 16:
+        cards += [_fits_card('BZERO', 32768), _fits_card('BSCALE', 1)]
+    if timestamp is not None:
+        date_obs = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp))
+        date_obs += f'{timestamp % 1:.6f}'[1:]
+        cards.append(_fits_card('DATE-OBS', date_obs, 'UTC start of exposure'))
+    cards.append(_fits_card('END', None))
+    header = ''.join(cards).encode('ascii')
+    f.write(header.ljust(-(-len(header) // FITS_BLOCK_SIZE) * FITS_BLOCK_SIZE, b' '))
+    raw = np.ascontiguousarray(data).tobytes()
+    f.write(raw)
+    f.write(bytes(-len(raw) % FITS_BLOCK_SIZE))
+
+
+def write_image(path, image, fmt, compression=None, binning=1, timestamp=None):
+    """Encode an image and write it to a file.
+
+    The file is written under a temporary name and renamed to path once complete. Missing
+    directories are created. This is the function run by the workers of an ImageSink but it can
+    also be called directly.
+
+    Args:
+        path: Path of the file to write.
+        image: Array of shape (height, width) or (height, width, 3), uint8 or uint16.
+        fmt: One of the keys of FORMATS.
+        compression: For png, the zlib compression level (0-9). For tiff, the name of a PIL TIFF
+            compression method such as 'tiff_deflate' or 'tiff_lzw'. Must be None for the other
+            formats.
+        binning: Binning factor applied before encoding.
+        timestamp: Time of the exposure in seconds since the epoch, recorded in FITS headers.
+
+    Returns:
+        Tuple (bytes written, seconds spent encoding and writing).
+    """
+    start = time.perf_counter()
+    image = bin_image(image, binning)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    if fmt in ('png', 'tiff'):
+        from PIL import Image  # pylint: disable=import-outside-toplevel
+        pil_image = Image.fromarray(image)
+        if fmt == 'png':
+            options = {} if compression is None else {'compress_level': compression}
+            pil_image.save(tmp_path, format='PNG', **options)
+        else:
+            options = {} if compression is None else {'compression': compression}
+            pil_image.save(tmp_path, format='TIFF', **options)
+    elif fmt == 'fits':
+        with open(tmp_path, 'wb') as f:
+            _write_fits(f, image, timestamp)
+    elif fmt == 'npy':
+        with open(tmp_path, 'wb') as f:
+            np.save(f, image)
+    else:
+        raise ValueError(f'Unknown format {fmt!r}')
+    os.replace(tmp_path, path)
+    return os.path.getsize(path), time.perf_counter() - start
+
+
+def _percentiles_ms(values):
+    """Return a dict of p50, p99 and max of durations in seconds, in milliseconds."""
+    if not values:
+        return None
+    values_ms = np.array(values) * 1e3
+    return {
+        'p50': float(np.percentile(values_ms, 50)),
+        'p99': float(np.percentile(values_ms, 99)),
+        'max': float(np.max(values_ms)),
+    }
+
+
+class _Task:
+    """An image waiting to be written."""
+
+    def __init__(self, path, image, timestamp):
+        self.path = path
+        self.image = image
+        self.timestamp = timestamp
+        self.submitted = time.monotonic()
+
+
+class ImageSink:
+    """Bounded write-behind queue feeding a pool of image encoders.
+
+    Args:
+        directory: Root directory for the images.
+        fmt: File format; one of the keys of FORMATS.
+        workers: Number of encoder processes (or threads).
+        queue_size: Maximum number of images waiting for a free encoder.
+        policy: What submit() does when the queue is full; one of POLICIES.
+        compression: Compression setting passed to write_image().
+        crop: Region (x, y, width, height) of each image to keep, or None for the whole image.
+        binning: Binning factor applied after cropping and before encoding.
+        stage: Optional callable applied to each image in submit() before cropping and copying,
+            such as an asi.binning.Binning. Unlike binning, which is applied by the encoders to
+            the copied image, this reduces the image before it is copied and queued.
+        layout: strftime() format of the subdirectory for each image, from the UTC time of the
+            image. Use '' for no subdirectories.
+        prefix: Prefix of each file name.
+        name_format: strftime() format of the UTC time of the image in each file name. Images
+            that would get the name of the previous image or of an existing file get a sequence
+            number appended, such as _1, so that no file is overwritten.
+        processes: Encode in worker processes. Use threads if False, which is enough for formats
+            that are limited by disk rather than CPU, such as npy and uncompressed TIFF and FITS.
+        registry: asi.metrics.Registry the sink reports to. Defaults to asi.metrics.REGISTRY.
+
+    Attributes:
+        submitted: Number of images accepted by submit().
+        written: Number of files written.
+        dropped: Number of images discarded because the queue was full.
+        failed: Number of images that could not be written.
+        bytes_written: Total size of the files written.
+        max_queued: Highest number of images ever waiting in the queue.
+    """
+
+    def __init__(
+            self,
+            directory,
+            fmt='png',
+            workers=2,
+            queue_size=8,
+            policy=BLOCK,
+            compression=None,
+            crop=None,
+            binning=1,
+            stage=None,
+            layout='%Y/%m/%d',
+            prefix='',
+            name_format='%Y%m%d_%H%M%S',
+            processes=True,
+            registry=None,
+        ):
+        if fmt not in FORMATS:
+            raise ValueError(f'fmt must be one of {tuple(FORMATS)}, got {fmt!r}')
+        if policy not in POLICIES:
+            raise ValueError(f'policy must be one of {POLICIES}, got {policy!r}')
+        if queue_size < 1 or workers < 1:
+            raise ValueError('queue_size and workers must be at least 1')
+        if fmt == 'png' and compression is not None and not 0 <= compression <= 9:
+            raise ValueError('PNG compression level must be in the range [0, 9]')
+        if fmt in ('fits', 'npy') and compression is not None:
+            raise ValueError(f'Compression is not supported for {fmt}')
+        if fmt in ('png', 'tiff'):
+            import PIL  # pylint: disable=import-outside-toplevel,unused-import
+
+        self.directory = os.fspath(directory)
+        self.fmt = fmt
+        self.workers = workers
+        self.queue_size = queue_size
+        self.policy = policy
+        self.compression = compression
+        self.crop = crop
+        self.binning = binning
+        self.stage = stage
+        self.layout = layout
+        self.prefix = prefix
+        self.name_format = name_format
+
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.bytes_written = 0
+        self.max_queued = 0
+        self.last_error = None
+        self._latencies = collections.deque(maxlen=LATENCY_HISTORY)
+        self._encode_times = collections.deque(maxlen=LATENCY_HISTORY)
+        registry = metrics.REGISTRY if registry is None else registry
+        self._encode_latency = registry.stage_latency('encode')
+        registry.add_collector(self)
+
+        if processes:
+            # Worker processes are spawned rather than forked since forking a process with other
+            # threads running (such as the ASI library's USB threads) is not safe
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                workers, thread_name_prefix='asi-sink'
+            )
+        self._pending = collections.deque()
+        self._in_flight = 0
+        self._last_path = None
+        self._repeats = 0
+        self._closed = False
+        self._cv = threading.Condition()
+        self._thread = threading.Thread(target=self._dispatch, name='asi-sink', daemon=True)
+        self._thread.start()
+
+    def path(self, timestamp, suffix=''):
+        """Return the path of the file for an image taken at the given time.
+
+        Rather than overwriting a file, a sequence number is appended to the name of an image
+        that would get the same name as the previous image, such as a second image within the
+        same second with the default name_format, or as an existing file.
+        """
+        utc = time.gmtime(timestamp)
+        name = f'{self.prefix}{time.strftime(self.name_format, utc)}{suffix}'
+        path = os.path.join(self.directory, time.strftime(self.layout, utc), name)
+        extension = FORMATS[self.fmt]
+        with self._cv:
+            if path == self._last_path:
+                self._repeats += 1
+            else:
+                self._last_path = path
+                self._repeats = 0
+            while True:
+                unique = f'{path}_{self._repeats}' if self._repeats else path
+                if not os.path.exists(unique + extension):
+                    return unique + extension
+                logger.warning('%s already exists, not overwriting it', unique + extension)
+                self._repeats += 1
+
+    def submit(self, image, timestamp=None, suffix='', timeout=None):
+        """Queue an image to be written.
+
+        The cropped region of the image is copied, so the caller may reuse the array as soon as
+        this returns.
+
+        Args:
+            image: Array of shape (height, width) or (height, width, 3), uint8 or uint16.
+            timestamp: Time of the exposure in seconds since the epoch. Defaults to now.
+            suffix: Text appended to the file name before the extension.
+            timeout: Maximum time to wait for room in the queue with the BLOCK policy, or None to
+                wait indefinitely.
+
+        Returns:
+            True if the image was queued, False if it was dropped.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        if self.stage is not None:
+            image = self.stage(image)
+        if self.crop is not None:
+            x, y, width, height = self.crop
+            image = image[y:y + height, x:x + width]
+        task = _Task(self.path(timestamp, suffix), np.array(image), timestamp)
+
+        with self._cv:
+            if self._closed:
+                raise RuntimeError('ImageSink is closed')
+            while len(self._pending) >= self.queue_size:
+                if self.policy == BLOCK:
+                    if not self._cv.wait_for(
+                            lambda: len(self._pending) < self.queue_size, timeout):
+                        self.dropped += 1
+                        return False
+                elif self.policy == DROP_OLDEST:
+                    dropped = self._pending.popleft()
+                    self.dropped += 1
+                    logger.warning('Write queue full, dropped %s', dropped.path)
+                else:
+                    self.dropped += 1
+                    logger.warning('Write queue full, dropped %s', task.path)
+                    return False
+            self._pending.append(task)
+            self.submitted += 1
+            self.max_queued = max(self.max_queued, len(self._pending))
+            self._cv.notify_all()
+        return True
+
+    def _dispatch(self):
+        """Dispatcher thread body: hand queued images to the encoders as they become free.
+
+        Images are only handed over when an encoder is free, so the overflow policy applies to
+        everything not yet being encoded.
+        """
+        while True:
+            with self._cv:
+                self._cv.wait_for(
+                    lambda: (self._pending and self._in_flight < self.workers)
+                    or (self._closed and not self._pending)
+                )
+                if not self._pending:
+                    return
+                task = self._pending.popleft()
+                self._in_flight += 1
+                self._cv.notify_all()
+            future = self._executor.submit(
+                write_image,
+                task.path,
+                task.image,
+                self.fmt,
+                self.compression,
+                self.binning,
+                task.timestamp,
+            )
+            future.add_done_callback(functools.partial(self._done, task))
+
+    def _done(self, task, future):
+        """Record the outcome of writing one image."""
+        with self._cv:
+            self._in_flight -= 1
+            try:
+                size, encode_time = future.result()
+            except Exception as e:  # pylint: disable=broad-except
+                self.failed += 1
+                self.last_error = e
+                logger.error('Failed to write %s: %s', task.path, e)
+            else:
+                self.written += 1
+                self.bytes_written += size
+                self._latencies.append(time.monotonic() - task.submitted)
+                self._encode_times.append(encode_time)
+                self._encode_latency.observe(encode_time)
+            self._cv.notify_all()
+
+    @property
+    def queued(self):
+        """Number of images waiting for a free encoder."""
+        return len(self._pending)
+
+    def flush(self, timeout=None):
+        """Wait until all queued images have been written.
+
+        Returns:
+            True if everything was written, False if the timeout expired first.
+        """
+        with self._cv:
+            return self._cv.wait_for(
+                lambda: not self._pending and self._in_flight == 0, timeout
+            )
+
+    def close(self):
+        """Write all queued images and shut down the encoders."""
+        with self._cv:
+            if self._closed:
+                return
+            self._closed = True
+            self._cv.notify_all()
+        self._thread.join()
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self):
+        """Return a dict of counts and per-file latency statistics in milliseconds.
+
+        latency_ms is the time from submit() until the file was complete and encode_ms the time
+        spent encoding and writing in a worker.
+        """
+        with self._cv:
+            return {
+                'submitted': self.submitted,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'queued': len(self._pending),
+                'in_flight': self._in_flight,
+                'bytes_written': self.bytes_written,
+                'latency_ms': _percentiles_ms(self._latencies),
+                'encode_ms': _percentiles_ms(self._encode_times),
+            }
+
+    def collect_metrics(self):
+        """Return asi.metrics.Sample values for the queue and output of the sink."""
+        output = {'output': self.directory}
+        return metrics.queue_samples(
+            f'sink:{self.directory}', len(self._pending), self.max_queued, self.dropped
+        ) + [
+            metrics.Sample('asi_files_written_total', 'counter', 'Files written', output,
+                           self.written),
+            metrics.Sample('asi_write_failures_total', 'counter', 'Files that could not be written',
+                           output, self.failed),
+            metrics.Sample('asi_bytes_written_total', 'counter', 'Bytes written', output,
+                           self.bytes_written),
+        ]
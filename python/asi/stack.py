@@ -0,0 +1,321 @@
+"""Stacking of SER frames with bounded memory.
+
+Combines the frames of a SER file (8 or 16 bits, mono, Bayer or RGB) into a single float32 image,
+typically after choosing the best frames with asi.quality:
+
+    metrics = quality.score_ser('jupiter.ser')
+    best = quality.rank(metrics)[:2000]
+    image = stack_ser('jupiter.ser', 'sigma_clip', indices=best)
+
+The image is divided into bands of rows, and each band is stacked by streaming through the frames
+in batches, so memory use depends on the size of a band and not on the number of frames. Bands
+are spread over a pool of worker processes that each map the SER file themselves, and the height
+of the bands is chosen so that the batch buffers and accumulators of all workers stay under the
+max_memory limit. A band of rows is contiguous within each frame, so each band reads whole pages
+of the file.
+
+Three methods are available:
+
+- mean: weighted mean.
+- median: approximate median using the remedian algorithm (Rousseeuw and Bassett, 1990). The
+  median of each batch of frames is taken, then the median of each batch of those medians, and so
+  on, so only one batch per level is kept in memory. The few partial batches left at the end are
+  combined with a median weighted by the number of frames each represents. Weights are ignored.
+- sigma_clip: weighted mean of the values within kappa standard deviations of the weighted mean
+  of each pixel. This reads every frame twice.
+
+Frames can be aligned with integer shifts. The output only covers the area common to all shifted
+frames. Shifts of Bayer frames must be even so that the color pattern stays aligned.
+"""
+
+import concurrent.futures
+import logging
+import math
+import multiprocessing
+import os
+import numpy as np
+
+from asi import ser
+
+
+logger = logging.getLogger(__name__)
+
+METHODS = ('mean', 'median', 'sigma_clip')
+
+# Default limit on the memory used for stacking, in bytes
+MAX_MEMORY = 2 << 30
+
+# Number of frames read into the batch buffer at a time, and the base of the remedian
+BATCH_FRAMES = 32
+
+DEFAULT_KAPPA = 3.0
+
+# Bands per worker process, so that workers finishing early can pick up more work
+BANDS_PER_WORKER = 4
+
+# Stacker used by each worker process
+_stacker = None
+
+
+def _weighted_median(values, weights):
+    """Return the weighted median along the first axis of values."""
+    order = np.argsort(values, axis=0)
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    cumulative = np.cumsum(weights[order], axis=0)
+    position = np.argmax(cumulative >= cumulative[-1] / 2, axis=0)
+    return np.take_along_axis(sorted_values, position[np.newaxis], axis=0)[0]
+
+
+class _Stacker:
+    """Stacks bands of rows of the frames of an open SERReader."""
+
+    def __init__(self, reader, method, indices, weights, shifts, kappa):
+        self.reader = reader
+        self.method = method
+        self.indices = indices
+        self.weights = weights
+        # np.tensordot() would convert every batch to float64 to multiply it by float64 weights
+        self._weights32 = weights.astype(np.float32)
+        self.kappa = kappa
+        self.channels = reader.shape[2:]
+
+        dy, dx = shifts[:, 0], shifts[:, 1]
+        self.height = reader.height - int(dy.max() - dy.min())
+        self.width = reader.width - int(dx.max() - dx.min())
+        if self.height <= 0 or self.width <= 0:
+            raise ValueError('The shifted frames do not overlap')
+        # Position in each frame of the top left pixel of the output
+        self.rows = dy - dy.min()
+        self.cols = dx - dx.min()
+
+    @property
+    def shape(self):
+        """Shape of the stacked image."""
+        return (self.height, self.width) + self.channels
+
+    def _batches(self, start, stop, buffer):
+        """Yield (batch, weights) with the rows start to stop of each frame, in batches."""
+        for first in range(0, len(self.indices), len(buffer)):
+            last = min(first + len(buffer), len(self.indices))
+            batch = buffer[:last - first]
+            for j, i in enumerate(range(first, last)):
+                row, col = self.rows[i], self.cols[i]
+                frame = self.reader[int(self.indices[i])]
+                np.copyto(batch[j], frame[row + start:row + stop, col:col + self.width])
+            yield batch, self._weights32[first:last]
+
+    def bytes_per_row(self, batch_frames):
+        """Estimate the memory used per row of a band in bytes."""
+        pixels = self.width * int(np.prod(self.channels, dtype=np.int64))
+        if self.method == 'median':
+            levels = max(1, math.ceil(math.log(max(len(self.indices), 2), batch_frames)))
+            # Batch buffer, one batch of medians per level, and the result
+            return pixels * 4 * (batch_frames * (levels + 1) + 1)
+        if self.method == 'sigma_clip':
+            # Batch buffer and the deviations and mask of a batch, float64 accumulators and
+            # temporaries, and the float32 mean and result
+            return pixels * (9 * batch_frames + 8 * 5 + 8)
+        # Batch buffer, float64 accumulator and temporary, and the result
+        return pixels * (4 * batch_frames + 8 * 2 + 4)
+
+    def stack(self, start, stop, batch_frames=BATCH_FRAMES):
+        """Stack the rows start to stop of the output and return them as float32."""
+        shape = (stop - start, self.width) + self.channels
+        buffer = np.empty((min(batch_frames, len(self.indices)),) + shape, dtype=np.float32)
+        if self.method == 'median':
+            if len(self.indices) == 1:
+                # A single frame is its own median, and batches of one would never fill a level
+                batch, _ = next(self._batches(start, stop, buffer))
+                return batch[0]
+            return self._median(start, stop, buffer)
+
+        total = np.zeros(shape, dtype=np.float64)
+        weight_total = float(self.weights.sum())
+        for batch, weights in self._batches(start, stop, buffer):
+            total += np.tensordot(weights, batch, axes=1)
+        mean = total / weight_total
+        if self.method == 'mean':
+            return mean.astype(np.float32)
+
+        squares = np.zeros(shape, dtype=np.float64)
+        for batch, weights in self._batches(start, stop, buffer):
+            squares += np.tensordot(weights, np.square(batch, out=batch), axes=1)
+        threshold = self.kappa * np.sqrt(np.maximum(squares / weight_total - mean * mean, 0))
+
+        total[...] = 0
+        accepted = np.zeros(shape, dtype=np.float64)
+        mean32 = mean.astype(np.float32)
+        threshold = threshold.astype(np.float32)
+        deviation = np.empty_like(buffer)
+        mask = np.empty(buffer.shape, dtype=bool)
+        for batch, weights in self._batches(start, stop, buffer):
+            n = len(batch)
+            np.subtract(batch, mean32, out=deviation[:n])
+            np.abs(deviation[:n], out=deviation[:n])
+            np.less_equal(deviation[:n], threshold, out=mask[:n])
+            batch *= mask[:n]
+            total += np.tensordot(weights, batch, axes=1)
+            np.copyto(deviation[:n], mask[:n])
+            accepted += np.tensordot(weights, deviation[:n], axes=1)
+        # Pixels where every value was rejected keep the plain mean
+        np.divide(total, accepted, out=mean, where=accepted > 0)
+        return mean.astype(np.float32)
+
+    def _median(self, start, stop, buffer):
+        base = len(buffer)
+        # levels[k] is a batch of medians of base ** (k + 1) frames each, and the number of them
+        levels = []
+        counts = []
+        leftover = None
+
+        for batch, _ in self._batches(start, stop, buffer):
+            median = np.median(batch, axis=0, overwrite_input=True)
+            if len(batch) < base:
+                leftover = median
+                continue
+            # Carry full batches of medians up to the next level
+            k = 0
+            while True:
+                if k == len(levels):
+                    levels.append(np.empty_like(buffer))
+                    counts.append(0)
+                levels[k][counts[k]] = median
+                counts[k] += 1
+                if counts[k] < base:
+                    break
+                counts[k] = 0
+                median = np.median(levels[k], axis=0, overwrite_input=True)
+                k += 1
+
+        values = [level[:count] for level, count in zip(levels, counts)]
+        weights = [np.full(count, base ** (k + 1)) for k, count in enumerate(counts)]
+        if leftover is not None:
+            values.append(leftover[np.newaxis])
+            weights.append([len(self.indices) % base])
+        weights = np.concatenate(weights).astype(np.float32)
+        if len(weights) == 1:
+            return next(value[0] for value in values if len(value))
+        # Row by row, since sorting needs several times the memory of the values
+        result = np.empty(buffer.shape[1:], dtype=np.float32)
+        for row in range(len(result)):
+            result[row] = _weighted_median(
+                np.concatenate([value[:, row] for value in values]), weights
+            )
+        return result
+
+
+def _init_worker(filename, little_endian, *args):
+    global _stacker  # pylint: disable=global-statement
+    _stacker = _Stacker(ser.SERReader(filename, little_endian), *args)
+
+
+def _stack_task(start, stop, batch_frames):
+    return _stacker.stack(start, stop, batch_frames)
+
+
+def stack_ser(
+        filename,
+        method='mean',
+        indices=None,
+        weights=None,
+        shifts=None,
+        kappa=DEFAULT_KAPPA,
+        workers=None,
+        max_memory=MAX_MEMORY,
+        batch_frames=BATCH_FRAMES,
+        little_endian=None,
+    ):
+    """Stack frames of a SER file.
+
+    Args:
+        filename: Path of the SER file.
+        method: One of METHODS.
+        indices: Indices of the frames to stack. Defaults to all frames.
+        weights: Optional weight of each frame in indices, such as a sharpness score. Used by the
+            mean and sigma_clip methods.
+        shifts: Optional integer (dy, dx) of each frame in indices, such that pixel (y, x) of the
+            stack is taken from pixel (y + dy, x + dx) of the frame, up to a common offset.
+        kappa: Rejection threshold of the sigma_clip method in standard deviations.
+        workers: Number of worker processes. Defaults to the number of CPUs. With 1, frames are
+            stacked in the calling process.
+        max_memory: Approximate limit on the memory used, in bytes, including the result. The
+            pages of the SER file mapped by the workers are not counted since they are part of the
+            page cache and can be reclaimed at any time.
+        batch_frames: Number of frames read at a time. At least 2 for the median method, which
+            takes the median of each batch.
+        little_endian: Byte order override passed to SERReader.
+
+    Returns:
+        float32 array of shape (height, width) or (height, width, 3), in ADU.
+
+    Raises:
+        ValueError: If the arguments are invalid or max_memory is too small.
+    """
+    if method not in METHODS:
+        raise ValueError(f'method must be one of {METHODS}, got {method!r}')
+    if batch_frames < (2 if method == 'median' else 1):
+        raise ValueError(f'batch_frames of {batch_frames} is too small for the {method} method')
+    filename = os.fspath(filename)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    with ser.SERReader(filename, little_endian) as reader:
+        indices = np.arange(len(reader)) if indices is None else np.asarray(indices, np.int64)
+        if len(indices) == 0:
+            raise ValueError('No frames to stack')
+        if indices.min() < 0 or indices.max() >= len(reader):
+            raise ValueError(f'Frame indices must be in the range [0, {len(reader)})')
+        weights = np.ones(len(indices)) if weights is None else np.asarray(weights, np.float64)
+        shifts = np.zeros((len(indices), 2), np.int64) if shifts is None else np.asarray(shifts)
+        if weights.shape != indices.shape or shifts.shape != (len(indices), 2):
+            raise ValueError('weights and shifts must have one entry per frame')
+        if np.any(weights < 0) or weights.sum() <= 0:
+            raise ValueError('weights must be non-negative and not all zero')
+        bayer = reader.color_id not in (ser.MONO, ser.RGB, ser.BGR)
+        if bayer and np.any(shifts % 2):
+            raise ValueError('Shifts of Bayer frames must be even')
+        shifts = shifts.astype(np.int64)
+
+        args = (method, indices, weights, shifts, kappa)
+        stacker = _Stacker(reader, *args)
+        result = np.empty(stacker.shape, dtype=np.float32)
+        workers = max(1, min(workers, stacker.height))
+        bytes_per_row = stacker.bytes_per_row(batch_frames)
+        budget = (max_memory - result.nbytes) // workers
+        rows = min(
+            budget // bytes_per_row,
+            math.ceil(stacker.height / (workers * BANDS_PER_WORKER)),
+        )
+        if rows < 1:
+            raise ValueError(
+                f'max_memory of {max_memory} bytes is too small; a single row of {workers} '
+                f'worker(s) needs {result.nbytes + workers * bytes_per_row} bytes'
+            )
+        bands = [(start, min(start + rows, stacker.height))
+                 for start in range(0, stacker.height, rows)]
+        logger.info('Stacking %d frames (%s) in %d bands of %d rows with %d worker(s)',
+                    len(indices), method, len(bands), rows, workers)
+
+        if workers == 1:
+            for start, stop in bands:
+                result[start:stop] = stacker.stack(start, stop, batch_frames)
+            return result
+
+    # Worker processes are spawned for the same reason as in asi.sink
+    with concurrent.futures.ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(filename, little_endian) + args,
+        ) as executor:
+        futures = {
+            executor.submit(_stack_task, start, stop, batch_frames): start
+            for start, stop in bands
+        }
+        for future in concurrent.futures.as_completed(futures):
+            # Drop each future once copied so that the bands are not all held until the end
+            start = futures.pop(future)
+            band = future.result()
+            result[start:start + len(band)] = band
+            del future, band
+    return result
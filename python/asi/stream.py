@@ -0,0 +1,596 @@
+"""Streaming video capture using a fixed pool of preallocated frame buffers.
+
+This is a Python port of the design used by the C++ capture program. A fixed number of frame
+buffers are allocated up front and recycled for the lifetime of the stream, so no memory is
+allocated per frame. A dedicated reader thread pulls frames from the camera into free buffers and
+hands each frame out to any number of consumers through bounded queues. Frames are reference
+counted: a frame goes back to the pool of free buffers once every consumer that received it has
+released it.
+
+Typical usage:
+
+    with VideoStream(camera_id) as stream:
+        disk = stream.add_consumer('disk', maxsize=32, policy=BLOCK)
+        preview = stream.add_consumer('preview', policy=LATEST)
+        ...
+        for frame in disk:
+            with frame:
+                process(frame.image)
+"""
+
+import collections
+import logging
+import threading
+import time
+import numpy as np
+
+import asi
+from asi import integrity
+from asi import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Number of frame buffers allocated by default. Matches FRAME_POOL_SIZE in the capture program.
+FRAME_POOL_SIZE = 64
+
+# Consumer queue policies. These determine what happens when a frame is ready but the consumer's
+# queue is full.
+BLOCK = 'block'  # reader waits for the consumer to make room (no frames lost to this consumer)
+DROP_OLDEST = 'drop_oldest'  # oldest queued frame is discarded to make room for the new one
+LATEST = 'latest'  # consumer only ever sees the most recent frame, like the AGC thread
+POLICIES = (BLOCK, DROP_OLDEST, LATEST)
+
+# Interval in seconds between calls to ASIGetDroppedFrames() by the reader thread
+DROPPED_FRAMES_POLL_INTERVAL = 1.0
+
+# Time in seconds beyond the read timeout that suspend() waits for the reader thread to stop
+SUSPEND_TIMEOUT = 1.0
+
+
+def image_geometry(camera_id, backend=None):
+    """Return the (shape, dtype) of images for the current ROI format of a camera."""
+    backend = asi if backend is None else backend
+    width, height, _, img_type = backend.ASICheck(backend.ASIGetROIFormat(camera_id))
+    if img_type == backend.ASI_IMG_RAW16:
+        return (height, width), np.uint16
+    if img_type == backend.ASI_IMG_RGB24:
+        return (height, width, 3), np.uint8
+    return (height, width), np.uint8
+
+
+class Frame:
+    """A frame buffer from the pool owned by a VideoStream.
+
+    Consumers must release each frame they receive exactly once, either by calling
+    decr_ref_count() or by using the frame as a context manager. The buffer is reused for a new
+    frame as soon as the last reference is released, so views of the data must not be kept
+    around after that.
+
+    Attributes:
+        buffer: Flat uint8 array holding the raw bytes of the frame as read from the camera.
+        image: View of buffer with the shape and dtype of the image, e.g. (height, width) uint16.
+        index: Sequence number of this frame within the stream, starting at 0.
+        timestamp: Time the frame was received, in seconds since the epoch.
+    """
+
+    def __init__(self, pool, buffer, image):
+        self.buffer = buffer
+        self.image = image
+        self.index = -1
+        self.timestamp = 0.0
+        self._pool = pool
+        self._ref_count = 0
+        self._lock = threading.Lock()
+
+    def incr_ref_count(self):
+        """Add a reference to this frame."""
+        with self._lock:
+            self._ref_count += 1
+
+    def decr_ref_count(self):
+        """Release a reference to this frame, returning it to the pool if it was the last one."""
+        with self._lock:
+            if self._ref_count <= 0:
+                raise RuntimeError('decr_ref_count called on frame with reference count of zero')
+            self._ref_count -= 1
+            unused = self._ref_count == 0
+        if unused:
+            self._pool.put(self)
+
+    @property
+    def ref_count(self):
+        """Current number of references to this frame."""
+        return self._ref_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.decr_ref_count()
+
+
+class FramePool:
+    """Fixed-size pool of preallocated frame buffers.
+
+    All buffers are slices of a single contiguous allocation. Every buffer is C-contiguous and can
+    be filled in place by ASIGetVideoDataInto().
+
+    Args:
+        size: Number of frames in the pool.
+        shape: Shape of each image.
+        dtype: Numpy dtype of each image.
+    """
+
+    def __init__(self, size, shape, dtype):
+        self.size = size
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.frame_size_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self._storage = np.zeros((size, self.frame_size_bytes), dtype=np.uint8)
+        self.frames = [
+            Frame(self, buffer, buffer.view(self.dtype).reshape(self.shape))
+            for buffer in self._storage
+        ]
+        self._unused = collections.deque(self.frames)
+        self._cv = threading.Condition()
+        self.exhausted_count = 0
+
+    def get(self, stop_event=None):
+        """Take a free frame out of the pool, waiting for one if the pool is exhausted.
+
+        The returned frame has a reference count of one, owned by the caller.
+
+        Args:
+            stop_event: Optional threading.Event. If it becomes set while waiting for a free frame
+                this function gives up and returns None.
+
+        Returns:
+            A Frame or None if stop_event was set.
+        """
+        with self._cv:
+            if not self._unused:
+                self.exhausted_count += 1
+                logger.error('Frame pool exhausted: all %d frames are in use.', self.size)
+                while not self._unused:
+                    if stop_event is not None and stop_event.is_set():
+                        return None
+                    self._cv.wait(0.1)
+            frame = self._unused.pop()
+        frame.incr_ref_count()
+        return frame
+
+    def put(self, frame):
+        """Return a frame to the pool. Called when the frame's reference count drops to zero."""
+        with self._cv:
+            self._unused.append(frame)
+            self._cv.notify()
+
+    @property
+    def free(self):
+        """Number of frames currently available in the pool."""
+        return len(self._unused)
+
+
+class Consumer:
+    """A bounded queue of frames headed for one consumer of a VideoStream.
+
+    Consumers are created with VideoStream.add_consumer(). Each frame received from get() or by
+    iterating over the consumer holds a reference that must be released by the consumer.
+
+    Attributes:
+        name: Name of the consumer, used in stats.
+        maxsize: Maximum number of frames held in the queue.
+        policy: One of BLOCK, DROP_OLDEST or LATEST.
+        frames_received: Number of frames put in this consumer's queue.
+        frames_dropped: Number of frames discarded from this consumer's queue because it was full.
+        max_lag: Highest number of frames ever waiting in the queue.
+        notify: Callable taking no arguments called whenever a frame is queued or the consumer is
+            closed, or None. It is called from the reader thread and must not block.
+    """
+
+    def __init__(self, name, maxsize, policy, notify=None):
+        if policy not in POLICIES:
+            raise ValueError(f'policy must be one of {POLICIES}, got {policy!r}')
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.name = name
+        self.policy = policy
+        self.maxsize = 1 if policy == LATEST else maxsize
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.max_lag = 0
+        self.notify = notify
+        self._deque = collections.deque()
+        self._cv = threading.Condition()
+        self._closed = False
+
+    @property
+    def lag(self):
+        """Number of frames currently waiting in the queue."""
+        return len(self._deque)
+
+    @property
+    def closed(self):
+        """True if the consumer no longer accepts frames."""
+        return self._closed
+
+    def _notify(self):
+        if self.notify is not None:
+            self.notify()
+
+    def put(self, frame, stop_event):
+        """Add a frame to the queue according to the queue policy. Called by the reader thread.
+
+        A reference is added to the frame if it is queued.
+
+        Returns:
+            True if the frame was queued, False if it was not because the consumer is closed or
+            the stream is stopping.
+        """
+        with self._cv:
+            while len(self._deque) >= self.maxsize and not self._closed:
+                if self.policy == BLOCK:
+                    if stop_event.is_set():
+                        return False
+                    self._cv.wait(0.1)
+                else:
+                    self._deque.popleft().decr_ref_count()
+                    self.frames_dropped += 1
+            if self._closed:
+                return False
+            frame.incr_ref_count()
+            self._deque.append(frame)
+            self.frames_received += 1
+            self.max_lag = max(self.max_lag, len(self._deque))
+            self._cv.notify_all()
+        self._notify()
+        return True
+
+    def get(self, timeout=None):
+        """Get the next frame from the queue.
+
+        Args:
+            timeout: Maximum time to wait for a frame in seconds, or None to wait indefinitely.
+
+        Returns:
+            The next Frame or None if the timeout expired or the consumer is closed and empty.
+        """
+        with self._cv:
+            if not self._cv.wait_for(lambda: self._deque or self._closed, timeout):
+                return None
+            if not self._deque:
+                return None
+            frame = self._deque.popleft()
+            self._cv.notify_all()
+            return frame
+
+    def close(self):
+        """Stop accepting frames and release any frames still waiting in the queue.
+
+        Frames already handed out by get() are not affected and must still be released.
+        """
+        with self._cv:
+            self._closed = True
+            while self._deque:
+                self._deque.popleft().decr_ref_count()
+            self._cv.notify_all()
+        self._notify()
+
+    def finish(self):
+        """Stop accepting frames but allow the frames already queued to be consumed."""
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+        self._notify()
+
+    def __iter__(self):
+        """Yield frames until the consumer is closed and its queue is empty."""
+        while True:
+            frame = self.get()
+            if frame is None:
+                return
+            yield frame
+
+    def stats(self):
+        """Return a dict of statistics for this consumer."""
+        return {
+            'policy': self.policy,
+            'lag': self.lag,
+            'max_lag': self.max_lag,
+            'received': self.frames_received,
+            'dropped': self.frames_dropped,
+        }
+
+
+class VideoStream:
+    """Reads video frames from a camera on a dedicated thread into a pool of frame buffers.
+
+    The frame geometry is taken from the camera's ROI format when the stream is created, so the
+    ROI and image type must be configured beforehand and must not change while streaming.
+
+    Args:
+        camera_id: ID of an open and initialized camera.
+        pool_size: Number of frame buffers to allocate.
+        timeout_ms: Timeout passed to ASIGetVideoDataInto().
+        validate_frames: Check the sync words of every frame (see asi.integrity) and count the
+            frames where they are wrong. Only meaningful for raw frames from cameras that send
+            sync words, such as the ASI178.
+        backend: Module implementing the ASI API. Defaults to the asi package. Any object with the
+            same functions and constants can be substituted, e.g. for testing without hardware.
+        registry: asi.metrics.Registry the stream reports to. Defaults to asi.metrics.REGISTRY.
+
+    Attributes:
+        frames_read: Number of frames read from the camera.
+        timeouts: Number of calls to ASIGetVideoDataInto() that timed out.
+        errors: Number of calls to ASIGetVideoDataInto() that failed.
+        camera_dropped: Number of frames the camera reported as dropped while streaming, from
+            ASIGetDroppedFrames().
+        sync_errors: Number of frames with invalid sync words, if validate_frames is True.
+    """
+
+    def __init__(
+            self,
+            camera_id,
+            pool_size=FRAME_POOL_SIZE,
+            timeout_ms=500,
+            validate_frames=False,
+            backend=None,
+            registry=None,
+        ):
+        self.camera_id = camera_id
+        self.timeout_ms = timeout_ms
+        self.validate_frames = validate_frames
+        self._backend = asi if backend is None else backend
+
+        self.pool = FramePool(pool_size, *image_geometry(camera_id, self._backend))
+
+        self.frames_read = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.camera_dropped = 0
+        self.sync_errors = 0
+        self.last_error = None
+        self._last_dropped_count = 0
+        self._next_dropped_poll = 0.0
+
+        registry = metrics.REGISTRY if registry is None else registry
+        self._read_latency = registry.stage_latency('read')
+        registry.add_collector(self)
+
+        self._consumers = []
+        self._consumers_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def shape(self):
+        """Shape of each image in the stream."""
+        return self.pool.shape
+
+    @property
+    def dtype(self):
+        """Numpy dtype of each image in the stream."""
+        return self.pool.dtype
+
+    def add_consumer(self, name, maxsize=FRAME_POOL_SIZE // 2, policy=BLOCK, notify=None):
+        """Register a new consumer of frames.
+
+        Consumers may be added before or while the stream is running. Consumers using the BLOCK
+        policy will stall the reader thread when their queue is full, so maxsize should be well
+        below the pool size to leave frames for the other consumers.
+
+        Args:
+            name: Name used to identify the consumer in stats.
+            maxsize: Maximum number of frames waiting in the consumer's queue. Ignored for the
+                LATEST policy which always holds at most one frame.
+            policy: One of BLOCK, DROP_OLDEST or LATEST.
+            notify: Optional callable invoked from the reader thread whenever a frame is queued or
+                the consumer is closed, for waking up consumers that do not block in get().
+
+        Returns:
+            A Consumer object.
+        """
+        consumer = Consumer(name, maxsize, policy, notify)
+        with self._consumers_lock:
+            self._consumers.append(consumer)
+        return consumer
+
+    def remove_consumer(self, consumer):
+        """Unregister a consumer and release any frames waiting in its queue."""
+        with self._consumers_lock:
+            self._consumers.remove(consumer)
+        consumer.close()
+
+    def start(self):
+        """Start video capture and the reader thread."""
+        if self._thread is not None:
+            raise RuntimeError('stream already started')
+        self._backend.ASICheck(self._backend.ASIStartVideoCapture(self.camera_id))
+        # The camera may or may not reset its count of dropped frames when capture starts
+        self._last_dropped_count = 0
+        self._poll_dropped_frames()
+        # Each reader thread gets its own event, so a thread abandoned by suspend() still stops
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._read_frames, args=(self._stop_event,), name='asi-reader', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the reader thread and video capture.
+
+        Frames already queued for consumers remain available; iterating over a consumer ends once
+        its queue has been drained.
+        """
+        if self._thread is None:
+            return
+        self._stop_reader(None)
+        self._backend.ASICheck(self._backend.ASIStopVideoCapture(self.camera_id))
+        with self._consumers_lock:
+            consumers = list(self._consumers)
+        for consumer in consumers:
+            consumer.finish()
+
+    def suspend(self):
+        """Stop the reader thread and video capture but leave the consumers open.
+
+        This is how asi.watchdog recovers a faulty camera without ending the stream: consumers,
+        and anything they feed such as an open output file, simply receive the frames read after
+        resume(). Errors stopping video capture are logged and ignored, as the camera may be
+        gone. A reader thread stuck in the ASI library is abandoned after SUSPEND_TIMEOUT.
+        """
+        if self._thread is None:
+            return
+        self._stop_reader(max(self.timeout_ms, 0) / 1000 + SUSPEND_TIMEOUT)
+        rtn = self._backend.ASIStopVideoCapture(self.camera_id)
+        if rtn != self._backend.ASI_SUCCESS:
+            logger.warning('ASIStopVideoCapture returned %d', rtn)
+
+    def resume(self, camera_id=None):
+        """Restart video capture and the reader thread after suspend().
+
+        Frame indices carry on from where they were.
+
+        Args:
+            camera_id: ID of the camera if it changed, e.g. because it was reopened.
+
+        Raises:
+            ValueError if the ROI format of the camera no longer matches the frame buffers.
+        """
+        if camera_id is not None:
+            self.camera_id = camera_id
+        shape, dtype = image_geometry(self.camera_id, self._backend)
+        if tuple(shape) != self.pool.shape or np.dtype(dtype) != self.pool.dtype:
+            raise ValueError(
+                f'Camera now produces {np.dtype(dtype).name} images of shape {tuple(shape)} '
+                f'but the stream has {self.pool.dtype.name} buffers of shape {self.pool.shape}'
+            )
+        self.start()
+
+    def _stop_reader(self, timeout):
+        """Stop the reader thread, waiting at most timeout seconds unless it is None."""
+        self._stop_event.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error('Reader thread did not stop within %.1f s, abandoning it', timeout)
+        self._thread = None
+
+    @property
+    def running(self):
+        """True if the reader thread is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _read_frames(self, stop_event):
+        """Reader thread body: fill frames from the camera and dispatch them to consumers."""
+        backend = self._backend
+        frame = None
+        while not stop_event.is_set():
+            if frame is None:
+                frame = self.pool.get(stop_event)
+                if frame is None:
+                    break
+
+            start = time.perf_counter()
+            rtn = backend.ASIGetVideoDataInto(self.camera_id, frame.buffer, self.timeout_ms)
+            if stop_event is not self._stop_event:
+                # Abandoned by suspend() and replaced by a new reader thread
+                break
+            if time.monotonic() >= self._next_dropped_poll:
+                self._poll_dropped_frames()
+            if rtn == backend.ASI_ERROR_TIMEOUT:
+                self.timeouts += 1
+                continue
+            if rtn != backend.ASI_SUCCESS:
+                self.errors += 1
+                self.last_error = rtn
+                logger.error('ASIGetVideoDataInto returned %d', rtn)
+                stop_event.wait(0.01)
+                continue
+
+            frame.index = self.frames_read
+            frame.timestamp = time.time()
+            self.frames_read += 1
+            self._read_latency.observe_since(start)
+            if self.validate_frames and not integrity.validate(frame.buffer[np.newaxis])[0]:
+                self.sync_errors += 1
+
+            with self._consumers_lock:
+                consumers = list(self._consumers)
+            for consumer in consumers:
+                consumer.put(frame, stop_event)
+
+            # Drop the reader's own reference. If no consumer took the frame it goes straight back
+            # to the pool.
+            frame.decr_ref_count()
+            frame = None
+
+        if frame is not None:
+            frame.decr_ref_count()
+        self._poll_dropped_frames()
+
+    def _poll_dropped_frames(self):
+        """Add the frames dropped by the camera since the last call to camera_dropped."""
+        self._next_dropped_poll = time.monotonic() + DROPPED_FRAMES_POLL_INTERVAL
+        rtn, count = self._backend.ASIGetDroppedFrames(self.camera_id)
+        if rtn != self._backend.ASI_SUCCESS:
+            return
+        if count >= self._last_dropped_count:
+            self.camera_dropped += count - self._last_dropped_count
+        else:
+            # The camera reset its count
+            self.camera_dropped += count
+        self._last_dropped_count = count
+
+    def stats(self):
+        """Return a dict of statistics for the stream and each of its consumers."""
+        with self._consumers_lock:
+            consumers = list(self._consumers)
+        return {
+            'frames_read': self.frames_read,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'camera_dropped': self.camera_dropped,
+            'sync_errors': self.sync_errors,
+            'pool_size': self.pool.size,
+            'pool_free': self.pool.free,
+            'pool_exhausted': self.pool.exhausted_count,
+            'consumers': {consumer.name: consumer.stats() for consumer in consumers},
+        }
+
+    def collect_metrics(self):
+        """Return asi.metrics.Sample values for the stream and its consumers."""
+        camera = {'camera': str(self.camera_id)}
+        samples = [
+            metrics.Sample('asi_frames_read_total', 'counter', 'Frames read from the camera',
+                           camera, self.frames_read),
+            metrics.Sample('asi_read_timeouts_total', 'counter',
+                           'Calls to ASIGetVideoDataInto() that timed out', camera, self.timeouts),
+            metrics.Sample('asi_read_errors_total', 'counter',
+                           'Calls to ASIGetVideoDataInto() that failed', camera, self.errors),
+            metrics.Sample('asi_camera_dropped_frames_total', 'counter',
+                           'Frames dropped by the camera according to ASIGetDroppedFrames()',
+                           camera, self.camera_dropped),
+            metrics.Sample('asi_sync_errors_total', 'counter', 'Frames with invalid sync words',
+                           camera, self.sync_errors),
+            metrics.Sample('asi_pool_exhausted_total', 'counter',
+                           'Times the reader had to wait for a free frame buffer', camera,
+                           self.pool.exhausted_count),
+            metrics.Sample('asi_pool_free_frames', 'gauge', 'Free frame buffers in the pool',
+                           camera, self.pool.free),
+        ]
+        with self._consumers_lock:
+            consumers = list(self._consumers)
+        for consumer in consumers:
+            samples.extend(metrics.queue_samples(
+                f'{self.camera_id}/{consumer.name}', consumer.lag, consumer.max_lag,
+                consumer.frames_dropped,
+            ))
+        return samples
@@ -0,0 +1,373 @@
+"""Tuning of the USB bandwidth and readout settings of a camera for each host.
+
+The highest frame rate a camera sustains without dropping frames depends on the host USB
+controller, the cable and the camera, so no fixed value of ASI_BANDWIDTHOVERLOAD and
+ASI_HIGH_SPEED_MODE suits every deployment. tune() sweeps these settings over a set of image types
+and ROI formats. At each point it streams for a while and measures the sustained frame rate,
+the frames the camera reports as dropped by ASIGetDroppedFrames(), read timeouts and errors, and
+optionally frames with corrupt sync words (see asi.integrity). choose() then picks the setting
+with the highest throughput that loses no frames in any format.
+
+Profiles are stored in a JSON file keyed by host name and camera serial number, or by camera
+name for cameras without a serial number. The file is ~/.config/asi/profiles.json unless the
+environment variable ASI_PROFILES names another file. asi.camera.Camera applies the profile of
+the camera on the current host when it opens it:
+
+    results = tune.tune(camera_id)
+    profile = tune.choose(results)
+    tune.ProfileStore().put(tune.host_name(), tune.camera_serial(camera_id), profile)
+
+tune_camera.py is a command-line front end.
+"""
+
+import datetime
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+import numpy as np
+
+import asi
+from asi import integrity
+from asi import watchdog
+
+
+logger = logging.getLogger(__name__)
+
+# ASI_BANDWIDTHOVERLOAD values swept by default. tune() clamps values outside the range of a
+# camera's control to it and measures each resulting value once.
+BANDWIDTHS = (40, 50, 60, 70, 80, 90, 100)
+
+# ASI_HIGH_SPEED_MODE values swept by default
+HIGH_SPEED_MODES = (0, 1)
+
+# Image types swept by default, by name, mapped to the names of the ASI constants
+IMG_TYPES = {
+    'raw8': 'ASI_IMG_RAW8',
+    'raw16': 'ASI_IMG_RAW16',
+    'rgb24': 'ASI_IMG_RGB24',
+    'y8': 'ASI_IMG_Y8',
+}
+
+# Time in seconds that frames are counted at each point of a sweep
+MEASURE_SECONDS = 2.0
+
+# Time in seconds that frames are read and discarded after a setting changes, before counting
+SETTLE_SECONDS = 0.5
+
+# Maximum time to wait for a frame in milliseconds
+TIMEOUT_MS = 1000
+
+# Environment variable naming the profile file
+PROFILES_ENV = 'ASI_PROFILES'
+
+
+def profile_path():
+    """Return the path of the profile file, from ASI_PROFILES or in ~/.config/asi."""
+    path = os.environ.get(PROFILES_ENV)
+    if path:
+        return path
+    config_home = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+    return os.path.join(config_home, 'asi', 'profiles.json')
+
+
+def host_name():
+    """Return the name of this host, the first part of the profile key."""
+    return platform.node()
+
+
+def camera_serial(camera_id, backend=None):
+    """Return the serial number of an open camera, or its name if it has none."""
+    backend = asi if backend is None else backend
+    get_serial = getattr(backend, 'ASIGetSerialNumber', None)
+    if get_serial is not None:
+        rtn, serial = get_serial(camera_id)
+        if rtn == backend.ASI_SUCCESS and serial.strip('0'):
+            return serial
+    return backend.ASICheck(backend.ASIGetCameraPropertyByID(camera_id)).Name
+
+
+class ProfileStore:
+    """JSON file of tuned profiles keyed by host and camera serial number.
+
+    Each profile is a dict with at least the keys 'bandwidth' and 'high_speed_mode', as returned
+    by choose(). The file is rewritten atomically by put(), so a crash cannot corrupt it.
+
+    Args:
+        path: Path of the file. Defaults to profile_path().
+    """
+
+    def __init__(self, path=None):
+        self.path = profile_path() if path is None else path
+
+    @staticmethod
+    def key(host, serial):
+        """Return the key of the profile for a camera on a host."""
+        return f'{host}/{serial}'
+
+    def load(self):
+        """Return the dict of all profiles keyed by key(), empty if the file does not exist."""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                profiles = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning('Ignoring unreadable profile file %s: %s', self.path, e)
+            return {}
+        return profiles if isinstance(profiles, dict) else {}
+
+    def get(self, host, serial):
+        """Return the profile for a camera on a host, or None."""
+        return self.load().get(self.key(host, serial))
+
+    def put(self, host, serial, profile):
+        """Store the profile for a camera on a host, replacing any earlier one."""
+        profiles = self.load()
+        profiles[self.key(host, serial)] = profile
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(profiles, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def find(self, camera_id, backend=None):
+        """Return the profile for an open camera on this host, or None.
+
+        The camera is only asked for its serial number if the file has any profiles.
+        """
+        profiles = self.load()
+        if not profiles:
+            return None
+        return profiles.get(self.key(host_name(), camera_serial(camera_id, backend)))
+
+
+def measure(camera_id, seconds=MEASURE_SECONDS, validate_frames=False, backend=None):
+    """Stream from a camera with its current settings and count frames and faults.
+
+    Args:
+        camera_id: ID of an open camera that is not capturing.
+        seconds: Time in seconds to count frames for, after SETTLE_SECONDS.
+        validate_frames: Check the sync words of every frame (see asi.integrity).
+        backend: Module implementing the ASI API. Defaults to the asi package.
+
+    Returns:
+        Dict with the number of frames read, the frame rate 'fps', 'mb_per_s', and the numbers of
+        frames 'dropped' by the camera, read 'timeouts', read 'errors' and 'sync_errors'.
+    """
+    backend = asi if backend is None else backend
+    size = backend.GetImageSizeBytes(camera_id)
+    buffer = np.zeros(size, dtype=np.uint8)
+    counts = {'frames': 0, 'timeouts': 0, 'errors': 0, 'sync_errors': 0}
+    backend.ASICheck(backend.ASIStartVideoCapture(camera_id))
+    try:
+        settle_end = time.monotonic() + SETTLE_SECONDS
+        while time.monotonic() < settle_end:
+            backend.ASIGetVideoDataInto(camera_id, buffer, TIMEOUT_MS)
+        dropped = backend.ASICheck(backend.ASIGetDroppedFrames(camera_id))
+        start = time.perf_counter()
+        end = start + seconds
+        while time.perf_counter() < end:
+            rtn = backend.ASIGetVideoDataInto(camera_id, buffer, TIMEOUT_MS)
+            if rtn == backend.ASI_ERROR_TIMEOUT:
+                counts['timeouts'] += 1
+            elif rtn != backend.ASI_SUCCESS:
+                counts['errors'] += 1
+            else:
+                counts['frames'] += 1
+                if validate_frames and not integrity.validate(buffer[np.newaxis])[0]:
+                    counts['sync_errors'] += 1
+        elapsed = time.perf_counter() - start
+        counts['dropped'] = backend.ASICheck(backend.ASIGetDroppedFrames(camera_id)) - dropped
+    finally:
+        backend.ASIStopVideoCapture(camera_id)
+    counts['fps'] = counts['frames'] / elapsed
+    counts['mb_per_s'] = counts['fps'] * size / 1e6
+    return counts
+
+
+def drop_free(result):
+    """Return True if a result of measure() lost no frames and had no read faults."""
+    return (
+        result['frames'] > 0
+        and not result['dropped']
+        and not result['timeouts']
+        and not result['errors']
+        and not result['sync_errors']
+    )
+
+
+def tune(
+        camera_id,
+        bandwidths=BANDWIDTHS,
+        high_speed_modes=HIGH_SPEED_MODES,
+        img_types=('raw8', 'raw16'),
+        rois=None,
+        seconds=MEASURE_SECONDS,
+        exposure_us=None,
+        validate_frames=False,
+        backend=None,
+    ):
+    """Measure a camera at every combination of the given settings.
+
+    The configuration of the camera (see asi.watchdog.read_config()) is restored afterwards.
+    Image types and ROI formats the camera does not support are skipped.
+
+    Args:
+        camera_id: ID of an open and initialized camera that is not capturing.
+        bandwidths: ASI_BANDWIDTHOVERLOAD values. Values outside the range of the control are
+            clamped to it, and values that are the same once clamped are measured once.
+        high_speed_modes: ASI_HIGH_SPEED_MODE values. Ignored if the camera lacks the control.
+        img_types: Image type names from IMG_TYPES.
+        rois: List of (width, height, binning) ROI formats. Defaults to the full sensor unbinned.
+        seconds: Time in seconds to measure at each combination.
+        exposure_us: Exposure time to use, or None to keep the current one. It must be short for
+            the frame rate to be limited by the USB bandwidth.
+        validate_frames: Check the sync words of every frame. Only meaningful for raw frames from
+            cameras that send sync words, such as the ASI178.
+        backend: Module implementing the ASI API. Defaults to the asi package.
+
+    Returns:
+        List of result dicts, the return values of measure() with the keys 'bandwidth',
+        'high_speed_mode', 'img_type', 'width', 'height' and 'bin' added.
+    """
+    backend = asi if backend is None else backend
+    info = backend.ASICheck(backend.ASIGetCameraPropertyByID(camera_id))
+    if rois is None:
+        rois = [(info.MaxWidth // 8 * 8, info.MaxHeight // 2 * 2, 1)]
+    config = watchdog.read_config(camera_id, backend)
+    if backend.ASI_HIGH_SPEED_MODE not in config.controls:
+        high_speed_modes = (None,)
+    bandwidths = clamp_bandwidths(camera_id, bandwidths, backend)
+
+    results = []
+    try:
+        if exposure_us is not None:
+            backend.ASICheck(backend.ASISetControlValue(
+                camera_id, backend.ASI_EXPOSURE, int(exposure_us), backend.ASI_FALSE
+            ))
+        for img_type in img_types:
+            for width, height, binning in rois:
+                status = backend.ASISetROIFormat(
+                    camera_id, width, height, binning, getattr(backend, IMG_TYPES[img_type])
+                )
+                if status != backend.ASI_SUCCESS:
+                    logger.warning('Skipping %dx%d bin%d %s: ASISetROIFormat() returned %d',
+                                   width, height, binning, img_type, status)
+                    continue
+                for high_speed_mode in high_speed_modes:
+                    if high_speed_mode is not None:
+                        backend.ASICheck(backend.ASISetControlValue(
+                            camera_id, backend.ASI_HIGH_SPEED_MODE, high_speed_mode,
+                            backend.ASI_FALSE,
+                        ))
+                    for bandwidth in bandwidths:
+                        backend.ASICheck(backend.ASISetControlValue(
+                            camera_id, backend.ASI_BANDWIDTHOVERLOAD, bandwidth, backend.ASI_FALSE
+                        ))
+                        result = {
+                            'bandwidth': bandwidth,
+                            'high_speed_mode': high_speed_mode,
+                            'img_type': img_type,
+                            'width': width,
+                            'height': height,
+                            'bin': binning,
+                        }
+                        result.update(measure(camera_id, seconds, validate_frames, backend))
+                        logger.info('%s', format_result(result))
+                        results.append(result)
+    finally:
+        watchdog.write_config(camera_id, config, backend)
+    return results
+
+
+def clamp_bandwidths(camera_id, bandwidths, backend=None):
+    """Clamp ASI_BANDWIDTHOVERLOAD values to the range of the control of a camera.
+
+    The SDK clamps out of range values itself, so without this a sweep would measure the same
+    setting several times and record it under values that were never applied.
+
+    Returns:
+        The clamped values in their original order, without duplicates.
+    """
+    backend = asi if backend is None else backend
+    for index in range(backend.ASICheck(backend.ASIGetNumOfControls(camera_id))):
+        caps = backend.ASICheck(backend.ASIGetControlCaps(camera_id, index))
+        if caps.ControlType == backend.ASI_BANDWIDTHOVERLOAD:
+            break
+    else:
+        raise ValueError(f'Camera {camera_id} has no ASI_BANDWIDTHOVERLOAD control')
+    clamped = []
+    for bandwidth in bandwidths:
+        value = max(caps.MinValue, min(caps.MaxValue, int(bandwidth)))
+        if value != bandwidth:
+            logger.info('Bandwidth %s is outside of [%d, %d], using %d', bandwidth,
+                        caps.MinValue, caps.MaxValue, value)
+        if value not in clamped:
+            clamped.append(value)
+    return clamped
+
+
+def choose(results):
+    """Choose the best setting from the results of tune().
+
+    The setting of ASI_BANDWIDTHOVERLOAD and ASI_HIGH_SPEED_MODE chosen is the one with the
+    highest total throughput among those that were drop-free in every format measured, preferring
+    the lower bandwidth in a tie. If no setting was drop-free everywhere, the one losing the
+    fewest frames is chosen instead.
+
+    Returns:
+        Profile dict with the chosen 'bandwidth' and 'high_speed_mode', whether it is
+        'drop_free', the drop-free format with the highest frame rate at that setting ('img_type',
+        'width', 'height', 'bin', 'fps' and 'mb_per_s'), and the time it was 'tuned'.
+
+    Raises:
+        ValueError if results is empty.
+    """
+    if not results:
+        raise ValueError('No results to choose from')
+    settings = {}
+    for result in results:
+        settings.setdefault((result['bandwidth'], result['high_speed_mode']), []).append(result)
+
+    def rank(item):
+        (bandwidth, high_speed_mode), points = item
+        clean = all(drop_free(point) for point in points)
+        lost = sum(point['dropped'] + point['timeouts'] + point['errors'] + point['sync_errors']
+                   for point in points)
+        throughput = sum(point['mb_per_s'] for point in points)
+        return (clean, -lost, throughput, -bandwidth, -(high_speed_mode or 0))
+
+    (bandwidth, high_speed_mode), points = max(settings.items(), key=rank)
+    clean_points = [point for point in points if drop_free(point)] or points
+    best = max(clean_points, key=lambda point: point['fps'])
+    return {
+        'bandwidth': bandwidth,
+        'high_speed_mode': high_speed_mode,
+        'drop_free': all(drop_free(point) for point in points),
+        'img_type': best['img_type'],
+        'width': best['width'],
+        'height': best['height'],
+        'bin': best['bin'],
+        'fps': best['fps'],
+        'mb_per_s': best['mb_per_s'],
+        'tuned': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def format_result(result):
+    """Return a one line summary of a result of tune()."""
+    high_speed = '-' if result['high_speed_mode'] is None else result['high_speed_mode']
+    return (
+        f'bandwidth {result["bandwidth"]:>3} high speed {high_speed} '
+        f'{result["width"]:>5}x{result["height"]:<5} bin{result["bin"]} {result["img_type"]:<5} '
+        f'{result["fps"]:8.1f} FPS {result["mb_per_s"]:8.1f} MB/s  dropped {result["dropped"]} '
+        f'timeouts {result["timeouts"]} errors {result["errors"]} sync {result["sync_errors"]}'
+    )
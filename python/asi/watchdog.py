@@ -0,0 +1,425 @@
+"""In-process detection of and recovery from camera faults, without rebooting the host.
+
+Cameras occasionally wedge or drop off the USB bus during long unattended runs: video reads stop
+returning frames, ASIGetExpStatus() reports an exposure in progress forever, or every call fails
+with ASI_ERROR_CAMERA_REMOVED. The only cure used to be rebooting the computer. Watchdog instead
+closes the camera, waits for it to be enumerated again, reopens and reinitializes it, restores its
+configuration and resumes capture:
+
+    with VideoStream(camera_id) as stream, Watchdog(camera_id, stream) as watchdog:
+        writer = stream.add_consumer('disk', policy=BLOCK)
+        ...
+
+A VideoStream is recovered in place with VideoStream.suspend() and VideoStream.resume(), so its
+consumers never notice anything but a gap in the frames, and an output file being written from
+one of them stays open. The configuration restored is what read_config() captures: the ROI
+format (size, binning and image type), the start position, the values and automatic modes of all
+writable controls and, for cameras with a trigger input, the camera mode. It is refreshed
+periodically while the camera is healthy, so changes made by auto gain control or by the user
+are not lost.
+
+Single exposures are guarded by wait_exposure(), which gives up on an exposure that is still in
+progress well after it should have ended, recovers the camera and reports ASI_EXP_FAILED so that
+the exposure can be retried with the camera ID in Watchdog.camera_id.
+
+Each recovery is logged with the time it took, which is also recorded in the
+asi_camera_recovery_seconds histogram of the metrics registry.
+"""
+
+import logging
+import threading
+import time
+
+import asi
+from asi import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Time in seconds without a new frame after which a running stream is considered stalled
+STALL_TIMEOUT = 2.0
+
+# Interval in seconds between checks of the stream by the watchdog thread
+POLL_INTERVAL = 0.1
+
+# Interval in seconds between refreshes of the saved camera configuration
+CONFIG_INTERVAL = 5.0
+
+# Time in seconds that a recovery keeps waiting for the camera to reappear before giving up
+RECOVERY_TIMEOUT = 30.0
+
+# Interval in seconds between attempts to reopen the camera during a recovery
+RETRY_INTERVAL = 0.25
+
+# Time in seconds allowed for an exposure beyond the exposure time before it is considered stuck
+EXPOSURE_GRACE = 5.0
+
+# Upper bounds of the buckets of the recovery time histogram, in seconds
+RECOVERY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class CameraConfig:
+    """Settings of an open camera that are lost when it is closed or power cycled.
+
+    Attributes:
+        name: Name of the camera model, used to find the camera again after it was removed.
+        roi: Tuple of (width, height, binning, image type) from ASIGetROIFormat().
+        start_pos: Tuple of (start x, start y) from ASIGetStartPos().
+        controls: Dict of (value, auto) tuples keyed by the control type of each writable control.
+        mode: ASI_MODE_* camera mode from ASIGetCameraMode() if the camera has a trigger input
+            (IsTriggerCam), otherwise None.
+    """
+
+    def __init__(self, name, roi, start_pos, controls, mode=None):
+        self.name = name
+        self.roi = tuple(roi)
+        self.start_pos = tuple(start_pos)
+        self.controls = dict(controls)
+        self.mode = mode
+
+    def __eq__(self, other):
+        if not isinstance(other, CameraConfig):
+            return NotImplemented
+        return (
+            (self.name, self.roi, self.start_pos, self.controls, self.mode)
+            == (other.name, other.roi, other.start_pos, other.controls, other.mode)
+        )
+
+    def __repr__(self):
+        return (
+            f'CameraConfig({self.name!r}, roi={self.roi}, start_pos={self.start_pos}, '
+            f'controls={self.controls}, mode={self.mode})'
+        )
+
+
+def read_config(camera_id, backend=None):
+    """Read the configuration of an open camera.
+
+    Raises:
+        ASIError if any of the calls to the ASI library fails.
+    """
+    backend = asi if backend is None else backend
+    info = backend.ASICheck(backend.ASIGetCameraPropertyByID(camera_id))
+    roi = backend.ASICheck(backend.ASIGetROIFormat(camera_id))
+    start_pos = backend.ASICheck(backend.ASIGetStartPos(camera_id))
+    controls = {}
+    for index in range(backend.ASICheck(backend.ASIGetNumOfControls(camera_id))):
+        caps = backend.ASICheck(backend.ASIGetControlCaps(camera_id, index))
+        if caps.IsWritable:
+            value, auto = backend.ASICheck(backend.ASIGetControlValue(camera_id, caps.ControlType))
+            controls[caps.ControlType] = (value, bool(auto))
+    mode = None
+    if info.IsTriggerCam:
+        mode = backend.ASICheck(backend.ASIGetCameraMode(camera_id))
+    return CameraConfig(info.Name, roi, start_pos, controls, mode)
+
+
+def write_config(camera_id, config, backend=None):
+    """Apply a configuration from read_config() to an open camera.
+
+    The ROI format is set before the start position, since setting the format moves the ROI. The
+    camera mode of trigger cameras is set first; like the format, it can only be changed while
+    capture is stopped.
+
+    Raises:
+        ASIError if any of the calls to the ASI library fails.
+    """
+    backend = asi if backend is None else backend
+    if config.mode is not None:
+        backend.ASICheck(backend.ASISetCameraMode(camera_id, config.mode))
+    backend.ASICheck(backend.ASISetROIFormat(camera_id, *config.roi))
+    backend.ASICheck(backend.ASISetStartPos(camera_id, *config.start_pos))
+    for control_type, (value, auto) in config.controls.items():
+        backend.ASICheck(backend.ASISetControlValue(
+            camera_id, control_type, int(value), backend.ASI_TRUE if auto else backend.ASI_FALSE
+        ))
+
+
+def find_camera(name, backend=None, preferred_id=None):
+    """Enumerate the connected cameras and return the ID of one with the given name.
+
+    Args:
+        name: Name of the camera model, as in ASI_CAMERA_INFO.
+        backend: Module implementing the ASI API. Defaults to the asi package.
+        preferred_id: Camera ID to return if several cameras have the name, e.g. the ID the camera
+            had before it was removed.
+
+    Returns:
+        A camera ID, or None if no connected camera has the name.
+    """
+    backend = asi if backend is None else backend
+    camera_ids = []
+    for index in range(backend.ASIGetNumOfConnectedCameras()):
+        rtn, info = backend.ASIGetCameraProperty(index)
+        if rtn == backend.ASI_SUCCESS and info.Name == name:
+            camera_ids.append(info.CameraID)
+    if preferred_id in camera_ids:
+        return preferred_id
+    return camera_ids[0] if camera_ids else None
+
+
+class Watchdog:
+    """Watches a camera and recovers it when it stalls or is removed.
+
+    The camera configuration is read when the watchdog is created, so the camera must be fully
+    configured by then. While started, a thread checks the stream every poll_interval seconds
+    with check(). Recovery can also be triggered directly with recover().
+
+    Args:
+        camera_id: ID of an open and initialized camera.
+        stream: asi.stream.VideoStream reading from the camera, or None if the camera is used for
+            single exposures only. It is resumed after a recovery if it was running.
+        stall_timeout: Time in seconds without a new frame after which a running stream is
+            recovered.
+        poll_interval: Interval in seconds between checks by the watchdog thread.
+        config_interval: Interval in seconds between refreshes of the saved configuration.
+        recovery_timeout: Time in seconds a recovery waits for the camera to reappear.
+        on_recover: Optional callable invoked with the new camera ID after every successful
+            recovery, e.g. to update an asi.camera.Camera or restart an exposure.
+        backend: Module implementing the ASI API. Defaults to the asi package.
+        registry: asi.metrics.Registry the watchdog reports to. Defaults to asi.metrics.REGISTRY.
+
+    Attributes:
+        camera_id: Current ID of the camera, which may change when it is recovered.
+        config: CameraConfig restored on recovery.
+        recoveries: Number of successful recoveries.
+        failures: Number of recoveries that gave up.
+        last_recovery_seconds: Duration of the last successful recovery, or None.
+    """
+
+    def __init__(
+            self,
+            camera_id,
+            stream=None,
+            stall_timeout=STALL_TIMEOUT,
+            poll_interval=POLL_INTERVAL,
+            config_interval=CONFIG_INTERVAL,
+            recovery_timeout=RECOVERY_TIMEOUT,
+            on_recover=None,
+            backend=None,
+            registry=None,
+        ):
+        self._backend = asi if backend is None else backend
+        self.camera_id = camera_id
+        self.stream = stream
+        self.stall_timeout = stall_timeout
+        self.poll_interval = poll_interval
+        self.config_interval = config_interval
+        self.recovery_timeout = recovery_timeout
+        self.on_recover = on_recover
+        self.config = read_config(camera_id, self._backend)
+        self.recoveries = 0
+        self.failures = 0
+        self.last_recovery_seconds = None
+        # Set when a recovery of a running stream gave up, so that the next check tries again
+        self._resume_pending = False
+
+        registry = metrics.REGISTRY if registry is None else registry
+        labels = {'camera': self.config.name}
+        self._recovery_time = registry.histogram(
+            'asi_camera_recovery_seconds', 'Time taken to recover a faulty camera', labels,
+            RECOVERY_BUCKETS,
+        )
+        self._failure_count = registry.counter(
+            'asi_camera_recovery_failures_total', 'Camera recoveries that gave up', labels
+        )
+
+        self._lock = threading.RLock()
+        self._next_config = time.monotonic() + config_interval
+        self._reset_progress()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _reset_progress(self):
+        """Start measuring stalls from now."""
+        stream = self.stream
+        self._frames_seen = stream.frames_read if stream is not None else 0
+        self._errors_seen = stream.errors if stream is not None else 0
+        self._last_progress = time.monotonic()
+
+    def start(self):
+        """Start the watchdog thread."""
+        if self._thread is not None:
+            raise RuntimeError('watchdog already started')
+        self._reset_progress()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='asi-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the watchdog thread, waiting for a recovery in progress to finish."""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self.check()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Watchdog check failed')
+
+    def check(self):
+        """Check the stream once and recover the camera if it is faulty.
+
+        Also refreshes the saved configuration every config_interval seconds while the camera is
+        healthy.
+
+        Returns:
+            The reason for recovering the camera, or None if it is healthy or not streaming.
+        """
+        with self._lock:
+            reason = self._fault()
+            if reason is not None:
+                self.recover(reason)
+            elif time.monotonic() >= self._next_config:
+                self.refresh_config()
+            return reason
+
+    def _fault(self):
+        """Return a description of what is wrong with the stream, or None."""
+        if self._resume_pending:
+            return 'camera not recovered yet'
+        stream = self.stream
+        if stream is None or not stream.running:
+            self._reset_progress()
+            return None
+        now = time.monotonic()
+        errors = stream.errors
+        if errors != self._errors_seen:
+            self._errors_seen = errors
+            if stream.last_error == self._backend.ASI_ERROR_CAMERA_REMOVED:
+                return 'camera removed'
+        if stream.frames_read != self._frames_seen:
+            self._frames_seen = stream.frames_read
+            self._last_progress = now
+        elif now - self._last_progress > self.stall_timeout:
+            return f'no frames for {now - self._last_progress:.1f} s'
+        return None
+
+    def refresh_config(self):
+        """Read the configuration of the camera again, keeping the old one if that fails."""
+        with self._lock:
+            self._next_config = time.monotonic() + self.config_interval
+            try:
+                self.config = read_config(self.camera_id, self._backend)
+            except self._backend.ASIError as e:
+                logger.warning('Cannot read configuration of camera %d: %s', self.camera_id, e)
+
+    def wait_exposure(self, timeout, poll_interval=0.01):
+        """Wait for a single exposure started with ASIStartExposure() to end.
+
+        The camera is recovered if the exposure is still in progress after timeout seconds or the
+        camera was removed, in which case the exposure must be started again with the new
+        camera_id.
+
+        Args:
+            timeout: Maximum time in seconds to wait, typically the exposure time plus
+                EXPOSURE_GRACE.
+            poll_interval: Interval in seconds between calls to ASIGetExpStatus().
+
+        Returns:
+            The final ASI_EXP_* status: ASI_EXP_SUCCESS, or ASI_EXP_FAILED if the exposure failed
+            or the camera was recovered.
+        """
+        backend = self._backend
+        deadline = time.monotonic() + timeout
+        while True:
+            rtn, status = backend.ASIGetExpStatus(self.camera_id)
+            if rtn == backend.ASI_ERROR_CAMERA_REMOVED:
+                reason = 'camera removed'
+                break
+            if rtn == backend.ASI_SUCCESS and status != backend.ASI_EXP_WORKING:
+                return status
+            if time.monotonic() >= deadline:
+                reason = f'exposure still in progress after {timeout:.1f} s'
+                backend.ASIStopExposure(self.camera_id)
+                break
+            time.sleep(poll_interval)
+        self.recover(reason)
+        return backend.ASI_EXP_FAILED
+
+    def recover(self, reason='requested'):
+        """Close, reopen and reconfigure the camera, then resume the stream if it was running.
+
+        Args:
+            reason: Description of the fault, for the log.
+
+        Returns:
+            True if the camera was recovered, False if it did not reappear within
+            recovery_timeout or could not be configured.
+        """
+        backend = self._backend
+        with self._lock:
+            start = time.perf_counter()
+            logger.warning('Recovering camera %d (%s): %s', self.camera_id, self.config.name,
+                           reason)
+            stream = self.stream
+            resume = self._resume_pending or (stream is not None and stream.running)
+            if resume:
+                stream.suspend()
+            backend.ASICloseCamera(self.camera_id)
+
+            deadline = time.monotonic() + self.recovery_timeout
+            camera_id = self._reopen()
+            while camera_id is None and time.monotonic() < deadline:
+                time.sleep(RETRY_INTERVAL)
+                camera_id = self._reopen()
+            if camera_id is None:
+                self.failures += 1
+                self._failure_count.inc()
+                logger.error('Camera %s did not come back within %.1f s', self.config.name,
+                             self.recovery_timeout)
+                self._resume_pending = resume
+                return False
+
+            self.camera_id = camera_id
+            self._resume_pending = False
+            if resume:
+                stream.resume(camera_id)
+            self.recoveries += 1
+            self.last_recovery_seconds = time.perf_counter() - start
+            self._recovery_time.observe(self.last_recovery_seconds)
+            logger.warning('Recovered camera %d (%s) in %.2f s', camera_id, self.config.name,
+                           self.last_recovery_seconds)
+            self._reset_progress()
+        if self.on_recover is not None:
+            self.on_recover(camera_id)
+        return True
+
+    def _reopen(self):
+        """Try once to find, open, initialize and configure the camera.
+
+        Returns:
+            The camera ID, or None if the camera is not connected or any step failed.
+        """
+        backend = self._backend
+        camera_id = find_camera(self.config.name, backend, self.camera_id)
+        if camera_id is None:
+            return None
+        try:
+            backend.ASICheck(backend.ASIOpenCamera(camera_id))
+            backend.ASICheck(backend.ASIInitCamera(camera_id))
+            write_config(camera_id, self.config, backend)
+        except backend.ASIError as e:
+            logger.warning('Cannot reopen camera %d: %s', camera_id, e)
+            backend.ASICloseCamera(camera_id)
+            return None
+        return camera_id
+
+    def stats(self):
+        """Return a dict of recovery statistics."""
+        return {
+            'recoveries': self.recoveries,
+            'failures': self.failures,
+            'last_recovery_seconds': self.last_recovery_seconds,
+        }
@@ -4,6 +4,7 @@ The asi package is a SWIG-generated Python interface to the C API provided by ZW
 """
 
 import time
+import threading
 import unittest
 import random
 import numpy as np
@@ -193,6 +194,99 @@ class TestASI(unittest.TestCase):
         self.assertLess(dropped, 10)
         self.assertEqual(asi.ASIStopVideoCapture(self.info.CameraID), asi.ASI_SUCCESS)
 
+    def test_video_capture_into(self):
+        """Test video capture into a caller-owned buffer."""
+
+        self.set_standard_config()
+
+        self.assertEqual(asi.ASIStartVideoCapture(self.info.CameraID), asi.ASI_SUCCESS)
+
+        frame = np.zeros((self.info.MaxHeight, self.info.MaxWidth), dtype=np.uint8)
+        num_timeouts = 0
+        for _ in range(100):
+            rtn = asi.ASIGetVideoDataInto(self.info.CameraID, frame, 200)
+            self.assertIn(rtn, [asi.ASI_SUCCESS, asi.ASI_ERROR_TIMEOUT])
+            if rtn == asi.ASI_ERROR_TIMEOUT:
+                num_timeouts += 1
+        self.assertLess(num_timeouts, 2)
+
+        # Any writable C-contiguous buffer of the right size is accepted
+        buffer = bytearray(frame.nbytes)
+        self.assertIn(
+            asi.ASIGetVideoDataInto(self.info.CameraID, buffer, 200),
+            [asi.ASI_SUCCESS, asi.ASI_ERROR_TIMEOUT]
+        )
+
+        # Buffer size must match the current ROI format
+        self.assertEqual(
+            asi.ASIGetVideoDataInto(self.info.CameraID, frame[:-1], 200),
+            asi.ASI_ERROR_INVALID_SIZE
+        )
+
+        # Only uint8 and uint16 buffers are accepted
+        with self.assertRaises(TypeError):
+            asi.ASIGetVideoDataInto(self.info.CameraID, frame.view(np.int8), 200)
+
+        # Read-only and non-contiguous buffers are rejected
+        with self.assertRaises(BufferError):
+            asi.ASIGetVideoDataInto(self.info.CameraID, bytes(frame.nbytes), 200)
+        with self.assertRaises(ValueError):
+            asi.ASIGetVideoDataInto(self.info.CameraID, frame.T, 200)
+
+        self.assertEqual(asi.ASIStopVideoCapture(self.info.CameraID), asi.ASI_SUCCESS)
+
+    def test_gil_released(self):
+        """Test that other Python threads make progress while waiting for video data.
+
+        A CPU-bound thread counts loop iterations while the main thread blocks in
+        ASIGetVideoData(). If the GIL were held for the duration of the call the counter would
+        barely move.
+        """
+
+        exposure_time = 0.5  # in seconds
+
+        self.set_standard_config()
+        self.assertEqual(
+            asi.ASISetControlValue(
+                self.info.CameraID,
+                asi.ASI_EXPOSURE,
+                int(exposure_time * 1e6),
+                asi.ASI_FALSE
+            ),
+            asi.ASI_SUCCESS
+        )
+
+        count = 0
+        stop = threading.Event()
+
+        def spin():
+            nonlocal count
+            while not stop.is_set():
+                count += 1
+
+        thread = threading.Thread(target=spin)
+        thread.start()
+        try:
+            self.assertEqual(asi.ASIStartVideoCapture(self.info.CameraID), asi.ASI_SUCCESS)
+            frame_size = self.info.MaxWidth * self.info.MaxHeight
+            count_start = count
+            time_start = time.perf_counter()
+            rtn, _ = asi.ASIGetVideoData(self.info.CameraID, frame_size, 2000)
+            elapsed = time.perf_counter() - time_start
+            iterations = count - count_start
+            self.assertEqual(rtn, asi.ASI_SUCCESS)
+            self.assertEqual(asi.ASIStopVideoCapture(self.info.CameraID), asi.ASI_SUCCESS)
+        finally:
+            stop.set()
+            thread.join()
+
+        message = (
+            f'spin thread ran {iterations} iterations during {elapsed * 1e3:.1f} ms '
+            f'in ASIGetVideoData ({iterations / elapsed:.0f} iterations/s)'
+        )
+        self.assertGreater(elapsed, exposure_time / 2, message)
+        self.assertGreater(iterations / elapsed, 10000, message)
+
     def test_pulse_guide(self):
         """Test pulse guide port API"""
         for direction in range(4):
@@ -247,3 +341,6 @@ class TestASI(unittest.TestCase):
         rtn, frame = asi.ASIGetDataAfterExp(self.info.CameraID, frame_size)
         self.assertEqual(rtn, asi.ASI_SUCCESS)
         self.assertEqual(frame.size, frame_size)
+
+        frame = np.zeros(frame_size, dtype=np.uint8)
+        self.assertEqual(asi.ASIGetDataAfterExpInto(self.info.CameraID, frame), asi.ASI_SUCCESS)
@@ -0,0 +1,13 @@
+"""Throughput and latency benchmarks for the Python capture path.
+
+Run from the python/ directory, against a real camera or the simulated backend:
+
+    $ python3 -m benchmarks.run --backend sim --output results.json
+    $ python3 -m benchmarks.run --baseline results.json
+
+See benchmarks.run for the workloads and options and benchmarks.harness for how each workload is
+measured.
+
+benchmarks.frame_bus compares handing frames to consumer processes through an asi.shm.FrameBus
+with a multiprocessing.Queue.
+"""
@@ -0,0 +1,224 @@
+"""Benchmark consumer processes fed frames by an asi.shm.FrameBus against a multiprocessing.Queue.
+
+Each consumer process scores frames with asi.quality.frame_metrics(), a CPU-bound workload that
+threads cannot run in parallel. With N consumers, consumer i scores every frame whose sequence
+number is i modulo N, so the aggregate throughput should scale with N up to the number of CPU
+cores if frames reach the consumers cheaply enough.
+
+Two ways of handing out frames are compared:
+
+- shm: every consumer attaches to a FrameBus as a BLOCK reader and sees every frame as a view of
+  shared memory, skipping those of other consumers. Publishing costs one copy into the bus per
+  frame however many consumers there are.
+- queue: each frame is put on the multiprocessing.Queue of the consumer that scores it, which
+  pickles and copies the frame and sends it through a pipe.
+
+Frames are published as fast as the consumers take them, so the frame rate measures the pipeline
+rather than a camera.
+
+Example:
+
+    $ python3 -m benchmarks.frame_bus --processes 1,2,4 --frames 400 --output bus.json
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+import time
+import numpy as np
+
+from asi import quality
+from asi import shm
+from asi.stream import BLOCK
+
+
+logger = logging.getLogger(__name__)
+
+TRANSPORTS = ('shm', 'queue')
+
+# Number of distinct synthetic frames cycled through by the publisher
+DISTINCT_FRAMES = 4
+
+# Maximum time in seconds to wait for consumer processes to start or finish
+PROCESS_TIMEOUT = 60
+
+
+def _bus_consumer(name, worker, workers, results):
+    """Score this worker's share of the frames on a FrameBus until the bus is closed."""
+    scored = 0
+    with shm.FrameReader(name, policy=BLOCK) as reader:
+        results.put(None)
+        for frame in reader:
+            with frame:
+                if frame.sequence % workers == worker:
+                    quality.frame_metrics(frame.image[np.newaxis])
+                    scored += 1
+    results.put(scored)
+
+
+def _queue_consumer(queue, results):
+    """Score the frames put on a queue until None is received."""
+    scored = 0
+    results.put(None)
+    while True:
+        image = queue.get()
+        if image is None:
+            break
+        quality.frame_metrics(image[np.newaxis])
+        scored += 1
+    results.put(scored)
+
+
+def _wait_ready(results, processes):
+    for _ in range(processes):
+        if results.get(timeout=PROCESS_TIMEOUT) is not None:
+            raise RuntimeError('Consumer reported a result before it was ready')
+
+
+def run_transport(transport, processes, frames, images, slots):
+    """Run one configuration.
+
+    Args:
+        transport: One of TRANSPORTS.
+        processes: Number of consumer processes.
+        frames: Number of frames to publish.
+        images: Array of frames to cycle through.
+        slots: Number of slots of the FrameBus, and size of each queue.
+
+    Returns:
+        Result dict.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    if transport == 'shm':
+        bus = shm.FrameBus(images.shape[1:], images.dtype, slots=slots)
+        consumers = [
+            context.Process(target=_bus_consumer, args=(bus.name, i, processes, results))
+            for i in range(processes)
+        ]
+    else:
+        queues = [context.Queue(slots) for _ in range(processes)]
+        consumers = [
+            context.Process(target=_queue_consumer, args=(queue, results)) for queue in queues
+        ]
+    for consumer in consumers:
+        consumer.start()
+    try:
+        _wait_ready(results, processes)
+        start = time.perf_counter()
+        if transport == 'shm':
+            for i in range(frames):
+                bus.publish(images[i % len(images)])
+            bus.close()
+        else:
+            for i in range(frames):
+                queues[i % processes].put(images[i % len(images)])
+            for queue in queues:
+                queue.put(None)
+        scored = sum(results.get(timeout=PROCESS_TIMEOUT) for _ in range(processes))
+        seconds = time.perf_counter() - start
+    finally:
+        if transport == 'shm':
+            bus.close()
+        for consumer in consumers:
+            consumer.join(PROCESS_TIMEOUT)
+    if scored != frames:
+        raise RuntimeError(f'Consumers scored {scored} of {frames} frames')
+    return {
+        'transport': transport,
+        'processes': processes,
+        'width': images.shape[2],
+        'height': images.shape[1],
+        'dtype': images.dtype.name,
+        'frames': frames,
+        'seconds': seconds,
+        'fps': frames / seconds,
+        'mb_per_s': frames * images[0].nbytes / seconds / 1e6,
+    }
+
+
+def add_speedups(results):
+    """Add to each result its throughput relative to one process with the same transport."""
+    single = {
+        result['transport']: result['fps'] for result in results if result['processes'] == 1
+    }
+    for result in results:
+        base = single.get(result['transport'])
+        result['speedup'] = None if base is None else result['fps'] / base
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument(
+        '--processes',
+        default='1,2,4',
+        help='comma-separated numbers of consumer processes',
+    )
+    parser.add_argument(
+        '--transports',
+        default=','.join(TRANSPORTS),
+        help=f'comma-separated transports to run, from {", ".join(TRANSPORTS)}',
+    )
+    parser.add_argument('--frames', type=int, default=400, help='frames per configuration')
+    parser.add_argument('--width', type=int, default=1920, help='frame width')
+    parser.add_argument('--height', type=int, default=1080, help='frame height')
+    parser.add_argument('--raw8', action='store_true', help='8-bit frames instead of 16-bit')
+    parser.add_argument('--slots', type=int, default=16, help='slots of the bus or queue size')
+    parser.add_argument('--output', default=None, help='write results to this JSON file')
+    args = parser.parse_args(argv)
+    args.processes = [int(item) for item in args.processes.split(',') if item.strip()]
+    args.transports = [item.strip() for item in args.transports.split(',') if item.strip()]
+    for transport in args.transports:
+        if transport not in TRANSPORTS:
+            parser.error(f'Unknown transport {transport}')
+    return args
+
+
+def format_result(result):
+    """Return a one line summary of a result."""
+    speedup = '' if result['speedup'] is None else f'  x{result["speedup"]:.2f}'
+    return (
+        f'{result["transport"]:<6} {result["processes"]:>2} processes '
+        f'{result["width"]:>5}x{result["height"]:<5} {result["dtype"]:<6} '
+        f'{result["fps"]:9.1f} FPS {result["mb_per_s"]:9.1f} MB/s{speedup}'
+    )
+
+
+def main(argv=None):
+    """Run the benchmark and return the exit status."""
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = parse_args(argv)
+    dtype = np.uint8 if args.raw8 else np.uint16
+    rng = np.random.default_rng(0)
+    images = rng.integers(
+        0, np.iinfo(dtype).max, (DISTINCT_FRAMES, args.height, args.width), endpoint=True
+    ).astype(dtype)
+
+    results = []
+    for transport in args.transports:
+        for processes in args.processes:
+            logger.info('Running %s with %d processes', transport, processes)
+            results.append(run_transport(transport, processes, args.frames, images, args.slots))
+    add_speedups(results)
+    for result in results:
+        print(format_result(result))
+
+    if args.output is not None:
+        meta = {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        }
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
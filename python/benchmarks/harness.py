@@ -0,0 +1,142 @@
+"""Measurement of individual benchmark workloads and comparison of results.
+
+A workload is a callable that processes one frame. measure() calls it repeatedly and records the
+time taken by each call, from which throughput and the latency distribution are derived. Memory
+allocated per frame is measured in a separate pass with tracemalloc, since tracing slows down
+allocation and would distort the timing. NumPy reports its array buffers to tracemalloc, so this
+captures per-frame image allocations as well as Python objects.
+"""
+
+import time
+import tracemalloc
+import numpy as np
+
+
+# Number of calls made before measuring, to fill caches and trigger lazy initialization
+WARMUP_FRAMES = 3
+
+# Number of calls measured with tracemalloc enabled
+ALLOCATION_FRAMES = 10
+
+
+def latency_stats(latencies_s):
+    """Return a dict of latency statistics in milliseconds from an array of durations in seconds."""
+    latencies_ms = np.asarray(latencies_s) * 1e3
+    return {
+        'mean': float(np.mean(latencies_ms)),
+        'p50': float(np.percentile(latencies_ms, 50)),
+        'p99': float(np.percentile(latencies_ms, 99)),
+        'max': float(np.max(latencies_ms)),
+    }
+
+
+def allocated_bytes_per_call(func, count=ALLOCATION_FRAMES):
+    """Return the mean peak memory allocated during each call to func, in bytes.
+
+    Returns None if the Python version does not support tracemalloc.reset_peak() (before 3.9).
+    """
+    if not hasattr(tracemalloc, 'reset_peak'):
+        return None
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(count):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - before
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    return total / count
+
+
+def measure(func, frames, bytes_per_frame, track_allocations=True):
+    """Measure the throughput and latency of a workload.
+
+    Args:
+        func: Callable processing one frame. If it returns False the frame is not counted, for
+            example when reading from the camera timed out.
+        frames: Number of frames to measure.
+        bytes_per_frame: Size of the data processed per frame, for the MB/s figure.
+        track_allocations: Whether to also measure memory allocated per frame.
+
+    Returns:
+        Dict of results.
+    """
+    for _ in range(WARMUP_FRAMES):
+        func()
+
+    latencies = np.zeros(frames)
+    failures = 0
+    count = 0
+    start = time.perf_counter()
+    while count < frames:
+        call_start = time.perf_counter()
+        ok = func()
+        call_end = time.perf_counter()
+        if ok is False:
+            failures += 1
+            if failures > frames:
+                break
+            continue
+        latencies[count] = call_end - call_start
+        count += 1
+    elapsed = time.perf_counter() - start
+
+    result = {
+        'frames': count,
+        'failures': failures,
+        'seconds': elapsed,
+        'fps': count / elapsed if elapsed > 0 else 0.0,
+        'mb_per_s': count * bytes_per_frame / elapsed / 1e6 if elapsed > 0 else 0.0,
+        'latency_ms': latency_stats(latencies[:count]) if count else None,
+        'alloc_bytes_per_frame': None,
+    }
+    if track_allocations:
+        result['alloc_bytes_per_frame'] = allocated_bytes_per_call(func)
+    return result
+
+
+def result_key(result):
+    """Return the key identifying the workload and configuration of a result."""
+    return (
+        result['workload'],
+        result['width'],
+        result['height'],
+        result['bin'],
+        result['img_type'],
+    )
+
+
+def compare(results, baseline, tolerance):
+    """Compare results against a baseline and describe any regressions.
+
+    A regression is a drop in frame rate or a rise in p99 latency by more than the tolerance,
+    relative to the baseline result with the same workload and configuration.
+
+    Args:
+        results: List of result dicts.
+        baseline: List of result dicts from an earlier run.
+        tolerance: Allowed relative change, e.g. 0.1 for 10%.
+
+    Returns:
+        List of strings, one per regression.
+    """
+    previous = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None or not old['frames'] or not result['frames']:
+            continue
+        name = '{} {}x{} bin{} {}'.format(*result_key(result))
+        if result['fps'] < old['fps'] * (1 - tolerance):
+            regressions.append(f'{name}: {old["fps"]:.1f} -> {result["fps"]:.1f} frames/s')
+        old_p99 = old['latency_ms']['p99']
+        new_p99 = result['latency_ms']['p99']
+        if new_p99 > old_p99 * (1 + tolerance):
+            regressions.append(f'{name}: p99 latency {old_p99:.3f} -> {new_p99:.3f} ms')
+    return regressions
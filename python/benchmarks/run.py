@@ -0,0 +1,429 @@
+"""Benchmark the Python capture path against a camera and write the results as JSON.
+
+Every workload is run for each combination of ROI size, binning, and image type given on the
+command line. The workloads are:
+
+- video_alloc: ASIGetVideoData(), which allocates a new array for every frame.
+- video_into: ASIGetVideoDataInto() into a single preallocated buffer.
+- debayer: reshape of the raw buffer into an image followed by asi.preview.superpixel(), or
+  asi.preview.bin2x2() for mono cameras.
+- histogram: asi.agc.histogram() on the default subsample.
+- agc: a full asi.agc.AGC.update() (histogram, percentile, policy, and mapping).
+- calibrate: asi.calib.Calibration.apply() with a master dark and flat, in place on a copy of
+  the frame.
+- ser_write: asi.ser.SERWriter.add_frame() to a file in the scratch directory.
+- png, tiff: PIL Image.frombuffer() and save() of the full frame, the way test.py saves images.
+  These are skipped if PIL is not installed.
+
+The video workloads are limited by the camera, so their frame rate measures the camera and the
+ASI library as much as Python. The other workloads run on a frame captured beforehand and measure
+processing cost only.
+
+Examples:
+
+    $ python3 -m benchmarks.run --backend sim --output results.json
+    $ python3 -m benchmarks.run --roi full,1/4 --bin 1,2 --img-type raw8 --baseline results.json
+
+With --baseline, results are compared with an earlier run and the exit status is 1 if any
+workload got slower by more than the tolerance.
+"""
+
+import argparse
+import datetime
+import fractions
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import numpy as np
+
+from benchmarks import harness
+
+
+logger = logging.getLogger(__name__)
+
+
+WORKLOADS = (
+    'video_alloc',
+    'video_into',
+    'debayer',
+    'histogram',
+    'agc',
+    'calibrate',
+    'ser_write',
+    'png',
+    'tiff',
+)
+
+# Names of image types on the command line mapped to the names of the ASI constants
+IMG_TYPES = {
+    'raw8': 'ASI_IMG_RAW8',
+    'raw16': 'ASI_IMG_RAW16',
+    'y8': 'ASI_IMG_Y8',
+}
+
+# PIL mode for each image type
+PIL_MODES = {
+    'raw8': 'L',
+    'raw16': 'I;16',
+    'y8': 'L',
+}
+
+# asi.preview Bayer pattern names indexed by ASI_BAYER_PATTERN value
+BAYER_PATTERNS = ('RGGB', 'BGGR', 'GRBG', 'GBRG')
+
+# Maximum time to wait for a frame in milliseconds
+TIMEOUT_MS = 1000
+
+
+def parse_list(text, convert=str):
+    """Parse a comma-separated command line argument."""
+    return [convert(item.strip()) for item in text.split(',') if item.strip()]
+
+
+def parse_roi(text):
+    """Parse an ROI size given as 'full' or a fraction of the full frame like '1/2'."""
+    if text == 'full':
+        return fractions.Fraction(1)
+    fraction = fractions.Fraction(text)
+    if not 0 < fraction <= 1:
+        raise argparse.ArgumentTypeError(f'ROI fraction {text} is outside the range (0, 1]')
+    return fraction
+
+
+def roi_size(info, binning, fraction):
+    """Return the (width, height) of an ROI that is a fraction of the full binned frame.
+
+    The width is rounded down to a multiple of 8 and the height to a multiple of 2 as required by
+    the ASI library.
+    """
+    width = int(info.MaxWidth // binning * fraction) // 8 * 8
+    height = int(info.MaxHeight // binning * fraction) // 2 * 2
+    return width, height
+
+
+def metadata(asi, info, args):
+    """Return a dict describing the environment the benchmarks ran in."""
+    return {
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'backend': asi.BACKEND,
+        'camera': info.Name,
+        'max_width': info.MaxWidth,
+        'max_height': info.MaxHeight,
+        'color': bool(info.IsColorCam),
+        'exposure_us': args.exposure_us,
+        'gain': args.gain,
+    }
+
+
+class Bench:
+    """Runs the workloads on one camera.
+
+    Args:
+        asi: The asi package, imported after the backend was selected.
+        info: ASI_CAMERA_INFO of the camera.
+        args: Parsed command line arguments.
+        scratch_dir: Directory for files written by the file workloads.
+    """
+
+    def __init__(self, asi, info, args, scratch_dir):
+        self.asi = asi
+        self.info = info
+        self.args = args
+        self.scratch_dir = scratch_dir
+        self._writers = []
+
+    def run_config(self, width, height, binning, img_type):
+        """Run all selected workloads at one ROI format.
+
+        Returns:
+            List of result dicts, or an empty list if the camera does not support the format.
+        """
+        asi = self.asi
+        camera_id = self.info.CameraID
+        status = asi.ASISetROIFormat(
+            camera_id, width, height, binning, getattr(asi, IMG_TYPES[img_type])
+        )
+        if status != asi.ASI_SUCCESS:
+            logger.warning(
+                'Skipping %dx%d bin%d %s: ASISetROIFormat() returned %d',
+                width, height, binning, img_type, status,
+            )
+            return []
+        size = asi.GetImageSizeBytes(camera_id)
+        dtype = np.uint16 if img_type == 'raw16' else np.uint8
+        buffer = np.zeros(size, dtype=np.uint8)
+
+        results = []
+
+        def record(name, func, frames):
+            logger.info('Running %s at %dx%d bin%d %s', name, width, height, binning, img_type)
+            result = {
+                'workload': name,
+                'width': width,
+                'height': height,
+                'bin': binning,
+                'img_type': img_type,
+            }
+            result.update(harness.measure(func, frames, size, not self.args.no_allocations))
+            results.append(result)
+
+        asi.ASICheck(asi.ASIStartVideoCapture(camera_id))
+        try:
+            def video_alloc():
+                status, _ = asi.ASIGetVideoData(camera_id, size, TIMEOUT_MS)
+                return status == asi.ASI_SUCCESS
+
+            def video_into():
+                return asi.ASIGetVideoDataInto(camera_id, buffer, TIMEOUT_MS) == asi.ASI_SUCCESS
+
+            if 'video_alloc' in self.args.workloads:
+                record('video_alloc', video_alloc, self.args.frames)
+            if 'video_into' in self.args.workloads:
+                record('video_into', video_into, self.args.frames)
+            asi.ASICheck(asi.ASIGetVideoDataInto(camera_id, buffer, TIMEOUT_MS))
+        finally:
+            asi.ASICheck(asi.ASIStopVideoCapture(camera_id))
+
+        for name, func, frames in self.processing_workloads(buffer, dtype, width, height, img_type):
+            if name in self.args.workloads:
+                record(name, func, frames)
+        return results
+
+    def processing_workloads(self, buffer, dtype, width, height, img_type):
+        """Return (name, func, frames) for the workloads that process an already captured frame."""
+        # Imported here so that the backend is selected before asi is first imported
+        from asi import agc
+        from asi import calib
+        from asi import preview
+        from asi import ser
+
+        if self.info.IsColorCam and img_type != 'y8':
+            pattern = BAYER_PATTERNS[self.info.BayerPattern]
+
+            def debayer():
+                preview.superpixel(buffer.view(dtype).reshape(height, width), pattern)
+        else:
+            def debayer():
+                preview.bin2x2(buffer.view(dtype).reshape(height, width))
+
+        image = buffer.view(dtype).reshape(height, width)
+        controller = agc.AGC()
+
+        def histogram():
+            agc.histogram(image)
+
+        def agc_update():
+            controller.update(image)
+
+        dark = calib.Master('dark', np.full(image.shape, 16, dtype=np.float32), None, 1)
+        vignetting = np.linspace(0.8, 1.2, width, dtype=np.float32)
+        flat = calib.Master('flat', np.broadcast_to(vignetting, image.shape).copy(), None, 1)
+        calibration = calib.Calibration(dark, flat)
+        calibrated = image.copy()
+
+        def calibrate():
+            calibration.apply(calibrated)
+
+        workloads = [
+            ('debayer', debayer, self.args.frames),
+            ('histogram', histogram, self.args.frames),
+            ('agc', agc_update, self.args.frames),
+            ('calibrate', calibrate, self.args.frames),
+        ]
+
+        if 'ser_write' in self.args.workloads:
+            writer = ser.SERWriter(
+                os.path.join(self.scratch_dir, 'benchmark.ser'),
+                width,
+                height,
+                color_id=ser.BAYER_RGGB if self.info.IsColorCam else ser.MONO,
+                bit_depth=16 if img_type == 'raw16' else 8,
+                add_trailer=False,
+            )
+            self._writers.append(writer)
+            workloads.append(('ser_write', lambda: writer.add_frame(image), self.args.frames))
+
+        try:
+            from PIL import Image
+        except ImportError:
+            logger.warning('PIL is not installed, skipping PNG and TIFF workloads')
+            return workloads
+
+        mode = PIL_MODES[img_type]
+        for extension in ('png', 'tiff'):
+            filename = os.path.join(self.scratch_dir, f'benchmark.{extension}')
+
+            def save(filename=filename):
+                Image.frombuffer(mode, (width, height), buffer, 'raw', mode, 0, 1).save(filename)
+
+            workloads.append((extension, save, self.args.image_frames))
+        return workloads
+
+    def run(self):
+        """Run the workloads for every combination of ROI size, binning, and image type.
+
+        Returns:
+            List of result dicts.
+        """
+        results = []
+        for binning in self.args.bin:
+            for fraction in self.args.roi:
+                width, height = roi_size(self.info, binning, fraction)
+                for img_type in self.args.img_type:
+                    self._writers = []
+                    try:
+                        results += self.run_config(width, height, binning, img_type)
+                    finally:
+                        for writer in self._writers:
+                            writer.close()
+        return results
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the Python capture path',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '--backend',
+        choices=('sdk', 'sim'),
+        default=os.environ.get('ASI_BACKEND', 'sdk'),
+        help='camera backend, see asi.BACKEND',
+    )
+    parser.add_argument('--camera', type=int, default=0, help='index of the camera')
+    parser.add_argument(
+        '--roi',
+        type=lambda text: parse_list(text, parse_roi),
+        default=[fractions.Fraction(1)],
+        help="comma-separated ROI sizes as 'full' or fractions of the frame like '1/2'",
+    )
+    parser.add_argument(
+        '--bin',
+        type=lambda text: parse_list(text, int),
+        default=[1],
+        help='comma-separated binning factors',
+    )
+    parser.add_argument(
+        '--img-type',
+        type=lambda text: parse_list(text),
+        default=['raw8', 'raw16'],
+        help=f'comma-separated image types from {", ".join(IMG_TYPES)}',
+    )
+    parser.add_argument(
+        '--workloads',
+        type=lambda text: parse_list(text),
+        default=list(WORKLOADS),
+        help=f'comma-separated workloads from {", ".join(WORKLOADS)}',
+    )
+    parser.add_argument('--frames', type=int, default=100, help='frames measured per workload')
+    parser.add_argument(
+        '--image-frames',
+        type=int,
+        default=10,
+        help='frames measured for the PNG and TIFF workloads, which are much slower',
+    )
+    parser.add_argument(
+        '--exposure-us',
+        type=int,
+        default=100,
+        help='exposure time; short exposures make video frame rate limited by bandwidth',
+    )
+    parser.add_argument('--gain', type=int, default=0, help='camera gain')
+    parser.add_argument(
+        '--no-allocations',
+        action='store_true',
+        help='skip measuring memory allocated per frame',
+    )
+    parser.add_argument(
+        '--scratch-dir',
+        default=None,
+        help='directory for files written by the SER, PNG, and TIFF workloads (default: a new '
+        'temporary directory, which should be on the disk that will be used for capture)',
+    )
+    parser.add_argument('--output', default=None, help='write results to this JSON file')
+    parser.add_argument('--baseline', default=None, help='JSON results of an earlier run')
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.1,
+        help='relative change from the baseline reported as a regression',
+    )
+    args = parser.parse_args(argv)
+
+    for img_type in args.img_type:
+        if img_type not in IMG_TYPES:
+            parser.error(f'Unknown image type {img_type}')
+    for workload in args.workloads:
+        if workload not in WORKLOADS:
+            parser.error(f'Unknown workload {workload}')
+    return args
+
+
+def format_result(result):
+    """Return a one line summary of a result."""
+    alloc = result['alloc_bytes_per_frame']
+    alloc_text = 'n/a' if alloc is None else f'{alloc / 1e3:.1f} kB'
+    latency = result['latency_ms'] or {'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+    return (
+        f'{result["workload"]:<12} {result["width"]:>5}x{result["height"]:<5} '
+        f'bin{result["bin"]} {result["img_type"]:<6} '
+        f'{result["fps"]:9.1f} FPS {result["mb_per_s"]:9.1f} MB/s  '
+        f'p50 {latency["p50"]:8.3f} p99 {latency["p99"]:8.3f} max {latency["max"]:8.3f} ms  '
+        f'alloc {alloc_text}'
+    )
+
+
+def main(argv=None):
+    """Run the benchmarks and return the exit status."""
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = parse_args(argv)
+
+    # The backend is selected when the asi package is first imported
+    os.environ['ASI_BACKEND'] = args.backend
+    import asi
+
+    if asi.ASIGetNumOfConnectedCameras() <= args.camera:
+        logger.error('Camera %d is not connected', args.camera)
+        return 2
+    info = asi.ASICheck(asi.ASIGetCameraProperty(args.camera))
+    asi.ASICheck(asi.ASIOpenCamera(info.CameraID))
+    try:
+        asi.ASICheck(asi.ASIInitCamera(info.CameraID))
+        asi.ASICheck(
+            asi.ASISetControlValue(info.CameraID, asi.ASI_EXPOSURE, args.exposure_us, asi.ASI_FALSE)
+        )
+        asi.ASICheck(asi.ASISetControlValue(info.CameraID, asi.ASI_GAIN, args.gain, asi.ASI_FALSE))
+        with tempfile.TemporaryDirectory(dir=args.scratch_dir) as scratch_dir:
+            results = Bench(asi, info, args, scratch_dir).run()
+        meta = metadata(asi, info, args)
+    finally:
+        asi.ASICloseCamera(info.CameraID)
+
+    for result in results:
+        print(format_result(result))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = harness.compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
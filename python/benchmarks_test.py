@@ -0,0 +1,113 @@
+"""Tests for the benchmark suite in the benchmarks package."""
+
+import tempfile
+import unittest
+import numpy as np
+
+from asi import sim
+from benchmarks import frame_bus
+from benchmarks import harness
+from benchmarks import run
+
+
+class TestHarness(unittest.TestCase):
+    """Collection of tests for benchmarks.harness."""
+
+    def test_measure(self):
+        """Frames are counted, failures are excluded, and allocations are measured."""
+        calls = []
+
+        def workload():
+            calls.append(np.zeros(100_000, dtype=np.uint8))
+            return len(calls) % 4 != 0
+
+        result = harness.measure(workload, 30, 1000)
+        self.assertEqual(result['frames'], 30)
+        self.assertEqual(result['failures'], 10)
+        self.assertGreater(result['fps'], 0)
+        self.assertAlmostEqual(result['mb_per_s'], result['fps'] * 1000 / 1e6)
+        latency = result['latency_ms']
+        self.assertLessEqual(latency['p50'], latency['p99'])
+        self.assertLessEqual(latency['p99'], latency['max'])
+        if result['alloc_bytes_per_frame'] is not None:
+            self.assertGreaterEqual(result['alloc_bytes_per_frame'], 100_000)
+
+    def test_compare(self):
+        """Only changes larger than the tolerance are reported as regressions."""
+        def result(fps, p99):
+            return {
+                'workload': 'agc',
+                'width': 640,
+                'height': 480,
+                'bin': 1,
+                'img_type': 'raw8',
+                'frames': 10,
+                'fps': fps,
+                'latency_ms': {'p99': p99},
+            }
+
+        baseline = [result(100.0, 1.0)]
+        self.assertEqual(harness.compare([result(95.0, 1.05)], baseline, 0.1), [])
+        self.assertEqual(len(harness.compare([result(80.0, 1.0)], baseline, 0.1)), 1)
+        self.assertEqual(len(harness.compare([result(80.0, 2.0)], baseline, 0.1)), 2)
+
+
+class TestRun(unittest.TestCase):
+    """Collection of tests for benchmarks.run on the simulated backend."""
+
+    def setUp(self):
+        sim.set_cameras(sim.SimulatedCamera(width=320, height=240, readout_latency=0.0))
+        sim.ASICheck(sim.ASIOpenCamera(0))
+        sim.ASICheck(sim.ASIInitCamera(0))
+        sim.ASICheck(sim.ASISetControlValue(0, sim.ASI_EXPOSURE, 100, sim.ASI_FALSE))
+
+    def tearDown(self):
+        sim.ASICloseCamera(0)
+        sim.set_cameras(sim.SimulatedCamera())
+
+    def test_sweep(self):
+        """Every workload is run for every supported format and unsupported ones are skipped."""
+        args = run.parse_args([
+            '--roi', 'full,1/2',
+            '--bin', '1,5',
+            '--img-type', 'raw8,raw16',
+            '--workloads', 'video_into,debayer,ser_write',
+            '--frames', '5',
+            '--no-allocations',
+        ])
+        info = sim.ASICheck(sim.ASIGetCameraProperty(0))
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            results = run.Bench(sim, info, args, scratch_dir).run()
+
+        # Binning by 5 is not supported by the simulated camera
+        self.assertEqual(len(results), 2 * 2 * 3)
+        self.assertEqual(
+            {(r['width'], r['height']) for r in results}, {(320, 240), (160, 120)}
+        )
+        for result in results:
+            self.assertEqual(result['frames'], 5)
+            self.assertIsNone(result['alloc_bytes_per_frame'])
+
+
+
+class TestFrameBus(unittest.TestCase):
+    """Collection of tests for benchmarks.frame_bus."""
+
+    def test_transports(self):
+        """Every frame is scored once by the consumer processes over both transports."""
+        images = np.zeros((frame_bus.DISTINCT_FRAMES, 24, 32), dtype=np.uint16)
+        results = [
+            frame_bus.run_transport(transport, processes, 10, images, slots=4)
+            for transport in frame_bus.TRANSPORTS
+            for processes in (1, 2)
+        ]
+        frame_bus.add_speedups(results)
+        for result in results:
+            self.assertEqual(result['frames'], 10)
+            self.assertGreater(result['fps'], 0)
+            self.assertIsNotNone(result['speedup'])
+        self.assertEqual(results[0]['speedup'], 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+"""Tests for the asi.binning module."""
+
+import os
+import tempfile
+import tracemalloc
+import unittest
+import numpy as np
+
+from asi import binning
+from asi import metrics
+from asi import segment
+from asi import ser
+
+
+def reference_bin(image, factor_x, factor_y, mode):
+    """Bin a 2-D image with a reshape, discarding partial bins."""
+    height = image.shape[0] // factor_y
+    width = image.shape[1] // factor_x
+    blocks = image[:height * factor_y, :width * factor_x].reshape(
+        height, factor_y, width, factor_x
+    ).astype(np.int64)
+    sums = blocks.sum(axis=(1, 3))
+    if mode == binning.SUM:
+        return sums
+    count = factor_x * factor_y
+    return (sums + count // 2) // count
+
+
+class TestBinning(unittest.TestCase):
+    """Collection of tests for Binning."""
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.registry = metrics.Registry()
+
+    def test_mono(self):
+        """Sums and means match a reference, in the narrowest dtype that holds them."""
+        image = self.rng.integers(0, 4096, (12, 17)).astype(np.uint16)
+        stage = binning.Binning(image.shape, np.uint16, 2, binning.SUM, bit_depth=12,
+                                registry=self.registry)
+        self.assertEqual(stage.out_dtype, np.uint16)
+        self.assertEqual(stage.bit_depth, 14)
+        result = stage(image)
+        self.assertIs(result, stage.out)
+        np.testing.assert_array_equal(result, reference_bin(image, 2, 2, binning.SUM))
+
+        stage = binning.Binning(image.shape, np.uint16, 2, binning.SUM, registry=self.registry)
+        self.assertEqual(stage.out_dtype, np.uint32)
+
+        stage = binning.Binning(image.shape, np.uint16, (3, 2), binning.MEAN,
+                                registry=self.registry)
+        self.assertEqual(stage.output_shape, (6, 5))
+        self.assertEqual(stage.out_dtype, np.uint16)
+        np.testing.assert_array_equal(stage(image), reference_bin(image, 3, 2, binning.MEAN))
+        self.assertEqual(self.registry.stage_latency('bin').count, 2)
+
+    def test_crop(self):
+        """Crops are applied before binning."""
+        image = self.rng.integers(0, 256, (20, 24)).astype(np.uint8)
+        stage = binning.Binning(image.shape, np.uint8, 4, binning.MEAN, crop=(3, 5, 16, 9),
+                                registry=self.registry)
+        self.assertEqual(stage.output_shape, (2, 4))
+        np.testing.assert_array_equal(
+            stage(image), reference_bin(image[5:14, 3:19], 4, 4, binning.MEAN)
+        )
+
+    def test_bayer(self):
+        """Bayer binning bins each color separately and keeps the color filter structure."""
+        image = self.rng.integers(0, 65536, (16, 24)).astype(np.uint16)
+        stage = binning.Binning(image.shape, np.uint16, (3, 2), binning.SUM, crop=(1, 2, 23, 14),
+                                pattern='RGGB', registry=self.registry)
+        self.assertEqual(stage.pattern, 'GRBG')
+        self.assertEqual(stage.output_shape, (6, 6))
+        result = stage(image)
+        cropped = image[2:16, 1:24]
+        for row in range(2):
+            for col in range(2):
+                np.testing.assert_array_equal(
+                    result[row::2, col::2],
+                    # Only whole 2x2 output cells are kept
+                    reference_bin(cropped[row::2, col::2], 3, 2, binning.SUM)[:3, :3],
+                )
+
+    def test_shift(self):
+        """MSB-aligned samples are right-aligned before binning, and rejected without shift."""
+        image = self.rng.integers(0, 4096, (8, 12)).astype(np.uint16)
+        image[:4, :4] = 4095
+        aligned = image << 4
+        for pattern in (None, 'RGGB'):
+            stage = binning.Binning(image.shape, np.uint16, 2, binning.SUM, pattern=pattern,
+                                    bit_depth=12, shift=4, registry=self.registry)
+            self.assertEqual((stage.out_dtype, stage.bit_depth), (np.uint16, 14))
+            np.testing.assert_array_equal(
+                stage(aligned), binning.Binning(image.shape, np.uint16, 2, binning.SUM,
+                                                pattern=pattern, bit_depth=12,
+                                                registry=self.registry)(image)
+            )
+            self.assertEqual(stage.out.max(), 4 * 4095)
+        stage = binning.Binning(image.shape, np.uint16, 2, binning.MEAN, shift=4,
+                                registry=self.registry)
+        self.assertEqual(stage.input_bit_depth, 12)
+        np.testing.assert_array_equal(stage(aligned), reference_bin(image, 2, 2, binning.MEAN))
+
+        stage = binning.Binning(image.shape, np.uint16, 2, binning.SUM, bit_depth=12,
+                                registry=self.registry)
+        with self.assertRaises(ValueError):
+            stage(aligned)
+        with self.assertRaises(ValueError):
+            binning.Binning(image.shape, np.uint16, bit_depth=14, shift=4)
+        with self.assertRaises(ValueError):
+            binning.Binning(image.shape, np.uint8, shift=8)
+
+    def test_no_allocation(self):
+        """Binning into the preallocated output does not hold on to memory."""
+        image = self.rng.integers(0, 4096, (480, 640)).astype(np.uint16)
+        for mode in binning.MODES:
+            stage = binning.Binning(image.shape, np.uint16, 2, mode, pattern='GBRG',
+                                    registry=self.registry)
+            stage(image)
+            tracemalloc.start()
+            for _ in range(10):
+                stage(image)
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            self.assertLess(size, 1000)
+
+    def test_writer_stage(self):
+        """A SegmentedWriter records the binned frames."""
+        frames = self.rng.integers(0, 4096, (3, 8, 12)).astype(np.uint16)
+        stage = binning.Binning((8, 12), np.uint16, 2, binning.SUM, bit_depth=12,
+                                registry=self.registry)
+        with tempfile.TemporaryDirectory() as directory:
+            with segment.SegmentedWriter(directory, 6, 4, ser.MONO, stage.bit_depth, prefix='run',
+                                         stage=stage, registry=self.registry) as writer:
+                for frame in frames:
+                    writer.add_frame(frame)
+            with segment.SegmentedReader(os.path.join(directory, 'run.json')) as reader:
+                self.assertEqual(len(reader), len(frames))
+                for frame, binned in zip(frames, reader):
+                    np.testing.assert_array_equal(binned, reference_bin(frame, 2, 2, binning.SUM))
+
+    def test_invalid(self):
+        """Invalid arguments and frames are rejected."""
+        with self.assertRaises(TypeError):
+            binning.Binning((8, 8), np.float32)
+        with self.assertRaises(ValueError):
+            binning.Binning((8, 8), np.uint16, mode='median')
+        with self.assertRaises(ValueError):
+            binning.Binning((8, 8), np.uint16, crop=(4, 4, 8, 8))
+        with self.assertRaises(ValueError):
+            binning.Binning((8, 8), np.uint16, 4, pattern='RGGB', crop=(0, 0, 6, 8))
+        with self.assertRaises(ValueError):
+            binning.Binning((8, 8), np.uint16, mode=binning.SUM, out_dtype=np.uint16)
+        stage = binning.Binning((8, 8), np.uint16, registry=self.registry)
+        with self.assertRaises(ValueError):
+            stage(np.zeros((8, 8), np.uint8))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+"""Tests for asi.calib."""
+
+import os
+import tempfile
+import unittest
+import numpy as np
+
+from asi import calib
+from asi import ser
+from asi import sim
+from asi.stream import VideoStream
+
+
+class TestAccumulators(unittest.TestCase):
+    """Collection of tests for the accumulators and master builders."""
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.frames = self.rng.normal(1000, 20, (40, 24, 32)).round().astype(np.uint16)
+
+    def test_mean(self):
+        """MeanAccumulator matches the mean and sample standard deviation of the frames."""
+        accumulator = calib.MeanAccumulator((24, 32))
+        for frame in self.frames:
+            accumulator.add(frame)
+        np.testing.assert_allclose(accumulator.mean, self.frames.mean(axis=0), rtol=1e-6)
+        np.testing.assert_allclose(accumulator.std, self.frames.std(axis=0, ddof=1), rtol=1e-3)
+        with self.assertRaises(ValueError):
+            accumulator.add(self.frames[0, :10])
+
+    def test_sigma_clip(self):
+        """Outliers after the warmup frames are rejected."""
+        self.frames[10, 5, 7] = 60_000  # cosmic ray hit
+        self.frames[20:25, 12, :] = 5_000  # satellite trail
+        master = calib.build_master(self.frames)
+        self.assertAlmostEqual(master.data[5, 7], 1000, delta=10)
+        self.assertTrue(np.all(np.abs(master.data[12] - 1000) < 15))
+        self.assertGreater(master.rejected, (1 + 5 * 32) / self.frames.size)
+        self.assertLess(master.rejected, 0.02)
+        plain = calib.build_master(self.frames, kappa=None)
+        self.assertGreater(plain.data[5, 7], 2000)
+        self.assertEqual(plain.rejected, 0)
+
+    def test_sources(self):
+        """Masters are built from SER files and from stream consumers."""
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'darks.ser')
+            with ser.SERWriter(filename, 32, 24, color_id=ser.MONO, bit_depth=16) as writer:
+                writer.add_frames(self.frames)
+            with ser.SERReader(filename) as reader:
+                master = calib.build_master(reader, kind='bias', count=10, kappa=None)
+        self.assertEqual((master.kind, master.frames), ('bias', 10))
+        np.testing.assert_allclose(master.data, self.frames[:10].mean(axis=0), rtol=1e-6)
+
+        sim.set_cameras(sim.SimulatedCamera(width=64, height=48, bandwidth=64 * 48 * 1000))
+        self.addCleanup(sim.set_cameras, sim.SimulatedCamera())
+        sim.ASIOpenCamera(0)
+        sim.ASIInitCamera(0)
+        self.addCleanup(sim.ASICloseCamera, 0)
+        with VideoStream(0, pool_size=4, backend=sim) as stream:
+            consumer = stream.add_consumer('darks', maxsize=2)
+            master = calib.build_master(consumer, count=5)
+            consumer.close()
+        self.assertEqual((master.frames, master.shape), (5, (48, 64)))
+        self.assertEqual(stream.pool.free, len(stream.pool.frames))
+
+    def test_flat(self):
+        """Flats are dark subtracted and normalized to a mean of 1."""
+        vignetting = np.linspace(0.5, 1.5, 32, dtype=np.float32)[np.newaxis, :]
+        dark = calib.Master('dark', np.full((24, 32), 100, np.float32), None, 1)
+        flats = [100 + 2000 * vignetting * np.ones((24, 1)) for _ in range(4)]
+        flat = calib.build_flat(flats, dark=dark, kappa=None)
+        self.assertAlmostEqual(float(flat.data.mean()), 1.0, places=5)
+        np.testing.assert_allclose(flat.data[0], vignetting[0], rtol=1e-5)
+        with self.assertRaises(ValueError):
+            calib.build_flat([np.full((24, 32), 100)], dark=dark)
+
+
+class TestMasterCache(unittest.TestCase):
+    """Collection of tests for MasterCache and the cache keys."""
+
+    def test_lru(self):
+        """The least recently used master is evicted first."""
+        cache = calib.MasterCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get_or_build('b', lambda: 4), 4)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.get_or_build('b', lambda: 5), 4)
+        self.assertEqual(cache.stats(), {'size': 2, 'hits': 2, 'misses': 1, 'evictions': 2})
+
+    def test_keys(self):
+        """Keys combine exposure, gain, temperature bucket, ROI and binning."""
+        self.assertEqual(
+            calib.master_key(10_000, 200, 205, (0, 0, 640, 480), 2),
+            calib.master_key(10_000, 200, 195, [0, 0, 640, 480], 2),
+        )
+        self.assertNotEqual(
+            calib.master_key(10_000, 200, 205, (0, 0, 640, 480), 2),
+            calib.master_key(10_000, 200, 235, (0, 0, 640, 480), 2),
+        )
+        sim.set_cameras(sim.SimulatedCamera(width=320, height=240))
+        self.addCleanup(sim.set_cameras, sim.SimulatedCamera())
+        sim.ASIOpenCamera(0)
+        sim.ASIInitCamera(0)
+        self.addCleanup(sim.ASICloseCamera, 0)
+        sim.ASICheck(sim.ASISetROIFormat(0, 160, 120, 2, sim.ASI_IMG_RAW16))
+        sim.ASICheck(sim.ASISetControlValue(0, sim.ASI_GAIN, 150, sim.ASI_FALSE))
+        sim.ASICheck(sim.ASISetControlValue(0, sim.ASI_EXPOSURE, 5000, sim.ASI_FALSE))
+        self.assertEqual(
+            calib.camera_key(0, backend=sim), calib.master_key(5000, 150, 200, (0, 0, 160, 120), 2)
+        )
+
+
+class TestCalibration(unittest.TestCase):
+    """Collection of tests for Calibration."""
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.raw = rng.integers(0, 4096, (37, 50), dtype=np.uint16) << 4
+        dark = rng.uniform(0, 3000, (37, 50)).astype(np.float32)
+        flat = rng.uniform(0.5, 1.5, (37, 50)).astype(np.float32)
+        self.dark = calib.Master('dark', dark, None, 1)
+        self.flat = calib.Master('flat', flat, None, 1)
+
+    def test_dark(self):
+        """Dark subtraction alone saturates at zero."""
+        image = self.raw.copy()
+        calibration = calib.Calibration(dark=self.dark)
+        self.assertIs(calibration.apply(image), image)
+        expected = np.maximum(self.raw - np.rint(self.dark.data), 0)
+        np.testing.assert_array_equal(image, expected)
+
+    def test_dark_and_flat(self):
+        """Dark and flat correction matches the floating point formula, in blocks of any size."""
+        self.flat.data[3, 4] = 0.01  # dead pixel
+        expected = (self.raw - self.dark.data.astype(np.float64)) / self.flat.data + 100
+        expected[3, 4] = self.raw[3, 4] - self.dark.data[3, 4] + 100
+        expected = np.clip(np.rint(expected), 0, 65535)
+        for chunk_pixels in (1, 64, 10**6):
+            calibration = calib.Calibration(self.dark, self.flat, 100, chunk_pixels)
+            image = calibration.apply(self.raw.copy())
+            self.assertLessEqual(np.abs(image - expected).max(), 1)
+
+    def test_uint8(self):
+        """uint8 frames are clipped to 255."""
+        image = np.full((37, 50), 250, dtype=np.uint8)
+        flat = calib.Master('flat', np.full((37, 50), 0.5, np.float32), None, 1)
+        calib.Calibration(flat=flat).apply(image)
+        self.assertTrue(np.all(image == 255))
+
+    def test_invalid(self):
+        """Mismatched masters and frames are rejected."""
+        with self.assertRaises(ValueError):
+            calib.Calibration()
+        calibration = calib.Calibration(dark=self.dark)
+        with self.assertRaises(ValueError):
+            calibration.apply(np.zeros((10, 10), dtype=np.uint16))
+        with self.assertRaises(TypeError):
+            calibration.apply(np.zeros((37, 50), dtype=np.float32))
+
+
+if __name__ == '__main__':
+    unittest.main()
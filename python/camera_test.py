@@ -0,0 +1,116 @@
+"""Tests for asi.camera on the simulated backend."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from asi import sim
+from asi import tune
+from asi.camera import Camera
+
+
+class CountingBackend:
+    """Wraps asi.sim and counts the calls made to each API function."""
+
+    def __init__(self):
+        self.calls = {}
+
+    def __getattr__(self, name):
+        attr = getattr(sim, name)
+        if not callable(attr) or not name.startswith('ASI') or name in ('ASICheck', 'ASIError'):
+            return attr
+
+        def counted(*args):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return attr(*args)
+        return counted
+
+
+class TestCamera(unittest.TestCase):
+    """Collection of tests for Camera."""
+
+    def setUp(self):
+        # Keep any profile stored for the simulated camera on this host out of the tests
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profiles = mock.patch.dict(
+            os.environ, {tune.PROFILES_ENV: os.path.join(directory.name, 'profiles.json')}
+        )
+        profiles.start()
+        self.addCleanup(profiles.stop)
+        sim.set_cameras(sim.SimulatedCamera(width=320, height=240))
+        self.backend = CountingBackend()
+        self.camera = Camera(0, backend=self.backend)
+
+    def tearDown(self):
+        self.camera.close()
+        sim.set_cameras(sim.SimulatedCamera())
+
+    def test_snapshot(self):
+        """Camera information and control capabilities are read once when opening."""
+        camera = self.camera
+        self.assertEqual(camera.info.MaxWidth, 320)
+        self.assertEqual(camera.supported_bins, [1, 2, 3, 4])
+        self.assertIn(sim.ASI_IMG_RAW16, camera.supported_video_formats)
+        gain = camera.control('gain')
+        self.assertIs(camera.control(sim.ASI_GAIN), gain)
+        self.assertEqual((gain.min_value, gain.max_value), (0, 510))
+        self.assertEqual(camera.value('gain'), sim.REFERENCE_GAIN)
+        self.assertIn('high_speed_mode', camera)
+        self.assertNotIn('cooler_on', camera)
+        with self.assertRaises(KeyError):
+            camera.control('cooler_on')
+
+        num_controls = len(camera.controls)
+        self.assertEqual(self.backend.calls['ASIGetControlCaps'], num_controls)
+        for _ in range(10):
+            camera.control('exposure')
+        self.assertEqual(self.backend.calls['ASIGetControlCaps'], num_controls)
+
+    def test_apply_skips_unchanged(self):
+        """Only values that differ from the last written value are written."""
+        camera = self.camera
+        self.assertEqual(camera.apply(gain=100, exposure=5000), 2)
+        for _ in range(100):
+            camera.apply(gain=100, exposure=5000)
+        self.assertEqual(camera.apply(gain=100, exposure=6000), 1)
+        self.assertEqual(self.backend.calls['ASISetControlValue'], 3)
+        self.assertEqual(camera.stats(), {'writes': 3, 'writes_skipped': 201})
+        self.assertEqual(sim.ASICheck(sim.ASIGetControlValue(0, sim.ASI_EXPOSURE)), (6000, 0))
+
+    def test_apply_checks_locally(self):
+        """Invalid values are rejected without calling the library and nothing is written."""
+        camera = self.camera
+        with self.assertRaises(ValueError):
+            camera.apply(exposure=5000, gain=511)
+        with self.assertRaises(ValueError):
+            camera.apply(temperature=0)
+        with self.assertRaises(ValueError):
+            camera.set('offset', 10, auto=True)
+        self.assertNotIn('ASISetControlValue', self.backend.calls)
+        self.assertEqual(camera.value('gain'), sim.REFERENCE_GAIN)
+
+    def test_auto(self):
+        """Controls in automatic mode are always written, since their value may have changed."""
+        camera = self.camera
+        self.assertTrue(camera.set('gain', 300, auto=True))
+        self.assertTrue(camera.control('gain').auto)
+        self.assertTrue(camera.set('gain', 300, auto=True))
+        self.assertTrue(camera.set('gain', 300))
+        self.assertFalse(camera.set('gain', 300))
+        self.assertEqual(camera.read('gain'), 300)
+
+    def test_close(self):
+        """Closing is idempotent and the camera can be used as a context manager."""
+        self.camera.close()
+        self.camera.close()
+        self.assertTrue(self.camera.closed)
+        with Camera(0, backend=sim) as camera:
+            self.assertFalse(camera.closed)
+        self.assertTrue(camera.closed)
+        self.assertEqual(sim.ASIGetNumOfControls(0)[0], sim.ASI_ERROR_CAMERA_CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
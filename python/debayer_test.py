@@ -0,0 +1,126 @@
+"""Tests for the asi.debayer module."""
+
+import types
+import unittest
+import numpy as np
+
+from asi import debayer
+from asi import preview
+from asi import ser
+from asi import sim
+
+
+def reference_bilinear(raw, pattern):
+    """Straightforward per-pixel bilinear demosaic with mirrored edges, in RGB order."""
+    height, width = raw.shape
+    padded = np.pad(raw.astype(np.int64), 1, mode='reflect')
+    colors = np.empty(padded.shape, dtype='U1')
+    for i, color in enumerate(pattern):
+        colors[(i // 2 + 1) % 2::2, (i % 2 + 1) % 2::2] = color
+    image = np.empty((height, width, 3), dtype=np.int64)
+    for y in range(1, height + 1):
+        for x in range(1, width + 1):
+            for channel, color in enumerate('RGB'):
+                values = [
+                    padded[y + dy, x + dx]
+                    for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+                    if colors[y + dy, x + dx] == color and (colors[y, x] != color or dy == dx == 0)
+                ]
+                image[y - 1, x - 1, channel] = (sum(values) + len(values) // 2) // len(values)
+    return image
+
+
+class TestDebayer(unittest.TestCase):
+    """Collection of tests for Debayer and the pattern helpers."""
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_bilinear(self):
+        """Bilinear interpolation matches a per-pixel reference for every pattern and dtype."""
+        for pattern in debayer.BAYER_PATTERNS:
+            for dtype in (np.uint8, np.uint16):
+                raw = self.rng.integers(0, np.iinfo(dtype).max, (10, 12), endpoint=True)
+                raw = raw.astype(dtype)
+                expected = reference_bilinear(raw, pattern)
+                # Small tiles so that frames are split into several bands
+                with debayer.Debayer(pattern, workers=3, tile_pixels=24) as engine:
+                    np.testing.assert_array_equal(engine(raw), expected)
+                bgr = debayer.debayer(raw, pattern, order='BGR')
+                np.testing.assert_array_equal(bgr, expected[..., ::-1])
+
+    def test_superpixel(self):
+        """Superpixel output matches asi.preview.superpixel()."""
+        raw = self.rng.integers(0, 4096, (8, 12)).astype(np.uint16)
+        for pattern in debayer.BAYER_PATTERNS:
+            out = np.empty((4, 6, 3), np.uint16)
+            result = debayer.debayer(raw, pattern, 'superpixel', order='BGR', out=out)
+            self.assertIs(result, out)
+            np.testing.assert_array_equal(out, preview.superpixel(raw, pattern))
+
+    def test_edge(self):
+        """Edge-aware interpolation keeps flat fields flat and has less error at edges."""
+        flat = np.full((12, 16), 1000, dtype=np.uint16)
+        with debayer.Debayer('GRBG', 'edge', workers=2, tile_pixels=32) as engine:
+            np.testing.assert_array_equal(engine(flat), np.dstack([flat] * 3))
+
+        # Gray scene with a sharp vertical edge, sampled through an RGGB filter
+        scene = np.full((16, 16), 100, dtype=np.uint8)
+        scene[:, 7:] = 200
+        errors = {}
+        for method in ('bilinear', 'edge'):
+            image = debayer.debayer(scene, 'RGGB', method).astype(int)
+            errors[method] = np.abs(image - scene[..., None]).sum()
+        self.assertEqual(errors['edge'], 0)
+        self.assertGreater(errors['bilinear'], 0)
+
+    def test_threads(self):
+        """Processing on several threads gives the same result as a single thread."""
+        raw = self.rng.integers(0, 65536, (64, 48)).astype(np.uint16)
+        for method in debayer.METHODS:
+            expected = debayer.debayer(raw, 'BGGR', method)
+            with debayer.Debayer('BGGR', method, workers=4, tile_pixels=200) as engine:
+                out = np.empty(engine.output_shape(raw.shape), raw.dtype)
+                for _ in range(2):
+                    np.testing.assert_array_equal(engine(raw, out=out), expected)
+
+    def test_short_last_band(self):
+        """Bands do not change the result, even when the last band is shorter than the halo."""
+        raw = self.rng.integers(0, 65536, (64, 64)).astype(np.uint16)
+        for method in debayer.METHODS:
+            with debayer.Debayer('RGGB', method, workers=1, tile_pixels=64 * 64) as engine:
+                expected = engine(raw).copy()
+            with debayer.Debayer('RGGB', method, workers=2, tile_pixels=62 * 64) as engine:
+                np.testing.assert_array_equal(engine(raw), expected, err_msg=method)
+
+    def test_patterns(self):
+        """Patterns are found from camera info, ROI offsets and SER color IDs."""
+        info = types.SimpleNamespace(IsColorCam=sim.ASI_TRUE, BayerPattern=sim.ASI_BAYER_GB)
+        self.assertEqual(debayer.camera_pattern(info, backend=sim), 'GBRG')
+        self.assertEqual(debayer.camera_pattern(info, start_x=1, backend=sim), 'BGGR')
+        self.assertEqual(debayer.camera_pattern(info, start_x=1, start_y=3, backend=sim), 'GRBG')
+        info.IsColorCam = sim.ASI_FALSE
+        self.assertIsNone(debayer.camera_pattern(info, backend=sim))
+
+        self.assertEqual(debayer.ser_pattern(ser.BAYER_GRBG), 'GRBG')
+        self.assertIsNone(debayer.ser_pattern(ser.MONO))
+        with self.assertRaises(ValueError):
+            debayer.ser_pattern(16)
+
+    def test_invalid(self):
+        """Invalid arguments and frames are rejected."""
+        with self.assertRaises(ValueError):
+            debayer.Debayer('RGBG')
+        with self.assertRaises(ValueError):
+            debayer.Debayer('RGGB', 'nearest')
+        engine = debayer.Debayer('RGGB', workers=1)
+        with self.assertRaises(ValueError):
+            engine(np.zeros((5, 6), np.uint16))
+        with self.assertRaises(TypeError):
+            engine(np.zeros((4, 6), np.float32))
+        with self.assertRaises(ValueError):
+            engine(np.zeros((4, 6), np.uint16), out=np.zeros((4, 6, 3), np.uint8))
+
+
+if __name__ == '__main__':
+    unittest.main()
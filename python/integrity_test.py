@@ -0,0 +1,97 @@
+"""Tests for the asi.integrity module."""
+
+import os
+import tempfile
+import unittest
+import numpy as np
+
+from asi import integrity, ser
+
+
+def make_frames(indices, width=32, height=8):
+    """Make stacked raw frames with valid sync words and the given frame counter values."""
+    frames = np.random.randint(0, 256, size=(len(indices), height, width), dtype=np.uint8)
+    raw = frames.reshape(len(indices), -1)
+    raw[:, 0] = integrity.SYNC_START >> 8
+    raw[:, 1] = integrity.SYNC_START & 0xff
+    raw[:, -2] = integrity.SYNC_END >> 8
+    raw[:, -1] = integrity.SYNC_END & 0xff
+    indices = np.asarray(indices) % 0x10000
+    raw[:, 2] = indices & 0xff
+    raw[:, 3] = indices >> 8
+    return frames
+
+
+class TestIntegrity(unittest.TestCase):
+    """Collection of tests for frame validation and gap detection."""
+
+    def test_sync_words_and_indices(self):
+        """Sync words and counters are extracted from the frame bytes."""
+        frames = make_frames([5, 6, 0x1234])
+        start, end = integrity.sync_words(frames)
+        np.testing.assert_array_equal(start, integrity.SYNC_START)
+        np.testing.assert_array_equal(end, integrity.SYNC_END)
+        np.testing.assert_array_equal(integrity.frame_indices(frames), [5, 6, 0x1234])
+        self.assertTrue(np.all(integrity.validate(frames)))
+
+        # Same bytes interpreted as 16-bit pixels give the same answer
+        np.testing.assert_array_equal(
+            integrity.frame_indices(frames.view(np.uint16)),
+            [5, 6, 0x1234]
+        )
+
+    def test_clean_sequence(self):
+        """Steps of 1 or 2 and counter wraparound are normal."""
+        indices = list(range(65530, 65536)) + list(range(0, 10, 2)) + [10, 11]
+        report = integrity.check(make_frames(indices))
+        self.assertTrue(report.ok)
+        self.assertEqual(report.wraparounds, 1)
+        self.assertEqual(report.estimated_missing, 0)
+
+    def test_corrupt_and_gaps(self):
+        """Bad sync words, gaps and repeated frames are reported."""
+        frames = make_frames([0, 1, 2, 3, 10, 11, 11, 12, 13])
+        frames[2, 0, 0] = 0
+        frames[7, -1, -1] = 0
+        report = integrity.check(frames, camera_dropped=4)
+        np.testing.assert_array_equal(report.corrupt, [2, 7])
+        np.testing.assert_array_equal(report.gaps, [4, 6])
+        np.testing.assert_array_equal(report.gap_steps, [7, 0])
+        self.assertEqual(report.estimated_missing, 6)
+        self.assertEqual(report.unexplained_missing, 2)
+        self.assertFalse(report.ok)
+        self.assertIn('2 corrupt', report.summary())
+
+    def test_batches_match_single_pass(self):
+        """Checking in batches finds the same gaps as checking everything at once."""
+        indices = np.cumsum(np.random.choice([1, 1, 1, 2, 5], size=1000)) + 60000
+        frames = make_frames(indices)
+        whole = integrity.check(frames)
+        checker = integrity.IntegrityChecker()
+        for i in range(0, 1000, 77):
+            checker.update(frames[i:i + 77])
+        batched = checker.report()
+        np.testing.assert_array_equal(whole.gaps, batched.gaps)
+        self.assertEqual(whole.wraparounds, batched.wraparounds)
+        self.assertEqual(whole.estimated_missing, batched.estimated_missing)
+        self.assertEqual(whole.estimated_missing, 4 * np.count_nonzero(np.diff(indices) == 5))
+
+    def test_audit_ser(self):
+        """A range of frames in a SER file can be audited."""
+        frames = make_frames(list(range(100)) + list(range(110, 200)))
+        with tempfile.TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'test.ser')
+            with ser.SERWriter(filename, 32, 8, bit_depth=8) as writer:
+                writer.add_frames(frames)
+            with ser.SERReader(filename) as reader:
+                report = integrity.audit_ser(reader, batch_size=16)
+                self.assertEqual(report.frame_count, 190)
+                np.testing.assert_array_equal(report.gaps, [100])
+                self.assertEqual(report.estimated_missing, 10)
+                report = integrity.audit_ser(reader, start=120, stop=150)
+                self.assertEqual(report.frame_count, 30)
+                self.assertTrue(report.ok)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+"""Tests for the asi.metrics module."""
+
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import unittest
+import urllib.error
+import urllib.request
+
+from asi import metrics
+from asi.stream import VideoStream, BLOCK
+from stream_test import FakeBackend
+
+
+class Queue:
+    """Collector reporting a fixed queue."""
+
+    def collect_metrics(self):
+        """Return the samples of the queue."""
+        return metrics.queue_samples('disk', 3, 7, 1)
+
+
+class TestRegistry(unittest.TestCase):
+    """Collection of tests for Registry and the metric types."""
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_histogram(self):
+        """Observations are counted in the bucket of the smallest bound at or above them."""
+        histogram = self.registry.histogram('latency', bounds=(1, 2, 4))
+        for value in (0.5, 1, 1.5, 3, 3, 8):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts.tolist(), [2, 1, 2, 1])
+        self.assertEqual(histogram.cumulative(), [2, 3, 5, 6])
+        self.assertEqual(histogram.count, 6)
+        self.assertEqual(histogram.sum, 17)
+        self.assertEqual(histogram.quantile(0.5), 2.0)
+        self.assertAlmostEqual(histogram.quantile(0.75), 2 + 2 * 1.5 / 2)
+        self.assertEqual(histogram.quantile(1.0), 4.0)
+        self.assertIsNone(self.registry.histogram('empty').quantile(0.5))
+
+    def test_get_or_create(self):
+        """Metrics are shared by name and labels, and a name has a single kind."""
+        counter = self.registry.counter('frames', 'Frames', {'camera': '0'})
+        self.assertIs(self.registry.counter('frames', labels={'camera': '0'}), counter)
+        self.assertIsNot(self.registry.counter('frames', labels={'camera': '1'}), counter)
+        with self.assertRaises(ValueError):
+            self.registry.gauge('frames', labels={'camera': '0'})
+
+    def test_no_allocation(self):
+        """Recording does not hold on to memory."""
+        histogram = self.registry.stage_latency('write')
+        counter = self.registry.counter('frames')
+        histogram.observe(0.001)
+        tracemalloc.start()
+        for _ in range(10000):
+            histogram.observe_since(time.perf_counter())
+            counter.inc()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        self.assertLess(size, 1000)
+
+    def test_prometheus(self):
+        """Metrics are rendered in the Prometheus text format."""
+        self.registry.counter('frames_total', 'Frames read', {'camera': 'a"b'}).inc(5)
+        histogram = self.registry.histogram('latency_seconds', 'Latency', bounds=(0.5, 1))
+        histogram.observe(0.25)
+        histogram.observe(2.0)
+        queue = Queue()
+        self.registry.add_collector(queue)
+        text = self.registry.to_prometheus()
+        self.assertIn('# HELP frames_total Frames read\n# TYPE frames_total counter\n', text)
+        self.assertIn('frames_total{camera="a\\"b"} 5\n', text)
+        self.assertIn('latency_seconds_bucket{le="0.5"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 2\n', text)
+        self.assertIn('latency_seconds_sum 2.25\nlatency_seconds_count 2\n', text)
+        self.assertIn('asi_queue_depth{queue="disk"} 3\n', text)
+        self.assertIn('asi_queue_dropped_total{queue="disk"} 1\n', text)
+
+        # Collectors are not kept alive by the registry
+        del queue
+        self.assertNotIn('asi_queue_depth', self.registry.to_prometheus())
+
+    def test_snapshot(self):
+        """Snapshots summarize histograms and can be serialized to JSON."""
+        self.registry.gauge('pool_free').set(4)
+        self.registry.stage_latency('read').observe(0.002)
+        snapshot = json.loads(json.dumps(self.registry.snapshot()))
+        self.assertEqual(snapshot['metrics']['pool_free']['values'][0]['value'], 4)
+        read = snapshot['metrics'][metrics.STAGE_LATENCY]['values'][0]
+        self.assertEqual(read['labels'], {'stage': 'read'})
+        self.assertEqual(read['count'], 1)
+        self.assertTrue(0.001 <= read['p50'] <= 0.0025)
+
+
+class TestExport(unittest.TestCase):
+    """Collection of tests for MetricsServer, SnapshotWriter and the pipeline metrics."""
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_stream(self):
+        """A VideoStream reports frames, camera drops, sync errors and queue depths."""
+        backend = FakeBackend()
+        stream = VideoStream(0, pool_size=8, validate_frames=True, backend=backend,
+                             registry=self.registry)
+        consumer = stream.add_consumer('disk', maxsize=4, policy=BLOCK)
+        with stream:
+            backend.dropped = 3
+            stream._next_dropped_poll = 0  # pylint: disable=protected-access
+            for i, frame in enumerate(consumer):
+                frame.decr_ref_count()
+                if i == 20:
+                    break
+        self.assertEqual(stream.camera_dropped, 3)
+        # The fake camera does not send sync words
+        self.assertEqual(stream.sync_errors, stream.frames_read)
+        text = self.registry.to_prometheus()
+        self.assertIn(f'asi_frames_read_total{{camera="0"}} {stream.frames_read}\n', text)
+        self.assertIn('asi_camera_dropped_frames_total{camera="0"} 3\n', text)
+        self.assertIn('asi_queue_max_depth{queue="0/disk"} ', text)
+        latency = self.registry.stage_latency('read')
+        self.assertEqual(latency.count, stream.frames_read)
+
+    def test_server(self):
+        """The HTTP server serves text and JSON and nothing else."""
+        self.registry.counter('frames_total').inc()
+        with metrics.MetricsServer(port=0, registry=self.registry) as server:
+            url = f'http://127.0.0.1:{server.port}'
+            with urllib.request.urlopen(f'{url}/metrics') as response:
+                self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+                self.assertIn(b'frames_total 1\n', response.read())
+            with urllib.request.urlopen(f'{url}/metrics.json') as response:
+                self.assertIn('frames_total', json.load(response)['metrics'])
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f'{url}/other')  # pylint: disable=consider-using-with
+
+    def test_snapshot_writer(self):
+        """Snapshots are written periodically and on close."""
+        counter = self.registry.counter('frames_total')
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'metrics.json')
+            with metrics.SnapshotWriter(filename, interval=0.01, registry=self.registry):
+                counter.inc()
+                time.sleep(0.05)
+                self.assertTrue(os.path.exists(filename))
+                counter.inc()
+            with open(filename) as f:
+                snapshot = json.load(f)
+            self.assertEqual(snapshot['metrics']['frames_total']['values'][0]['value'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+"""Tests for the asi.packed module."""
+
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+
+from asi import packed
+from asi import ser
+
+
+class TestPacking(unittest.TestCase):
+    """Collection of tests for pack() and unpack()."""
+
+    def test_round_trip(self):
+        """Every bit depth round trips, including counts that are not a multiple of 8."""
+        rng = np.random.default_rng(0)
+        for bit_depth in range(1, 17):
+            dtype = np.uint8 if bit_depth <= 8 else np.uint16
+            samples = rng.integers(0, 1 << bit_depth, 1003).astype(dtype)
+            data = packed.pack(samples, bit_depth)
+            self.assertEqual(len(data), packed.packed_size(1003, bit_depth))
+            np.testing.assert_array_equal(packed.unpack(data, bit_depth, 1003), samples)
+
+    def test_bit_layout(self):
+        """Samples are packed least significant bit first."""
+        data = packed.pack(np.array([0xabc, 0x123] + [0] * 6, dtype=np.uint16), 12)
+        self.assertEqual(data[:3].tolist(), [0xbc, 0x3a, 0x12])
+        data = packed.pack(np.array([1, 2, 3, 4, 5, 6, 7, 0], dtype=np.uint8), 3)
+        self.assertEqual(data.tolist(), [0b11010001, 0b01011000, 0b00011111])
+
+
+class TestPackedFile(unittest.TestCase):
+    """Collection of tests for PackedWriter, PackedReader and the SER converters."""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tempdir.name, 'test.asipack')
+        rng = np.random.default_rng(1)
+        self.frames = (rng.integers(0, 4096, (7, 12, 16)) << 4).astype(np.uint16)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_write_read(self):
+        """Frames and timestamps round trip with and without compression."""
+        timestamps = time.time() + np.arange(7) * 0.01
+        for compression in (None, 'zlib'):
+            for frames_per_chunk in (1, 3):
+                with packed.PackedWriter(
+                        self.filename,
+                        16,
+                        12,
+                        bit_depth=12,
+                        compression=compression,
+                        frames_per_chunk=frames_per_chunk,
+                    ) as writer:
+                    writer.add_frame(self.frames[0], timestamps[0])
+                    writer.add_frames(self.frames[1:], timestamps[1:])
+                    self.assertEqual(writer.frame_count, 6 if frames_per_chunk == 3 else 7)
+                if compression is None:
+                    self.assertEqual(writer.bytes_out, self.frames.nbytes * 3 // 4)
+
+                with packed.PackedReader(self.filename) as reader:
+                    self.assertEqual(len(reader), 7)
+                    self.assertEqual(reader.shape, (12, 16))
+                    self.assertEqual(reader.dtype, np.uint16)
+                    self.assertEqual(len(reader.index), -(-7 // frames_per_chunk))
+                    np.testing.assert_array_equal(reader[4], self.frames[4])
+                    np.testing.assert_array_equal(reader[-1], self.frames[6])
+                    np.testing.assert_array_equal(reader[1:6:2], self.frames[1:6:2])
+                    np.testing.assert_array_equal(np.stack(list(reader)), self.frames)
+                    np.testing.assert_allclose(ser.ticks_to_unix(reader.timestamps), timestamps,
+                                               atol=1e-6)
+                    with self.assertRaises(IndexError):
+                        reader[7]  # pylint: disable=pointless-statement
+
+    def test_lossless_check(self):
+        """Samples that would lose bits are rejected."""
+        with packed.PackedWriter(self.filename, 16, 12, bit_depth=12) as writer:
+            with self.assertRaises(ValueError):
+                writer.add_frame(self.frames[0] + 1)
+        with packed.PackedWriter(self.filename, 16, 12, bit_depth=12, shift=0) as writer:
+            with self.assertRaises(ValueError):
+                writer.add_frame(self.frames[0])
+            with self.assertRaises(ValueError):
+                writer.add_frame(self.frames[0, :6])
+
+    def test_unclosed(self):
+        """Complete chunks of a file that was not closed can still be read."""
+        writer = packed.PackedWriter(self.filename, 16, 12, bit_depth=12, frames_per_chunk=2)
+        writer.add_frames(self.frames)
+        os.close(writer._fd)  # pylint: disable=protected-access
+        with open(self.filename, 'ab') as f:
+            f.write(b'CHNK')  # partial chunk header
+        with packed.PackedReader(self.filename) as reader:
+            self.assertEqual(len(reader), 6)
+            np.testing.assert_array_equal(reader[1:], self.frames[1:6])
+            self.assertEqual(len(reader.timestamps), 6)
+
+    def test_ser_round_trip(self):
+        """Converting SER to packed and back gives an identical SER file."""
+        ser_filename = os.path.join(self.tempdir.name, 'test.ser')
+        copy_filename = os.path.join(self.tempdir.name, 'copy.ser')
+        rgb = np.random.default_rng(2).integers(0, 1024, (3, 4, 6, 3), dtype=np.uint16) << 6
+        for frames, color_id, add_trailer in (
+                (self.frames, ser.BAYER_GRBG, True),
+                (rgb, ser.RGB, False),
+            ):
+            with ser.SERWriter(
+                    ser_filename,
+                    frames.shape[2],
+                    frames.shape[1],
+                    color_id,
+                    bit_depth=16,
+                    observer='observer',
+                    add_trailer=add_trailer,
+                ) as writer:
+                # Big-endian data, which most software writes with the LittleEndian field 0
+                writer.add_frames(frames.astype('>u2'))
+                writer.header['LittleEndian'] = 0
+            bit_depth = 12 if color_id == ser.BAYER_GRBG else 10
+            count = packed.ser_to_packed(ser_filename, self.filename, bit_depth)
+            self.assertEqual(count, len(frames))
+            with packed.PackedReader(self.filename) as reader:
+                self.assertEqual(reader.bit_depth, bit_depth)
+                self.assertEqual(reader.color_id, color_id)
+                self.assertEqual(reader.timestamps is None, not add_trailer)
+            packed.packed_to_ser(self.filename, copy_filename)
+            with open(ser_filename, 'rb') as f1, open(copy_filename, 'rb') as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def test_invalid(self):
+        """Invalid arguments are rejected."""
+        with self.assertRaises(ValueError):
+            packed.PackedWriter(self.filename, 16, 12, bit_depth=17)
+        with self.assertRaises(ValueError):
+            packed.PackedWriter(self.filename, 16, 12, bit_depth=12, compression='lz4')
+        with open(self.filename, 'wb') as f:
+            f.write(bytes(packed.HEADER_SIZE))
+        with self.assertRaises(ValueError):
+            packed.PackedReader(self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+"""Tests for the asi.preview module."""
+
+import threading
+import time
+import unittest
+import numpy as np
+
+from asi import debayer
+from asi import preview
+from asi.stream import VideoStream
+from stream_test import FakeBackend
+
+
+class TestDebayer(unittest.TestCase):
+    """Collection of tests for the reduced resolution debayering functions."""
+
+    def test_superpixel(self):
+        """Each 2x2 Bayer cell becomes one BGR pixel with the greens averaged."""
+        raw = np.zeros((4, 6), dtype=np.uint8)
+        raw[0::2, 0::2] = 200  # R
+        raw[0::2, 1::2] = 100  # G
+        raw[1::2, 0::2] = 51  # G
+        raw[1::2, 1::2] = 10  # B
+        image = preview.superpixel(raw, 'RGGB')
+        self.assertEqual(image.shape, (2, 3, 3))
+        self.assertEqual(image.dtype, np.uint8)
+        self.assertTrue(np.all(image == [10, 75, 200]))
+
+        image = preview.superpixel(raw, 'BGGR')
+        self.assertTrue(np.all(image == [200, 75, 10]))
+
+    def test_superpixel_16bit_decimated(self):
+        """16-bit frames do not overflow and decimation skips whole Bayer cells."""
+        raw = np.full((10, 12), 0xfff0, dtype=np.uint16)
+        raw[0::4, 0::4] = 1000
+        image = preview.superpixel(raw, 'RGGB', decimation=2)
+        self.assertEqual(image.shape, (2, 3, 3))
+        self.assertTrue(np.all(image == [0xfff0, 0xfff0, 1000]))
+
+    def test_bin2x2(self):
+        """Mono frames are averaged over 2x2 blocks."""
+        raw = np.array([[0, 4, 8, 8], [4, 8, 8, 8], [255, 255, 1, 1]], dtype=np.uint8)
+        np.testing.assert_array_equal(preview.bin2x2(raw), [[4, 8]])
+
+    def test_invalid_pattern(self):
+        """Only the four Bayer patterns with diagonal greens are accepted."""
+        with self.assertRaises(ValueError):
+            preview.superpixel(np.zeros((4, 4), dtype=np.uint8), 'RGBG')
+
+
+class TestPreview(unittest.TestCase):
+    """Collection of tests for the Preview class."""
+
+    def test_process(self):
+        """Full frames are shown at reduced resolution and zoomed regions at full resolution."""
+        stream = VideoStream(0, pool_size=2, backend=FakeBackend(width=64, height=48))
+        raw = np.random.randint(0, 65536, size=(48, 64), dtype=np.uint16)
+
+        prev = preview.Preview(stream, render=lambda image: None)
+        image = prev.process(raw)
+        self.assertEqual(image.shape, (24, 32, 3))
+        self.assertEqual(image.dtype, np.uint8)
+
+        prev.zoom_roi = (11, 5, 16, 8)
+        image = prev.process(raw)
+        self.assertEqual(image.shape, (8, 16, 3))
+        np.testing.assert_array_equal(image[0, 0, 2], raw[4, 10] >> 8)
+        # Every sensor pixel is shown rather than each Bayer cell repeated
+        np.testing.assert_array_equal(
+            image, preview.to_8bit(debayer.debayer(raw[4:12, 10:26], 'RGGB', order='BGR'))
+        )
+        np.testing.assert_array_equal(image[0, 1, 1], raw[4, 11] >> 8)
+
+        mono = preview.Preview(stream, render=lambda image: None, bayer_pattern=None)
+        image = mono.process(raw)
+        self.assertEqual(image.shape, (24, 32))
+        self.assertFalse(np.shares_memory(image, raw))
+
+    def test_adaptive_rate(self):
+        """A slow renderer lowers the refresh rate without slowing down the stream."""
+        stream = VideoStream(0, pool_size=4, backend=FakeBackend(frame_period=0.001))
+        rendered = []
+        render_thread = []
+
+        def render(image):
+            render_thread.append(threading.current_thread())
+            rendered.append(image)
+            time.sleep(0.02)
+
+        with stream, preview.Preview(stream, render=render, max_load=0.5) as prev:
+            time.sleep(0.5)
+        self.assertGreater(len(rendered), 2)
+        self.assertLessEqual(len(rendered), 14)
+        self.assertGreater(stream.frames_read, 5 * len(rendered))
+        self.assertGreaterEqual(prev.interval, 0.04)
+        self.assertNotIn(threading.main_thread(), render_thread)
+        self.assertEqual(stream.pool.free, 4)
+
+    def test_stream_stopped(self):
+        """The preview thread ends rather than spinning once the stream has stopped."""
+        stream = VideoStream(0, pool_size=4, backend=FakeBackend(frame_period=0.001))
+        with preview.Preview(stream, render=lambda image: None) as prev:
+            with stream:
+                time.sleep(0.1)
+            deadline = time.monotonic() + 1
+            while prev.running and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(prev.running)
+        self.assertEqual(stream.pool.free, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
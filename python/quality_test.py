@@ -0,0 +1,128 @@
+"""Tests for asi.quality."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+
+from asi import quality
+from asi import ser
+
+
+def blur(image, passes):
+    """Return an image smoothed by repeated 3x3 box filtering."""
+    image = image.astype(np.float64)
+    for _ in range(passes):
+        padded = np.pad(image, 1, mode='edge')
+        image = sum(
+            padded[dy:dy + image.shape[0], dx:dx + image.shape[1]]
+            for dy in range(3) for dx in range(3)
+        ) / 9
+    return image
+
+
+class TestFrameMetrics(unittest.TestCase):
+    """Collection of tests for frame_metrics() and rank()."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        scene = rng.uniform(1000, 3000, (60, 80))
+        # Frames from sharpest to blurriest
+        self.frames = np.stack([blur(scene, passes) for passes in range(4)]).astype(np.uint16)
+
+    def test_sharpness(self):
+        """Blurrier frames score lower and scores do not depend on brightness."""
+        metrics = quality.frame_metrics(self.frames, first_index=10)
+        np.testing.assert_array_equal(metrics['index'], [10, 11, 12, 13])
+        for metric in quality.SHARPNESS_METRICS:
+            self.assertTrue(np.all(np.diff(metrics[metric]) < 0), metric)
+        brighter = quality.frame_metrics(self.frames * 2)
+        np.testing.assert_allclose(brighter['laplacian'], metrics['laplacian'], rtol=1e-4)
+        np.testing.assert_allclose(brighter['mean'], metrics['mean'] * 2, rtol=1e-6)
+
+    def test_bayer(self):
+        """The color filter pattern of Bayer frames is not counted as detail."""
+        pattern = np.tile(np.array([[1000, 3000], [2000, 500]], dtype=np.uint16), (30, 40))
+        mono = quality.frame_metrics(pattern[np.newaxis])
+        bayer = quality.frame_metrics(pattern[np.newaxis], bayer=True)
+        self.assertGreater(mono['laplacian'][0], 0.1)
+        self.assertEqual(bayer['laplacian'][0], 0)
+        self.assertAlmostEqual(bayer['mean'][0], 1625)
+
+    def test_saturation_and_roi(self):
+        """Saturated pixels are counted, within the ROI if one is given."""
+        frames = self.frames.copy()
+        frames[0, :6, :8] = 65535
+        metrics = quality.frame_metrics(frames)
+        self.assertAlmostEqual(metrics['saturated'][0], 48 / (60 * 80))
+        self.assertEqual(metrics['saturated'][1], 0)
+        metrics = quality.frame_metrics(frames, roi=(0, 0, 16, 12))
+        self.assertAlmostEqual(metrics['saturated'][0], 0.25)
+
+    def test_rank(self):
+        """Frames are ranked sharpest first, excluding dark and saturated frames."""
+        frames = np.concatenate([self.frames, self.frames[:2]])
+        frames[4] //= 4
+        frames[5, :10] = 65535
+        ranked = quality.rank(quality.frame_metrics(frames))
+        np.testing.assert_array_equal(ranked, [0, 1, 2, 3])
+        ranked = quality.rank(
+            quality.frame_metrics(frames), 'gradient', min_relative_brightness=0, max_saturated=1
+        )
+        self.assertEqual(set(ranked[:3].tolist()), {0, 4, 5})
+        with self.assertRaises(ValueError):
+            quality.rank(quality.frame_metrics(frames), 'mean')
+
+
+class TestSER(unittest.TestCase):
+    """Collection of tests for scoring and selecting the frames of SER files."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'capture.ser')
+        rng = np.random.default_rng(1)
+        scene = rng.uniform(50, 200, (48, 64))
+        self.blur = rng.integers(0, 4, 40)
+        with ser.SERWriter(self.filename, 64, 48, ser.BAYER_RGGB, 8) as writer:
+            for i, passes in enumerate(self.blur):
+                # Blurring each Bayer channel separately keeps the pattern intact
+                frame = np.empty((48, 64))
+                for y in range(2):
+                    for x in range(2):
+                        frame[y::2, x::2] = blur(scene[y::2, x::2], passes)
+                writer.add_frame(frame.astype(np.uint8), 1_700_000_000 + i)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_score_ser(self):
+        """Worker processes produce the same scores as scoring in the calling process."""
+        serial = quality.score_ser(self.filename, workers=1)
+        self.assertEqual(len(serial), 40)
+        sharpness = serial['laplacian']
+        for passes in range(1, 4):
+            self.assertLess(
+                sharpness[self.blur == passes].max(), sharpness[self.blur == passes - 1].min()
+            )
+        with mock.patch.object(quality, 'TASK_FRAMES', 7):
+            parallel = quality.score_ser(self.filename, workers=2)
+        np.testing.assert_array_equal(parallel, serial)
+
+    def test_select_ser(self):
+        """The sharpest frames are written in their original order with their timestamps."""
+        output = os.path.join(self.directory.name, 'best.ser')
+        selected = quality.select_ser(self.filename, output, top_percent=25, workers=1)
+        self.assertEqual(len(selected), 10)
+        self.assertTrue(np.all(self.blur[selected] <= np.sort(self.blur)[9]))
+        with ser.SERReader(self.filename) as reader, ser.SERReader(output) as best:
+            self.assertEqual((len(best), best.color_id), (10, ser.BAYER_RGGB))
+            order = np.sort(selected)
+            np.testing.assert_array_equal(best.frames, reader.frames[order])
+            np.testing.assert_allclose(
+                ser.ticks_to_unix(best.timestamps), 1_700_000_000 + order, atol=1e-6
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
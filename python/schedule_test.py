@@ -0,0 +1,155 @@
+"""Tests for asi.schedule."""
+
+import datetime
+import threading
+import time
+import unittest
+
+from asi import schedule
+
+
+def utc(*args):
+    """Return the Unix time of a UTC date and time."""
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc).timestamp()
+
+
+class TestSleep(unittest.TestCase):
+    """Collection of tests for sleep_until() and next_aligned_time()."""
+
+    def test_sleep_until(self):
+        """Wakeups are never early and usually within a millisecond of the deadline."""
+        lateness = sorted(schedule.sleep_until(time.time() + 0.005) for _ in range(20))
+        self.assertGreaterEqual(lateness[0], 0.0)
+        self.assertLess(lateness[len(lateness) // 2], 0.005)
+        self.assertGreater(schedule.sleep_until(time.time() - 1.0), 0.99)
+
+    def test_next_aligned_time(self):
+        """Instants are aligned to multiples of the interval plus the offset."""
+        t = utc(2024, 1, 1, 12, 0, 30)
+        self.assertEqual(schedule.next_aligned_time(60, t), utc(2024, 1, 1, 12, 1))
+        self.assertEqual(schedule.next_aligned_time(60, t, offset=40), utc(2024, 1, 1, 12, 0, 40))
+        self.assertEqual(schedule.next_aligned_time(60, t, margin=40), utc(2024, 1, 1, 12, 2))
+        self.assertEqual(schedule.next_aligned_time(60, utc(2024, 1, 1)), utc(2024, 1, 1))
+        # Instants computed from an aligned instant are not pushed back an interval by rounding
+        t = schedule.next_aligned_time(0.1, 1792295944.25)
+        self.assertAlmostEqual(schedule.next_aligned_time(0.1, t), t, delta=1e-6)
+        self.assertAlmostEqual(schedule.Scheduler(0.1, None).next_shot(t), t + 0.1, delta=1e-6)
+        with self.assertRaises(ValueError):
+            schedule.next_aligned_time(0)
+
+
+class TestObservationWindows(unittest.TestCase):
+    """Collection of tests for sun_altitude() and ObservationWindows."""
+
+    def test_sun_altitude(self):
+        """The Sun is overhead at the equator at noon on an equinox and at the expected height
+        at the solstices."""
+        noon = utc(2024, 3, 20, 12, 7)
+        altitudes = schedule.sun_altitude([noon, noon + 43_200], 0.0, 0.0)
+        self.assertAlmostEqual(altitudes[0], 90.0, delta=0.5)
+        self.assertAlmostEqual(altitudes[1], -90.0, delta=0.5)
+        # Local noon at 90 E is 6 hours earlier
+        self.assertAlmostEqual(
+            schedule.sun_altitude(utc(2024, 6, 20, 6, 2), 45.0, 90.0), 90 - 45 + 23.44, delta=0.2
+        )
+
+    def test_polar_windows(self):
+        """Near the pole there is one window all day in winter and none in summer."""
+        windows = schedule.ObservationWindows(-72.32, 170.23, sun_altitude_max=-5.0)
+        self.assertEqual(
+            windows.windows(datetime.date(2024, 6, 21)),
+            [(utc(2024, 6, 21), utc(2024, 6, 22))],
+        )
+        self.assertEqual(windows.windows(datetime.date(2024, 12, 21)), [])
+        self.assertFalse(windows.contains(utc(2024, 12, 21, 12)))
+        # The Sun first gets 5 degrees below the horizon around the end of February
+        next_start = windows.next_start(utc(2024, 12, 21))
+        self.assertTrue(utc(2025, 2, 1) < next_start < utc(2025, 3, 15))
+
+    def test_windows(self):
+        """Window boundaries match sunrise and sunset, and windows spanning midnight are split."""
+        windows = schedule.ObservationWindows(51.48, 0.0, sun_altitude_max=-0.83)
+        (_, sunrise), (sunset, _) = windows.windows(datetime.date(2024, 3, 20))
+        # Sunrise and sunset at Greenwich on the March equinox are at about 06:03 and 18:14 UTC
+        self.assertAlmostEqual(sunrise, utc(2024, 3, 20, 6, 3), delta=180)
+        self.assertAlmostEqual(sunset, utc(2024, 3, 20, 18, 14), delta=180)
+        self.assertTrue(windows.contains(utc(2024, 3, 20, 23)))
+        self.assertFalse(windows.contains(utc(2024, 3, 20, 12)))
+        self.assertEqual(windows.next_start(utc(2024, 3, 20, 12)), sunset)
+        self.assertEqual(windows.next_start(utc(2024, 3, 20, 23)), utc(2024, 3, 20, 23))
+
+
+class TestScheduler(unittest.TestCase):
+    """Collection of tests for Scheduler."""
+
+    def test_run(self):
+        """Shots are taken at aligned times and jitter is reported."""
+        times = []
+        scheduler = schedule.Scheduler(0.1, times.append)
+        scheduler.run(count=5)
+        self.assertEqual(len(times), 5)
+        for t in times:
+            self.assertAlmostEqual(t, round(t / 0.1) * 0.1, delta=1e-6)
+        stats = scheduler.stats()
+        self.assertEqual((stats['shots'], stats['missed']), (5, 0))
+        self.assertLess(stats['jitter_ms']['p50'], 5.0)
+
+    def test_overrun(self):
+        """Shots that cannot start on time are skipped and counted."""
+        def slow(t):
+            time.sleep(0.045)
+
+        scheduler = schedule.Scheduler(0.02, slow)
+        scheduler.run(count=3)
+        self.assertGreaterEqual(scheduler.stats()['missed'], 4)
+
+    def overrun_past_window(self, next_window):
+        """Return a Scheduler whose first shot overruns past the end of its observation window.
+
+        The window ends 0.3 s after now and the next one starts next_window seconds after now, or
+        never if next_window is None.
+        """
+        start = time.time()
+
+        def contains(t):
+            return t <= start + 0.3 or (next_window is not None and t >= start + next_window)
+
+        def next_start(t):
+            if contains(t):
+                return t
+            return None if next_window is None else start + next_window
+
+        def overrun(t):
+            time.sleep(start + 0.4 - time.time())
+            scheduler.stop()
+
+        windows = schedule.ObservationWindows(0.0, 0.0)
+        windows.contains = contains
+        windows.next_start = next_start
+        scheduler = schedule.Scheduler(0.02, overrun, windows=windows)
+        scheduler.run()
+        return scheduler
+
+    def test_overrun_past_window(self):
+        """Only the skipped shots inside the observation windows are counted as missed."""
+        for next_window in (100.0, None):
+            scheduler = self.overrun_past_window(next_window)
+            self.assertEqual(scheduler.shots, 1)
+            self.assertGreater(scheduler.missed, 5, next_window)
+            self.assertLessEqual(scheduler.missed, 16, next_window)
+
+    def test_windows_and_stop(self):
+        """Shots are only taken within observation windows and stop() ends run()."""
+        windows = schedule.ObservationWindows(0.0, 0.0)
+        windows.contains = lambda t: int(t * 10) % 2 == 0
+        windows.next_start = lambda t: (int(t * 10) + 1) / 10
+        times = []
+        scheduler = schedule.Scheduler(0.01, times.append, windows=windows)
+        threading.Timer(0.5, scheduler.stop).start()
+        scheduler.run()
+        self.assertGreater(len(times), 5)
+        self.assertTrue(all(windows.contains(t) for t in times))
+
+
+if __name__ == '__main__':
+    unittest.main()
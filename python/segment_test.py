@@ -0,0 +1,181 @@
+"""Tests for the asi.segment module."""
+
+import errno
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+import numpy as np
+
+from asi import segment
+from asi import ser
+
+
+class TestSegmentedWriter(unittest.TestCase):
+    """Collection of tests for SegmentedWriter and SegmentedReader."""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.directories = [os.path.join(self.tempdir.name, f'disk{i}') for i in range(2)]
+        self.frames = np.random.default_rng(0).integers(0, 4096, (12, 6, 8), dtype=np.uint16)
+        self.timestamps = 1_700_000_000 + np.arange(12) * 0.1
+        # Room for 5 frames and their timestamps
+        self.max_bytes = ser.HEADER_SIZE + 5 * (self.frames[0].nbytes + 8)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def record(self, **kwargs):
+        """Record all frames and return the path of the first manifest and the writer stats."""
+        kwargs.setdefault('max_bytes', self.max_bytes)
+        with segment.SegmentedWriter(
+                self.directories, 8, 6, ser.MONO, bit_depth=16, prefix='run', **kwargs
+            ) as writer:
+            for frame, timestamp in zip(self.frames, self.timestamps):
+                writer.add_frame(frame, timestamp)
+        return os.path.join(self.directories[0], 'run.json'), writer.stats()
+
+    def check_frames(self, manifest):
+        """Check that the recording holds every frame and timestamp in order."""
+        with segment.SegmentedReader(manifest) as reader:
+            self.assertEqual(len(reader), len(self.frames))
+            np.testing.assert_array_equal(np.stack(list(reader)), self.frames)
+            np.testing.assert_array_equal(reader[-2], self.frames[-2])
+            np.testing.assert_allclose(ser.ticks_to_unix(reader.timestamps), self.timestamps,
+                                       atol=1e-6)
+
+    def test_size_rollover(self):
+        """Segments are limited in size and alternate between directories."""
+        manifest, stats = self.record()
+        self.assertEqual(stats['written'], 12)
+        self.assertEqual(stats['dropped'], 0)
+        with open(manifest) as f:
+            entries = json.load(f)['segments']
+        self.assertEqual([entry['first_frame'] for entry in entries], [0, 5, 10])
+        self.assertEqual([entry['frame_count'] for entry in entries], [5, 5, 2])
+        self.assertEqual(
+            [os.path.dirname(entry['path']) for entry in entries],
+            [self.directories[0], self.directories[1], self.directories[0]],
+        )
+        for entry in entries:
+            self.assertTrue(entry['complete'])
+            self.assertLessEqual(os.path.getsize(entry['path']), self.max_bytes)
+        self.assertAlmostEqual(entries[1]['start_time'], self.timestamps[5])
+        self.assertAlmostEqual(entries[1]['end_time'], self.timestamps[9])
+        # Every directory has the same manifest
+        with open(os.path.join(self.directories[1], 'run.json')) as f:
+            self.assertEqual(json.load(f)['segments'], entries)
+        self.check_frames(manifest)
+
+    def test_time_rollover(self):
+        """Segments are limited in duration."""
+        manifest, _ = self.record(max_bytes=1 << 20, max_seconds=0.35)
+        with open(manifest) as f:
+            entries = json.load(f)['segments']
+        self.assertEqual([entry['frame_count'] for entry in entries], [4, 4, 4])
+        self.check_frames(manifest)
+
+    def test_full_disk(self):
+        """Directories without room for a segment are skipped, and frames dropped if none has."""
+        def free_bytes(directory):
+            return 0 if directory == self.directories[0] else 1 << 40
+
+        with mock.patch.object(segment, 'free_bytes', free_bytes):
+            manifest, stats = self.record()
+        self.assertEqual(os.listdir(self.directories[0]), ['run.json'])
+        self.check_frames(manifest)
+
+        with mock.patch.object(segment, 'free_bytes', return_value=0):
+            _, stats = self.record()
+        self.assertEqual(stats['written'], 0)
+        self.assertEqual(stats['dropped'], 12)
+
+    def test_write_failure(self):
+        """Frames queued for a directory that fails are moved to another directory."""
+        add_frames = ser.SERWriter.add_frames
+
+        def failing_add_frames(writer, images, timestamps=None, ticks=None):
+            if writer.filename.startswith(self.directories[1]) and writer.frame_count == 2:
+                raise OSError(errno.EIO, 'Input/output error')
+            add_frames(writer, images, timestamps, ticks)
+
+        with mock.patch.object(ser.SERWriter, 'add_frames', failing_add_frames):
+            manifest, stats = self.record()
+        self.assertTrue(stats['directories'][self.directories[1]]['failed'])
+        self.assertEqual(stats['written'], 12)
+        with open(manifest) as f:
+            entries = json.load(f)['segments']
+        self.assertEqual([entry['first_frame'] for entry in entries], [0, 5, 7, 10])
+        self.assertEqual(os.path.dirname(entries[1]['path']), self.directories[1])
+        self.check_frames(manifest)
+
+    def test_close_failure(self):
+        """A segment whose close fails after all its frames were written is not continued."""
+        close = ser.SERWriter.close
+        failures = []
+
+        def failing_close(writer):
+            if writer.filename.startswith(self.directories[1]) and not failures:
+                failures.append(writer.filename)
+                raise OSError(errno.EIO, 'Input/output error')
+            close(writer)
+
+        with mock.patch.object(ser.SERWriter, 'close', failing_close):
+            manifest, stats = self.record()
+        self.assertEqual(len(failures), 1)
+        self.assertTrue(stats['directories'][self.directories[1]]['failed'])
+        self.assertEqual(stats['segments'], 3)
+        with open(manifest) as f:
+            entries = json.load(f)['segments']
+        self.assertEqual([entry['first_frame'] for entry in entries], [0, 5, 10])
+        self.check_frames(manifest)
+
+    def test_relocated(self):
+        """Segments gathered into one directory are found next to the manifest."""
+        manifest, _ = self.record()
+        for name in os.listdir(self.directories[1]):
+            if name.endswith('.ser'):
+                shutil.move(os.path.join(self.directories[1], name), self.directories[0])
+        self.check_frames(manifest)
+
+    @mock.patch.object(segment, 'FREE_SPACE_CHECK_FRAMES', 4)
+    def test_read_while_recording(self):
+        """The segment being written is listed in the manifest and can be read before close()."""
+        manifest = os.path.join(self.directories[0], 'run.json')
+        with segment.SegmentedWriter(self.directories, 8, 6, ser.MONO, bit_depth=16,
+                                     prefix='run', max_bytes=1 << 20) as writer:
+            for frame, timestamp in zip(self.frames[:10], self.timestamps):
+                writer.add_frame(frame, timestamp)
+            deadline = time.monotonic() + 5
+            while writer.stats()['written'] < 10 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            with open(manifest) as f:
+                entries = json.load(f)['segments']
+            self.assertEqual(len(entries), 1)
+            self.assertFalse(entries[0]['complete'])
+            # Refreshed every FREE_SPACE_CHECK_FRAMES frames
+            self.assertEqual(entries[0]['frame_count'], 8)
+            with segment.SegmentedReader(manifest) as reader:
+                self.assertEqual(len(reader), 10)
+                np.testing.assert_array_equal(np.stack(list(reader)), self.frames[:10])
+                self.assertIsNone(reader.timestamps)
+        with segment.SegmentedReader(manifest) as reader:
+            self.assertEqual(len(reader), 10)
+            self.assertIsNotNone(reader.timestamps)
+
+    def test_invalid(self):
+        """Invalid arguments and frames are rejected."""
+        with self.assertRaises(ValueError):
+            segment.SegmentedWriter(self.directories, 8, 6, ser.MONO, 16, max_bytes=100)
+        with segment.SegmentedWriter(self.directories, 8, 6, ser.MONO, 16) as writer:
+            with self.assertRaises(ValueError):
+                writer.add_frame(self.frames[0, :3])
+        with self.assertRaises(RuntimeError):
+            writer.add_frame(self.frames[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Rank the frames of a SER video by sharpness for lucky imaging.
+
+Writes the ranked index as CSV (sharpest first, with every metric of each frame) and optionally
+the best frames as a new SER file.
+"""
+
+import argparse
+import csv
+import logging
+import sys
+import time
+
+from asi import quality
+from asi import ser
+
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('filename', help='SER file to score')
+    parser.add_argument('--metric', choices=quality.SHARPNESS_METRICS, default='laplacian')
+    parser.add_argument(
+        '--roi',
+        type=lambda s: tuple(int(v) for v in s.split(',')),
+        help='region x,y,width,height of each frame to score',
+    )
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--index', help='CSV file for the ranked index (default: standard output)')
+    parser.add_argument('--output', help='SER file for the best frames')
+    parser.add_argument('--top-percent', type=float, default=10.0, help='percentage of frames kept')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    start = time.perf_counter()
+    metrics = quality.score_ser(args.filename, workers=args.workers, roi=args.roi)
+    elapsed = time.perf_counter() - start
+    logger.info('Scored %d frames in %.1f s (%.0f frames/min)',
+                len(metrics), elapsed, len(metrics) / elapsed * 60)
+    ranked = quality.rank(metrics, args.metric)
+
+    f = open(args.index, 'w', newline='') if args.index else sys.stdout
+    try:
+        writer = csv.writer(f)
+        writer.writerow(('rank',) + metrics.dtype.names)
+        for i, index in enumerate(ranked):
+            # Metrics are in file order, so a frame index is also its position in metrics
+            writer.writerow((i,) + tuple(metrics[index].tolist()))
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+    if args.output:
+        selected = ranked[:int(round(len(metrics) * args.top_percent / 100))]
+        with ser.SERReader(args.filename) as reader:
+            quality.write_selected(reader, selected, args.output)
+        logger.info('Wrote %d frames to %s', len(selected), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""Tests for the asi.ser module."""
+
+import mmap
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+
+from asi import ser
+
+
+class TestSERWriter(unittest.TestCase):
+    """Collection of tests for SERWriter."""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tempdir.name, 'test.ser')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def read_file(self):
+        """Return the header and the raw contents of the SER file."""
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        header = np.frombuffer(data, dtype=ser.HEADER_DTYPE, count=1)[0]
+        return header, data
+
+    def test_header_layout(self):
+        """Header is packed to the 178 byte layout of SERHeader_t."""
+        self.assertEqual(ser.HEADER_SIZE, 178)
+        self.assertEqual(ser.HEADER_DTYPE.fields['FrameCount'][1], 38)
+        self.assertEqual(ser.HEADER_DTYPE.fields['DateTime'][1], 162)
+
+    def test_write_frames(self):
+        """Frames, header fields and the timestamp trailer are written."""
+        frames = np.random.randint(0, 4096, size=(5, 12, 16), dtype=np.uint16)
+        timestamps = time.time() + np.arange(5) * 0.01
+        with ser.SERWriter(
+                self.filename,
+                16,
+                12,
+                color_id=ser.MONO,
+                bit_depth=12,
+                instrument='ZWO ASI178MM',
+            ) as writer:
+            writer.add_frame(frames[0], timestamps[0])
+            writer.add_frames(frames[1:], timestamps[1:])
+            self.assertEqual(writer.frame_count, 5)
+
+        header, data = self.read_file()
+        self.assertEqual(header['FileID'], b'LUCAM-RECORDER')
+        self.assertEqual(header['ColorID'], ser.MONO)
+        self.assertEqual(header['ImageWidth'], 16)
+        self.assertEqual(header['ImageHeight'], 12)
+        self.assertEqual(header['PixelDepthPerPlane'], 12)
+        self.assertEqual(header['FrameCount'], 5)
+        self.assertEqual(header['Instrument'], b'ZWO ASI178MM')
+        self.assertAlmostEqual(ser.ticks_to_unix(header['DateTime_UTC']), time.time(), delta=5)
+
+        frame_bytes = frames.nbytes
+        self.assertEqual(len(data), ser.HEADER_SIZE + frame_bytes + 5 * 8)
+        written = np.frombuffer(data, dtype=np.uint16, count=frames.size, offset=ser.HEADER_SIZE)
+        np.testing.assert_array_equal(written.reshape(frames.shape), frames)
+        trailer = np.frombuffer(data, dtype=np.int64, offset=ser.HEADER_SIZE + frame_bytes)
+        np.testing.assert_allclose(ser.ticks_to_unix(trailer), timestamps, atol=1e-6)
+
+    def test_header_updated_in_place(self):
+        """The frame count on disk is current before the file is closed."""
+        writer = ser.SERWriter(self.filename, 8, 8, add_trailer=False)
+        writer.add_frame(np.zeros((8, 8), dtype=np.uint8))
+        writer.add_frame(np.zeros((8, 8), dtype=np.uint8))
+        header, data = self.read_file()
+        self.assertEqual(header['FrameCount'], 2)
+        self.assertEqual(len(data), ser.HEADER_SIZE + 2 * 64)
+        writer.close()
+
+    def test_empty_file_deleted(self):
+        """A file with no frames is removed on close."""
+        with ser.SERWriter(self.filename, 8, 8):
+            self.assertTrue(os.path.exists(self.filename))
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_wrong_frame_size(self):
+        """Frames of the wrong size are rejected."""
+        with ser.SERWriter(self.filename, 8, 8) as writer:
+            with self.assertRaises(ValueError):
+                writer.add_frame(np.zeros((8, 8), dtype=np.uint16))
+
+    def test_preallocate(self):
+        """Preallocated space beyond the last frame is released on close."""
+        with ser.SERWriter(self.filename, 8, 8, preallocate_frames=100) as writer:
+            self.assertGreaterEqual(os.path.getsize(self.filename), ser.HEADER_SIZE + 100 * 64)
+            writer.add_frames(np.ones((3, 8, 8), dtype=np.uint8))
+        _, data = self.read_file()
+        self.assertEqual(len(data), ser.HEADER_SIZE + 3 * 64 + 3 * 8)
+
+    def test_direct_io(self):
+        """Frames written with O_DIRECT are identical to frames written normally."""
+        frames = np.random.randint(0, 256, size=(20, 123, 97), dtype=np.uint8)
+        try:
+            writer = ser.SERWriter(self.filename, 97, 123, direct_io=True)
+        except OSError as e:
+            self.skipTest(f'O_DIRECT not supported: {e}')
+        with writer:
+            writer.add_frames(frames[:7])
+            # Only frames that have reached the file are counted in the header until it is closed
+            self.assertEqual(writer.frame_count, 7)
+            count = int(writer.header['FrameCount'])
+            self.assertLess(count, 7)
+            with open(self.filename, 'rb') as f:
+                f.seek(ser.HEADER_SIZE)
+                on_disk = np.frombuffer(f.read(count * frames[0].nbytes), dtype=np.uint8)
+            np.testing.assert_array_equal(on_disk.reshape((count,) + frames.shape[1:]),
+                                          frames[:count])
+            for i in range(7, 20, 7):
+                writer.add_frames(frames[i:i + 7])
+        header, data = self.read_file()
+        self.assertEqual(header['FrameCount'], 20)
+        written = np.frombuffer(data, dtype=np.uint8, count=frames.size, offset=ser.HEADER_SIZE)
+        np.testing.assert_array_equal(written.reshape(frames.shape), frames)
+        self.assertEqual(len(data), ser.HEADER_SIZE + frames.nbytes + 20 * 8)
+
+
+class TestSERReader(unittest.TestCase):
+    """Collection of tests for SERReader."""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tempdir.name, 'test.ser')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_round_trip(self):
+        """Frames and timestamps read back match what was written."""
+        frames = np.random.randint(0, 65536, size=(10, 12, 16), dtype=np.uint16)
+        timestamps = time.time() + np.arange(10) * 0.01
+        with ser.SERWriter(self.filename, 16, 12, ser.BAYER_GRBG, 16) as writer:
+            writer.add_frames(frames, timestamps)
+
+        with ser.SERReader(self.filename) as reader:
+            self.assertEqual(len(reader), 10)
+            self.assertEqual(reader.shape, (12, 16))
+            self.assertEqual(reader.color_id, ser.BAYER_GRBG)
+            self.assertEqual(reader.bit_depth, 16)
+            np.testing.assert_array_equal(reader[3], frames[3])
+            np.testing.assert_array_equal(reader[-1], frames[-1])
+            np.testing.assert_array_equal(reader[2:8:2], frames[2:8:2])
+            np.testing.assert_array_equal(np.stack(list(reader)), frames)
+            np.testing.assert_allclose(ser.ticks_to_unix(reader.timestamps), timestamps, atol=1e-6)
+            self.assertAlmostEqual(reader.datetime_utc, time.time(), delta=5)
+
+            # Frames are views into the mapped file, not copies
+            self.assertFalse(reader[0].flags.owndata)
+            self.assertFalse(reader[0].flags.writeable)
+
+    def test_rgb(self):
+        """RGB frames have a trailing color axis."""
+        frames = np.random.randint(0, 256, size=(3, 4, 6, 3), dtype=np.uint8)
+        with ser.SERWriter(self.filename, 6, 4, ser.RGB, add_trailer=False) as writer:
+            writer.add_frames(frames)
+        with ser.SERReader(self.filename) as reader:
+            self.assertEqual(reader[0].shape, (4, 6, 3))
+            self.assertIsNone(reader.timestamps)
+            np.testing.assert_array_equal(reader.frames, frames)
+
+    def test_big_endian(self):
+        """16-bit data is decoded according to the LittleEndian header field."""
+        frames = np.arange(2 * 4 * 4, dtype=np.uint16).reshape(2, 4, 4)
+        with ser.SERWriter(self.filename, 4, 4, ser.MONO, 16) as writer:
+            writer.add_frames(frames)
+        with ser.SERReader(self.filename, little_endian=False) as reader:
+            np.testing.assert_array_equal(reader.frames, frames.byteswap())
+
+    def test_truncated(self):
+        """Incomplete frames at the end of a file are ignored."""
+        with ser.SERWriter(self.filename, 8, 8, add_trailer=False) as writer:
+            writer.add_frames(np.ones((4, 8, 8), dtype=np.uint8))
+        os.truncate(self.filename, ser.HEADER_SIZE + 3 * 64 + 10)
+        with ser.SERReader(self.filename) as reader:
+            self.assertEqual(len(reader), 3)
+
+    def test_advise(self):
+        """Access pattern hints are applied and frames stay valid after the reader is closed."""
+        frames = np.random.randint(0, 256, size=(3, 8, 8), dtype=np.uint8)
+        with ser.SERWriter(self.filename, 8, 8) as writer:
+            writer.add_frames(frames)
+        with ser.SERReader(self.filename) as reader:
+            self.assertTrue(reader.advise(mmap.MADV_SEQUENTIAL))
+            frame = reader[1]
+        np.testing.assert_array_equal(frame, frames[1])
+
+    def test_not_ser(self):
+        """Files that are not SER files are rejected."""
+        with open(self.filename, 'wb') as f:
+            f.write(bytes(1000))
+        with self.assertRaises(ValueError):
+            ser.SERReader(self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
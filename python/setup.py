@@ -4,7 +4,7 @@ from setuptools.command.build_ext import build_ext as _build_ext
 
 
 # Have to define a new class that is used for the build_py step because build_py expects to find
-# asi.py, but that isn't generated until build_ext is run. Normally build_ext is run after
+# asi/sdk.py, but that isn't generated until build_ext is run. Normally build_ext is run after
 # build_py. When this class is used for build_py, build_ext is run first. See also the cmdclass
 # option added to the setup() function further down in this file.
 class build_py(_build_py):
@@ -48,12 +48,12 @@ setup(
         'Intended Audience :: Developers',
         'Topic :: Scientific/Engineering :: Astronomy',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.8',
     ],
 
     keywords='astronomy telescopes zwo asi',
 
-    python_requires='>=3.6',
+    python_requires='>=3.8',
 
     setup_requires=[
         'numpy',
@@ -65,14 +65,14 @@ setup(
 
     ext_modules=[
         Extension(
-            '_asi',
-            ['asi.i'],
+            'asi._sdk',
+            ['asi/sdk.i'],
             swig_opts=['-I/usr/include'],
             libraries=['ASICamera2'],
         )
     ],
 
-    py_modules=['asi'],
+    packages=['asi'],
 
     cmdclass={'build_py': build_py, 'build_ext': build_ext},
 
@@ -0,0 +1,157 @@
+"""Tests for the asi.shm module."""
+
+import multiprocessing
+import unittest
+from unittest import mock
+import numpy as np
+
+from asi import shm
+from asi.stream import BLOCK, DROP_OLDEST, LATEST
+
+
+def read_sums(name, started, results):
+    """Read every frame from a bus in a child process and send back (index, sum) pairs."""
+    with shm.FrameReader(name, policy=BLOCK) as reader:
+        started.set()
+        sums = []
+        for frame in reader:
+            with frame:
+                sums.append((frame.index, int(frame.image.sum())))
+    results.put(sums)
+
+
+def attach(name):
+    """Attach to a bus in a child process and exit."""
+    with shm.FrameReader(name, policy=BLOCK):
+        pass
+
+
+class TestFrameBus(unittest.TestCase):
+    """Collection of tests for FrameBus and FrameReader."""
+
+    def setUp(self):
+        self.bus = shm.FrameBus((6, 8), np.uint16, slots=4)
+        self.frames = np.arange(20 * 48, dtype=np.uint16).reshape(20, 6, 8)
+
+    def tearDown(self):
+        self.bus.close()
+
+    def publish(self, start, stop, timeout=None):
+        """Publish frames start to stop and return the results of publish()."""
+        return [
+            self.bus.publish(frame, timestamp=100.0 + i, index=i, timeout=timeout)
+            for i, frame in enumerate(self.frames[start:stop], start)
+        ]
+
+    def test_block(self):
+        """The publisher waits for BLOCK readers to release a slot before reusing it."""
+        with shm.FrameReader(self.bus.name, policy=BLOCK) as reader:
+            self.assertEqual(self.publish(0, 5, timeout=0.01), [True] * 4 + [False])
+            self.assertEqual(self.bus.dropped, 1)
+            self.assertEqual(self.bus.stats()['readers'][0]['lag'], 4)
+            frame = reader.get()
+            self.assertEqual((frame.index, frame.timestamp, frame.sequence), (0, 100.0, 0))
+            np.testing.assert_array_equal(frame.image, self.frames[0])
+            self.assertFalse(frame.image.flags.writeable)
+            self.assertTrue(frame.release())
+            self.assertEqual(self.publish(5, 6, timeout=0.01), [True])
+            indices = []
+            for _ in range(4):
+                with reader.get() as frame:
+                    indices.append(frame.index)
+            self.assertEqual(indices, [1, 2, 3, 5])
+            self.assertIsNone(reader.get(timeout=0.01))
+            self.assertEqual(reader.overruns, 0)
+        self.assertEqual(self.bus.stats()['readers'], [])
+        # Without BLOCK readers nothing holds up the publisher
+        self.assertEqual(self.publish(6, 12, timeout=0.01), [True] * 6)
+
+    def test_overrun(self):
+        """DROP_OLDEST readers skip frames that were overwritten and detect torn frames."""
+        reader = shm.FrameReader(self.bus.name)
+        self.publish(0, 10)
+        frame = reader.get()
+        # Frame 6 may have been partly overwritten by frame 10, so the oldest readable is 7
+        self.assertEqual(frame.index, 7)
+        self.assertEqual(reader.overruns, 7)
+        np.testing.assert_array_equal(frame.image, self.frames[7])
+        self.publish(10, 14)
+        self.assertFalse(frame.valid)
+        self.assertFalse(frame.release())
+        self.assertEqual(reader.overruns, 8)
+        reader.close()
+
+    def test_latest(self):
+        """LATEST readers always get the newest frame."""
+        with shm.FrameReader(self.bus.name, policy=LATEST) as reader:
+            self.publish(0, 3)
+            with reader.get() as frame:
+                self.assertEqual(frame.index, 2)
+            self.assertEqual(reader.skipped, 2)
+            self.publish(3, 4)
+            with reader.get() as frame:
+                self.assertEqual(frame.index, 3)
+
+    def test_close(self):
+        """Readers receive the frames published before the bus closed, then None."""
+        reader = shm.FrameReader(self.bus.name, policy=DROP_OLDEST)
+        self.publish(0, 2)
+        self.bus.close()
+        indices = []
+        for frame in reader:
+            with frame:
+                indices.append(frame.index)
+        self.assertEqual(indices, [0, 1])
+        reader.close()
+        with self.assertRaises(FileNotFoundError):
+            shm.FrameReader(self.bus.name)
+
+    def test_processes(self):
+        """A reader in another process sees every frame, and exiting does not remove the bus."""
+        context = multiprocessing.get_context('spawn')
+        started = context.Event()
+        results = context.Queue()
+        process = context.Process(target=read_sums, args=(self.bus.name, started, results))
+        process.start()
+        self.assertTrue(started.wait(30))
+        self.publish(0, 20)
+        self.bus.close()
+        sums = results.get(timeout=30)
+        process.join(30)
+        self.assertEqual(sums, [(i, int(frame.sum())) for i, frame in enumerate(self.frames)])
+
+        # The child's resource tracker must not have unlinked a bus that is still in use
+        bus = shm.FrameBus((2, 2), np.uint8)
+        process = context.Process(target=attach, args=(bus.name,))
+        process.start()
+        process.join(30)
+        self.assertEqual(process.exitcode, 0)
+        with shm.FrameReader(bus.name) as reader:
+            self.assertEqual(reader.shape, (2, 2))
+        bus.close()
+
+    def test_stale_reader(self):
+        """BLOCK readers whose process exited are detached by the publisher."""
+        reader = shm.FrameReader(self.bus.name, policy=BLOCK)
+        with mock.patch.object(shm, '_pid_exists', return_value=False), \
+                mock.patch.object(shm, 'STALE_READER_INTERVAL', 0.0):
+            self.assertEqual(self.publish(0, 6, timeout=1), [True] * 6)
+        self.assertEqual(self.bus.stats()['readers'], [])
+        reader.close()
+
+    def test_invalid(self):
+        """Invalid arguments and frames are rejected."""
+        with self.assertRaises(ValueError):
+            self.bus.publish(np.zeros((6, 8), np.uint8))
+        with self.assertRaises(ValueError):
+            shm.FrameReader(self.bus.name, policy='oldest')
+        self.bus.claim()
+        with self.assertRaises(RuntimeError):
+            self.bus.claim()
+        self.bus.commit()
+        with self.assertRaises(RuntimeError):
+            self.bus.commit()
+
+
+if __name__ == '__main__':
+    unittest.main()
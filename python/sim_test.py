@@ -0,0 +1,194 @@
+"""Tests for the simulated camera backend in asi.sim."""
+
+import time
+import unittest
+import numpy as np
+
+from asi import integrity
+from asi import sim
+from asi.stream import VideoStream
+
+
+class TestSim(unittest.TestCase):
+    """Collection of tests for simulated cameras."""
+
+    def setUp(self):
+        self.camera = sim.SimulatedCamera(
+            width=320,
+            height=240,
+            bit_depth=12,
+            bandwidth=320 * 240 * 500,  # 500 FPS for RAW8
+            readout_latency=0.0,
+            sync_words=True,
+            seed=1,
+        )
+        sim.set_cameras(self.camera)
+        self.assertEqual(sim.ASIOpenCamera(0), sim.ASI_SUCCESS)
+        self.assertEqual(sim.ASIInitCamera(0), sim.ASI_SUCCESS)
+
+    def tearDown(self):
+        sim.ASICloseCamera(0)
+        sim.set_cameras(sim.SimulatedCamera())
+
+    def capture(self, count, img_type=sim.ASI_IMG_RAW8):
+        """Capture frames in video mode and return them stacked as uint8 arrays."""
+        sim.ASICheck(sim.ASISetROIFormat(0, 320, 240, 1, img_type))
+        size = sim.GetImageSizeBytes(0)
+        frames = np.zeros((count, size), dtype=np.uint8)
+        sim.ASICheck(sim.ASIStartVideoCapture(0))
+        for frame in frames:
+            sim.ASICheck(sim.ASIGetVideoDataInto(0, frame, 1000))
+        sim.ASICheck(sim.ASIStopVideoCapture(0))
+        return frames
+
+    def test_properties(self):
+        """Cameras are enumerated with properties matching their configuration."""
+        self.assertEqual(sim.ASIGetNumOfConnectedCameras(), 1)
+        info = sim.ASICheck(sim.ASIGetCameraProperty(0))
+        self.assertEqual((info.MaxWidth, info.MaxHeight), (320, 240))
+        self.assertEqual(info.IsColorCam, sim.ASI_TRUE)
+        self.assertEqual(info.BitDepth, 12)
+        self.assertIn(sim.ASI_IMG_RAW16, sim.ASIGetSupportedVideoFormats(info))
+        self.assertEqual(sim.ASIGetCameraProperty(1)[0], sim.ASI_ERROR_INVALID_INDEX)
+        self.assertEqual(sim.ASIGetDroppedFrames(5)[0], sim.ASI_ERROR_INVALID_ID)
+
+    def test_controls(self):
+        """Controls are clamped to their range and read-only controls cannot be set."""
+        num_controls = sim.ASICheck(sim.ASIGetNumOfControls(0))
+        types = [sim.ASICheck(sim.ASIGetControlCaps(0, i)).ControlType for i in range(num_controls)]
+        self.assertIn(sim.ASI_GAIN, types)
+        self.assertIn(sim.ASI_EXPOSURE, types)
+
+        sim.ASICheck(sim.ASISetControlValue(0, sim.ASI_GAIN, 9999, sim.ASI_FALSE))
+        self.assertEqual(
+            sim.ASICheck(sim.ASIGetControlValue(0, sim.ASI_GAIN)),
+            (510, sim.ASI_FALSE)
+        )
+        self.assertEqual(
+            sim.ASISetControlValue(0, sim.ASI_TEMPERATURE, 0, sim.ASI_FALSE),
+            sim.ASI_ERROR_GENERAL_ERROR
+        )
+        self.assertEqual(
+            sim.ASIGetControlValue(0, sim.ASI_COOLER_ON)[0],
+            sim.ASI_ERROR_INVALID_CONTROL_TYPE
+        )
+
+    def test_roi(self):
+        """Invalid ROI formats are rejected and the image size follows the format."""
+        self.assertEqual(
+            sim.ASISetROIFormat(0, 100, 100, 1, sim.ASI_IMG_RAW8), sim.ASI_ERROR_INVALID_SIZE
+        )
+        self.assertEqual(
+            sim.ASISetROIFormat(0, 320, 240, 2, sim.ASI_IMG_RAW8), sim.ASI_ERROR_INVALID_SIZE
+        )
+        sim.ASICheck(sim.ASISetROIFormat(0, 160, 120, 2, sim.ASI_IMG_RGB24))
+        self.assertEqual(sim.GetImageSizeBytes(0), 160 * 120 * 3)
+        self.assertEqual(sim.ASISetStartPos(0, 8, 0), sim.ASI_ERROR_OUTOF_BOUNDARY)
+        sim.ASICheck(sim.ASISetROIFormat(0, 64, 48, 1, sim.ASI_IMG_RAW16))
+        sim.ASICheck(sim.ASISetStartPos(0, 256, 192))
+        self.assertEqual(sim.ASICheck(sim.ASIGetStartPos(0)), (256, 192))
+
+    def test_frame_rate_and_sync_words(self):
+        """Frames arrive at the bandwidth-limited rate with consecutive frame counters."""
+        sim.ASICheck(sim.ASISetControlValue(0, sim.ASI_EXPOSURE, 100, sim.ASI_FALSE))
+        start = time.monotonic()
+        frames = self.capture(50, sim.ASI_IMG_RAW16)
+        elapsed = time.monotonic() - start
+        self.assertAlmostEqual(elapsed, 50 / 250, delta=0.1)  # RAW16 is half the rate of RAW8
+        report = integrity.check(frames)
+        self.assertTrue(report.ok, report.summary())
+
+        # 12-bit data is left-aligned in 16-bit pixels
+        pixels = frames[:, 4:-2].view(np.uint16)
+        self.assertTrue(np.all(pixels % 16 == 0))
+
+    def test_dropped_frames(self):
+        """Injected drops and buffer overruns are counted and leave gaps in the frame counter."""
+        self.camera.drop_rate = 0.1
+        sim.ASICheck(sim.ASISetControlValue(0, sim.ASI_EXPOSURE, 100, sim.ASI_FALSE))
+        sim.ASICheck(sim.ASISetROIFormat(0, 320, 240, 1, sim.ASI_IMG_RAW8))
+        frames = np.zeros((100, 320 * 240), dtype=np.uint8)
+        sim.ASICheck(sim.ASIStartVideoCapture(0))
+        for i, frame in enumerate(frames):
+            sim.ASICheck(sim.ASIGetVideoDataInto(0, frame, 1000))
+            if i == 50:
+                time.sleep(0.05)  # about 25 frames, more than the camera can buffer
+        dropped = sim.ASICheck(sim.ASIGetDroppedFrames(0))
+        sim.ASICheck(sim.ASIStopVideoCapture(0))
+
+        self.assertGreater(dropped, 20)
+        report = integrity.check(frames, camera_dropped=dropped, max_step=1)
+        self.assertEqual(report.unexplained_missing, 0)
+
+    def test_timeouts(self):
+        """Injected timeouts and reads without capture running return ASI_ERROR_TIMEOUT."""
+        out = np.zeros(320 * 240, dtype=np.uint8)
+        self.assertEqual(sim.ASIGetVideoDataInto(0, out, 10), sim.ASI_ERROR_TIMEOUT)
+        self.camera.timeout_rate = 1.0
+        sim.ASICheck(sim.ASIStartVideoCapture(0))
+        self.assertEqual(sim.ASIGetVideoDataInto(0, out, 10), sim.ASI_ERROR_TIMEOUT)
+        self.assertEqual(sim.ASIGetVideoDataInto(0, out[1:], 10), sim.ASI_ERROR_INVALID_SIZE)
+        with self.assertRaises(TypeError):
+            sim.ASIGetVideoDataInto(0, np.zeros(320 * 240, dtype=np.int8), 10)
+
+    def test_brightness_follows_exposure(self):
+        """Longer exposures give brighter frames."""
+        self.camera.sync_words = False
+        means = []
+        for exposure_us in (2000, 10_000):
+            sim.ASICheck(sim.ASISetControlValue(0, sim.ASI_EXPOSURE, exposure_us, sim.ASI_FALSE))
+            means.append(self.capture(2)[-1].mean())
+        self.assertGreater(means[1], 3 * means[0])
+
+    def test_exposure(self):
+        """Single exposures complete after the exposure time."""
+        sim.ASICheck(sim.ASISetControlValue(0, sim.ASI_EXPOSURE, 50_000, sim.ASI_FALSE))
+        sim.ASICheck(sim.ASIStartExposure(0, sim.ASI_FALSE))
+        self.assertEqual(sim.ASIStartVideoCapture(0), sim.ASI_ERROR_EXPOSURE_IN_PROGRESS)
+        self.assertEqual(sim.ASICheck(sim.ASIGetExpStatus(0)), sim.ASI_EXP_WORKING)
+        time.sleep(0.06)
+        self.assertEqual(sim.ASICheck(sim.ASIGetExpStatus(0)), sim.ASI_EXP_SUCCESS)
+        frame = sim.ASICheck(sim.ASIGetDataAfterExp(0, 320 * 240))
+        self.assertEqual(frame.size, 320 * 240)
+
+    def test_unplug_and_hang(self):
+        """Unplugged cameras fail until reopened and hung cameras never deliver data."""
+        sim.ASICheck(sim.ASISetROIFormat(0, 160, 120, 1, sim.ASI_IMG_RAW8))
+        sim.unplug(0)
+        self.assertEqual(sim.ASIGetNumOfConnectedCameras(), 0)
+        self.assertEqual(sim.ASIGetROIFormat(0)[0], sim.ASI_ERROR_CAMERA_REMOVED)
+        self.assertEqual(sim.ASIOpenCamera(0), sim.ASI_ERROR_CAMERA_REMOVED)
+        sim.plug(0)
+        self.assertEqual(sim.ASICheck(sim.ASIGetCameraProperty(0)).CameraID, 0)
+        self.assertEqual(sim.ASIGetROIFormat(0)[0], sim.ASI_ERROR_CAMERA_REMOVED)
+        sim.ASICloseCamera(0)
+        sim.ASICheck(sim.ASIOpenCamera(0))
+        self.assertEqual(sim.ASICheck(sim.ASIGetROIFormat(0))[:2], (320, 240))
+
+        self.camera.hung = True
+        sim.ASICheck(sim.ASIStartVideoCapture(0))
+        frame = np.zeros(sim.GetImageSizeBytes(0), dtype=np.uint8)
+        self.assertEqual(sim.ASIGetVideoDataInto(0, frame, 10), sim.ASI_ERROR_TIMEOUT)
+        sim.ASICheck(sim.ASIStopVideoCapture(0))
+        sim.ASICheck(sim.ASIStartExposure(0, sim.ASI_FALSE))
+        time.sleep(0.02)
+        self.assertEqual(sim.ASICheck(sim.ASIGetExpStatus(0)), sim.ASI_EXP_WORKING)
+        sim.ASICloseCamera(0)
+        self.assertFalse(self.camera.hung)
+        sim.ASICheck(sim.ASIOpenCamera(0))
+
+    def test_video_stream(self):
+        """VideoStream runs unchanged on the simulated backend."""
+        sim.ASICheck(sim.ASISetROIFormat(0, 320, 240, 1, sim.ASI_IMG_RAW16))
+        stream = VideoStream(0, pool_size=16, backend=sim)
+        consumer = stream.add_consumer('test', maxsize=8)
+        with stream:
+            frames = [consumer.get(timeout=1) for _ in range(10)]
+        self.assertEqual([frame.index for frame in frames], list(range(10)))
+        self.assertEqual(frames[0].image.shape, (240, 320))
+        for frame in frames:
+            frame.decr_ref_count()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+"""Tests for asi.sink."""
+
+import calendar
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import numpy as np
+from PIL import Image
+
+from asi import sink
+
+
+def read_fits(path):
+    """Return the header cards and the data of a simple FITS file as (dict, bytes)."""
+    with open(path, 'rb') as f:
+        content = f.read()
+    header = {}
+    offset = 0
+    while True:
+        card = content[offset:offset + 80].decode('ascii')
+        offset += 80
+        if card.startswith('END'):
+            break
+        keyword, _, value = card.partition('=')
+        header[keyword.strip()] = value.split('/')[0].strip().strip("'").strip()
+    data_start = -(-offset // 2880) * 2880
+    return header, content[data_start:]
+
+
+class TestWriteImage(unittest.TestCase):
+    """Collection of tests for write_image() and bin_image()."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.image = np.random.default_rng(0).integers(0, 65536, (60, 80), dtype=np.uint16)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_formats(self):
+        """Images written in every format read back unchanged."""
+        for fmt in ('png', 'tiff', 'npy'):
+            path = os.path.join(self.directory, 'sub', f'image{sink.FORMATS[fmt]}')
+            size, _ = sink.write_image(path, self.image, fmt)
+            self.assertEqual(size, os.path.getsize(path))
+            if fmt == 'npy':
+                read = np.load(path)
+            else:
+                read = np.array(Image.open(path)).astype(np.uint16)
+            np.testing.assert_array_equal(read, self.image, err_msg=fmt)
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'sub')).count('image.png.tmp'), 0)
+
+    def test_fits(self):
+        """FITS files have a valid header and big-endian data offset by BZERO."""
+        path = os.path.join(self.directory, 'image.fits')
+        timestamp = calendar.timegm((2024, 3, 20, 12, 0, 0)) + 0.25
+        sink.write_image(path, self.image, 'fits', timestamp=timestamp)
+        self.assertEqual(os.path.getsize(path) % 2880, 0)
+        header, data = read_fits(path)
+        self.assertEqual(header['SIMPLE'], 'T')
+        self.assertEqual(header['BITPIX'], '16')
+        self.assertEqual((header['NAXIS1'], header['NAXIS2']), ('80', '60'))
+        self.assertEqual(header['BZERO'], '32768')
+        self.assertEqual(header['DATE-OBS'], '2024-03-20T12:00:00.250000')
+        values = np.frombuffer(data[:self.image.nbytes], dtype='>i2').astype(np.int32) + 32768
+        np.testing.assert_array_equal(values.reshape(self.image.shape), self.image)
+
+    def test_bin_image(self):
+        """Binning averages blocks with rounding and discards partial blocks."""
+        image = np.arange(35, dtype=np.uint16).reshape(5, 7)
+        binned = sink.bin_image(image, 2)
+        self.assertEqual(binned.shape, (2, 3))
+        self.assertEqual(binned[0, 0], round((0 + 1 + 7 + 8) / 4))
+        color = np.full((4, 4, 3), 255, dtype=np.uint8)
+        np.testing.assert_array_equal(sink.bin_image(color, 2), np.full((2, 2, 3), 255))
+
+
+class TestImageSink(unittest.TestCase):
+    """Collection of tests for ImageSink."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.image = np.arange(60 * 80, dtype=np.uint16).reshape(60, 80)
+        self.timestamp = calendar.timegm((2024, 3, 20, 23, 59, 58))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_layout_crop_and_bin(self):
+        """Files go in a directory per date and are cropped, then binned."""
+        with sink.ImageSink(
+                self.directory,
+                'npy',
+                crop=(10, 20, 40, 30),
+                binning=2,
+                prefix='ASC_',
+                processes=False,
+            ) as image_sink:
+            self.assertTrue(image_sink.submit(self.image, self.timestamp, suffix='_001000ms'))
+            # The image is copied on submission so it can be reused straight away
+            self.image[:] = 0
+        path = os.path.join(self.directory, '2024/03/20/ASC_20240320_235958_001000ms.npy')
+        written = np.load(path)
+        original = np.arange(60 * 80, dtype=np.uint16).reshape(60, 80)
+        expected = sink.bin_image(original[20:50, 10:50], 2)
+        np.testing.assert_array_equal(written, expected)
+        stats = image_sink.stats()
+        self.assertEqual((stats['submitted'], stats['written'], stats['failed']), (1, 1, 0))
+        self.assertGreater(stats['latency_ms']['max'], 0)
+
+    def test_no_overwrite(self):
+        """Images within the same second, or named like an existing file, get a sequence number."""
+        directory = os.path.join(self.directory, '2024/03/20')
+        os.makedirs(directory)
+        with open(os.path.join(directory, '20240320_235959.npy'), 'wb') as f:
+            f.write(b'existing')
+        with sink.ImageSink(self.directory, 'npy', processes=False) as image_sink:
+            for i, offset in enumerate((0.0, 0.3, 0.6, 1.0, 1.5)):
+                image_sink.submit(self.image + i, self.timestamp + offset)
+        names = ['20240320_235958', '20240320_235958_1', '20240320_235958_2',
+                 '20240320_235959_1', '20240320_235959_2']
+        for i, name in enumerate(names):
+            np.testing.assert_array_equal(np.load(os.path.join(directory, f'{name}.npy')),
+                                          self.image + i)
+        with open(os.path.join(directory, '20240320_235959.npy'), 'rb') as f:
+            self.assertEqual(f.read(), b'existing')
+
+    def slow_sink(self, policy):
+        """Return an ImageSink with one worker that writes nothing until released."""
+        release = threading.Event()
+
+        def slow_write(*args):
+            release.wait()
+            return 0, 0.0
+
+        patcher = mock.patch.object(sink, 'write_image', slow_write)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        image_sink = sink.ImageSink(
+            self.directory, 'npy', workers=1, queue_size=2, policy=policy, processes=False
+        )
+        self.addCleanup(image_sink.close)
+        self.addCleanup(release.set)
+        return image_sink, release
+
+    def fill(self, image_sink, count):
+        """Submit images one second apart and return the results of submit()."""
+        results = []
+        for i in range(count):
+            results.append(image_sink.submit(self.image, self.timestamp + i, timeout=0.05))
+            time.sleep(0.01)  # let the dispatcher hand the first image to the worker
+        return results
+
+    def test_drop_newest(self):
+        """With DROP_NEWEST, images submitted to a full queue are discarded."""
+        image_sink, release = self.slow_sink(sink.DROP_NEWEST)
+        self.assertEqual(self.fill(image_sink, 5), [True, True, True, False, False])
+        release.set()
+        self.assertTrue(image_sink.flush(1.0))
+        self.assertEqual(image_sink.stats()['written'], 3)
+        self.assertEqual(image_sink.stats()['dropped'], 2)
+
+    def test_drop_oldest(self):
+        """With DROP_OLDEST, the oldest waiting images make room for new ones."""
+        image_sink, release = self.slow_sink(sink.DROP_OLDEST)
+        self.assertEqual(self.fill(image_sink, 5), [True] * 5)
+        self.assertEqual(
+            [task.timestamp for task in image_sink._pending],  # pylint: disable=protected-access
+            [self.timestamp + 3, self.timestamp + 4],
+        )
+        release.set()
+        self.assertTrue(image_sink.flush(1.0))
+        self.assertEqual(image_sink.stats()['dropped'], 2)
+
+    def test_block(self):
+        """With BLOCK, submit() waits for room and gives up after the timeout."""
+        image_sink, release = self.slow_sink(sink.BLOCK)
+        start = time.monotonic()
+        self.assertEqual(self.fill(image_sink, 4), [True, True, True, False])
+        self.assertGreater(time.monotonic() - start, 0.05)
+        threading.Timer(0.05, release.set).start()
+        self.assertTrue(image_sink.submit(self.image, self.timestamp))
+        self.assertTrue(image_sink.flush(1.0))
+
+    def test_processes(self):
+        """Images are encoded in worker processes."""
+        with sink.ImageSink(self.directory, 'png', compression=1, layout='') as image_sink:
+            for i in range(3):
+                image_sink.submit(self.image, self.timestamp + i)
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+        self.assertEqual(image_sink.stats()['written'], 3)
+
+    def test_invalid(self):
+        """Invalid settings are rejected."""
+        with self.assertRaises(ValueError):
+            sink.ImageSink(self.directory, 'jpeg')
+        with self.assertRaises(ValueError):
+            sink.ImageSink(self.directory, 'png', compression=10)
+        with self.assertRaises(ValueError):
+            sink.ImageSink(self.directory, 'npy', compression=1)
+        with self.assertRaises(ValueError):
+            sink.ImageSink(self.directory, 'npy', policy='latest')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""Tests for asi.stack."""
+
+import os
+import tempfile
+import tracemalloc
+import unittest
+import numpy as np
+
+from asi import ser
+from asi import stack
+
+
+class TestStack(unittest.TestCase):
+    """Collection of tests for stack_ser()."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.rng = np.random.default_rng(0)
+        self.scene = self.rng.uniform(1000, 3000, (40, 48))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, frames, color_id=ser.MONO, bit_depth=16):
+        """Write frames to a SER file and return its path."""
+        filename = os.path.join(self.directory.name, f'{len(os.listdir(self.directory.name))}.ser')
+        height, width = frames.shape[1:3]
+        with ser.SERWriter(filename, width, height, color_id, bit_depth) as writer:
+            writer.add_frames(frames)
+        return filename
+
+    def noisy_frames(self, count):
+        """Return frames of the scene with Gaussian noise."""
+        frames = self.rng.normal(self.scene, 50, (count,) + self.scene.shape)
+        return frames.round().astype(np.uint16)
+
+    def test_mean(self):
+        """The mean is weighted and uses only the selected frames."""
+        frames = self.rng.integers(0, 256, (10, 8, 16), dtype=np.uint8)
+        filename = self.write(frames, bit_depth=8)
+        np.testing.assert_allclose(stack.stack_ser(filename, workers=1), frames.mean(axis=0),
+                                   rtol=1e-6)
+        weights = np.arange(1, 5)
+        result = stack.stack_ser(filename, indices=[1, 3, 5, 7], weights=weights, workers=1)
+        expected = np.average(frames[[1, 3, 5, 7]], axis=0, weights=weights)
+        np.testing.assert_allclose(result, expected, rtol=1e-6)
+
+    def test_sigma_clip(self):
+        """Sigma clipping removes satellite trails that the mean keeps."""
+        frames = self.noisy_frames(60)
+        frames[::20, 10:12] = 60_000
+        filename = self.write(frames)
+        mean = stack.stack_ser(filename, workers=1)
+        clipped = stack.stack_ser(filename, 'sigma_clip', workers=1, batch_frames=7)
+        self.assertGreater(np.abs(mean[10:12] - self.scene[10:12]).mean(), 1000)
+        self.assertLess(np.abs(clipped - self.scene).mean(), 15)
+
+    def test_median(self):
+        """The remedian approximates the median of many frames and is exact for one batch."""
+        frames = self.noisy_frames(70)
+        frames[::5, 20:22] = 60_000
+        filename = self.write(frames)
+        result = stack.stack_ser(filename, 'median', indices=range(9), workers=1, batch_frames=10)
+        np.testing.assert_array_equal(result, np.median(frames[:9], axis=0))
+        # Two levels of batches of 4 with leftovers at both levels and a partial batch of frames
+        result = stack.stack_ser(filename, 'median', workers=1, batch_frames=4)
+        self.assertLess(np.abs(result - np.median(frames, axis=0)).mean(), 15)
+        self.assertLess(np.abs(result[20:22] - self.scene[20:22]).mean(), 40)
+        # A single frame is returned as is
+        result = stack.stack_ser(filename, 'median', indices=[3], workers=1)
+        np.testing.assert_array_equal(result, frames[3])
+        with self.assertRaises(ValueError):
+            stack.stack_ser(filename, 'median', workers=1, batch_frames=1)
+
+    def test_shifts(self):
+        """Shifted frames are aligned and cropped to their common area."""
+        shifts = np.array([(0, 0), (2, -4), (-2, 6), (4, 2)])
+        frames = np.stack([np.roll(self.scene, (dy, dx), axis=(0, 1)) for dy, dx in shifts])
+        filename = self.write(frames.astype(np.uint16), color_id=ser.BAYER_RGGB)
+        result = stack.stack_ser(filename, shifts=shifts, workers=1)
+        self.assertEqual(result.shape, (40 - 6, 48 - 10))
+        np.testing.assert_allclose(result, frames[0, 2:36, 4:42].astype(np.uint16), rtol=1e-6)
+        with self.assertRaises(ValueError):
+            stack.stack_ser(filename, shifts=shifts + 1, workers=1)
+
+    def test_rgb(self):
+        """RGB frames are stacked per channel."""
+        frames = self.rng.integers(0, 256, (5, 8, 16, 3), dtype=np.uint8)
+        filename = self.write(frames, color_id=ser.RGB, bit_depth=8)
+        for method in stack.METHODS:
+            result = stack.stack_ser(filename, method, workers=1)
+            self.assertEqual(result.shape, (8, 16, 3))
+        np.testing.assert_array_equal(result, frames.mean(axis=0).astype(np.float32))
+
+    def test_memory(self):
+        """Memory use stays under max_memory and too small a limit is rejected."""
+        filename = self.write(self.noisy_frames(100))
+        for method in stack.METHODS:
+            tracemalloc.start()
+            stack.stack_ser(filename, method, workers=1, max_memory=1 << 20, batch_frames=16)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.assertLess(peak, 1 << 20, method)
+        with self.assertRaises(ValueError):
+            stack.stack_ser(filename, workers=1, max_memory=10_000)
+
+    def test_processes(self):
+        """Worker processes give the same result as stacking in the calling process."""
+        filename = self.write(self.noisy_frames(40))
+        serial = stack.stack_ser(filename, 'sigma_clip', workers=1)
+        parallel = stack.stack_ser(filename, 'sigma_clip', workers=2)
+        np.testing.assert_allclose(parallel, serial, rtol=1e-5)
+
+    def test_invalid(self):
+        """Invalid arguments are rejected."""
+        filename = self.write(self.noisy_frames(3))
+        with self.assertRaises(ValueError):
+            stack.stack_ser(filename, 'max')
+        with self.assertRaises(ValueError):
+            stack.stack_ser(filename, indices=[3])
+        with self.assertRaises(ValueError):
+            stack.stack_ser(filename, weights=[1, 2])
+        with self.assertRaises(ValueError):
+            stack.stack_ser(filename, shifts=[(0, 0), (0, 60), (0, -60)])
+
+
+if __name__ == '__main__':
+    unittest.main()
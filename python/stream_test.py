@@ -0,0 +1,178 @@
+"""Tests for asi.stream using a simulated camera so no hardware is required."""
+
+import threading
+import time
+import unittest
+import numpy as np
+
+import asi
+from asi.stream import VideoStream, BLOCK, DROP_OLDEST, LATEST
+
+
+class FakeBackend:
+    """Minimal stand-in for the asi module that produces numbered RAW16 frames."""
+
+    ASI_SUCCESS = 0
+    ASI_ERROR_TIMEOUT = 11
+    ASI_IMG_RAW8 = 0
+    ASI_IMG_RGB24 = 1
+    ASI_IMG_RAW16 = 2
+
+    ASICheck = staticmethod(asi.ASICheck)
+
+    def __init__(self, width=64, height=48, frame_period=0.0):
+        self.width = width
+        self.height = height
+        self.frame_period = frame_period
+        self.capturing = False
+        self.count = 0
+        self.dropped = 0
+
+    def ASIGetROIFormat(self, _camera_id):
+        return self.ASI_SUCCESS, self.width, self.height, 1, self.ASI_IMG_RAW16
+
+    def ASIStartVideoCapture(self, _camera_id):
+        self.capturing = True
+        return self.ASI_SUCCESS
+
+    def ASIStopVideoCapture(self, _camera_id):
+        self.capturing = False
+        return self.ASI_SUCCESS
+
+    def ASIGetVideoDataInto(self, _camera_id, out, timeout_ms):
+        if self.frame_period:
+            time.sleep(self.frame_period)
+        if not self.capturing:
+            time.sleep(timeout_ms / 1000)
+            return self.ASI_ERROR_TIMEOUT
+        out.view(np.uint16)[:] = self.count
+        self.count += 1
+        return self.ASI_SUCCESS
+
+    def ASIGetDroppedFrames(self, _camera_id):
+        return self.ASI_SUCCESS, self.dropped
+
+
+class TestVideoStream(unittest.TestCase):
+    """Collection of tests for VideoStream."""
+
+    def test_geometry(self):
+        """Frame buffers match the ROI format of the camera."""
+        stream = VideoStream(0, pool_size=4, backend=FakeBackend(width=32, height=16))
+        self.assertEqual(stream.shape, (16, 32))
+        self.assertEqual(stream.dtype, np.uint16)
+        for frame in stream.pool.frames:
+            self.assertEqual(frame.buffer.nbytes, 32 * 16 * 2)
+            self.assertTrue(frame.buffer.flags.c_contiguous)
+            self.assertTrue(np.shares_memory(frame.buffer, frame.image))
+
+    def test_block_consumer_gets_every_frame(self):
+        """A BLOCK consumer sees every frame in order even when slower than the camera."""
+        stream = VideoStream(0, pool_size=8, backend=FakeBackend())
+        consumer = stream.add_consumer('disk', maxsize=4, policy=BLOCK)
+        indices = []
+        with stream:
+            for frame in consumer:
+                with frame:
+                    self.assertTrue(np.all(frame.image == frame.image[0, 0]))
+                    indices.append(int(frame.image[0, 0]))
+                time.sleep(0.001)
+                if len(indices) == 50:
+                    break
+        self.assertEqual(indices, list(range(50)))
+        self.assertEqual(consumer.frames_dropped, 0)
+        self.assertLessEqual(consumer.max_lag, 4)
+
+    def test_drop_oldest_and_latest(self):
+        """Non-blocking consumers drop frames instead of stalling the reader."""
+        stream = VideoStream(0, pool_size=8, backend=FakeBackend(frame_period=0.0005))
+        disk = stream.add_consumer('disk', maxsize=4, policy=BLOCK)
+        slow = stream.add_consumer('slow', maxsize=2, policy=DROP_OLDEST)
+        agc = stream.add_consumer('agc', policy=LATEST)
+        count = 0
+        with stream:
+            for frame in disk:
+                frame.decr_ref_count()
+                count += 1
+                if count == 100:
+                    break
+        stats = stream.stats()
+        self.assertGreater(stats['consumers']['slow']['dropped'], 0)
+        self.assertGreater(stats['consumers']['agc']['dropped'], 0)
+        self.assertLessEqual(slow.lag, 2)
+        self.assertLessEqual(agc.lag, 1)
+
+        # The most recent frames are retained
+        newest = slow.get(timeout=0)
+        latest = agc.get(timeout=0)
+        self.assertEqual(latest.index, stream.frames_read - 1)
+        self.assertLessEqual(stream.frames_read - 1 - newest.index, 2)
+        newest.decr_ref_count()
+        latest.decr_ref_count()
+
+    def test_frames_return_to_pool(self):
+        """Frames go back to the pool once every consumer has released them."""
+        stream = VideoStream(0, pool_size=4, backend=FakeBackend())
+        first = stream.add_consumer('first', maxsize=2)
+        second = stream.add_consumer('second', maxsize=2)
+        with stream:
+            frame_a = first.get(timeout=1)
+            frame_b = second.get(timeout=1)
+            self.assertIs(frame_a, frame_b)
+            self.assertEqual(frame_a.ref_count, 2)
+            frame_a.decr_ref_count()
+            self.assertEqual(frame_b.ref_count, 1)
+            frame_b.decr_ref_count()
+            stream.remove_consumer(first)
+            stream.remove_consumer(second)
+        time.sleep(0.01)
+        self.assertEqual(stream.pool.free, 4)
+        with self.assertRaises(RuntimeError):
+            frame_a.decr_ref_count()
+
+    def test_pool_exhaustion(self):
+        """Holding on to frames exhausts the pool and is counted."""
+        stream = VideoStream(0, pool_size=3, backend=FakeBackend())
+        consumer = stream.add_consumer('hoarder', maxsize=16)
+        held = []
+        with stream:
+            for _ in range(3):
+                held.append(consumer.get(timeout=1))
+            time.sleep(0.05)
+            self.assertEqual(stream.pool.free, 0)
+            self.assertGreaterEqual(stream.stats()['pool_exhausted'], 1)
+            for frame in held:
+                frame.decr_ref_count()
+            frame = consumer.get(timeout=1)
+            self.assertIsNotNone(frame)
+            frame.decr_ref_count()
+
+    def test_stop_ends_iteration(self):
+        """Stopping the stream ends iteration over consumers once they are drained."""
+        stream = VideoStream(0, pool_size=8, backend=FakeBackend(frame_period=0.001))
+        consumer = stream.add_consumer('disk', maxsize=8)
+        frames = []
+
+        def consume():
+            for frame in consumer:
+                frames.append(frame.index)
+                frame.decr_ref_count()
+
+        thread = threading.Thread(target=consume)
+        thread.start()
+        stream.start()
+        time.sleep(0.05)
+        stream.stop()
+        thread.join(timeout=1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(frames, list(range(stream.frames_read)))
+
+    def test_invalid_policy(self):
+        """Unknown policies are rejected."""
+        stream = VideoStream(0, pool_size=2, backend=FakeBackend())
+        with self.assertRaises(ValueError):
+            stream.add_consumer('bad', policy='sometimes')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Timelapse capture for all-sky cameras.
+
+Exposures start at wall-clock aligned times (on the minute for a 60 s interval) while the Sun is
+below a given altitude, and each image is saved as a 16-bit PNG in a directory per UTC date by a
+pool of encoder processes so that saving never delays the next exposure.
+"""
+
+import argparse
+import logging
+import time
+import numpy as np
+
+import asi
+from asi.schedule import ObservationWindows, Scheduler
+from asi.sink import ImageSink
+from asi.watchdog import EXPOSURE_GRACE
+
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--interval', type=float, default=60.0, help='seconds between exposures')
+    parser.add_argument('--exposure', type=float, default=15.0, help='exposure time in seconds')
+    parser.add_argument('--gain', type=int, default=0)
+    parser.add_argument('--binning', type=int, default=1)
+    parser.add_argument('--latitude', type=float, required=True, help='degrees, positive north')
+    parser.add_argument('--longitude', type=float, required=True, help='degrees, positive east')
+    parser.add_argument(
+        '--sun-altitude-max',
+        type=float,
+        default=-10.0,
+        help='only take exposures while the Sun is at or below this altitude in degrees',
+    )
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--prefix', default='ASC')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    sink = ImageSink(args.output_dir, 'png', prefix=f'{args.prefix}_')
+    with sink, asi.Camera(0) as camera:
+        width = camera.info.MaxWidth // args.binning // 8 * 8
+        height = camera.info.MaxHeight // args.binning // 2 * 2
+        asi.ASICheck(asi.ASISetROIFormat(
+            camera.camera_id, width, height, args.binning, asi.ASI_IMG_RAW16
+        ))
+        camera.apply(gain=args.gain, exposure=round(args.exposure * 1e6))
+        image = np.zeros((height, width), dtype=np.uint16)
+
+        def take_exposure(scheduled_time):
+            asi.ASICheck(asi.ASIStartExposure(camera.camera_id, asi.ASI_FALSE))
+            deadline = time.monotonic() + args.exposure + EXPOSURE_GRACE
+            time.sleep(args.exposure)
+            while True:
+                status = asi.ASICheck(asi.ASIGetExpStatus(camera.camera_id))
+                if status != asi.ASI_EXP_WORKING:
+                    break
+                if time.monotonic() >= deadline:
+                    # A hung camera would otherwise stall every later exposure
+                    logger.error('Exposure still in progress %.1f s after it should have ended',
+                                 EXPOSURE_GRACE)
+                    asi.ASIStopExposure(camera.camera_id)
+                    return
+                time.sleep(0.01)
+            if status != asi.ASI_EXP_SUCCESS:
+                logger.error('Exposure failed with status %d', status)
+                return
+            asi.ASICheck(asi.ASIGetDataAfterExpInto(camera.camera_id, image))
+            sink.submit(image, scheduled_time, suffix=f'_{round(args.exposure * 1e3):06d}ms')
+
+        windows = ObservationWindows(args.latitude, args.longitude, args.sun_altitude_max)
+        scheduler = Scheduler(args.interval, take_exposure, windows=windows, margin=1.0)
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            pass
+        logger.info('%s', scheduler.stats())
+    logger.info('%s', sink.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Tune the USB bandwidth settings of a camera for this host.
+
+Finds the ASI_BANDWIDTHOVERLOAD and ASI_HIGH_SPEED_MODE settings that give the highest frame rate
+without dropped frames and stores them as the profile of the camera on this host.
+
+asi.Camera applies the stored profile whenever it opens the camera. Set ASI_BACKEND=sim to try it
+on a simulated camera.
+"""
+
+import argparse
+import logging
+
+import asi
+from asi import tune
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_list(text, convert=str):
+    """Parse a comma-separated command line argument."""
+    return [convert(item.strip()) for item in text.split(',') if item.strip()]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--camera', type=int, default=0, help='index of the camera')
+    parser.add_argument(
+        '--bandwidth',
+        type=lambda text: parse_list(text, int),
+        default=list(tune.BANDWIDTHS),
+        help='comma-separated ASI_BANDWIDTHOVERLOAD values',
+    )
+    parser.add_argument(
+        '--high-speed',
+        type=lambda text: parse_list(text, int),
+        default=list(tune.HIGH_SPEED_MODES),
+        help='comma-separated ASI_HIGH_SPEED_MODE values',
+    )
+    parser.add_argument(
+        '--img-type',
+        type=parse_list,
+        default=['raw8', 'raw16'],
+        help=f'comma-separated image types from {", ".join(tune.IMG_TYPES)}',
+    )
+    parser.add_argument(
+        '--roi',
+        type=lambda text: [tuple(int(v) for v in roi.split('x')) for roi in parse_list(text)],
+        help='comma-separated ROI formats as WIDTHxHEIGHTxBIN (default: full sensor, bin 1)',
+    )
+    parser.add_argument('--seconds', type=float, default=tune.MEASURE_SECONDS,
+                        help='time to measure each setting')
+    parser.add_argument('--exposure-us', type=int, default=100,
+                        help='exposure time; must be short for the frame rate to be USB limited')
+    parser.add_argument('--validate', action='store_true',
+                        help='check the sync words of raw ASI178 frames')
+    parser.add_argument('--profiles', help='profile file (default: $ASI_PROFILES or '
+                        '~/.config/asi/profiles.json)')
+    parser.add_argument('--dry-run', action='store_true', help='do not store the profile')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    for img_type in args.img_type:
+        if img_type not in tune.IMG_TYPES:
+            parser.error(f'Unknown image type {img_type}')
+
+    # The profile is only applied on opening, so an existing one does not affect the sweep
+    with asi.Camera(args.camera, apply_profile=False) as camera:
+        results = tune.tune(
+            camera.camera_id,
+            bandwidths=args.bandwidth,
+            high_speed_modes=args.high_speed,
+            img_types=args.img_type,
+            rois=args.roi,
+            seconds=args.seconds,
+            exposure_us=args.exposure_us,
+            validate_frames=args.validate,
+        )
+        serial = tune.camera_serial(camera.camera_id)
+    profile = tune.choose(results)
+
+    print(f'Best setting for {camera.name} ({serial}) on {tune.host_name()}: bandwidth '
+          f'{profile["bandwidth"]}, high speed mode {profile["high_speed_mode"]}')
+    print(f'Fastest format: {profile["width"]}x{profile["height"]} bin{profile["bin"]} '
+          f'{profile["img_type"]} at {profile["fps"]:.1f} FPS ({profile["mb_per_s"]:.1f} MB/s)')
+    if not profile['drop_free']:
+        logger.warning('No setting was free of dropped frames; chose the one losing the fewest')
+    if not args.dry_run:
+        store = tune.ProfileStore(args.profiles)
+        store.put(tune.host_name(), serial, profile)
+        logger.info('Stored profile in %s', store.path)
+
+
+if __name__ == '__main__':
+    main()
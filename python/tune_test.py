@@ -0,0 +1,129 @@
+"""Tests for the asi.tune module."""
+
+import os
+import platform
+import tempfile
+import unittest
+from unittest import mock
+
+from asi import sim
+from asi import tune
+from asi import watchdog
+from asi.camera import Camera
+
+
+def result(bandwidth, high_speed_mode, mb_per_s, dropped=0, img_type='raw8'):
+    """Return a result of tune() with the given measurements."""
+    return {
+        'bandwidth': bandwidth,
+        'high_speed_mode': high_speed_mode,
+        'img_type': img_type,
+        'width': 320,
+        'height': 240,
+        'bin': 1,
+        'frames': 100,
+        'fps': mb_per_s * 10,
+        'mb_per_s': mb_per_s,
+        'dropped': dropped,
+        'timeouts': 0,
+        'errors': 0,
+        'sync_errors': 0,
+    }
+
+
+class TestTune(unittest.TestCase):
+    """Collection of tests for tuning and profiles."""
+
+    def setUp(self):
+        # 200 FPS for RAW8 at the default bandwidth, with a host that only keeps up with 300 FPS
+        self.camera = sim.SimulatedCamera(
+            width=320,
+            height=240,
+            bit_depth=12,
+            bayer_pattern=None,
+            bandwidth=320 * 240 * 200,
+            host_bandwidth=320 * 240 * 300,
+            readout_latency=0.0,
+            buffer_frames=8,
+            seed=1,
+            serial='0123456789abcdef',
+        )
+        sim.set_cameras(self.camera)
+        self.addCleanup(sim.set_cameras, sim.SimulatedCamera())
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'asi', 'profiles.json')
+
+    def test_sweep(self):
+        """The highest bandwidth that drops no frames is chosen and the camera is restored."""
+        sim.ASICheck(sim.ASIOpenCamera(0))
+        self.addCleanup(sim.ASICloseCamera, 0)
+        sim.ASICheck(sim.ASISetROIFormat(0, 160, 120, 2, sim.ASI_IMG_RAW16))
+        config = watchdog.read_config(0, sim)
+        results = tune.tune(0, bandwidths=(40, 60, 100), high_speed_modes=(1,),
+                            img_types=('raw8',), rois=[(320, 240, 1)], seconds=0.25,
+                            exposure_us=32, backend=sim)
+        self.assertEqual(watchdog.read_config(0, sim), config)
+        self.assertEqual([r['bandwidth'] for r in results], [40, 60, 100])
+        # Values are clamped to the range of the control and measured once
+        self.assertEqual(tune.clamp_bandwidths(0, (20, 40, 60, 120, 100), sim), [40, 60, 100])
+        self.assertTrue(tune.drop_free(results[0]))
+        self.assertGreater(results[2]['dropped'], 0)
+        self.assertAlmostEqual(results[1]['fps'], 240, delta=40)
+        profile = tune.choose(results)
+        self.assertEqual((profile['bandwidth'], profile['high_speed_mode']), (60, 1))
+        self.assertTrue(profile['drop_free'])
+        self.assertEqual((profile['width'], profile['img_type']), (320, 'raw8'))
+
+    def test_choose(self):
+        """A setting must be drop-free in every format, and the fewest losses win otherwise."""
+        results = [
+            result(60, 0, 20), result(60, 0, 40, img_type='raw16'),
+            result(80, 0, 25), result(80, 0, 50, dropped=1, img_type='raw16'),
+            result(80, 1, 20), result(80, 1, 40, img_type='raw16'),
+        ]
+        profile = tune.choose(results)
+        # 60 and 80 with high speed mode tie on throughput, so the lower bandwidth wins
+        self.assertEqual((profile['bandwidth'], profile['high_speed_mode']), (60, 0))
+        self.assertEqual(profile['img_type'], 'raw16')
+        profile = tune.choose([result(60, 0, 20, dropped=5), result(80, 0, 25, dropped=2)])
+        self.assertEqual(profile['bandwidth'], 80)
+        self.assertFalse(profile['drop_free'])
+        with self.assertRaises(ValueError):
+            tune.choose([])
+
+    def test_profile_applied_on_open(self):
+        """Camera applies the profile stored for its serial number on this host."""
+        store = tune.ProfileStore(self.path)
+        self.assertIsNone(store.get(platform.node(), '0123456789abcdef'))
+        store.put(tune.host_name(), 'other', {'bandwidth': 40, 'high_speed_mode': 0})
+        store.put(tune.host_name(), '0123456789abcdef', {'bandwidth': 90, 'high_speed_mode': 1})
+        with Camera(0, backend=sim, profile_path=self.path) as camera:
+            self.assertEqual(camera.profile['bandwidth'], 90)
+            self.assertEqual(camera.read('bandwidthoverload'), 90)
+            self.assertEqual(camera.read('high_speed_mode'), 1)
+        with Camera(0, backend=sim, apply_profile=False, profile_path=self.path) as camera:
+            self.assertIsNone(camera.profile)
+            self.assertEqual(camera.read('bandwidthoverload'), sim.REFERENCE_BANDWIDTH_OVERLOAD)
+
+        # Cameras without a serial number are identified by name
+        self.camera.serial = None
+        store.put(tune.host_name(), self.camera.name, {'bandwidth': 70, 'high_speed_mode': None})
+        with mock.patch.dict(os.environ, {tune.PROFILES_ENV: self.path}):
+            with Camera(0, backend=sim) as camera:
+                self.assertEqual(camera.read('bandwidthoverload'), 70)
+                self.assertEqual(camera.read('high_speed_mode'), 0)
+
+    def test_unreadable_profiles(self):
+        """A corrupt profile file is ignored rather than preventing the camera from opening."""
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+        with Camera(0, backend=sim, profile_path=self.path) as camera:
+            self.assertIsNone(camera.profile)
+        tune.ProfileStore(self.path).put('host', 'serial', {'bandwidth': 50})
+        self.assertEqual(tune.ProfileStore(self.path).load(), {'host/serial': {'bandwidth': 50}})
+
+
+if __name__ == '__main__':
+    unittest.main()
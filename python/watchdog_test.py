@@ -0,0 +1,165 @@
+"""Tests for the asi.watchdog module."""
+
+import threading
+import time
+import unittest
+
+from asi import metrics
+from asi import sim
+from asi import watchdog
+from asi.stream import VideoStream
+
+
+class TestWatchdog(unittest.TestCase):
+    """Collection of tests for Watchdog using simulated cameras."""
+
+    def setUp(self):
+        self.camera = sim.SimulatedCamera(
+            width=320,
+            height=240,
+            bit_depth=12,
+            bandwidth=320 * 240 * 500,
+            readout_latency=0.0,
+            seed=1,
+        )
+        sim.set_cameras(self.camera)
+        self.addCleanup(sim.set_cameras, sim.SimulatedCamera())
+        sim.ASICheck(sim.ASIOpenCamera(0))
+        # Cleanups run in reverse order, so streams are stopped before the camera is closed
+        self.addCleanup(sim.ASICloseCamera, 0)
+        sim.ASICheck(sim.ASIInitCamera(0))
+        sim.ASICheck(sim.ASISetROIFormat(0, 96, 64, 2, sim.ASI_IMG_RAW16))
+        sim.ASICheck(sim.ASISetStartPos(0, 8, 4))
+        sim.ASICheck(sim.ASISetControlValue(0, sim.ASI_GAIN, 300, sim.ASI_FALSE))
+        sim.ASICheck(sim.ASISetControlValue(0, sim.ASI_EXPOSURE, 2000, sim.ASI_FALSE))
+        sim.ASICheck(sim.ASISetControlValue(0, sim.ASI_WB_R, 60, sim.ASI_TRUE))
+        self.registry = metrics.Registry()
+        self.config = watchdog.read_config(0, sim)
+
+    def make_stream(self):
+        """Return a running VideoStream on the camera and a BLOCK consumer of it."""
+        stream = VideoStream(0, pool_size=16, backend=sim, registry=self.registry)
+        consumer = stream.add_consumer('disk', maxsize=8)
+        stream.start()
+        self.addCleanup(stream.stop)
+        return stream, consumer
+
+    def read(self, consumer, count):
+        """Return the indices of the next count frames of a consumer."""
+        indices = []
+        for _ in range(count):
+            frame = consumer.get(timeout=2)
+            self.assertIsNotNone(frame)
+            with frame:
+                indices.append(frame.index)
+        return indices
+
+    def test_config(self):
+        """A configuration read from a camera restores it after a power cycle."""
+        self.assertEqual(self.config.roi, (96, 64, 2, sim.ASI_IMG_RAW16))
+        self.assertEqual(self.config.start_pos, (8, 4))
+        self.assertEqual(self.config.controls[sim.ASI_GAIN], (300, False))
+        self.assertEqual(self.config.controls[sim.ASI_WB_R], (60, True))
+        self.assertNotIn(sim.ASI_TEMPERATURE, self.config.controls)
+        self.assertIsNone(self.config.mode)
+        sim.ASICloseCamera(0)
+        sim.ASICheck(sim.ASIOpenCamera(0))
+        self.assertNotEqual(watchdog.read_config(0, sim), self.config)
+        watchdog.write_config(0, self.config, sim)
+        self.assertEqual(watchdog.read_config(0, sim), self.config)
+
+    def test_trigger_mode(self):
+        """The camera mode of a camera with a trigger input is restored with the rest."""
+        sim.ASICloseCamera(0)
+        self.camera.trigger_modes = (sim.ASI_MODE_TRIG_SOFT_EDGE, sim.ASI_MODE_TRIG_HIGH_LEVEL)
+        sim.ASICheck(sim.ASIOpenCamera(0))
+        sim.ASICheck(sim.ASISetCameraMode(0, sim.ASI_MODE_TRIG_HIGH_LEVEL))
+        config = watchdog.read_config(0, sim)
+        self.assertEqual(config.mode, sim.ASI_MODE_TRIG_HIGH_LEVEL)
+        sim.ASICloseCamera(0)
+        sim.ASICheck(sim.ASIOpenCamera(0))
+        self.assertEqual(sim.ASICheck(sim.ASIGetCameraMode(0)), sim.ASI_MODE_NORMAL)
+        watchdog.write_config(0, config, sim)
+        self.assertEqual(watchdog.read_config(0, sim), config)
+        self.assertEqual(
+            sim.ASISetCameraMode(0, sim.ASI_MODE_TRIG_FALL_EDGE), sim.ASI_ERROR_INVALID_MODE
+        )
+
+    def test_stall(self):
+        """A stalled stream is recovered in place and its consumers carry on."""
+        stream, consumer = self.make_stream()
+        dog = watchdog.Watchdog(0, stream, stall_timeout=0.2, backend=sim,
+                                registry=self.registry)
+        self.assertEqual(self.read(consumer, 5), list(range(5)))
+        self.assertIsNone(dog.check())
+        self.camera.hung = True
+        time.sleep(0.3)
+        self.assertIsNone(dog.check())
+        time.sleep(0.3)
+        self.assertIn('no frames', dog.check())
+        self.assertEqual(dog.recoveries, 1)
+        self.assertLess(dog.last_recovery_seconds, 5)
+        self.assertTrue(stream.running)
+        self.assertFalse(consumer.closed)
+        self.assertEqual(watchdog.read_config(0, sim), self.config)
+        # Frames read before the stall and still queued are not lost
+        indices = self.read(consumer, 10)
+        self.assertEqual(indices, sorted(indices))
+        self.assertEqual(indices[0], 5)
+        histogram = self.registry.histogram('asi_camera_recovery_seconds',
+                                            labels={'camera': self.config.name})
+        self.assertEqual(histogram.count, 1)
+
+    def test_removed(self):
+        """A camera that is unplugged is recovered once it is plugged back in."""
+        stream, consumer = self.make_stream()
+        recovered = []
+        with watchdog.Watchdog(0, stream, poll_interval=0.02, on_recover=recovered.append,
+                               backend=sim, registry=self.registry) as dog:
+            self.read(consumer, 3)
+            sim.unplug(0)
+            self.assertEqual(sim.ASIGetNumOfConnectedCameras(), 0)
+            timer = threading.Timer(0.3, sim.plug, (0,))
+            timer.start()
+            deadline = time.monotonic() + 5
+            while not recovered and time.monotonic() < deadline:
+                time.sleep(0.02)
+            timer.join()
+            self.assertEqual(recovered, [0])
+            self.assertEqual(dog.recoveries, 1)
+            self.assertGreaterEqual(stream.errors, 1)
+            self.assertEqual(stream.last_error, sim.ASI_ERROR_CAMERA_REMOVED)
+            self.assertEqual(watchdog.read_config(0, sim), self.config)
+            self.assertEqual(len(self.read(consumer, 5)), 5)
+
+    def test_gives_up(self):
+        """A recovery that gives up is retried by the next check."""
+        stream, consumer = self.make_stream()
+        dog = watchdog.Watchdog(0, stream, recovery_timeout=0.1, backend=sim,
+                                registry=self.registry)
+        sim.unplug(0)
+        self.assertFalse(dog.recover('unplugged'))
+        self.assertEqual(dog.failures, 1)
+        self.assertFalse(stream.running)
+        sim.plug(0)
+        self.assertEqual(dog.check(), 'camera not recovered yet')
+        self.assertEqual(dog.recoveries, 1)
+        self.assertTrue(stream.running)
+        self.assertEqual(len(self.read(consumer, 3)), 3)
+
+    def test_exposure(self):
+        """An exposure stuck in progress is abandoned and the camera recovered."""
+        dog = watchdog.Watchdog(0, backend=sim, registry=self.registry)
+        sim.ASICheck(sim.ASIStartExposure(0, sim.ASI_FALSE))
+        self.assertEqual(dog.wait_exposure(1), sim.ASI_EXP_SUCCESS)
+        self.camera.hung = True
+        sim.ASICheck(sim.ASIStartExposure(0, sim.ASI_FALSE))
+        self.assertEqual(dog.wait_exposure(0.1), sim.ASI_EXP_FAILED)
+        self.assertEqual(dog.recoveries, 1)
+        self.assertEqual(watchdog.read_config(dog.camera_id, sim), self.config)
+        sim.ASICheck(sim.ASIStartExposure(dog.camera_id, sim.ASI_FALSE))
+        self.assertEqual(dog.wait_exposure(1), sim.ASI_EXP_SUCCESS)
+
+
+if __name__ == '__main__':
+    unittest.main()